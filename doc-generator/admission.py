@@ -0,0 +1,246 @@
+"""
+Admission control for the synchronous generate endpoints.
+
+Bursts used to be accepted without limit: every request started its LLM call,
+render and soffice at once and the container ran out of memory. Now at most
+ADMISSION_MAX_ACTIVE generations run at a time and up to ADMISSION_MAX_WAITING
+more wait for a slot in arrival order. Anything beyond that, or a request that
+waited ADMISSION_QUEUE_TIMEOUT_SECONDS without getting a slot, is turned away
+with 429 and a Retry-After estimated from recent service times, so throughput
+levels off at capacity instead of collapsing.
+
+Admitted requests also share per-stage slots (ADMISSION_STAGE_LIMITS) so only a
+few of them render, convert or upload at the same time. The executor pools in
+executors.py stay the hard cap on threads; these limits decide how much work is
+allowed to queue up for them. Background jobs take the same slots, and at most
+JOBS_STAGE_WORKERS of them hold a stage at once so they cannot crowd out
+live requests.
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Iterable, Optional
+
+import metrics
+from jobs import STAGE_GROUPS, parse_stage_workers
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_MAX_ACTIVE = int(os.environ.get("ADMISSION_MAX_ACTIVE", "16"))
+ADMISSION_MAX_WAITING = int(os.environ.get("ADMISSION_MAX_WAITING", "32"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", "30"))
+# Max admitted requests in each stage at once, as "stage=count,..." (upload covers upload_docx and upload_pdf)
+ADMISSION_STAGE_LIMITS = os.environ.get("ADMISSION_STAGE_LIMITS", "ai=16,render=4,pdf=2,upload=8")
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; retry_after is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class StageSlots:
+    """
+    Semaphore for one stage that counts holders and waiters (used as a StagePipeline limit).
+
+    Args:
+        name: Stage (group) name for metrics.
+        limit: Holders allowed at once.
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_use = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> None:
+        self.waiting += 1
+        self._publish()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_use += 1
+        self._publish()
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self._semaphore.release()
+        self._publish()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    def _publish(self) -> None:
+        metrics.gauge("admission_stage_in_use", stage=self.name).set(self.in_use)
+        metrics.gauge("admission_stage_waiting", stage=self.name).set(self.waiting)
+
+    def to_dict(self) -> Dict[str, int]:
+        return {"limit": self.limit, "in_use": self.in_use, "waiting": self.waiting}
+
+
+class _QuotaSlots:
+    """A shared stage slot, taken only after a slot from the caller's own quota."""
+
+    def __init__(self, quota: asyncio.Semaphore, slots: StageSlots):
+        self.quota = quota
+        self.slots = slots
+
+    async def acquire(self) -> None:
+        await self.quota.acquire()
+        try:
+            await self.slots.acquire()
+        except BaseException:
+            self.quota.release()
+            raise
+
+    def release(self) -> None:
+        self.slots.release()
+        self.quota.release()
+
+
+class AdmissionController:
+    """
+    Bounded admission queue plus shared per-stage slots.
+
+    Args:
+        max_active: Generations running at once.
+        max_waiting: Requests allowed to wait for a slot; more are rejected at once.
+        queue_timeout_seconds: Longest a request waits for a slot before it is rejected.
+        stage_limits: Max admitted requests per stage (see ADMISSION_STAGE_LIMITS).
+    """
+
+    def __init__(
+        self,
+        max_active: int = ADMISSION_MAX_ACTIVE,
+        max_waiting: int = ADMISSION_MAX_WAITING,
+        queue_timeout_seconds: float = ADMISSION_QUEUE_TIMEOUT_SECONDS,
+        stage_limits: Optional[Dict[str, int]] = None,
+    ):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.stage_counts = parse_stage_workers(ADMISSION_STAGE_LIMITS) if stage_limits is None else stage_limits
+        self.active = 0
+        self.waiting = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._stages: Dict[str, StageSlots] = {}
+        self._service_seconds = 10.0  # moving average of admitted request durations
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free for a new arrival (1-60)."""
+        queued_ahead = self.waiting + 1
+        estimate = self._service_seconds * queued_ahead / max(1, self.max_active)
+        return max(1, min(60, int(math.ceil(estimate))))
+
+    def _reject(self, reason: str, message: str) -> Overloaded:
+        metrics.counter("admission_rejected_total", reason=reason).inc()
+        retry_after = self.retry_after()
+        logger.warning(f"Admission rejected ({reason}): {message}; retry after {retry_after}s")
+        return Overloaded(message, retry_after)
+
+    @asynccontextmanager
+    async def admit(self, timeout: Optional[float] = None):
+        """
+        Hold a generation slot for the duration of the block.
+
+        Args:
+            timeout: Optional shorter wait limit (e.g. the request's remaining deadline).
+
+        Raises:
+            Overloaded when the waiting queue is full or the wait times out.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_active)
+        if self._slots.locked() and self.waiting >= self.max_waiting:
+            raise self._reject("queue_full", f"{self.active} running and {self.waiting} waiting")
+
+        wait_limit = self.queue_timeout_seconds if timeout is None else min(timeout, self.queue_timeout_seconds)
+        queued = time.monotonic()
+        self.waiting += 1
+        self._publish()
+        try:
+            if self._slots.locked():
+                await asyncio.wait_for(self._slots.acquire(), timeout=wait_limit)
+            else:
+                await self._slots.acquire()
+        except asyncio.TimeoutError:
+            raise self._reject("queue_timeout", f"no slot within {wait_limit:.0f}s")
+        finally:
+            self.waiting -= 1
+        metrics.histogram("admission_wait_seconds").observe(time.monotonic() - queued)
+
+        self.active += 1
+        self._publish()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._slots.release()
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * (time.monotonic() - started)
+            self._publish()
+
+    def stage(self, name: str) -> Optional[StageSlots]:
+        """Shared slots for a stage, or None if the stage is unlimited."""
+        group = STAGE_GROUPS.get(name, name)
+        if group not in self.stage_counts:
+            return None
+        if group not in self._stages:
+            self._stages[group] = StageSlots(group, self.stage_counts[group])
+        return self._stages[group]
+
+    def stage_limits(self, stage_names: Iterable[str], quota: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Limits for StagePipeline (same shape as JobManager.stage_limits).
+
+        Args:
+            stage_names: Pipeline stages to limit.
+            quota: Optional per-stage semaphores the caller must hold as well
+                (JobManager.stage_limits for background jobs).
+        """
+        quota = quota or {}
+        limits = {}
+        for name in stage_names:
+            slots, own = self.stage(name), quota.get(name)
+            if slots is not None and own is not None:
+                limits[name] = _QuotaSlots(own, slots)
+            elif slots is not None or own is not None:
+                limits[name] = slots if slots is not None else own
+        return limits
+
+    @asynccontextmanager
+    async def stage_slot(self, name: str):
+        """Hold a stage slot outside a pipeline (no-op for unlimited stages)."""
+        slots = self.stage(name)
+        if slots is None:
+            yield
+            return
+        async with slots:
+            yield
+
+    def _publish(self) -> None:
+        metrics.gauge("admission_active").set(self.active)
+        metrics.gauge("admission_queue_depth").set(self.waiting)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current load, for /health."""
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_active": self.max_active,
+            "max_waiting": self.max_waiting,
+            "stages": {name: slots.to_dict() for name, slots in sorted(self._stages.items())},
+        }
@@ -0,0 +1,481 @@
+"""
+Deterministic offline fallback content for the AI placeholders.
+
+Used when the LLM is down, rate limited or runs past the request's AI time budget.
+The activity text is classified by keyword into one or more work categories and the
+matching curated sequence and risk content is assembled. No network, no model.
+"""
+
+import logging
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Marker values for AI_CONTENT_SOURCE
+SOURCE_AI = "ai"
+SOURCE_FALLBACK = "fallback"
+
+# Maximum categories merged into one document (keeps sections focused)
+MAX_CATEGORIES = 2
+
+
+# ============================================================================
+# Curated library
+# ============================================================================
+# Each category has:
+#   keywords  - lowercase substrings matched against the activity text
+#   label     - short description used in the scope narrative
+#   worklist  - CPP Section 3 inclusions
+#   sequence  - method steps (RAMS sequence and CPP milestones)
+#   risks     - (topic, [controls]) for CPP Section 7
+#   rams_rows - Activity|Hazard|Persons at Risk|Control Measures|Residual Risk rows
+
+CATEGORIES = {
+    "excavation": {
+        "keywords": ["excavat", "groundwork", "trench", "foundation", "dig", "drainage",
+                     "piling", "underground", "utilities", "muck away", "earthwork"],
+        "label": "excavation and groundworks",
+        "worklist": [
+            "Service location and CAT & Genny survey",
+            "Excavation and trenching",
+            "Temporary support to excavations",
+            "Foundations and below-ground drainage",
+            "Backfill, compaction and reinstatement",
+        ],
+        "sequence": [
+            "Review service drawings and carry out CAT & Genny scan before breaking ground",
+            "Mark out excavation area and install barriers and signage around the working zone",
+            "Hand dig trial holes to expose known services within 500mm of excavation line",
+            "Excavate using plant with a banksman in attendance for all plant movements",
+            "Install trench support or batter back sides in line with the temporary works design",
+            "Competent person to inspect excavation at start of each shift and record findings",
+            "Carry out foundation or drainage works within the supported excavation",
+            "Backfill in layers with compaction and reinstate surfaces",
+        ],
+        "risks": [
+            ("SERVICES & EXCAVATIONS", [
+                "Service drawings reviewed and CAT & Genny scan completed before excavation.",
+                "Trial holes hand dug to locate services before mechanical excavation.",
+                "Excavations supported or battered in line with temporary works design.",
+                "Daily excavation inspections recorded by a competent person.",
+            ]),
+            ("PLANT MOVEMENTS", [
+                "Plant operated by CPCS/NPORS certified operatives only.",
+                "Banksman deployed for all reversing and slewing movements.",
+                "Pedestrian and plant routes segregated with barriers.",
+            ]),
+        ],
+        "rams_rows": [
+            "Excavation works|Collapse of excavation sides|Operatives|Trench support or battering to design; Daily inspection by competent person; No entry to unsupported excavations|Low (2x4=8)",
+            "Breaking ground|Strike on underground services|Operatives, Public|Service drawings reviewed; CAT & Genny scan; Hand dig trial holes near services|Low (2x4=8)",
+            "Plant operation|Struck by moving plant|Operatives, Site personnel|CPCS/NPORS operators; Banksman for all movements; Segregated pedestrian routes|Low (2x4=8)",
+            "Open excavations|Falls into excavation|Operatives, Public|Edge protection and barriers; Covered or fenced when unattended; Lighting at night|Low (2x3=6)",
+        ],
+        "flags": ["include_competence_plant_height", "include_heavy_logistics_laydown",
+                  "include_secure_perimeter_hoarding"],
+    },
+    "height": {
+        "keywords": ["scaffold", "roof", "height", "mewp", "ladder", "facade", "façade",
+                     "cladding", "steel erection", "glazing", "gutter", "chimney", "podium"],
+        "label": "work at height",
+        "worklist": [
+            "Access scaffold or MEWP provision",
+            "Edge protection and fall prevention",
+            "Work at height installation works",
+            "Inspection and handover of access equipment",
+        ],
+        "sequence": [
+            "Confirm scaffold design and handover certificate before any access is used",
+            "Inspect scaffold or MEWP and record inspection before first use each shift",
+            "Install edge protection and exclusion zones below the working area",
+            "Carry out work from the platform with tools and materials secured against falling",
+            "Lower materials using a controlled method and never throw from height",
+            "Clear platform and stand down access equipment at the end of each shift",
+        ],
+        "risks": [
+            ("WORKING AT HEIGHT", [
+                "Weekly scaffold inspections by competent person with tagging system.",
+                "Edge protection installed before work at height commences.",
+                "MEWP operators to hold valid IPAF certification with a rescue plan in place.",
+                "Tools and materials secured to prevent falling objects.",
+            ]),
+            ("FALLING OBJECTS", [
+                "Exclusion zones established below work at height.",
+                "Toe boards, brick guards and debris netting fitted to platforms.",
+                "Hard hats worn in all areas below overhead work.",
+            ]),
+        ],
+        "rams_rows": [
+            "Working at height|Falls from height|Operatives|Scaffold inspected and tagged; Edge protection in place; IPAF trained MEWP operators; Rescue plan briefed|Low (2x4=8)",
+            "Working at height|Falling objects|Operatives, Public|Exclusion zone below; Toe boards and brick guards; Tool lanyards|Low (2x3=6)",
+            "Access and egress|Falls from ladders|Operatives|Ladders for short duration access only; Tied or footed; Three points of contact|Low (2x3=6)",
+            "Work in adverse weather|Loss of balance in high winds|Operatives|Wind speed monitored; Work stopped above safe limits; Materials secured|Low (2x3=6)",
+        ],
+        "flags": ["include_competence_plant_height", "include_section_16_facade"],
+    },
+    "demolition": {
+        "keywords": ["demolition", "demolish", "strip-out", "strip out", "soft strip",
+                     "asbestos", "break out", "breaking out", "dismantl"],
+        "label": "demolition and strip-out",
+        "worklist": [
+            "Refurbishment and demolition asbestos survey review",
+            "Isolation and disconnection of services",
+            "Soft strip and removal of fixtures",
+            "Controlled demolition and break out",
+            "Segregation and removal of waste",
+        ],
+        "sequence": [
+            "Review refurbishment and demolition asbestos survey and confirm area is clear",
+            "Confirm all services are isolated and locked off with permits issued",
+            "Erect hoarding, dust screens and signage around the demolition area",
+            "Soft strip fixtures and fittings working from top down",
+            "Carry out controlled demolition in line with the demolition method statement",
+            "Segregate waste streams and remove to licensed facilities with waste transfer notes",
+        ],
+        "risks": [
+            ("ASBESTOS & HAZARDOUS MATERIALS", [
+                "Refurbishment and demolition survey completed before works start.",
+                "Stop work procedure briefed for suspect materials.",
+                "Licensed contractor appointed for any licensable asbestos removal.",
+            ]),
+            ("STRUCTURAL STABILITY", [
+                "Demolition sequence designed to maintain stability at all stages.",
+                "Temporary works coordinator to approve propping before removal.",
+                "Exclusion zones maintained around demolition activities.",
+            ]),
+        ],
+        "rams_rows": [
+            "Strip-out works|Exposure to asbestos|Operatives, Site personnel|R&D survey reviewed; Stop work procedure for suspect materials; Licensed removal where required|Low (1x5=5)",
+            "Demolition|Uncontrolled collapse|Operatives, Public|Engineered demolition sequence; Temporary propping; Exclusion zones|Low (2x4=8)",
+            "Demolition|Contact with live services|Operatives|Services isolated and locked off; Permit to work; Test before touch|Low (2x4=8)",
+            "Break out|Dust and silica exposure|Operatives, Site personnel|Water suppression; On-tool extraction; FFP3 masks face fit tested|Low (2x3=6)",
+        ],
+        "flags": ["include_competence_plant_height", "include_heavy_logistics_laydown",
+                  "include_secure_perimeter_hoarding"],
+    },
+    "mep": {
+        "keywords": ["electrical", "mechanical", "m&e", "mep", "hvac", "plumbing",
+                     "commissioning", "cabling", "fire alarm", "sprinkler", "ductwork",
+                     "pipework", "distribution board", "ventilation", "boiler"],
+        "label": "mechanical and electrical installation",
+        "worklist": [
+            "First fix containment, pipework and ductwork",
+            "Second fix electrical and mechanical installation",
+            "Testing and commissioning of building services",
+            "Handover documentation and O&M manuals",
+        ],
+        "sequence": [
+            "Confirm isolations and issue permit to work for any live systems",
+            "Install containment, pipework and ductwork to approved drawings",
+            "Carry out second fix installation of equipment and terminations",
+            "Test installation and record results on certificates",
+            "Commission systems with witness testing where required",
+            "Hand over certificates, drawings and O&M information",
+        ],
+        "risks": [
+            ("ELECTRICAL SAFETY", [
+                "Safe isolation procedure with lock off and proving dead before work.",
+                "Permit to work required for work on or near live systems.",
+                "Only competent electricians to carry out electrical work.",
+            ]),
+            ("TESTING & COMMISSIONING", [
+                "Commissioning plan agreed before energising systems.",
+                "Affected areas cordoned during pressure and electrical testing.",
+                "Test results recorded and verified before handover.",
+            ]),
+        ],
+        "rams_rows": [
+            "Electrical installation|Electric shock|Operatives|Safe isolation and lock off; Prove dead before work; Competent electricians only|Low (1x5=5)",
+            "Pipework installation|Burns from hot works|Operatives|Hot works permit; Fire extinguisher at point of work; Fire watch after completion|Low (2x3=6)",
+            "Testing and commissioning|Release of stored energy|Operatives|Commissioning plan; Area cordoned during testing; Pressure relief checked|Low (2x3=6)",
+            "Ceiling void works|Falls from stepladders and podiums|Operatives|Podium steps with guardrails; Inspected before use; No overreaching|Low (2x3=6)",
+        ],
+        "flags": ["include_section_17_commissioning"],
+    },
+    "fitout": {
+        "keywords": ["fit-out", "fit out", "fitout", "partition", "ceiling", "flooring",
+                     "decorat", "joinery", "drylining", "dry lining", "refurb", "painting",
+                     "carpet", "office", "kitchen", "bathroom"],
+        "label": "internal fit-out",
+        "worklist": [
+            "Protection of existing finishes and occupied areas",
+            "Partitions, drylining and ceilings",
+            "Joinery, doors and ironmongery",
+            "Floor finishes and decoration",
+        ],
+        "sequence": [
+            "Protect existing finishes and segregate the works from occupied areas",
+            "Set out partitions and ceiling grids to the approved layout",
+            "Install partitions, drylining and ceilings",
+            "Install joinery, doors and ironmongery",
+            "Lay floor finishes and carry out decoration",
+            "Snag, clean and hand over the completed areas",
+        ],
+        "risks": [
+            ("INTERFACE WITH OCCUPIED AREAS", [
+                "Works segregated from occupants with screens and signage.",
+                "Noisy and dusty works agreed with the client in advance.",
+                "Fire escape routes kept clear at all times.",
+            ]),
+            ("DUST & COSHH", [
+                "On-tool extraction for cutting and sanding.",
+                "COSHH assessments for adhesives, paints and sealants.",
+                "Adequate ventilation maintained during application.",
+            ]),
+        ],
+        "rams_rows": [
+            "Cutting boards and timber|Dust inhalation|Operatives|On-tool extraction; FFP3 masks; Cutting in designated area|Low (2x3=6)",
+            "Use of adhesives and paints|Exposure to hazardous substances|Operatives, Occupants|COSHH assessments briefed; Ventilation maintained; Low VOC products|Low (2x2=4)",
+            "Working in occupied building|Injury to building occupants|Occupants, Public|Segregation screens; Signage; Works planned out of hours where needed|Low (2x3=6)",
+            "Ceiling installation|Falls from podiums|Operatives|Podium steps with guardrails; Inspected before use; Stable level floor|Low (2x3=6)",
+        ],
+        "flags": [],
+    },
+    "lifting": {
+        "keywords": ["crane", "lifting", "hoist", "telehandler", "loler", "lift plan",
+                     "slinging", "rigging", "tower crane", "spider crane"],
+        "label": "lifting operations",
+        "worklist": [
+            "Lift planning by Appointed Person",
+            "Crane or lifting equipment set-up",
+            "Lifting operations with slinger/signaller",
+            "Demobilisation of lifting equipment",
+        ],
+        "sequence": [
+            "Appointed Person to prepare and brief the lift plan to the lifting team",
+            "Check ground bearing capacity and set up outriggers on suitable mats",
+            "Inspect lifting accessories and confirm LOLER certificates are in date",
+            "Establish exclusion zone under the load path",
+            "Carry out lifts under the direction of a competent slinger/signaller",
+            "Stow lifting accessories and stand down lifting equipment",
+        ],
+        "risks": [
+            ("LIFTING OPERATIONS", [
+                "Appointed Person to produce lift plans for all lifts.",
+                "Cranes and accessories inspected under LOLER with certificates on file.",
+                "Exclusion zones established and slinger/signallers deployed.",
+                "Lifting suspended when wind speeds exceed manufacturer limits.",
+            ]),
+        ],
+        "rams_rows": [
+            "Lifting operations|Dropped load|Operatives, Public|Lift plan by Appointed Person; Exclusion zone under load; LOLER certified accessories|Low (2x4=8)",
+            "Crane set-up|Overturning of crane|Operatives, Public|Ground bearing checked; Outrigger mats; Wind speed monitored|Low (1x5=5)",
+            "Slinging loads|Crush injuries to hands|Operatives|Competent slinger/signaller; Tag lines used; Hands clear when load moves|Low (2x3=6)",
+        ],
+        "flags": ["include_competence_plant_height", "include_heavy_logistics_laydown"],
+    },
+    "concrete": {
+        "keywords": ["concrete", "formwork", "rebar", "reinforcement", "pour", "slab",
+                     "blockwork", "masonry", "brickwork", "screed", "structural"],
+        "label": "concrete and structural works",
+        "worklist": [
+            "Formwork and falsework",
+            "Reinforcement fixing",
+            "Concrete pours and curing",
+            "Masonry and blockwork",
+        ],
+        "sequence": [
+            "Temporary works coordinator to approve formwork and falsework design",
+            "Erect formwork and fix reinforcement to drawings",
+            "Pre-pour inspection and sign off by the engineer",
+            "Pour and compact concrete with pump and vibrators",
+            "Cure concrete and strike formwork once strength is confirmed",
+        ],
+        "risks": [
+            ("TEMPORARY WORKS", [
+                "Temporary Works Coordinator appointed before works commence.",
+                "Design check certificates obtained for all formwork and propping.",
+                "Permit to load and permit to strike in place.",
+            ]),
+            ("CONCRETE & CEMENT", [
+                "Gloves and eye protection worn when handling wet concrete.",
+                "Welfare with washing facilities available for cement burns.",
+                "Concrete pump set up with outriggers on firm ground.",
+            ]),
+        ],
+        "rams_rows": [
+            "Formwork and falsework|Collapse of temporary works|Operatives|TWC approved design; Permit to load; Inspection before pour|Low (1x5=5)",
+            "Concrete pour|Cement burns and dermatitis|Operatives|Gloves and eye protection; Washing facilities; Skin checks|Low (2x2=4)",
+            "Reinforcement fixing|Impalement on starter bars|Operatives|Rebar caps fitted; Good housekeeping; Designated walkways|Low (2x3=6)",
+        ],
+        "flags": ["include_competence_plant_height", "include_heavy_logistics_laydown"],
+    },
+}
+
+# Content used for every document, wrapped around the category content
+GENERAL = {
+    "label": "general building works",
+    "worklist": [
+        "Site set-up, welfare and mobilisation",
+        "Main works as described in the activity description",
+        "Making good, clean and handover",
+    ],
+    "sequence_start": [
+        "Establish site welfare facilities and secure the work area with barriers and signage",
+        "Conduct site induction and pre-start briefing covering task hazards and emergency procedures",
+        "Verify all operatives hold valid CSCS cards and task-specific competencies",
+    ],
+    "sequence_end": [
+        "Carry out daily housekeeping and remove waste to designated skips",
+        "Inspect completed works and record any defects for rectification",
+        "Clean down the work area, remove equipment and hand over to the client",
+    ],
+    "risks": [
+        ("FIRE SAFETY", [
+            "Hot works permit system in operation.",
+            "Fire points with extinguishers at each escape route.",
+            "Fire escape routes kept clear and signed.",
+        ]),
+        ("MANUAL HANDLING", [
+            "Mechanical aids used where possible.",
+            "Team lifting for heavy or awkward items.",
+            "Manual handling training for all operatives.",
+        ]),
+        ("COSHH", [
+            "COSHH assessments held for all hazardous substances.",
+            "Substances stored in a secure COSHH store.",
+            "Appropriate PPE issued as identified in assessments.",
+        ]),
+        ("NOISE, VIBRATION & DUST", [
+            "Low vibration tools selected and trigger times monitored.",
+            "Hearing protection zones marked around noisy plant.",
+            "Dust suppression and on-tool extraction used.",
+        ]),
+    ],
+    "rams_rows": [
+        "Manual handling|Musculoskeletal injuries|Operatives|Mechanical aids used where possible; Team lifting for heavy items; Regular breaks|Low (2x3=6)",
+        "General site movement|Slips, trips and falls|Operatives, Site personnel|Good housekeeping; Designated walkways; Adequate lighting|Low (2x2=4)",
+        "Use of hazardous substances|Exposure to hazardous substances|Operatives|COSHH assessments; Appropriate PPE; Secure storage|Low (2x2=4)",
+        "Hot works and storage|Fire|Operatives, Site personnel|Hot works permit; Extinguishers at point of work; Fire watch after completion|Low (1x4=4)",
+        "Use of power tools|Noise and vibration exposure|Operatives|Low vibration tools; Trigger time monitoring; Hearing protection|Low (2x2=4)",
+        "Site deliveries|Vehicle and pedestrian collision|Operatives, Public|Delivery booking; Banksman for reversing; Segregated routes|Low (2x3=6)",
+    ],
+}
+
+_PUBLIC_INTERFACE_KEYWORDS = ["road", "footway", "pavement", "highway", "public", "street", "carriageway"]
+
+ALL_BLUE_FLAGS = [
+    "include_competence_plant_height",
+    "include_heavy_logistics_laydown",
+    "include_public_traffic_mgmt",
+    "include_secure_perimeter_hoarding",
+    "include_section_16_facade",
+    "include_section_17_commissioning",
+]
+
+
+def classify_activity(text: str) -> List[str]:
+    """
+    Classify activity text into work categories by keyword hits.
+
+    Returns:
+        Up to MAX_CATEGORIES category names, best match first. Empty if nothing matched.
+    """
+    lowered = (text or "").lower()
+    scores = []
+    for name, category in CATEGORIES.items():
+        hits = sum(lowered.count(kw) for kw in category["keywords"])
+        if hits:
+            scores.append((hits, name))
+    # Highest score first; ties broken by library order for determinism
+    order = list(CATEGORIES)
+    scores.sort(key=lambda s: (-s[0], order.index(s[1])))
+    return [name for _, name in scores[:MAX_CATEGORIES]]
+
+
+def _dedupe(items: List[str]) -> List[str]:
+    seen = set()
+    result = []
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            result.append(item)
+    return result
+
+
+def _sequence(categories: List[str]) -> List[str]:
+    steps = list(GENERAL["sequence_start"])
+    for name in categories:
+        steps.extend(CATEGORIES[name]["sequence"])
+    steps.extend(GENERAL["sequence_end"])
+    return _dedupe(steps)
+
+
+def build_rams_fallback_content(context: str) -> Dict[str, str]:
+    """Assemble AI_SEQUENCE_OF_WORKS and AI_RISK_ASSESSMENT from the local library."""
+    categories = classify_activity(context)
+    logger.info(f"RAMS fallback content: categories={categories or ['general']}")
+
+    rows = []
+    for name in categories:
+        rows.extend(CATEGORIES[name]["rams_rows"])
+    rows.extend(GENERAL["rams_rows"])
+
+    return {
+        "AI_SEQUENCE_OF_WORKS": "\n".join(_sequence(categories)),
+        "AI_RISK_ASSESSMENT": "\n".join(_dedupe(rows)[:14]),
+        "AI_CONTENT_SOURCE": SOURCE_FALLBACK,
+    }
+
+
+def build_cpp_fallback_content(context: str) -> dict:
+    """Assemble the CPP yellow sections and blue flags from the local library."""
+    categories = classify_activity(context)
+    logger.info(f"CPP fallback content: categories={categories or ['general']}")
+
+    labels = [CATEGORIES[name]["label"] for name in categories] or [GENERAL["label"]]
+    scope = (
+        f"This Construction Phase Plan sets out the arrangements for managing health, safety and welfare "
+        f"during the {' and '.join(labels)} described in the activity description. "
+        "It identifies the principal hazards, the control measures to be implemented and the responsibilities "
+        "of the Principal Contractor, contractors and workers in accordance with CDM 2015. "
+        "Inclusions are limited to the works described; design, client-direct packages and works outside the "
+        "defined site boundary are excluded unless stated otherwise. The plan will be reviewed and updated as "
+        "the works progress and as further information becomes available."
+    )
+
+    worklist = list(GENERAL["worklist"][:1])
+    for name in categories:
+        worklist.extend(CATEGORIES[name]["worklist"])
+    if not categories:
+        worklist.append(GENERAL["worklist"][1])
+    worklist.append(GENERAL["worklist"][-1])
+
+    # CPP sequence is high level: keep to 10 numbered milestones
+    milestones = _sequence(categories)
+    if len(milestones) > 10:
+        milestones = milestones[:8] + milestones[-2:]
+    sequence = "\n".join(f"{i}. {step}" for i, step in enumerate(milestones, start=1))
+
+    topics = []
+    for name in categories:
+        topics.extend(CATEGORIES[name]["risks"])
+    topics.extend(GENERAL["risks"])
+    blocks = []
+    for i, (title, controls) in enumerate(topics[:12], start=1):
+        blocks.append("\n".join([f"7.{i} {title}"] + controls))
+
+    flags = {flag: False for flag in ALL_BLUE_FLAGS}
+    for name in categories:
+        for flag in CATEGORIES[name]["flags"]:
+            flags[flag] = True
+    lowered = (context or "").lower()
+    if any(kw in lowered for kw in _PUBLIC_INTERFACE_KEYWORDS):
+        flags["include_public_traffic_mgmt"] = True
+    if not categories:
+        # Nothing recognised - keep every conditional section rather than guess
+        flags = {flag: True for flag in ALL_BLUE_FLAGS}
+
+    return {
+        "AI_SCOPE_NARRATIVE": scope,
+        "AI_WORK_LIST": "\n".join(_dedupe(worklist)),
+        "AI_CONSTRUCTION_SEQUENCE": sequence,
+        "AI_RISK_MANAGEMENT": "\n\n".join(blocks),
+        "BLUE_FLAG_COMPETENCE_PLANT_HEIGHT": flags["include_competence_plant_height"],
+        "BLUE_FLAG_HEAVY_LOGISTICS_LAYDOWN": flags["include_heavy_logistics_laydown"],
+        "BLUE_FLAG_PUBLIC_TRAFFIC_MGMT": flags["include_public_traffic_mgmt"],
+        "BLUE_FLAG_SECURE_PERIMETER_HOARDING": flags["include_secure_perimeter_hoarding"],
+        "BLUE_FLAG_SECTION_16_FACADE": flags["include_section_16_facade"],
+        "BLUE_FLAG_SECTION_17_COMMISSIONING": flags["include_section_17_commissioning"],
+        "AI_CONTENT_SOURCE": SOURCE_FALLBACK,
+    }
@@ -1,14 +1,60 @@
 """
-AI Content Generator for CPP Documents.
-Uses Google Gemini to generate technical content based on task description.
+AI Content Generator for CPP and RAMS Documents.
+Calls an OpenRouter model to generate technical content based on task description.
+Slow calls are hedged with a duplicate or fallback-model call (see _complete_json).
 """
 
 import os
 import json
+import time
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, List, Optional, Union
+
+import metrics
+from ai_fallback import build_cpp_fallback_content, build_rams_fallback_content, SOURCE_AI
+from rate_limiter import AdaptiveRateLimiter
+from prompt_budget import compact_context, estimate_tokens, prompt_size_class
 
 logger = logging.getLogger(__name__)
 
+# Model configuration
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+AI_MODEL = os.environ.get("AI_MODEL", "google/gemma-3-4b-it:free")  # Free tier model
+# Ordered fallback chain, e.g. "meta-llama/llama-3.2-3b-instruct:free,mistralai/mistral-7b-instruct:free"
+AI_FALLBACK_MODELS = [m.strip() for m in os.environ.get("AI_FALLBACK_MODELS", "").split(",") if m.strip()]
+
+# Hedging configuration
+AI_HEDGE_ENABLED = os.environ.get("AI_HEDGE_ENABLED", "true").lower() == "true"
+AI_HEDGE_PERCENTILE = float(os.environ.get("AI_HEDGE_PERCENTILE", "90"))
+AI_HEDGE_MAX_PER_MINUTE = int(os.environ.get("AI_HEDGE_MAX_PER_MINUTE", "6"))
+AI_HEDGE_MIN_DELAY_SECONDS = float(os.environ.get("AI_HEDGE_MIN_DELAY_SECONDS", "2"))
+AI_HEDGE_DEFAULT_DELAY_SECONDS = float(os.environ.get("AI_HEDGE_DEFAULT_DELAY_SECONDS", "20"))
+AI_MAX_PARALLEL_CALLS = int(os.environ.get("AI_MAX_PARALLEL_CALLS", "8"))
+
+# 429s are retried through the shared rate limiter (not the SDK) while the deadline allows
+AI_RATE_LIMIT_MAX_RETRIES = int(os.environ.get("AI_RATE_LIMIT_MAX_RETRIES", "3"))
+
+# Prompt size: user context is compacted to this many (estimated) tokens; 0 disables
+AI_MAX_CONTEXT_TOKENS = int(os.environ.get("AI_MAX_CONTEXT_TOKENS", "1500"))
+# Models that get the compact system prompt variant (exact ids, or prefixes ending in "*")
+AI_COMPACT_PROMPT_MODELS = [m.strip() for m in os.environ.get("AI_COMPACT_PROMPT_MODELS", "").split(",") if m.strip()]
+
+# Token-count buckets for the prompt/completion size histograms
+_TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000)
+
+# Default time budget for the AI stage of one request; past it, fallback content is used
+AI_TIME_BUDGET_SECONDS = float(os.environ.get("AI_TIME_BUDGET_SECONDS", "60"))
+# Budgets shorter than this go straight to fallback content instead of starting a call
+AI_MIN_BUDGET_SECONDS = float(os.environ.get("AI_MIN_BUDGET_SECONDS", "3"))
+
+
+class AIBudgetExceeded(TimeoutError):
+    """Raised when no valid AI response arrived within the request's time budget."""
+    pass
+
 # System prompt for CPP document generation - REFINED with Yellow + Blue sections
 CPP_SYSTEM_PROMPT = """You are an expert UK Principal Contractor and CDM 2015 Specialist.
 
@@ -86,66 +132,380 @@ CONSTRAINTS:
 - Keep the EXACT JSON key names shown above (these are required placeholders for the existing tool).
 """
 
+# Same contract as CPP_SYSTEM_PROMPT in roughly a third of the tokens (see AI_COMPACT_PROMPT_MODELS)
+CPP_SYSTEM_PROMPT_COMPACT = """You are a UK Principal Contractor and CDM 2015 specialist writing Construction Phase Plan content for the activity below.
+Return ONLY a valid JSON object (no markdown, no code fences) with exactly these keys:
+{
+  "yellow_section_2_scope": "~150 word Scope & Purpose: works, inclusions, exclusions. UK English, CDM 2015 terms, no invented facts.",
+  "yellow_section_3_worklist": "Main work items, one per line, no numbers or bullets.",
+  "yellow_section_6_sequence": "6-10 ordered milestones, one per line, prefixed '1. ', '2. ' ...",
+  "yellow_section_7_risks": "8-12 topics. Each topic: subheader line like '7.1 WORKING AT HEIGHT' (no end punctuation), then 3-5 control measures each on its own line, no bullet symbols; blank line between topics.",
+  "blue_logic_flags": {"include_competence_plant_height": bool, "include_heavy_logistics_laydown": bool, "include_public_traffic_mgmt": bool, "include_secure_perimeter_hoarding": bool, "include_section_16_facade": bool, "include_section_17_commissioning": bool}
+}
+Flags are real JSON booleans, TRUE only when likely: plant_height = work at height or heavy plant; laydown = cranes/hoists/large material storage; public_traffic = affects public roads/footways; hoarding = external boundary control; section_16_facade = scaffolding/cladding/facade access; section_17_commissioning = M&E commissioning.
+Do not invent specific equipment, permits or quantities; use generic professional wording when unsure.
+"""
+
+
+# ============================================================================
+# LLM call with adaptive hedging
+# ============================================================================
+
+# Minimum number of latency samples before the percentile replaces the default delay
+_MIN_LATENCY_SAMPLES = 5
+
+_ai_executor = ThreadPoolExecutor(max_workers=AI_MAX_PARALLEL_CALLS, thread_name_prefix="ai-call")
+
+
+class _LatencyWindow:
+    """Sliding window of recent successful call latencies (seconds)."""
+
+    def __init__(self, size: int = 50):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < _MIN_LATENCY_SAMPLES:
+            return None
+        idx = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[idx]
+
+
+class _HedgeBudget:
+    """Caps the number of hedged calls fired per rolling minute."""
+
+    def __init__(self, max_per_minute: int):
+        self.max_per_minute = max_per_minute
+        self._fired = deque()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            while self._fired and now - self._fired[0] > 60:
+                self._fired.popleft()
+            if len(self._fired) >= self.max_per_minute:
+                return False
+            self._fired.append(now)
+            return True
+
+
+_latency_window = _LatencyWindow()
+_hedge_budget = _HedgeBudget(AI_HEDGE_MAX_PER_MINUTE)
+
+# One limiter per process: every call shares the same OPENROUTER_API_KEY
+_rate_limiter = AdaptiveRateLimiter()
+
+
+class _Attempt:
+    """One in-flight model call. Holds the client so losers can be torn down."""
+
+    def __init__(self, model: str, role: str, deadline: Optional[float] = None):
+        self.model = model
+        self.role = role  # "primary", "hedge" or "fallback"
+        self.deadline = deadline
+        self.started = time.monotonic()
+        self.client = None
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """Best-effort cancel: closing the client aborts its HTTP connection."""
+        self.cancelled = True
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+
+
+def _strip_code_fences(response_text: str) -> str:
+    """Remove markdown code fences the model sometimes wraps around JSON."""
+    if response_text.startswith("```"):
+        lines = response_text.split("\n")
+        if lines[0].startswith("```"):
+            lines = lines[1:]
+        if lines and lines[-1].strip() == "```":
+            lines = lines[:-1]
+        response_text = "\n".join(lines)
+    return response_text
+
+
+def _uses_compact_prompt(model: str) -> bool:
+    """True if the model is listed in AI_COMPACT_PROMPT_MODELS (exact id or "prefix*")."""
+    for pattern in AI_COMPACT_PROMPT_MODELS:
+        if pattern.endswith("*") and model.startswith(pattern[:-1]):
+            return True
+        if model == pattern:
+            return True
+    return False
+
+
+def _prompt_builder(full_system: str, compact_system: str, heading: str, context: str) -> Callable[[str], str]:
+    """
+    Return model -> prompt. The user context is compacted to AI_MAX_CONTEXT_TOKENS
+    once; the system prompt variant is chosen per model (hedges may use another model).
+    """
+    context = compact_context(context, AI_MAX_CONTEXT_TOKENS)
+
+    def build(model: str) -> str:
+        system = compact_system if _uses_compact_prompt(model) else full_system
+        # Combine system prompt and user input (some models don't support system role)
+        return f"{system}\n\n{heading}:\n{context}"
+
+    return build
+
+
+def _record_call_size(attempt: _Attempt, prompt: str, response, response_text: str, elapsed: float) -> None:
+    """Record estimated prompt/completion tokens and latency by prompt size."""
+    prompt_tokens = estimate_tokens(prompt)
+    completion_tokens = estimate_tokens(response_text)
+    size_class = prompt_size_class(prompt_tokens)
+    metrics.histogram("ai_prompt_tokens", buckets=_TOKEN_BUCKETS, model=attempt.model).observe(prompt_tokens)
+    metrics.histogram("ai_completion_tokens", buckets=_TOKEN_BUCKETS, model=attempt.model).observe(completion_tokens)
+    metrics.histogram("ai_call_latency_by_prompt_size_seconds", prompt_size=size_class).observe(elapsed)
+
+    usage = getattr(response, "usage", None)
+    reported = ""
+    if usage is not None and getattr(usage, "prompt_tokens", None):
+        reported = f" (provider: prompt={usage.prompt_tokens}, completion={usage.completion_tokens})"
+    logger.info(
+        f"{attempt.model}: ~{prompt_tokens} prompt tokens [{size_class}], ~{completion_tokens} completion tokens, "
+        f"{elapsed:.1f}s{reported}"
+    )
+
+
+def _call_llm(prompt: str, attempt: _Attempt) -> dict:
+    """
+    Run a single chat completion and parse the JSON body.
 
-def generate_cpp_ai_content(task_activity: str) -> dict:
+    Raises on transport errors and on responses that are not valid JSON objects,
+    so only usable responses can win a hedge race. Each request first takes a
+    token from the shared rate limiter; a 429 feeds the limiter and the call is
+    re-queued until AI_RATE_LIMIT_MAX_RETRIES or the attempt deadline.
+    """
+    # Import here to avoid startup errors if library not installed
+    from openai import OpenAI, RateLimitError
+
+    # OpenRouter uses OpenAI-compatible API. SDK retries are off: the limiter owns 429 handling.
+    # The HTTP timeout ends with the attempt's budget so the call never outlives its request.
+    attempt.client = OpenAI(
+        base_url=OPENROUTER_BASE_URL,
+        api_key=os.environ.get("OPENROUTER_API_KEY"),
+        max_retries=0,
+        timeout=max(1.0, attempt.deadline - time.monotonic()) if attempt.deadline is not None else None,
+    )
+
+    for retry in range(AI_RATE_LIMIT_MAX_RETRIES + 1):
+        if attempt.cancelled:
+            raise RuntimeError("cancelled before start")
+        _rate_limiter.acquire(attempt.deadline)
+        if attempt.cancelled:
+            # The race was decided while this attempt queued; the next waiter gets the token
+            _rate_limiter.refund()
+            raise RuntimeError("cancelled before start")
+        call_started = time.monotonic()
+        try:
+            raw = attempt.client.chat.completions.with_raw_response.create(
+                model=attempt.model,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.7,
+            )
+        except RateLimitError as e:
+            _rate_limiter.on_rate_limited(e.response.headers if e.response is not None else None)
+            if retry == AI_RATE_LIMIT_MAX_RETRIES:
+                raise
+            logger.warning(f"{attempt.model} rate limited, re-queueing (retry {retry + 1}/{AI_RATE_LIMIT_MAX_RETRIES})")
+            continue
+        _rate_limiter.on_success(raw.headers)
+        response = raw.parse()
+        break
+
+    response_text = _strip_code_fences(response.choices[0].message.content.strip())
+    _record_call_size(attempt, prompt, response, response_text, time.monotonic() - call_started)
+    try:
+        ai_content = json.loads(response_text)
+    except json.JSONDecodeError:
+        logger.error(f"Raw response from {attempt.model}: {response_text[:500]}...")
+        raise
+    if not isinstance(ai_content, dict):
+        raise ValueError(f"Expected a JSON object from {attempt.model}, got {type(ai_content).__name__}")
+    return ai_content
+
+
+def _hedge_delay() -> float:
+    """Seconds to wait on the primary call before firing a hedge."""
+    observed = _latency_window.percentile(AI_HEDGE_PERCENTILE)
+    if observed is None:
+        return AI_HEDGE_DEFAULT_DELAY_SECONDS
+    return max(AI_HEDGE_MIN_DELAY_SECONDS, observed)
+
+
+def _complete_json(
+    prompt: Union[str, Callable[[str], str]],
+    label: str,
+    deadline: Optional[float] = None,
+) -> dict:
+    """
+    Get a parsed JSON response for a prompt, hedging slow calls.
+
+    The primary model is called first. If it has not answered by the configured
+    percentile of recent latency, a hedge is fired (next model in AI_FALLBACK_MODELS,
+    or a duplicate of the primary when the chain is exhausted), subject to
+    AI_HEDGE_MAX_PER_MINUTE. A failed call falls through to the next model in the
+    chain. The first valid response wins and the other calls are cancelled.
+
+    Args:
+        prompt: Full prompt text, or a model -> prompt callable (see _prompt_builder).
+        label: Short name used in log lines ("CPP", "RAMS").
+        deadline: Optional time.monotonic() value after which waiting stops.
+
+    Raises:
+        AIBudgetExceeded if the deadline passed first; otherwise the last call
+        error if every attempt failed.
+    """
+    models: List[str] = [AI_MODEL] + AI_FALLBACK_MODELS
+    prompt_for = prompt if callable(prompt) else (lambda model: prompt)
+    next_model = 1
+    started = time.monotonic()
+    pending = {}
+    last_error: Optional[Exception] = None
+
+    def launch(model: str, role: str) -> None:
+        attempt = _Attempt(model, role, deadline)
+        pending[_ai_executor.submit(_call_llm, prompt_for(model), attempt)] = attempt
+        logger.info(f"[{label}] Started {role} call to {model}")
+
+    launch(models[0], "primary")
+    hedge_at = started + _hedge_delay() if AI_HEDGE_ENABLED else None
+
+    while pending:
+        now = time.monotonic()
+        waits = [t - now for t in (hedge_at, deadline) if t is not None]
+        timeout = max(0.0, min(waits)) if waits else None
+        done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done and deadline is not None and time.monotonic() >= deadline:
+            for other_future, other in pending.items():
+                other_future.cancel()
+                other.cancel()
+            metrics.counter("ai_budget_exceeded_total").inc()
+            raise AIBudgetExceeded(f"No AI response within budget ({time.monotonic() - started:.1f}s)")
+
+        if not done:
+            # Primary is slower than the hedge threshold
+            hedge_at = None
+            if _hedge_budget.try_acquire():
+                if next_model < len(models):
+                    model = models[next_model]
+                    next_model += 1
+                else:
+                    model = models[0]
+                metrics.counter("ai_hedges_fired_total").inc()
+                launch(model, "hedge")
+            else:
+                metrics.counter("ai_hedges_suppressed_total").inc()
+                logger.info(f"[{label}] Hedge budget exhausted, waiting on primary")
+            continue
+
+        for future in done:
+            attempt = pending.pop(future)
+            elapsed = time.monotonic() - attempt.started
+            try:
+                result = future.result()
+            except Exception as e:
+                last_error = e
+                metrics.counter("ai_call_errors_total", model=attempt.model).inc()
+                logger.warning(f"[{label}] {attempt.role} call to {attempt.model} failed after {elapsed:.1f}s: {e}")
+                continue
+
+            metrics.histogram("ai_call_latency_seconds", model=attempt.model, role=attempt.role).observe(elapsed)
+            metrics.histogram("ai_request_latency_seconds").observe(time.monotonic() - started)
+            if attempt.model == models[0]:
+                _latency_window.add(elapsed)
+            if attempt.role == "hedge":
+                metrics.counter("ai_hedges_won_total").inc()
+            _record_hedge_win_rate()
+
+            for other_future, other in pending.items():
+                other_future.cancel()
+                other.cancel()
+            logger.info(f"[{label}] {attempt.role} call to {attempt.model} won after {elapsed:.1f}s")
+            return result
+
+        if not pending and next_model < len(models):
+            # Everything in flight failed - fall through the model chain
+            launch(models[next_model], "fallback")
+            next_model += 1
+
+    raise last_error or RuntimeError("No AI call attempted")
+
+
+def _record_hedge_win_rate() -> None:
+    fired = metrics.counter("ai_hedges_fired_total").value
+    won = metrics.counter("ai_hedges_won_total").value
+    metrics.gauge("ai_hedge_win_rate").set(won / fired if fired else 0.0)
+
+
+def _budget_deadline(budget_seconds: Optional[float]) -> float:
+    """Convert a budget in seconds (None = AI_TIME_BUDGET_SECONDS) to a monotonic deadline."""
+    if budget_seconds is None:
+        budget_seconds = AI_TIME_BUDGET_SECONDS
+    return time.monotonic() + max(0.0, budget_seconds)
+
+
+def _budget_too_short(budget_seconds: Optional[float]) -> bool:
+    """True when the request has too little time left to make an LLM call worthwhile."""
+    if budget_seconds is not None and budget_seconds < AI_MIN_BUDGET_SECONDS:
+        metrics.counter("ai_budget_too_short_total").inc()
+        return True
+    return False
+
+
+def generate_cpp_ai_content(task_activity: str, budget_seconds: Optional[float] = None) -> dict:
     """
     Call OpenRouter API to generate AI content for CPP document.
     
+    Falls back to the local content library (ai_fallback) when the API key is
+    missing, the call fails, or no valid response arrives within the budget.
+    
     Args:
         task_activity: The CPP_TASK_ACTIVITY text from the form.
+        budget_seconds: AI time budget for this request (default AI_TIME_BUDGET_SECONDS).
     
     Returns:
         Dict with:
         - Yellow section placeholders: AI_SCOPE_NARRATIVE, AI_CONSTRUCTION_SEQUENCE, AI_RISK_MANAGEMENT
         - Blue logic flags: BLUE_FLAG_* for conditional section removal
+        - AI_CONTENT_SOURCE: "ai" or "fallback" (absent when there was no input)
     """
+    if not task_activity or not task_activity.strip():
+        logger.warning("No task_activity provided, returning empty AI content")
+        return _empty_ai_content()
+    
     # Check for API key
     api_key = os.environ.get("OPENROUTER_API_KEY")
     if not api_key:
-        logger.warning("OPENROUTER_API_KEY not set, returning empty AI content")
-        return _empty_ai_content()
+        logger.warning("OPENROUTER_API_KEY not set, using fallback AI content")
+        return build_cpp_fallback_content(task_activity)
     
-    if not task_activity or not task_activity.strip():
-        logger.warning("No task_activity provided, returning empty AI content")
-        return _empty_ai_content()
+    if _budget_too_short(budget_seconds):
+        logger.warning(f"Only {budget_seconds:.1f}s of budget left, using fallback CPP AI content")
+        return build_cpp_fallback_content(task_activity)
     
+    deadline = _budget_deadline(budget_seconds)
     try:
-        # Import here to avoid startup errors if library not installed
-        from openai import OpenAI
-        
-        # OpenRouter uses OpenAI-compatible API
-        client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=api_key,
-        )
-        
-        # Combine system prompt and user input (some models don't support system role)
-        combined_prompt = f"{CPP_SYSTEM_PROMPT}\n\nPROJECT DESCRIPTION:\n{task_activity}"
+        combined_prompt = _prompt_builder(CPP_SYSTEM_PROMPT, CPP_SYSTEM_PROMPT_COMPACT, "PROJECT DESCRIPTION", task_activity)
         
         logger.info("Calling OpenRouter API for CPP AI content...")
-        response = client.chat.completions.create(
-            model="google/gemma-3-4b-it:free",  # Free tier model
-            messages=[
-                {"role": "user", "content": combined_prompt}
-            ],
-            temperature=0.7,
-        )
-        
-        # Parse JSON from response
-        response_text = response.choices[0].message.content.strip()
-        
-        # Handle potential markdown code fences
-        if response_text.startswith("```"):
-            # Remove opening fence
-            lines = response_text.split("\n")
-            if lines[0].startswith("```"):
-                lines = lines[1:]
-            # Remove closing fence
-            if lines and lines[-1].strip() == "```":
-                lines = lines[:-1]
-            response_text = "\n".join(lines)
-        
-        ai_content = json.loads(response_text)
+        ai_content = _complete_json(combined_prompt, "CPP", deadline=deadline)
         
         logger.info("AI content generated successfully")
         
@@ -168,6 +528,8 @@ def generate_cpp_ai_content(task_activity: str) -> dict:
             "BLUE_FLAG_SECURE_PERIMETER_HOARDING": blue.get("include_secure_perimeter_hoarding", True),
             "BLUE_FLAG_SECTION_16_FACADE": blue.get("include_section_16_facade", True),
             "BLUE_FLAG_SECTION_17_COMMISSIONING": blue.get("include_section_17_commissioning", True),
+            
+            "AI_CONTENT_SOURCE": SOURCE_AI,
         }
         
         logger.info(f"Yellow sections extracted: scope={bool(result['AI_SCOPE_NARRATIVE'])}, worklist={bool(result['AI_WORK_LIST'])}, seq={bool(result['AI_CONSTRUCTION_SEQUENCE'])}, risk={bool(result['AI_RISK_MANAGEMENT'])}")
@@ -175,13 +537,15 @@ def generate_cpp_ai_content(task_activity: str) -> dict:
         
         return result
         
+    except AIBudgetExceeded as e:
+        logger.warning(f"CPP AI budget exceeded, using fallback content: {e}")
+        return build_cpp_fallback_content(task_activity)
     except json.JSONDecodeError as e:
         logger.error(f"Failed to parse AI response as JSON: {e}")
-        logger.error(f"Raw response: {response_text[:500]}...")
-        return _empty_ai_content()
+        return build_cpp_fallback_content(task_activity)
     except Exception as e:
         logger.error(f"Failed to generate AI content: {e}")
-        return _empty_ai_content()
+        return build_cpp_fallback_content(task_activity)
 
 
 def _empty_ai_content() -> dict:
@@ -239,6 +603,14 @@ CONSTRAINTS:
 - AI_RISK_ASSESSMENT MUST always be a properly formatted pipe-separated table string.
 """
 
+# Same contract as RAMS_SYSTEM_PROMPT in fewer tokens (see AI_COMPACT_PROMPT_MODELS)
+RAMS_SYSTEM_PROMPT_COMPACT = """You are a UK Health & Safety technical writer producing RAMS content for the task below.
+Return ONLY a valid JSON object (no markdown, no code fences) with:
+"AI_SEQUENCE_OF_WORKS": 10-20 detailed method steps including plant, equipment and materials, one per line (\\n), no numbers.
+"AI_RISK_ASSESSMENT": pipe table string, rows separated by \\n. First row: Activity|Hazard|Persons at Risk|Control Measures|Residual Risk. Then 8-14 hazard rows, each exactly 5 cells (4 pipes); control measures semicolon-separated; residual risk like Low (2x2=4), Medium (3x3=9), High (4x4=16).
+Use UK English and UK legislation terms (CDM 2015, LOLER 1998, PUWER 1998, Work at Height Regulations 2005).
+"""
+
 
 
 def _sanitize_pipe_table(text: str, min_rows: int = 1, max_rows: int = 14) -> str:
@@ -291,62 +663,40 @@ def _sanitize_pipe_table(text: str, min_rows: int = 1, max_rows: int = 14) -> st
         return text.strip()
 
 
-def generate_rams_ai_content(rams_title: str) -> dict:
+def generate_rams_ai_content(rams_title: str, budget_seconds: Optional[float] = None) -> dict:
     """
     Call OpenRouter API to generate AI content for RAMS document.
-    Uses the same API approach as CPP for consistency.
+    Uses the same API approach as CPP for consistency, including the
+    local fallback content when the call fails or exceeds the budget.
     
     Args:
         rams_title: The RAMS_TITLE text from the form (describes the task).
+        budget_seconds: AI time budget for this request (default AI_TIME_BUDGET_SECONDS).
     
     Returns:
-        Dict with AI_SEQUENCE_OF_WORKS, AI_RISK_ASSESSMENT
+        Dict with AI_SEQUENCE_OF_WORKS, AI_RISK_ASSESSMENT and AI_CONTENT_SOURCE
     """
+    if not rams_title or not rams_title.strip():
+        logger.warning("No rams_title provided, returning empty RAMS AI content")
+        return _empty_rams_ai_content()
+    
     # Check for API key - use same key as CPP
     api_key = os.environ.get("OPENROUTER_API_KEY")
     if not api_key:
-        logger.warning("OPENROUTER_API_KEY not set, returning empty RAMS AI content")
-        return _empty_rams_ai_content()
+        logger.warning("OPENROUTER_API_KEY not set, using fallback RAMS AI content")
+        return build_rams_fallback_content(rams_title)
     
-    if not rams_title or not rams_title.strip():
-        logger.warning("No rams_title provided, returning empty RAMS AI content")
-        return _empty_rams_ai_content()
+    if _budget_too_short(budget_seconds):
+        logger.warning(f"Only {budget_seconds:.1f}s of budget left, using fallback RAMS AI content")
+        return build_rams_fallback_content(rams_title)
     
+    deadline = _budget_deadline(budget_seconds)
     try:
-        # Import here to avoid startup errors if library not installed
-        from openai import OpenAI
-        
-        # OpenRouter uses OpenAI-compatible API
-        client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=api_key,
-        )
-        
         # Combine system prompt and user input (same approach as CPP)
-        combined_prompt = f"{RAMS_SYSTEM_PROMPT}\n\nRAMS TASK DESCRIPTION:\n{rams_title}"
+        combined_prompt = _prompt_builder(RAMS_SYSTEM_PROMPT, RAMS_SYSTEM_PROMPT_COMPACT, "RAMS TASK DESCRIPTION", rams_title)
         
         logger.info("Calling OpenRouter API for RAMS AI content...")
-        response = client.chat.completions.create(
-            model="google/gemma-3-4b-it:free",  # Free tier model, same as CPP
-            messages=[
-                {"role": "user", "content": combined_prompt}
-            ],
-            temperature=0.7,
-        )
-        
-        # Parse JSON from response
-        response_text = response.choices[0].message.content.strip()
-        
-        # Handle potential markdown code fences
-        if response_text.startswith("```"):
-            lines = response_text.split("\n")
-            if lines[0].startswith("```"):
-                lines = lines[1:]
-            if lines and lines[-1].strip() == "```":
-                lines = lines[:-1]
-            response_text = "\n".join(lines)
-        
-        ai_content = json.loads(response_text)
+        ai_content = _complete_json(combined_prompt, "RAMS", deadline=deadline)
         
         # Sanitize the risk assessment table
         risk_raw = ai_content.get("AI_RISK_ASSESSMENT", "")
@@ -355,16 +705,19 @@ def generate_rams_ai_content(rams_title: str) -> dict:
         logger.info(f"RAMS AI content generated. Risk table: {len(risk_clean.splitlines()) if risk_clean else 0} valid rows")
         return {
             "AI_SEQUENCE_OF_WORKS": ai_content.get("AI_SEQUENCE_OF_WORKS", ""),
-            "AI_RISK_ASSESSMENT": risk_clean
+            "AI_RISK_ASSESSMENT": risk_clean,
+            "AI_CONTENT_SOURCE": SOURCE_AI,
         }
         
+    except AIBudgetExceeded as e:
+        logger.warning(f"RAMS AI budget exceeded, using fallback content: {e}")
+        return build_rams_fallback_content(rams_title)
     except json.JSONDecodeError as e:
         logger.error(f"Failed to parse RAMS AI response as JSON: {e}")
-        logger.error(f"Raw response: {response_text[:500] if response_text else 'empty'}...")
-        return _empty_rams_ai_content()
+        return build_rams_fallback_content(rams_title)
     except Exception as e:
         logger.error(f"Failed to generate RAMS AI content: {e}")
-        return _empty_rams_ai_content()
+        return build_rams_fallback_content(rams_title)
 
 
 def _empty_rams_ai_content() -> dict:
@@ -0,0 +1,155 @@
+"""
+Speculative AI prefetch store.
+
+The front-end posts the draft AI context to /prefetch-ai while the user is still
+filling in the form. The AI call runs in the background and its result is kept
+under a key derived from (product, context). A later generate call with the same
+context adopts the in-flight or completed result instead of starting over.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional
+
+import metrics
+from ai_fallback import SOURCE_FALLBACK
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_TTL_SECONDS = float(os.environ.get("PREFETCH_TTL_SECONDS", "600"))
+PREFETCH_MAX_PER_CLIENT = int(os.environ.get("PREFETCH_MAX_PER_CLIENT", "3"))
+PREFETCH_MAX_WORKERS = int(os.environ.get("PREFETCH_MAX_WORKERS", "4"))
+
+
+class PrefetchLimitError(Exception):
+    """Raised when a client already has PREFETCH_MAX_PER_CLIENT prefetches in flight."""
+    pass
+
+
+def prefetch_key(product: str, context: str) -> str:
+    """Stable key for an AI context. Same inputs as the generate call => same key."""
+    digest = hashlib.sha256(f"{product.upper()}\n{context}".encode("utf-8")).hexdigest()
+    return digest[:32]
+
+
+class _Entry:
+    def __init__(self, client_id: str, future: Future):
+        self.client_id = client_id
+        self.future = future
+        self.created = time.monotonic()
+
+
+class PrefetchStore:
+    """In-process store of prefetched AI results with TTL and a per-client cap."""
+
+    def __init__(
+        self,
+        ttl_seconds: float = PREFETCH_TTL_SECONDS,
+        max_per_client: int = PREFETCH_MAX_PER_CLIENT,
+        max_workers: int = PREFETCH_MAX_WORKERS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_per_client = max_per_client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai-prefetch")
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def start(self, client_id: str, product: str, context: str, fn: Callable[[str], dict]) -> Dict[str, str]:
+        """
+        Start fn(context) in the background unless a live entry already exists.
+
+        Returns:
+            {"prefetch_key": ..., "status": "started" | "in_flight" | "ready"}
+
+        Raises:
+            PrefetchLimitError if the client is at its cap and nothing can be evicted.
+        """
+        key = prefetch_key(product, context)
+        with self._lock:
+            self._evict_expired()
+            existing = self._entries.get(key)
+            if existing is not None:
+                return {"prefetch_key": key, "status": "ready" if existing.future.done() else "in_flight"}
+
+            owned = sorted(
+                ((k, e) for k, e in self._entries.items() if e.client_id == client_id),
+                key=lambda item: item[1].created,
+            )
+            if len(owned) >= self.max_per_client:
+                # Make room by dropping the client's oldest finished prefetch (stale drafts)
+                finished = [k for k, e in owned if e.future.done()]
+                if not finished:
+                    metrics.counter("ai_prefetch_rejected_total").inc()
+                    raise PrefetchLimitError(
+                        f"Client has {len(owned)} prefetches in flight (max {self.max_per_client})"
+                    )
+                del self._entries[finished[0]]
+
+            future = self._executor.submit(fn, context)
+            self._entries[key] = _Entry(client_id, future)
+            metrics.counter("ai_prefetch_started_total").inc()
+            metrics.gauge("ai_prefetch_entries").set(len(self._entries))
+
+        logger.info(f"AI prefetch started: product={product}, key={key}, client={client_id}")
+        return {"prefetch_key": key, "status": "started"}
+
+    def adopt(self, product: str, context: str, timeout: Optional[float] = None) -> Optional[dict]:
+        """
+        Return the prefetched result for this context, waiting up to timeout for an
+        in-flight call. Returns None when there is no usable entry.
+        """
+        key = prefetch_key(product, context)
+        with self._lock:
+            self._evict_expired()
+            entry = self._entries.get(key)
+        if entry is None:
+            metrics.counter("ai_prefetch_misses_total").inc()
+            return None
+
+        in_flight = not entry.future.done()
+        try:
+            result = entry.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            logger.warning(f"AI prefetch {key} still running after {timeout}s, not adopting")
+            metrics.counter("ai_prefetch_misses_total").inc()
+            return None
+        except Exception as e:
+            logger.warning(f"AI prefetch {key} failed: {e}")
+            with self._lock:
+                self._entries.pop(key, None)
+            metrics.counter("ai_prefetch_misses_total").inc()
+            return None
+
+        if result.get("AI_CONTENT_SOURCE") == SOURCE_FALLBACK:
+            # The model was unavailable during prefetch; let the generate call try again
+            with self._lock:
+                self._entries.pop(key, None)
+            metrics.counter("ai_prefetch_misses_total").inc()
+            return None
+
+        metrics.counter("ai_prefetch_hits_total", state="in_flight" if in_flight else "ready").inc()
+        logger.info(f"Adopted AI prefetch {key} ({'in-flight' if in_flight else 'completed'})")
+        # Callers mutate the dict (pop/override flags), so hand out a copy
+        return dict(result)
+
+    def is_pending(self, product: str, context: str) -> bool:
+        """True if a prefetch for this context exists and is still running."""
+        with self._lock:
+            entry = self._entries.get(prefetch_key(product, context))
+        return entry is not None and not entry.future.done()
+
+    def _evict_expired(self) -> None:
+        """Drop entries past their TTL. Caller holds the lock."""
+        now = time.monotonic()
+        expired = [k for k, e in self._entries.items() if now - e.created > self.ttl_seconds]
+        for k in expired:
+            entry = self._entries.pop(k)
+            entry.future.cancel()  # No-op if already running
+        if expired:
+            metrics.counter("ai_prefetch_expired_total").inc(len(expired))
+            logger.info(f"Evicted {len(expired)} expired AI prefetches")
+        metrics.gauge("ai_prefetch_entries").set(len(self._entries))
@@ -0,0 +1,156 @@
+"""
+Content-addressed uploads of generated documents.
+
+Every regeneration used to upload both documents again under new timestamped
+names, even when the bytes were the same as last time. Documents are now stored
+as <submission>/<product>_<id>_<sha256 prefix>.<ext>, and a local SQLite index
+remembers which hashes each submission already has in Storage. On a match the
+object is confirmed with a HEAD request and the upload is skipped, reusing the
+stored URL; a missing object is simply uploaded again.
+
+Documents rendered in memory (memory_render.py) are hashed and uploaded from
+their bytes.
+
+Unchanged inputs only give unchanged bytes because DOCX files are saved with
+fixed zip timestamps (generator.save_document) and PDFs have their dates and
+document ID blanked (pdf_convert.strip_volatile_metadata).
+"""
+
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import metrics
+from executors import run_in
+from local_store import open_sqlite
+from memory_render import Document, InMemoryDocument
+from supabase_client import (
+    object_exists_async, upload_bytes_to_storage_async, upload_file_to_storage_async, SUPABASE_TIMEOUT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_INDEX_PATH = os.environ.get(
+    "ARTIFACT_INDEX_PATH", os.path.join(os.path.dirname(__file__), "artifact_index.sqlite3")
+)
+ARTIFACT_BUCKET = "generated-documents"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def storage_path_for(submission_id: str, name: str, digest: str, extension: str) -> str:
+    """Storage object for a document: the content hash is part of the name."""
+    return f"{submission_id}/{name}_{digest[:16]}{extension}"
+
+
+class ArtifactStore:
+    """
+    Uploads documents to Storage once per distinct content.
+
+    Args:
+        index_path: SQLite index of (submission, hash) -> stored object.
+        bucket: Storage bucket for the documents.
+    """
+
+    def __init__(self, index_path: str = ARTIFACT_INDEX_PATH, bucket: str = ARTIFACT_BUCKET):
+        self.index_path = index_path
+        self.bucket = bucket
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = open_sqlite(
+                self.index_path,
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                "submission_id TEXT NOT NULL, sha256 TEXT NOT NULL, storage_path TEXT NOT NULL, "
+                "url TEXT NOT NULL, uploaded_at REAL NOT NULL, PRIMARY KEY (submission_id, sha256))",
+            )
+        return self._conn
+
+    def _lookup(self, submission_id: str, digest: str) -> Optional[tuple]:
+        with self._lock:
+            return self._db().execute(
+                "SELECT storage_path, url FROM artifacts WHERE submission_id = ? AND sha256 = ?",
+                (submission_id, digest),
+            ).fetchone()
+
+    def _record(self, submission_id: str, digest: str, storage_path: str, url: str) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+                (submission_id, digest, storage_path, url, time.time()),
+            )
+            db.commit()
+
+    def _forget(self, submission_id: str, digest: str) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM artifacts WHERE submission_id = ? AND sha256 = ?", (submission_id, digest))
+            db.commit()
+
+    async def upload(self, document: Document, submission_id: str, name: str, timeout: float) -> Dict[str, Any]:
+        """
+        Upload a document unless the same bytes are already stored for the submission.
+
+        Args:
+            document: Path of the rendered DOCX or PDF, or the InMemoryDocument.
+            submission_id: Submission the document belongs to (also the Storage folder).
+            name: Object name prefix, e.g. "RAMS_1a2b3c4d".
+            timeout: Seconds for the existence check and upload together.
+
+        Returns:
+            {"url", "sha256", "skipped"} where skipped means no bytes were sent.
+        """
+        started = time.monotonic()
+        in_memory = isinstance(document, InMemoryDocument)
+        if in_memory:
+            digest = await run_in("io", document.sha256)
+            extension = document.extension
+        else:
+            digest = await run_in("io", file_sha256, document)
+            extension = os.path.splitext(document)[1]
+        kind = extension.lstrip(".") or "file"
+
+        known = await run_in("io", self._lookup, submission_id, digest)
+        if known is not None:
+            storage_path, url = known
+            try:
+                exists = await object_exists_async(
+                    storage_path, bucket=self.bucket, timeout=min(timeout, SUPABASE_TIMEOUT_SECONDS)
+                )
+            except Exception as e:
+                logger.warning(f"Could not confirm {storage_path} in storage, uploading again: {e}")
+                exists = False
+            if exists:
+                logger.info(f"{kind.upper()} unchanged ({digest[:16]}); reusing {url}")
+                metrics.counter("artifact_uploads_total", kind=kind, outcome="skipped").inc()
+                return {"url": url, "sha256": digest, "skipped": True}
+            await run_in("io", self._forget, submission_id, digest)
+
+        storage_path = storage_path_for(submission_id, name, digest, extension)
+        left = max(0.1, timeout - (time.monotonic() - started))
+        if in_memory:
+            url = await upload_bytes_to_storage_async(document.content, storage_path, bucket=self.bucket, timeout=left)
+        else:
+            url = await upload_file_to_storage_async(document, storage_path, bucket=self.bucket, timeout=left)
+        await run_in("io", self._record, submission_id, digest, storage_path, url)
+        metrics.counter("artifact_uploads_total", kind=kind, outcome="uploaded").inc()
+        return {"url": url, "sha256": digest, "skipped": False}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,201 @@
+"""
+Benchmarks for the doc generator service.
+
+    python bench.py load --url http://localhost:8000 --concurrency 64 --requests 400
+    python bench.py render --jobs 40 --sizes 0,1,2,4
+    python bench.py render-upload --jobs 20
+
+`load` drives a running server with a mixed workload (renders interleaved with
+cheap /health probes) and reports throughput and latency percentiles per
+endpoint. The /health latency under load shows whether slow work is starving
+the server: with blocking handlers it queues behind renders for a threadpool slot.
+
+`render` measures DOCX render throughput in-process (size 0) and through the
+render process pool at each size, rendering to memory so disk speed is excluded.
+
+`render-upload` compares the disk and in-memory (RENDER_IN_MEMORY) paths from
+render to the bytes handed to the uploader, PDF conversion included when
+LibreOffice is installed, and reports time and bytes written to persistent disk
+per document. The upload itself is left out so network time does not hide the
+difference.
+"""
+
+import os
+import time
+import random
+import shutil
+import asyncio
+import hashlib
+import argparse
+import statistics
+from typing import Dict, List
+
+import httpx
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _report(title: str, latencies: Dict[str, List[float]], errors: Dict[str, int], elapsed: float) -> None:
+    total = sum(len(v) for v in latencies.values())
+    print(f"\n{title}: {total} requests in {elapsed:.2f}s ({total / elapsed:.1f} req/s)")
+    print(f"{'endpoint':<28}{'n':>6}{'err':>6}{'p50':>9}{'p95':>9}{'max':>9}")
+    for name, values in sorted(latencies.items()):
+        print(
+            f"{name:<28}{len(values):>6}{errors.get(name, 0):>6}"
+            f"{_percentile(values, 50):>9.3f}{_percentile(values, 95):>9.3f}{max(values, default=0):>9.3f}"
+        )
+
+
+async def _load(args) -> None:
+    payload = {
+        "product": "RAMS",
+        "placeholders": {"RAMS_TITLE": "Benchmark render", "RAMS_SITE_ADDRESS_LINE1": "1 Test Street"},
+    }
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait("generate" if random.random() < args.render_ratio else "health")
+
+    async def worker(client: httpx.AsyncClient, worker_id: int) -> None:
+        while True:
+            try:
+                kind = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.monotonic()
+            try:
+                if kind == "generate":
+                    body = dict(payload, output_basename=f"bench_{worker_id}_{queue.qsize()}")
+                    response = await client.post("/generate", json=body)
+                else:
+                    response = await client.get("/health")
+                ok = response.status_code < 500
+            except httpx.HTTPError:
+                ok = False
+            latencies.setdefault(kind, []).append(time.monotonic() - started)
+            if not ok:
+                errors[kind] = errors.get(kind, 0) + 1
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(worker(client, i) for i in range(args.concurrency)))
+        elapsed = time.monotonic() - started
+
+    _report(f"Mixed load (concurrency={args.concurrency})", latencies, errors, elapsed)
+    if "generate" in latencies and len(latencies["generate"]) > 1:
+        print(f"render latency stdev: {statistics.stdev(latencies['generate']):.3f}s")
+
+
+def _render(args) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+    from render_pool import RenderPool
+
+    template = os.path.join(TEMPLATE_DIR, f"{args.product}_TEMPLATE_WORKING_v1_copy.docx")
+    placeholders = {"RAMS_TITLE": "Benchmark render", "CPP_PROJECT_NAME": "Benchmark render"}
+    sizes = [int(v) for v in args.sizes.split(",")]
+    baseline = None
+    print(f"{'pool size':<12}{'jobs':>6}{'seconds':>10}{'docs/s':>9}{'speedup':>9}")
+    for size in sizes:
+        pool = RenderPool([template], size=size)
+        pool.warm()
+        threads = max(1, size)
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=threads) as callers:
+            list(callers.map(lambda _: pool.render(template, None, dict(placeholders)), range(args.jobs)))
+        elapsed = time.monotonic() - started
+        pool.shutdown()
+        rate = args.jobs / elapsed
+        baseline = baseline or rate  # speedup is relative to the first size listed
+        print(f"{size if size else 'in-process':<12}{args.jobs:>6}{elapsed:>10.2f}{rate:>9.2f}{rate / baseline:>8.2f}x")
+
+
+def _render_upload(args) -> None:
+    from render_pool import RenderPool
+    from memory_render import DiskWriteMeter
+    import pdf_convert
+
+    template = os.path.join(TEMPLATE_DIR, f"{args.product}_TEMPLATE_WORKING_v1_copy.docx")
+    placeholders = {"RAMS_TITLE": "Benchmark render", "CPP_PROJECT_NAME": "Benchmark render"}
+    with_pdf = not args.no_pdf and shutil.which(pdf_convert.LIBREOFFICE_BIN) is not None
+    pool = RenderPool([template], size=0)
+    pool.warm()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    def on_disk(index: int, meter: DiskWriteMeter) -> None:
+        docx_path = os.path.join(args.output_dir, f"bench_render_upload_{index}.docx")
+        pool.render(template, docx_path, dict(placeholders))
+        paths = [docx_path]
+        if with_pdf:
+            paths.append(pdf_convert.convert_to_pdf(docx_path, args.output_dir))
+        for path in paths:
+            meter.add_file(path)
+            with open(path, "rb") as f:
+                hashlib.sha256(f.read()).hexdigest()
+            os.remove(path)
+
+    def in_memory(index: int, meter: DiskWriteMeter) -> None:
+        content = pool.render(template, None, dict(placeholders))
+        documents = [content]
+        if with_pdf:
+            documents.append(pdf_convert.convert_docx_bytes_to_pdf(content, f"bench_render_upload_{index}"))
+        for document in documents:
+            hashlib.sha256(document).hexdigest()
+
+    print(f"render-upload: {args.jobs} {args.product} documents, PDF {'on' if with_pdf else 'off'}")
+    print(f"{'mode':<12}{'seconds':>10}{'s/doc':>9}{'disk bytes':>14}{'bytes/doc':>12}")
+    for mode, run in (("disk", on_disk), ("memory", in_memory)):
+        meter = DiskWriteMeter()
+        started = time.monotonic()
+        for index in range(args.jobs):
+            run(index, meter)
+        elapsed = time.monotonic() - started
+        print(
+            f"{mode:<12}{elapsed:>10.2f}{elapsed / args.jobs:>9.3f}"
+            f"{meter.bytes:>14,}{meter.bytes // args.jobs:>12,}"
+        )
+    pool.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Doc generator benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="Mixed /generate + /health load against a running server")
+    load.add_argument("--url", default="http://localhost:8000")
+    load.add_argument("--concurrency", type=int, default=64)
+    load.add_argument("--requests", type=int, default=400)
+    load.add_argument("--render-ratio", type=float, default=0.25, help="Share of requests that render")
+    load.add_argument("--timeout", type=float, default=300)
+
+    render = sub.add_parser("render", help="DOCX render throughput per render pool size")
+    render.add_argument("--product", default="RAMS", choices=["CPP", "RAMS"])
+    render.add_argument("--jobs", type=int, default=40)
+    render.add_argument("--sizes", default=",".join(str(n) for n in sorted({0, 1, 2, 4, os.cpu_count() or 1})))
+
+    render_upload = sub.add_parser("render-upload", help="Disk vs in-memory render-to-upload: time and disk writes")
+    render_upload.add_argument("--product", default="RAMS", choices=["CPP", "RAMS"])
+    render_upload.add_argument("--jobs", type=int, default=20)
+    render_upload.add_argument("--output-dir", default="output", help="Where disk mode writes (removed afterwards)")
+    render_upload.add_argument("--no-pdf", action="store_true", help="Skip PDF conversion")
+
+    args = parser.parse_args()
+    if args.command == "load":
+        asyncio.run(_load(args))
+    elif args.command == "render":
+        _render(args)
+    elif args.command == "render-upload":
+        _render_upload(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Bulk ZIP export of generated documents.
+
+Admins pulling every document of a project or date range used to call
+/download once per file. POST /export takes a filter or an ID list and streams
+one ZIP back instead:
+
+- submissions are read page by page (keyset paging on id), never all at once;
+- up to EXPORT_CONCURRENCY documents are fetched from Storage at the same time,
+  each through a small bounded queue, so a slow client throttles the fetches
+  rather than letting them pile up in memory;
+- the archive is written entry by entry to the response as the bytes arrive.
+  zipfile writes to a sink the response drains after every chunk; nothing is
+  staged on disk and memory stays at a few chunks per fetch however large the
+  archive gets.
+
+Entries are stored, not deflated: DOCX and PDF are already compressed, and
+stored entries keep compression work off the event loop. Documents that are
+missing or fail mid-way are listed in export_manifest.json at the end of the
+archive.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import zipfile
+from collections import deque
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+from supabase_client import (
+    list_submissions_async, open_storage_stream_async, storage_object_from_url, STORAGE_UPLOAD_TIMEOUT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+EXPORT_PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", "100"))
+# Documents fetched from Storage at the same time
+EXPORT_CONCURRENCY = int(os.environ.get("EXPORT_CONCURRENCY", "4"))
+EXPORT_MAX_IDS = int(os.environ.get("EXPORT_MAX_IDS", "5000"))
+EXPORT_CHUNK_BYTES = 64 * 1024
+# Chunks a fetch may run ahead of the writer
+EXPORT_BUFFER_CHUNKS = 4
+
+EXPORT_COLUMNS = "id,product,outputs"
+EXPORT_FORMATS = ("docx", "pdf")
+# Placeholders that hold the project name a submission belongs to
+PROJECT_PLACEHOLDERS = ("CPP_PROJECT_TITLE", "RAMS_TITLE")
+MANIFEST_NAME = "export_manifest.json"
+
+
+class ExportError(Exception):
+    """Raised when a document cannot be added to an export."""
+    pass
+
+
+def export_filters(
+    product: Optional[str] = None,
+    project: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+) -> List[Tuple[str, str]]:
+    """
+    PostgREST filters for an export.
+
+    Args:
+        product: "CPP" or "RAMS".
+        project: Exact project name (matched against PROJECT_PLACEHOLDERS).
+        created_from: ISO date/time, inclusive.
+        created_to: ISO date/time, exclusive.
+    """
+    filters = []
+    if product:
+        filters.append(("product", f"eq.{product.upper()}"))
+    if project:
+        quoted = '"' + project.replace("\\", "\\\\").replace('"', '\\"') + '"'
+        matches = ",".join(f"placeholders->>{key}.eq.{quoted}" for key in PROJECT_PLACEHOLDERS)
+        filters.append(("or", f"({matches})"))
+    if created_from:
+        filters.append(("created_at", f"gte.{created_from}"))
+    if created_to:
+        filters.append(("created_at", f"lt.{created_to}"))
+    return filters
+
+
+async def iter_submissions(
+    submission_ids: Optional[List[str]] = None,
+    filters: Iterable[Tuple[str, str]] = (),
+    page_size: int = EXPORT_PAGE_SIZE,
+) -> AsyncIterator[dict]:
+    """
+    Yield the submissions to export, one page of metadata in memory at a time.
+
+    An ID list is fetched in pages of page_size IDs; a filter is paged by id.
+    """
+    if submission_ids is not None:
+        ids = sorted(set(submission_ids))
+        for start in range(0, len(ids), page_size):
+            batch = ids[start:start + page_size]
+            page = await list_submissions_async(
+                list(filters) + [("id", f"in.({','.join(batch)})")], columns=EXPORT_COLUMNS, limit=page_size
+            )
+            for row in page:
+                yield row
+        return
+
+    after_id = None
+    while True:
+        page = await list_submissions_async(list(filters), columns=EXPORT_COLUMNS, limit=page_size, after_id=after_id)
+        for row in page:
+            yield row
+        if len(page) < page_size:
+            return
+        after_id = page[-1]["id"]
+
+
+async def prime(rows: AsyncIterator[dict]) -> Optional[AsyncIterator[dict]]:
+    """
+    Read the first row now, so a failing query or an empty selection is reported
+    before the response starts.
+
+    Returns:
+        An iterator over all rows, or None if there are none.
+    """
+    first = await anext(rows, None)
+    if first is None:
+        return None
+
+    async def chained():
+        yield first
+        async for row in rows:
+            yield row
+
+    return chained()
+
+
+async def _entries(rows: AsyncIterator[dict], formats: Iterable[str]) -> AsyncIterator[Tuple[str, Optional[str]]]:
+    """(archive name, stored URL or None) for every requested document of every row."""
+    async for row in rows:
+        product = row.get("product") or "Document"
+        outputs = row.get("outputs") or {}
+        for extension in formats:
+            yield f"{product}/{product}-{row['id']}.{extension}", outputs.get(f"{extension}_url")
+
+
+async def _fetch(url: str, queue: asyncio.Queue, timeout: float) -> None:
+    """Stream a stored document into queue, ending with None (or the exception that stopped it)."""
+    try:
+        location = storage_object_from_url(url)
+        if location is None:
+            raise ExportError(f"Not a Storage object: {url}")
+        bucket, storage_path = location
+        async with open_storage_stream_async(storage_path, bucket, timeout=timeout) as response:
+            if response is None:
+                raise ExportError(f"Missing from Storage: {bucket}/{storage_path}")
+            async for chunk in response.aiter_bytes(EXPORT_CHUNK_BYTES):
+                await queue.put(chunk)
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+
+
+class _ZipSink:
+    """Write end of the archive: zipfile writes here and the response drains it."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+async def stream_zip(
+    rows: AsyncIterator[dict],
+    formats: Iterable[str] = EXPORT_FORMATS,
+    concurrency: int = EXPORT_CONCURRENCY,
+    timeout: float = STORAGE_UPLOAD_TIMEOUT_SECONDS,
+) -> AsyncIterator[bytes]:
+    """
+    Yield a ZIP of the rows' documents as it is written.
+
+    Args:
+        rows: Submissions (id, product, outputs), e.g. from iter_submissions().
+        formats: Documents to include per submission.
+        concurrency: Documents fetched at the same time (the one being written included).
+        timeout: Seconds per document fetch.
+    """
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED)
+    entries = _entries(rows, list(formats))
+    pending: deque = deque()  # (name, queue, task) in archive order
+    exhausted = False
+    current: Optional[asyncio.Task] = None
+    missing: List[Dict[str, str]] = []
+    written = 0
+    started = time.monotonic()
+
+    async def refill(limit: int) -> None:
+        nonlocal exhausted
+        while not exhausted and len(pending) < limit:
+            entry = await anext(entries, None)
+            if entry is None:
+                exhausted = True
+            elif entry[1] is None:
+                missing.append({"name": entry[0], "error": "Not generated"})
+            else:
+                queue = asyncio.Queue(maxsize=EXPORT_BUFFER_CHUNKS)
+                pending.append((entry[0], queue, asyncio.create_task(_fetch(entry[1], queue, timeout))))
+
+    try:
+        await refill(concurrency)
+        while pending:
+            name, queue, current = pending.popleft()
+            await refill(concurrency - 1)  # the next documents download while this one is written
+            item = await queue.get()
+            if isinstance(item, Exception):
+                logger.warning(f"Export skipped {name}: {item}")
+                missing.append({"name": name, "error": str(item)})
+                metrics.counter("export_files_total", outcome="missing").inc()
+                continue
+
+            with archive.open(zipfile.ZipInfo(name, time.localtime()[:6]), "w") as out:
+                while item is not None:
+                    if isinstance(item, Exception):
+                        logger.warning(f"Export truncated {name}: {item}")
+                        missing.append({"name": name, "error": f"Truncated: {item}"})
+                        break
+                    out.write(item)
+                    written += len(item)
+                    yield sink.drain()
+                    item = await queue.get()
+            data = sink.drain()
+            if data:
+                yield data
+            metrics.counter("export_files_total", outcome="exported" if item is None else "truncated").inc()
+
+        if missing:
+            archive.writestr(MANIFEST_NAME, json.dumps({"missing": missing}, indent=2))
+        archive.close()
+        yield sink.drain()
+        metrics.counter("export_bytes_total").inc(written)
+        logger.info(
+            f"Export finished: {written:,} document bytes in {time.monotonic() - started:.1f}s, "
+            f"{len(missing)} missing"
+        )
+    finally:
+        for task in [current] + [task for _, _, task in pending]:
+            if task is not None:
+                task.cancel()
+        await entries.aclose()
+        if hasattr(rows, "aclose"):
+            await rows.aclose()
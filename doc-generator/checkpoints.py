@@ -0,0 +1,354 @@
+"""
+Stage checkpoint ledger for /generate-from-submission.
+
+When the PDF conversion or an upload fails late, a retry used to repeat the LLM
+call and the render from scratch. Each checkpointed stage's result (AI content,
+downloaded images, DOCX, PDF, upload URLs) is now recorded under the submission
+id together with the hash of the submission's inputs. A re-run with the same
+inputs hash restores those results and resumes at the first incomplete stage;
+changed inputs discard the old checkpoints.
+
+Results live in a local SQLite ledger. Files a result refers to are hard-linked
+(or copied) into CHECKPOINT_DIR so they survive temp-dir cleanup and output
+eviction. On restore they are put back where the resuming run wants them (its
+own temp directory and output names, see ResumePlan's relocate), and the paths
+in the restored result are rewritten to match. With
+CHECKPOINT_MIRROR_BUCKET set, records and files are also mirrored to Supabase
+Storage so another replica, or a restarted container, can resume.
+
+A restored result is only used when every stage it depends on was restored too;
+anything downstream of a stage that had to run again runs again as well.
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import metrics
+from executors import run_in
+from local_store import link_or_copy, open_sqlite
+from pipeline import Stage
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_ENABLED = os.environ.get("CHECKPOINT_ENABLED", "true").lower() in ("1", "true", "yes")
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR", os.path.join(os.path.dirname(__file__), "checkpoints"))
+CHECKPOINT_TTL_SECONDS = float(os.environ.get("CHECKPOINT_TTL_SECONDS", "86400"))
+CHECKPOINT_MIRROR_BUCKET = os.environ.get("CHECKPOINT_MIRROR_BUCKET", "")  # empty = local only
+
+_MISSING = object()
+
+
+class Checkpoint:
+    """
+    How one stage is checkpointed.
+
+    Args:
+        files: Returns the local files a result refers to (kept with the checkpoint).
+        keep: Returns False for results that should not be reused (degraded or failed).
+    """
+
+    def __init__(
+        self,
+        files: Callable[[Any], Iterable[str]] = lambda value: (),
+        keep: Callable[[Any], bool] = lambda value: True,
+    ):
+        self.files = files
+        self.keep = keep
+
+
+class CheckpointLedger:
+    """
+    SQLite ledger of stage results, one row per (submission, stage).
+
+    Args:
+        directory: Where the ledger database and kept files live.
+        ttl_seconds: Checkpoints older than this are pruned.
+        mirror_bucket: Supabase Storage bucket to mirror to ("" to disable).
+    """
+
+    def __init__(
+        self,
+        directory: str = CHECKPOINT_DIR,
+        ttl_seconds: float = CHECKPOINT_TTL_SECONDS,
+        mirror_bucket: str = CHECKPOINT_MIRROR_BUCKET,
+    ):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.mirror_bucket = mirror_bucket
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._mirror = ThreadPoolExecutor(max_workers=2, thread_name_prefix="checkpoint-mirror") if mirror_bucket else None
+        self._last_prune = 0.0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = open_sqlite(
+                os.path.join(self.directory, "ledger.sqlite3"),
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "submission_id TEXT NOT NULL, stage TEXT NOT NULL, input_hash TEXT NOT NULL, "
+                "value TEXT NOT NULL, files TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (submission_id, stage))",
+            )
+        return self._conn
+
+    def _file_dir(self, submission_id: str, stage: str) -> str:
+        return os.path.join(self.directory, "files", submission_id, stage)
+
+    def save(self, submission_id: str, input_hash: str, stage: str, value: Any, files: Iterable[str] = ()) -> None:
+        """Record a stage result. Checkpoints for other inputs of the submission are dropped."""
+        kept = {}
+        for path in files:
+            if not path or not os.path.exists(path):
+                continue
+            target_dir = self._file_dir(submission_id, stage)
+            os.makedirs(target_dir, exist_ok=True)
+            target = os.path.join(target_dir, f"{len(kept)}_{os.path.basename(path)}")
+            link_or_copy(path, target)
+            kept[path] = target
+
+        record = json.dumps(value, default=str)
+        with self._lock:
+            db = self._db()
+            stale = db.execute(
+                "SELECT stage FROM checkpoints WHERE submission_id = ? AND input_hash != ?",
+                (submission_id, input_hash),
+            ).fetchall()
+            db.execute("DELETE FROM checkpoints WHERE submission_id = ? AND input_hash != ?", (submission_id, input_hash))
+            db.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?)",
+                (submission_id, stage, input_hash, record, json.dumps(kept), time.time()),
+            )
+            db.commit()
+        for (old_stage,) in stale:
+            if old_stage != stage:
+                shutil.rmtree(self._file_dir(submission_id, old_stage), ignore_errors=True)
+        metrics.counter("checkpoint_saves_total", stage=stage).inc()
+        if self._mirror is not None:
+            self._mirror.submit(self._mirror_save, submission_id, stage, input_hash, record, kept)
+        self._maybe_prune()
+
+    def load(
+        self, submission_id: str, input_hash: str, stage: str, relocate: Optional[Callable[[str], str]] = None
+    ) -> Any:
+        """
+        Restore a stage result recorded for the same inputs.
+
+        Args:
+            relocate: Maps a file's recorded path to where it should be restored
+                (default: the recorded path).
+
+        Returns:
+            The recorded value with its file paths relocated, or _MISSING when
+            there is no usable checkpoint.
+        """
+        with self._lock:
+            row = self._db().execute(
+                "SELECT value, files FROM checkpoints WHERE submission_id = ? AND stage = ? AND input_hash = ?",
+                (submission_id, stage, input_hash),
+            ).fetchone()
+        if row is None and self.mirror_bucket:
+            row = self._mirror_load(submission_id, stage, input_hash)
+        if row is None:
+            return _MISSING
+        value, kept = json.loads(row[0]), json.loads(row[1])
+        restored = {}
+        for original, copy in kept.items():
+            target = relocate(original) if relocate else original
+            if not os.path.exists(copy):
+                logger.warning(f"Checkpoint {submission_id}/{stage} lost {copy}; stage will run again")
+                return _MISSING
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            link_or_copy(copy, target)
+            os.utime(target)  # a fresh file for output eviction, not the checkpoint's age
+            restored[original] = target
+        metrics.counter("checkpoint_restores_total", stage=stage).inc()
+        return _replace_paths(value, restored)
+
+    def clear(self, submission_id: str) -> None:
+        """Forget every checkpoint of a submission (after it completed)."""
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM checkpoints WHERE submission_id = ?", (submission_id,))
+            db.commit()
+        shutil.rmtree(os.path.join(self.directory, "files", submission_id), ignore_errors=True)
+
+    def _maybe_prune(self) -> None:
+        now = time.time()
+        if now - self._last_prune < 600:
+            return
+        self._last_prune = now
+        with self._lock:
+            db = self._db()
+            old = db.execute(
+                "SELECT DISTINCT submission_id FROM checkpoints WHERE created_at < ?", (now - self.ttl_seconds,)
+            ).fetchall()
+        for (submission_id,) in old:
+            self.clear(submission_id)
+        if old:
+            logger.info(f"Pruned checkpoints of {len(old)} submissions")
+
+    # --- Storage mirror ---------------------------------------------------------
+
+    def _mirror_save(self, submission_id: str, stage: str, input_hash: str, record: str, kept: Dict[str, str]) -> None:
+        from supabase_client import upload_bytes_to_storage
+
+        prefix = f"checkpoints/{submission_id}/{stage}"
+        try:
+            files = {}
+            for original, copy in kept.items():
+                name = os.path.basename(copy)
+                with open(copy, "rb") as f:
+                    upload_bytes_to_storage(f.read(), f"{prefix}/{name}", bucket=self.mirror_bucket)
+                files[original] = name
+            manifest = json.dumps({"input_hash": input_hash, "value": record, "files": files})
+            upload_bytes_to_storage(manifest.encode("utf-8"), f"{prefix}/record.json", bucket=self.mirror_bucket)
+        except Exception as e:
+            logger.warning(f"Checkpoint mirror upload failed for {prefix}: {e}")
+
+    def _mirror_load(self, submission_id: str, stage: str, input_hash: str) -> Optional[tuple]:
+        from supabase_client import download_from_storage
+
+        prefix = f"checkpoints/{submission_id}/{stage}"
+        try:
+            manifest = download_from_storage(f"{prefix}/record.json", bucket=self.mirror_bucket)
+            if manifest is None:
+                return None
+            manifest = json.loads(manifest)
+            if manifest["input_hash"] != input_hash:
+                return None
+            kept = {}
+            target_dir = self._file_dir(submission_id, stage)
+            os.makedirs(target_dir, exist_ok=True)
+            for original, name in manifest["files"].items():
+                content = download_from_storage(f"{prefix}/{name}", bucket=self.mirror_bucket)
+                if content is None:
+                    return None
+                kept[original] = os.path.join(target_dir, name)
+                with open(kept[original], "wb") as f:
+                    f.write(content)
+        except Exception as e:
+            logger.warning(f"Checkpoint mirror download failed for {prefix}: {e}")
+            return None
+        logger.info(f"Checkpoint {submission_id}/{stage} restored from storage mirror")
+        return manifest["value"], json.dumps(kept)
+
+    def close(self) -> None:
+        if self._mirror is not None:
+            self._mirror.shutdown(wait=True)
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _replace_paths(value: Any, paths: Dict[str, str]) -> Any:
+    """Rewrite every string in value that is a key of paths."""
+    if isinstance(value, str):
+        return paths.get(value, value)
+    if isinstance(value, dict):
+        return {key: _replace_paths(item, paths) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_replace_paths(item, paths) for item in value]
+    return value
+
+
+class ResumePlan:
+    """
+    Wraps pipeline stages so they restore or record checkpoints.
+
+    Args:
+        ledger: Where checkpoints live.
+        submission_id / input_hash: Identify the run; only checkpoints of the same inputs are used.
+        checkpoints: Stage name -> Checkpoint for the stages worth recording.
+        relocate: relocate(stage, recorded_path) -> where this run wants a restored
+            file (its temp directory, its output names); default: the recorded path.
+    """
+
+    def __init__(
+        self,
+        ledger: CheckpointLedger,
+        submission_id: str,
+        input_hash: str,
+        checkpoints: Dict[str, Checkpoint],
+        relocate: Optional[Callable[[str, str], str]] = None,
+    ):
+        self.ledger = ledger
+        self.submission_id = submission_id
+        self.input_hash = input_hash
+        self.checkpoints = checkpoints
+        self.relocate = relocate
+        self.restored: List[str] = []
+        self.saved: List[str] = []
+        self._consistent = set()  # stages whose result matches the recorded run
+
+    @property
+    def complete(self) -> bool:
+        """True when every checkpointed stage has a reusable result (nothing left to retry)."""
+        return set(self.checkpoints) <= set(self.restored) | set(self.saved)
+
+    def wrap(self, stages: List[Stage]) -> List[Stage]:
+        return [Stage(s.name, self._wrap_fn(s), deps=s.deps, executor=s.executor) for s in stages]
+
+    def _wrap_fn(self, stage: Stage):
+        checkpoint = self.checkpoints.get(stage.name)
+        if asyncio.iscoroutinefunction(stage.fn):
+            async def run_async(results: dict):
+                value = await run_in("io", self._restore, stage) if checkpoint else self._pass_through(stage)
+                if value is not _MISSING:
+                    return value
+                value = await stage.fn(results)
+                if checkpoint:
+                    await run_in("io", self._record, stage.name, checkpoint, value)
+                return value
+            return run_async
+
+        def run_sync(results: dict):
+            value = self._restore(stage) if checkpoint else self._pass_through(stage)
+            if value is not _MISSING:
+                return value
+            value = stage.fn(results)
+            if checkpoint:
+                self._record(stage.name, checkpoint, value)
+            return value
+        return run_sync
+
+    def _deps_consistent(self, stage: Stage) -> bool:
+        return all(dep in self._consistent for dep in stage.deps)
+
+    def _pass_through(self, stage: Stage) -> Any:
+        # Unrecorded stages are recomputed, and stay consistent if their inputs were
+        if self._deps_consistent(stage):
+            self._consistent.add(stage.name)
+        return _MISSING
+
+    def _restore(self, stage: Stage) -> Any:
+        if not self._deps_consistent(stage):
+            return _MISSING
+        try:
+            relocate = (lambda path: self.relocate(stage.name, path)) if self.relocate else None
+            value = self.ledger.load(self.submission_id, self.input_hash, stage.name, relocate)
+        except Exception as e:
+            logger.warning(f"Checkpoint lookup failed for {stage.name}: {e}")
+            return _MISSING
+        if value is not _MISSING:
+            self._consistent.add(stage.name)
+            self.restored.append(stage.name)
+            logger.info(f"Submission {self.submission_id}: resumed stage {stage.name} from checkpoint")
+        return value
+
+    def _record(self, name: str, checkpoint: Checkpoint, value: Any) -> None:
+        if not checkpoint.keep(value):
+            return
+        try:
+            self.ledger.save(self.submission_id, self.input_hash, name, value, checkpoint.files(value))
+            self.saved.append(name)
+        except Exception as e:
+            logger.warning(f"Checkpoint save failed for {name}: {e}")
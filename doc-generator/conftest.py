@@ -0,0 +1,94 @@
+"""
+Shared test fixtures: a stub Supabase (PostgREST + Storage) server.
+"""
+
+import os
+import sys
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import supabase_client
+
+
+class StubRequest(BaseHTTPRequestHandler):
+    """One request to the stub server, dispatched to the route with the longest matching prefix."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    routes = {}  # (method, path prefix) -> handler
+
+    @property
+    def url(self):
+        return urlparse(self.path)
+
+    @property
+    def query(self):
+        return parse_qsl(self.url.query)
+
+    def body(self) -> bytes:
+        if self._body is None:
+            self._body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        return self._body
+
+    def reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _dispatch(self):
+        self._body = None
+        path = self.url.path
+        prefixes = [prefix for method, prefix in self.routes if method == self.command and path.startswith(prefix)]
+        if not prefixes:
+            self.body()
+            self.reply(404)
+            return
+        answer = self.routes[(self.command, max(prefixes, key=len))](self)
+        if answer is None:  # the handler answered (or dropped the connection) itself
+            return
+        self.body()  # an unread body would corrupt the next request on the connection
+        self.reply(*answer)
+
+    do_GET = do_HEAD = do_POST = do_PATCH = do_PUT = do_DELETE = _dispatch
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def supabase_stub(monkeypatch):
+    """
+    Start a stub Supabase server and point supabase_client at it.
+
+    Call it with routes {(method, path prefix): handler}; the longest matching
+    prefix wins and anything else gets a 404. A handler receives the
+    StubRequest (.url, .query, .headers, .body()) and returns
+    (status, body[, headers]), or None when it has answered itself.
+    Returns the server's base URL.
+    """
+    servers = []
+
+    def start(routes):
+        handler = type("StubSupabase", (StubRequest,), {"routes": dict(routes)})
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        base = f"http://127.0.0.1:{httpd.server_address[1]}"
+        monkeypatch.setattr(supabase_client, "SUPABASE_URL", base)
+        monkeypatch.setattr(supabase_client, "SUPABASE_SERVICE_ROLE_KEY", "service-key")
+        return base
+
+    yield start
+    asyncio.run(supabase_client.close_clients())
+    for httpd in servers:
+        httpd.shutdown()
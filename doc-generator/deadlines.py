@@ -0,0 +1,99 @@
+"""
+Per-request deadlines.
+
+Each generation gets one deadline, from the X-Request-Deadline header or
+REQUEST_DEADLINE_SECONDS, and every step takes only what is left of it: image
+downloads, Supabase calls and uploads use the remaining time as their timeout,
+the AI stage gets what is left after a reserve for rendering and delivery, and
+soffice is killed when the budget runs out. When the budget is too short for an
+optional step it degrades (fallback AI content, DOCX without PDF); when it is
+too short for a required one the request fails fast with 504 instead of holding
+a worker.
+"""
+
+import os
+import time
+import logging
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_HEADER = "X-Request-Deadline"
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "300"))
+# Upper bound for deadlines asked for in the header
+REQUEST_DEADLINE_MAX_SECONDS = float(os.environ.get("REQUEST_DEADLINE_MAX_SECONDS", "900"))
+# Time kept back from the AI stage for render, PDF and uploads
+DEADLINE_DELIVERY_RESERVE_SECONDS = float(os.environ.get("DEADLINE_DELIVERY_RESERVE_SECONDS", "20"))
+# Shortest useful budgets; below them the PDF is skipped or a required step fails the request
+# (the AI stage has its own minimum, AI_MIN_BUDGET_SECONDS in ai_generator.py)
+DEADLINE_MIN_PDF_SECONDS = float(os.environ.get("DEADLINE_MIN_PDF_SECONDS", "5"))
+DEADLINE_MIN_STEP_SECONDS = float(os.environ.get("DEADLINE_MIN_STEP_SECONDS", "0.5"))
+# Time kept back from optional steps (PDF, uploads) so the submission outputs can still be written
+DEADLINE_OUTPUTS_RESERVE_SECONDS = float(os.environ.get("DEADLINE_OUTPUTS_RESERVE_SECONDS", "3"))
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when too little of a request's deadline is left for a required step."""
+    pass
+
+
+class Deadline:
+    """
+    A point in time (time.monotonic()) a request must finish by.
+
+    Args:
+        seconds: Time from now until the deadline.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_header(cls, value: Optional[str], default: float = REQUEST_DEADLINE_SECONDS) -> "Deadline":
+        """
+        Parse X-Request-Deadline: seconds from now, or an absolute Unix timestamp.
+        Missing or malformed values use the default; values are capped at
+        REQUEST_DEADLINE_MAX_SECONDS.
+        """
+        seconds = default
+        if value:
+            try:
+                parsed = float(value)
+                # Large values are absolute epoch seconds (front-ends often send Date.now()/1000 + budget)
+                seconds = parsed - time.time() if parsed > 1e9 else parsed
+            except ValueError:
+                logger.warning(f"Ignoring malformed {DEADLINE_HEADER}: {value!r}")
+        return cls(min(seconds, REQUEST_DEADLINE_MAX_SECONDS))
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self, step: str, minimum: float = DEADLINE_MIN_STEP_SECONDS) -> float:
+        """
+        Fail fast before a required step.
+
+        Returns:
+            The remaining seconds.
+
+        Raises:
+            DeadlineExceeded if less than minimum is left.
+        """
+        remaining = self.remaining()
+        if remaining < minimum:
+            metrics.counter("deadline_exceeded_total", step=step).inc()
+            raise DeadlineExceeded(f"Request deadline reached before {step} ({remaining:.1f}s left)")
+        return remaining
+
+    def timeout(self, cap: float, step: str, minimum: float = DEADLINE_MIN_STEP_SECONDS) -> float:
+        """Timeout for a required step: the remaining time, at most cap (raises like check())."""
+        return min(cap, self.check(step, minimum))
+
+    def budget(self, cap: Optional[float], reserve: float = 0.0) -> float:
+        """Budget for an optional step: remaining time minus reserve, at most cap (never negative)."""
+        budget = self.remaining() - reserve
+        if cap is not None:
+            budget = min(budget, cap)
+        return max(0.0, budget)
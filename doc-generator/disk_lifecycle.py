@@ -0,0 +1,273 @@
+"""
+Disk lifecycle for OUTPUT_DIR and per-request temp directories.
+
+Every render writes a timestamped DOCX/PDF pair to OUTPUT_DIR and nothing ever
+removed them; the image temp directory of each generation was never removed
+either, so long-running containers slowly filled their ephemeral disk. The
+documents live in Storage, so local copies are only needed while a request
+uses them:
+
+- temp directories come from scoped_temp_dir(), which removes them when the
+  request ends, however it ends; directories left behind by a crash are swept
+  after TEMP_ORPHAN_SECONDS;
+- OutputJanitor sweeps OUTPUT_DIR every DISK_SWEEP_INTERVAL_SECONDS, removing
+  files older than OUTPUT_MAX_AGE_SECONDS and then the oldest files while the
+  directory is over OUTPUT_MAX_BYTES or the disk has less than
+  DISK_MIN_FREE_BYTES free. Renders check free space first, so a full disk is
+  dealt with before it fails a request;
+- files in use are pinned (the files of a running generation, a local file
+  being streamed by /download) and never removed. Files that are the only copy
+  of a document (its upload failed) are kept back: size and free-space eviction
+  only take them once nothing else is left, and age eviction still applies.
+
+Usage is reported as disk_* gauges and counters.
+"""
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set
+
+import metrics
+from executors import run_in
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the limit
+OUTPUT_MAX_AGE_SECONDS = float(os.environ.get("OUTPUT_MAX_AGE_SECONDS", "86400"))
+OUTPUT_MAX_BYTES = int(os.environ.get("OUTPUT_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Evict (oldest first) when the disk holding OUTPUT_DIR has less free space than this
+DISK_MIN_FREE_BYTES = int(os.environ.get("DISK_MIN_FREE_BYTES", str(512 * 1024 * 1024)))
+DISK_SWEEP_INTERVAL_SECONDS = float(os.environ.get("DISK_SWEEP_INTERVAL_SECONDS", "300"))
+
+TEMP_DIR_PREFIX = "doc_gen_"
+# Temp directories older than this and not in use are left over from a crash
+TEMP_ORPHAN_SECONDS = 3600
+
+_active_temp_dirs: Set[str] = set()
+_temp_lock = threading.Lock()
+
+
+@contextmanager
+def scoped_temp_dir(prefix: str = TEMP_DIR_PREFIX) -> Iterator[str]:
+    """A temp directory for one request, removed with its contents on exit."""
+    path = tempfile.mkdtemp(prefix=prefix)
+    with _temp_lock:
+        _active_temp_dirs.add(path)
+        metrics.gauge("disk_temp_dirs_active").set(len(_active_temp_dirs))
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+        with _temp_lock:
+            _active_temp_dirs.discard(path)
+            metrics.gauge("disk_temp_dirs_active").set(len(_active_temp_dirs))
+        metrics.counter("disk_temp_dirs_removed_total", reason="scoped").inc()
+
+
+def sweep_temp_dirs(prefix: str = TEMP_DIR_PREFIX, max_age_seconds: float = TEMP_ORPHAN_SECONDS) -> int:
+    """Remove temp directories a crashed or killed request left behind. Returns directories removed."""
+    root = tempfile.gettempdir()
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.name.startswith(prefix) or not entry.is_dir(follow_symlinks=False):
+            continue
+        with _temp_lock:
+            if entry.path in _active_temp_dirs:
+                continue
+        try:
+            if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        removed += 1
+    if removed:
+        metrics.counter("disk_temp_dirs_removed_total", reason="orphaned").inc(removed)
+        logger.info(f"Removed {removed} orphaned temp director{'y' if removed == 1 else 'ies'}")
+    return removed
+
+
+class OutputJanitor:
+    """
+    Keeps a directory of generated files within age, size and free-space limits.
+
+    Args:
+        directory: Directory to manage (its top-level files; dotfiles are left alone).
+        max_age_seconds: Files older than this are removed (0 = no limit).
+        max_bytes: Size cap; oldest files are removed down to 90% of it (0 = no cap).
+        min_free_bytes: Free space to keep on the directory's disk (0 = not checked).
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_age_seconds: float = OUTPUT_MAX_AGE_SECONDS,
+        max_bytes: int = OUTPUT_MAX_BYTES,
+        min_free_bytes: int = DISK_MIN_FREE_BYTES,
+    ):
+        self.directory = directory
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self._pins: Dict[str, int] = {}
+        self._kept: Set[str] = set()
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._last: Dict[str, float] = {}
+
+    # --- Pins -------------------------------------------------------------------
+
+    def pin(self, *paths: Optional[str]) -> None:
+        """Protect files while they are in use (paths need not exist yet)."""
+        with self._lock:
+            for path in filter(None, paths):
+                path = os.path.abspath(path)
+                self._pins[path] = self._pins.get(path, 0) + 1
+
+    def unpin(self, *paths: Optional[str]) -> None:
+        with self._lock:
+            for path in filter(None, paths):
+                path = os.path.abspath(path)
+                count = self._pins.get(path, 0) - 1
+                if count > 0:
+                    self._pins[path] = count
+                else:
+                    self._pins.pop(path, None)
+
+    @contextmanager
+    def pinned(self, *paths: Optional[str]) -> Iterator[None]:
+        self.pin(*paths)
+        try:
+            yield
+        finally:
+            self.unpin(*paths)
+
+    def keep(self, *paths: Optional[str]) -> None:
+        """Mark files that are the only copy of a document (still served from disk by /download)."""
+        with self._lock:
+            self._kept.update(os.path.abspath(path) for path in paths if path)
+
+    # --- Sweeps -----------------------------------------------------------------
+
+    def free_bytes(self) -> int:
+        return shutil.disk_usage(self.directory).free
+
+    def ensure_free(self) -> int:
+        """Sweep now if the disk is short of min_free_bytes. Returns files removed."""
+        if not self.min_free_bytes:
+            return 0
+        try:
+            if self.free_bytes() >= self.min_free_bytes:
+                return 0
+        except OSError:
+            return 0
+        logger.warning(f"Low disk space under {self.directory}, evicting generated files")
+        return self.sweep()
+
+    def sweep(self) -> int:
+        """
+        Remove expired files, then the oldest ones while over max_bytes or short of
+        min_free_bytes. Pinned files are never removed. Returns files removed.
+        """
+        with self._sweep_lock:
+            now = time.time()
+            try:
+                entries = [
+                    entry for entry in os.scandir(self.directory)
+                    if not entry.name.startswith(".") and entry.is_file(follow_symlinks=False)
+                ]
+            except FileNotFoundError:
+                return 0
+            files = []
+            for entry in entries:
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, os.path.abspath(entry.path)))
+            with self._lock:
+                pins = set(self._pins)
+                kept = set(self._kept)
+            # Oldest first, only copies of a document last
+            files.sort(key=lambda item: (item[2] in kept, item[0]))
+            total = sum(size for _, size, _ in files)
+            try:
+                free = self.free_bytes()
+            except OSError:
+                free = None
+
+            victims: List[tuple] = []
+            remaining = []
+            for mtime, size, path in files:
+                if path in pins:
+                    continue
+                if self.max_age_seconds and now - mtime > self.max_age_seconds:
+                    victims.append((path, size, "age"))
+                else:
+                    remaining.append((mtime, size, path))
+            freed = sum(size for _, size, _ in victims)
+            for mtime, size, path in remaining:
+                over_size = self.max_bytes and total > self.max_bytes and total - freed > self.max_bytes * 0.9
+                low_space = free is not None and self.min_free_bytes and free + freed < self.min_free_bytes
+                if not over_size and not low_space:
+                    break
+                victims.append((path, size, "size" if over_size else "low_space"))
+                freed += size
+
+            removed = 0
+            for path, size, reason in victims:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    logger.warning(f"Could not evict {path}: {e}")
+                    continue
+                removed += 1
+                metrics.counter("disk_evictions_total", reason=reason).inc()
+                metrics.counter("disk_evicted_bytes_total").inc(size)
+            with self._lock:
+                self._kept.difference_update(path for path, _, _ in victims)
+            if removed:
+                logger.info(f"Evicted {removed} generated file(s) from {self.directory}, {freed:,} bytes")
+            self._report(len(files) - removed, total - freed)
+            return removed
+
+    def _report(self, files: int, total: int) -> None:
+        try:
+            usage = shutil.disk_usage(self.directory)
+        except OSError:
+            usage = None
+        self._last = {"output_files": files, "output_bytes": total, "swept_at": time.time()}
+        metrics.gauge("disk_output_files").set(files)
+        metrics.gauge("disk_output_bytes").set(total)
+        if usage is not None:
+            self._last.update(free_bytes=usage.free, total_bytes=usage.total)
+            metrics.gauge("disk_free_bytes").set(usage.free)
+            metrics.gauge("disk_free_ratio").set(round(usage.free / usage.total, 4) if usage.total else 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Figures from the last sweep, plus current pins (for /health)."""
+        with self._lock:
+            return dict(self._last, pinned_files=len(self._pins), kept_files=len(self._kept))
+
+    async def run(self, interval_seconds: float = DISK_SWEEP_INTERVAL_SECONDS) -> None:
+        """Sweep the directory and the temp directories every interval_seconds until cancelled."""
+        while True:
+            try:
+                await run_in("io", self.sweep)
+                await run_in("io", sweep_temp_dirs)
+            except Exception as e:
+                logger.error(f"Disk sweep failed: {e}")
+            await asyncio.sleep(interval_seconds)
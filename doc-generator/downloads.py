@@ -0,0 +1,196 @@
+"""
+Serving generated documents from /download.
+
+/download used to stream the docx_path/pdf_path recorded in the submission's
+outputs, which only exists on the replica that rendered it and is gone after a
+redeploy. The documents are in Storage, so the endpoint now redirects to the
+stored URL, or to a short-lived signed URL when DOWNLOAD_SIGNED_URL_SECONDS is
+set (for private buckets), and the bytes never pass through this service.
+
+Replicas that should serve downloads themselves can set DOWNLOAD_CACHE_DIR:
+documents are then fetched from Storage once into a local LRU cache keyed by
+content hash and served with the hash as ETag, answering If-None-Match with 304
+and Range requests with partial content.
+
+Submission lookups go through a short TTL cache, since a client usually fetches
+both documents (or several ranges) right after each other. Stored URLs are
+content-addressed, so a stale entry still points at a valid, older document.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+from urllib.parse import urlencode
+
+import metrics
+from executors import run_in
+from artifact_store import file_sha256
+from supabase_client import create_signed_url_async, download_to_file_async, storage_object_from_url
+
+logger = logging.getLogger(__name__)
+
+# 0 redirects to the stored URL; more signs a URL valid for that many seconds
+DOWNLOAD_SIGNED_URL_SECONDS = int(os.environ.get("DOWNLOAD_SIGNED_URL_SECONDS", "0"))
+DOWNLOAD_METADATA_TTL_SECONDS = float(os.environ.get("DOWNLOAD_METADATA_TTL_SECONDS", "30"))
+DOWNLOAD_METADATA_MAX_ENTRIES = 1024
+# Empty disables the local cache (downloads are redirected)
+DOWNLOAD_CACHE_DIR = os.environ.get("DOWNLOAD_CACHE_DIR", "")
+DOWNLOAD_CACHE_MAX_BYTES = int(os.environ.get("DOWNLOAD_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+class MetadataCache:
+    """Submission rows kept for a few seconds, least recently used dropped first."""
+
+    def __init__(self, ttl_seconds: float = DOWNLOAD_METADATA_TTL_SECONDS, max_entries: int = DOWNLOAD_METADATA_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires, row)
+
+    async def get(self, key: str, load: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        """
+        Return the cached row for key, or load() it. Missing rows are not cached.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            metrics.counter("download_metadata_requests_total", outcome="hit").inc()
+            return entry[1]
+
+        metrics.counter("download_metadata_requests_total", outcome="miss").inc()
+        row = await load()
+        if row is None or self.ttl_seconds <= 0:
+            self._entries.pop(key, None)
+            return row
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, row)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return row
+
+    def invalidate(self, key: str) -> None:
+        """Forget key (its outputs were just rewritten)."""
+        self._entries.pop(key, None)
+
+
+class ArtifactCache:
+    """
+    Local copies of stored documents, named by content hash and evicted LRU.
+
+    Args:
+        directory: Cache directory.
+        max_bytes: Total size the cache is trimmed back under after each fetch.
+    """
+
+    def __init__(self, directory: str = DOWNLOAD_CACHE_DIR, max_bytes: int = DOWNLOAD_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._fetching: Dict[str, asyncio.Lock] = {}
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    async def fetch(self, url: str, digest: Optional[str], extension: str, timeout: float) -> Optional[str]:
+        """
+        Local path of the document at url, fetched from Storage on a miss.
+
+        Args:
+            url: Stored object URL from the submission's outputs.
+            digest: sha256 of the document if recorded; the download is checked against it.
+            extension: "docx" or "pdf".
+            timeout: Seconds for the Storage download.
+
+        Returns:
+            The cached file, or None if url is not a Storage object or no longer exists.
+
+        Raises:
+            Exception if the download fails or does not match digest.
+        """
+        key = digest or hashlib.sha256(url.encode("utf-8")).hexdigest()
+        path = self._path(key, extension)
+        # Concurrent misses for one document wait for a single download
+        lock = self._fetching.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                if os.path.exists(path):
+                    os.utime(path)  # mtime is the LRU clock
+                    metrics.counter("download_cache_requests_total", outcome="hit").inc()
+                    return path
+                metrics.counter("download_cache_requests_total", outcome="miss").inc()
+
+                location = storage_object_from_url(url)
+                if location is None:
+                    return None
+                bucket, storage_path = location
+                os.makedirs(self.directory, exist_ok=True)
+                partial = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.{extension}")
+                if not await download_to_file_async(storage_path, bucket, partial, timeout=timeout):
+                    return None
+                if digest is not None and await run_in("io", file_sha256, partial) != digest:
+                    os.remove(partial)
+                    raise Exception(f"Downloaded {storage_path} does not match sha256 {digest[:16]}")
+                os.replace(partial, path)
+        finally:
+            if not lock.locked():
+                self._fetching.pop(key, None)
+        await run_in("io", self.evict)
+        return path
+
+    def evict(self) -> int:
+        """Remove least recently served files until the cache is under 90% of max_bytes."""
+        try:
+            entries = [
+                entry for entry in os.scandir(self.directory)
+                if entry.is_file() and not entry.name.startswith(".")
+            ]
+        except FileNotFoundError:
+            return 0
+        stats = sorted(((entry.stat(), entry.path) for entry in entries), key=lambda item: item[0].st_mtime)
+        total = sum(stat.st_size for stat, _ in stats)
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for stat, path in stats:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= stat.st_size
+            removed += 1
+        metrics.counter("download_cache_evictions_total").inc(removed)
+        logger.info(f"Download cache evicted {removed} file(s), {total:,} bytes left")
+        return removed
+
+
+def etag_for(digest: str) -> str:
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header covers etag (weak comparison, as RFC 9110 asks)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+async def redirect_target(url: str, filename: str, timeout: float) -> str:
+    """
+    Where to send the client for a stored document: a signed URL when configured,
+    otherwise the stored URL. Both ask Storage to serve it as filename.
+    """
+    location = storage_object_from_url(url)
+    if DOWNLOAD_SIGNED_URL_SECONDS > 0 and location is not None:
+        bucket, storage_path = location
+        return await create_signed_url_async(
+            storage_path, bucket, DOWNLOAD_SIGNED_URL_SECONDS, download=filename, timeout=timeout
+        )
+    if location is None:
+        return url
+    return url + ("&" if "?" in url else "?") + urlencode({"download": filename})
@@ -0,0 +1,85 @@
+"""
+Explicitly sized executors for blocking work called from async handlers.
+
+Handlers are async; anything that blocks (LLM SDK calls, python-docx rendering,
+LibreOffice) runs in one of these pools instead of Starlette's shared default
+threadpool, so each kind of work has its own capacity and cannot starve the others:
+
+    ai     - blocking LLM SDK calls and prefetch adoption (waits on the network)
+    render - generate_docx (CPU-bound, holds the GIL)
+    pdf    - LibreOffice conversions (one soffice process per worker)
+    io     - small blocking file operations
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+AI_EXECUTOR_WORKERS = int(os.environ.get("AI_EXECUTOR_WORKERS", "32"))
+RENDER_EXECUTOR_WORKERS = int(os.environ.get("RENDER_EXECUTOR_WORKERS", str(os.cpu_count() or 2)))
+PDF_EXECUTOR_WORKERS = int(os.environ.get("PDF_EXECUTOR_WORKERS", "2"))
+IO_EXECUTOR_WORKERS = int(os.environ.get("IO_EXECUTOR_WORKERS", "8"))
+
+_SIZES = {
+    "ai": AI_EXECUTOR_WORKERS,
+    "render": RENDER_EXECUTOR_WORKERS,
+    "pdf": PDF_EXECUTOR_WORKERS,
+    "io": IO_EXECUTOR_WORKERS,
+}
+
+# Threads are started lazily by ThreadPoolExecutor, so idle pools cost nothing
+_executors: Dict[str, ThreadPoolExecutor] = {
+    name: ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"{name}-pool")
+    for name, size in _SIZES.items()
+}
+_busy: Dict[str, int] = {name: 0 for name in _SIZES}
+_busy_lock = threading.Lock()
+
+
+def get_executor(name: str) -> ThreadPoolExecutor:
+    """Return the named pool ("ai", "render", "pdf" or "io")."""
+    try:
+        return _executors[name]
+    except KeyError:
+        raise ValueError(f"Unknown executor: {name}. Use one of {sorted(_executors)}")
+
+
+async def run_in(name: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a blocking callable in the named pool and await its result.
+
+    Records how long the call queued for a free worker (executor_wait_seconds)
+    and how many workers are busy (executor_busy).
+    """
+    executor = get_executor(name)
+    submitted = time.monotonic()
+
+    def call():
+        metrics.histogram("executor_wait_seconds", pool=name).observe(time.monotonic() - submitted)
+        _set_busy(name, 1)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _set_busy(name, -1)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, call)
+
+
+def _set_busy(name: str, delta: int) -> None:
+    with _busy_lock:
+        _busy[name] += delta
+        metrics.gauge("executor_busy", pool=name).set(_busy[name])
+
+
+def pool_sizes() -> Dict[str, int]:
+    """Configured worker count per pool (reported by /health)."""
+    return dict(_SIZES)
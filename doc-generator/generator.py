@@ -3,9 +3,11 @@ DOCX document generator with placeholder replacement.
 Handles Word's run-splitting of placeholders and optional image insertion.
 """
 
+import io
 import os
 import re
 import logging
+import zipfile
 from typing import Dict, Optional
 from docx import Document
 from docx.shared import Inches
@@ -14,11 +16,59 @@ from docx.oxml.ns import qn
 logger = logging.getLogger(__name__)
 
 
+# Placed size (width, height) in inches of each image placeholder; others get
+# DEFAULT_IMAGE_WIDTH_INCHES wide with their own aspect ratio
+IMAGE_SIZES_INCHES = {
+    "CPP_LOGO_TOP_RIGHT_IMG": (0.51, 0.51),       # header logo
+    "CPP_LOGO_COVER_MIDDLE_IMG": (1.43, 1.43),    # cover page logo
+    "RAMS_COVER_PAGE_LOGO_IMG": (1.41, 1.41),     # RAMS cover page logo
+    "RAMS_CLIENT_PAGE_LOGO_IMG": (1.41, 1.41),    # RAMS client logo
+    "RAMS_DELIVERIES_IMG": (6.26, 4.18),          # deliveries TMP image
+    "RAMS_FIRE_PLAN_IMG": (6.26, 4.18),           # fire plan image
+    "RAMS_NEAREST_HOSPITAL_IMG": (2.09, 3.13),    # hospital route map
+}
+DEFAULT_IMAGE_WIDTH_INCHES = 2.0
+
+# python-docx stamps every zip entry with the save time; a fixed stamp makes
+# identical documents byte-identical (uploads are de-duplicated by content hash)
+_ZIP_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+
+
 class TemplateNotFoundError(Exception):
     """Raised when template file is not found."""
     pass
 
 
+def load_template(template_path: str) -> Document:
+    """
+    Parse a DOCX template.
+    
+    Raises:
+        TemplateNotFoundError: If template file doesn't exist
+    """
+    if not os.path.exists(template_path):
+        raise TemplateNotFoundError(f"Template not found: {template_path}")
+    
+    logger.info(f"Loading template: {template_path}")
+    return Document(template_path)
+
+
+def save_document(doc: Document, target) -> None:
+    """
+    Save a document to a path or binary file object with fixed zip timestamps,
+    so the same content always produces the same bytes.
+    """
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    with zipfile.ZipFile(buffer) as source, zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as out:
+        for item in source.infolist():
+            entry = zipfile.ZipInfo(item.filename, date_time=_ZIP_TIMESTAMP)
+            entry.compress_type = item.compress_type
+            entry.external_attr = item.external_attr
+            out.writestr(entry, source.read(item))
+
+
 def generate_docx(
     template_path: str,
     output_path: str,
@@ -42,12 +92,33 @@ def generate_docx(
     Raises:
         TemplateNotFoundError: If template file doesn't exist
     """
-    if not os.path.exists(template_path):
-        raise TemplateNotFoundError(f"Template not found: {template_path}")
+    doc = load_template(template_path)
+    render_document(doc, placeholders, images, blue_flags)
     
-    logger.info(f"Loading template: {template_path}")
-    doc = Document(template_path)
+    # Ensure output directory exists
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    
+    # Save the document
+    logger.info(f"Saving document: {output_path}")
+    save_document(doc, output_path)
+    
+    return output_path
+
+
+def render_document(
+    doc: Document,
+    placeholders: Dict[str, str],
+    images: Optional[Dict[str, str]] = None,
+    blue_flags: Optional[Dict[str, bool]] = None
+) -> Document:
+    """
+    Fill a parsed template in place (blue logic, placeholders, images, TOC refresh).
+    
+    Split out of generate_docx so render workers can reuse a preloaded template.
     
+    Returns:
+        The same Document, ready to save
+    """
     images = images or {}
     blue_flags = blue_flags or {}
     logger.info(f"Images dictionary: {images}")
@@ -102,14 +173,7 @@ def generate_docx(
     # Force Table of Contents to update when document is opened in Word
     _set_update_fields_on_open(doc)
     
-    # Ensure output directory exists
-    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
-    
-    # Save the document
-    logger.info(f"Saving document: {output_path}")
-    doc.save(output_path)
-    
-    return output_path
+    return doc
 
 
 def _set_update_fields_on_open(doc: Document):
@@ -634,31 +698,11 @@ def _replace_in_paragraph(
                     run.text = run_text.replace(full_placeholder, "")
                     run_text = run.text
                     try:
-                        # Special sizing for different logo placeholders
-                        if placeholder_key == "CPP_LOGO_TOP_RIGHT_IMG":
-                            # 0.51 inch x 0.51 inch for header logo
-                            run.add_picture(image_path, width=Inches(0.51), height=Inches(0.51))
-                        elif placeholder_key == "CPP_LOGO_COVER_MIDDLE_IMG":
-                            # 1.43 inch x 1.43 inch for cover page logo
-                            run.add_picture(image_path, width=Inches(1.43), height=Inches(1.43))
-                        elif placeholder_key == "RAMS_COVER_PAGE_LOGO_IMG":
-                            # 1.41 inch x 1.41 inch for RAMS cover page logo
-                            run.add_picture(image_path, width=Inches(1.41), height=Inches(1.41))
-                        elif placeholder_key == "RAMS_CLIENT_PAGE_LOGO_IMG":
-                            # 1.41 inch x 1.41 inch for RAMS client logo
-                            run.add_picture(image_path, width=Inches(1.41), height=Inches(1.41))
-                        elif placeholder_key == "RAMS_DELIVERIES_IMG":
-                            # 6.26 inch width x 4.18 inch height for RAMS deliveries TMP image
-                            run.add_picture(image_path, width=Inches(6.26), height=Inches(4.18))
-                        elif placeholder_key == "RAMS_FIRE_PLAN_IMG":
-                            # 6.26 inch width x 4.18 inch height for RAMS fire plan image
-                            run.add_picture(image_path, width=Inches(6.26), height=Inches(4.18))
-                        elif placeholder_key == "RAMS_NEAREST_HOSPITAL_IMG":
-                            # 2.09 inch width x 3.13 inch height for RAMS hospital route map
-                            run.add_picture(image_path, width=Inches(2.09), height=Inches(3.13))
+                        width, height = IMAGE_SIZES_INCHES.get(placeholder_key, (DEFAULT_IMAGE_WIDTH_INCHES, None))
+                        if height is None:
+                            run.add_picture(image_path, width=Inches(width))
                         else:
-                            # Default 2.0 inches width for other images
-                            run.add_picture(image_path, width=Inches(2.0))
+                            run.add_picture(image_path, width=Inches(width), height=Inches(height))
                     except Exception as e:
                         logger.warning(f"Failed to insert image {image_path}: {e}")
                     
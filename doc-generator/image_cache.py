@@ -0,0 +1,295 @@
+"""
+Content-addressed local cache for uploaded images.
+
+Company logos are the same across most submissions from one customer, yet every
+generation downloaded them again into a fresh temp directory. Downloaded images
+are now kept in IMAGE_CACHE_DIR under their SHA-256, with a SQLite index from
+URL to content hash and the validators the server sent (ETag, Last-Modified).
+The next request for a known URL is sent as a conditional GET; a 304 serves the
+cached file without transferring the body.
+
+Each cached image also gets a normalised copy per placed size: EXIF rotation
+applied and scaled down to IMAGE_NORMALISE_DPI at the size the template places
+it (generator.IMAGE_SIZES_INCHES), so a 4000px phone photo shrunk to a 1.4" logo
+is not embedded (and converted to PDF) at full resolution on every render.
+
+The cache is bounded by IMAGE_CACHE_MAX_BYTES and evicts least recently used
+files. Files are written to a temp name and renamed into place, and callers get
+hard links (or copies) in their own directory, so concurrent readers and
+replicas sharing the directory never see a partial file and eviction never
+pulls a file out from under a render.
+"""
+
+import os
+import math
+import time
+import sqlite3
+import asyncio
+import logging
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+
+import metrics
+from executors import run_in
+from local_store import link_or_copy, open_sqlite
+from generator import IMAGE_SIZES_INCHES, DEFAULT_IMAGE_WIDTH_INCHES
+from image_downloads import ImageDownload, download_images
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_ENABLED = os.environ.get("IMAGE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", os.path.join(os.path.dirname(__file__), "image_cache"))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Resolution of the normalised copies at their placed size (0 = embed the originals)
+IMAGE_NORMALISE_DPI = int(os.environ.get("IMAGE_NORMALISE_DPI", "200"))
+
+
+def target_pixels(placeholder_key: str, dpi: int = IMAGE_NORMALISE_DPI) -> Tuple[int, int]:
+    """Pixel box an image needs at its placed size (height 0 = only the width is fixed)."""
+    width, height = IMAGE_SIZES_INCHES.get(placeholder_key, (DEFAULT_IMAGE_WIDTH_INCHES, None))
+    return math.ceil(width * dpi), math.ceil(height * dpi) if height else 0
+
+
+def normalise_image(source: str, target_base: str, box: Tuple[int, int]) -> Optional[str]:
+    """
+    Write an upright copy of source scaled down to box (never up).
+
+    Fixed boxes are filled at full resolution on both axes, because Word stretches
+    the picture to the box. JPEGs stay JPEG; everything else becomes PNG.
+
+    Returns:
+        Path of the written file (target_base plus extension), or None when source
+        is already upright and no larger than the box.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as original:
+        source_format = original.format
+        orientation = original.getexif().get(0x0112, 1)  # EXIF orientation tag
+        rotated = orientation != 1
+        width, height = original.size
+        if orientation in (5, 6, 7, 8):  # quarter turns swap the axes
+            width, height = height, width
+        box_width, box_height = box
+        scale = box_width / width
+        if box_height:
+            scale = max(scale, box_height / height)
+        if scale >= 1 and not rotated:
+            return None
+        image = ImageOps.exif_transpose(original)
+        if scale < 1:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.LANCZOS)
+        if source_format == "JPEG" and image.mode in ("RGB", "L"):
+            path = f"{target_base}.jpg"
+            image.save(path, "JPEG", quality=88, optimize=True)
+        else:
+            if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            path = f"{target_base}.png"
+            image.save(path, "PNG", optimize=True)
+    return path
+
+
+class ImageCache:
+    """
+    Cached image downloads.
+
+    Args:
+        directory: Where the index and cached files live.
+        max_bytes: Size cap; least recently used files are evicted beyond it.
+        dpi: Resolution of normalised copies (0 disables normalisation).
+    """
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES, dpi: int = IMAGE_NORMALISE_DPI):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.dpi = dpi
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.join(self.directory, "files"), exist_ok=True)
+            self._conn = open_sqlite(
+                os.path.join(self.directory, "index.sqlite3"),
+                "CREATE TABLE IF NOT EXISTS urls ("
+                "url TEXT PRIMARY KEY, name TEXT NOT NULL, etag TEXT, last_modified TEXT, validated_at REAL NOT NULL)",
+                "CREATE TABLE IF NOT EXISTS files ("
+                "name TEXT PRIMARY KEY, bytes INTEGER NOT NULL, last_used REAL NOT NULL)",
+            )
+        return self._conn
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, "files", name[:2], name)
+
+    # --- Index ------------------------------------------------------------------
+
+    def _lookup(self, url: str) -> Optional[tuple]:
+        with self._lock:
+            return self._db().execute(
+                "SELECT name, etag, last_modified FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+
+    def _touch(self, name: str) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute("UPDATE files SET last_used = ? WHERE name = ?", (time.time(), name))
+            db.commit()
+
+    def _store(self, source: str, name: str) -> str:
+        """Move a file into the cache under name (no-op if it is already there)."""
+        path = self._path(name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".incoming-")
+            os.close(fd)
+            link_or_copy(source, temp)
+            os.replace(temp, path)
+        with self._lock:
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (name, os.path.getsize(path), time.time()))
+            db.commit()
+        return path
+
+    def _remember(self, result: ImageDownload, name: str) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?)",
+                (result.url, name, result.etag, result.last_modified, time.time()),
+            )
+            db.commit()
+
+    def evict(self) -> int:
+        """Drop least recently used files until the cache is under max_bytes. Returns files removed."""
+        with self._lock:
+            db = self._db()
+            total = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM files").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            victims = []
+            for name, size in db.execute("SELECT name, bytes FROM files ORDER BY last_used"):
+                if total <= self.max_bytes * 0.9:
+                    break
+                victims.append(name)
+                total -= size
+            db.executemany("DELETE FROM files WHERE name = ?", [(name,) for name in victims])
+            db.commit()
+        for name in victims:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+        metrics.counter("image_cache_evictions_total").inc(len(victims))
+        metrics.gauge("image_cache_bytes").set(total)
+        logger.info(f"Image cache evicted {len(victims)} files")
+        return len(victims)
+
+    # --- Fetch ------------------------------------------------------------------
+
+    def _claim_cached(self, key: str, url: str, dest_dir: str) -> Tuple[Dict[str, str], Optional[tuple]]:
+        """
+        Link the cached original for url into dest_dir and build its conditional headers.
+        Linking first means a concurrent eviction cannot remove it before a 304 arrives.
+        """
+        row = self._lookup(url)
+        if row is None:
+            return {}, None
+        name, etag, last_modified = row
+        claimed = os.path.join(dest_dir, f".{key}.cached{os.path.splitext(name)[1]}")
+        try:
+            link_or_copy(self._path(name), claimed)
+        except FileNotFoundError:
+            return {}, None
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers, (name, claimed, etag, last_modified)
+
+    def _settle(self, result: ImageDownload, claimed: Optional[tuple], dest_dir: str) -> None:
+        """Turn a download result into a cached original plus a normalised file in dest_dir."""
+        if result.not_modified and claimed:
+            name, original, etag, last_modified = claimed
+            # Servers may leave validators out of a 304; keep the stored ones then
+            result.etag = result.etag or etag
+            result.last_modified = result.last_modified or last_modified
+            self._touch(name)
+            self._remember(result, name)
+            result.cache = "hit"
+        elif result.path:
+            name = f"{result.sha256}.{result.path.rsplit('.', 1)[-1]}"
+            self._store(result.path, name)
+            self._remember(result, name)
+            original = result.path
+            result.cache = "miss"
+        else:
+            if result.not_modified:
+                result.error = "304 without a cached copy"
+            if claimed:
+                os.remove(claimed[1])
+            return
+        metrics.counter("image_cache_requests_total", outcome=result.cache).inc()
+
+        path = original
+        if self.dpi > 0:
+            try:
+                path = self._normalised(result.key, name, original, dest_dir)
+            except Exception as e:
+                logger.warning(f"Could not normalise image for {result.key}, using the original: {e}")
+        final = os.path.join(dest_dir, f"{result.key}{os.path.splitext(path)[1]}")
+        if path != final:
+            link_or_copy(path, final)
+        for staged in {original, result.path, path, claimed[1] if claimed else None}:
+            if staged and staged != final and os.path.dirname(staged) == dest_dir and os.path.exists(staged):
+                os.remove(staged)
+        result.path = final
+
+    def _normalised(self, key: str, name: str, original: str, dest_dir: str) -> str:
+        """Path of the normalised copy of a cached file for key's placed size (created once per size)."""
+        box_width, box_height = target_pixels(key, self.dpi)
+        base = f"{name.split('.')[0]}-{box_width}x{box_height}"
+        with self._lock:
+            row = self._db().execute(
+                "SELECT name FROM files WHERE name IN (?, ?)", (f"{base}.png", f"{base}.jpg")
+            ).fetchone()
+        if row is not None:
+            staged = os.path.join(dest_dir, f".{key}.norm{os.path.splitext(row[0])[1]}")
+            try:
+                link_or_copy(self._path(row[0]), staged)
+                self._touch(row[0])
+                return staged
+            except FileNotFoundError:
+                pass  # evicted meanwhile; make it again
+        written = normalise_image(original, os.path.join(dest_dir, f".{key}.norm"), (box_width, box_height))
+        if written is None:
+            return original
+        self._store(written, base + os.path.splitext(written)[1])
+        return written
+
+    async def fetch(self, uploads: Dict[str, str], dest_dir: str, timeout: float = 30) -> Dict[str, ImageDownload]:
+        """
+        download_images() through the cache: known URLs are revalidated, new ones
+        stored, and each result's path is the normalised copy in dest_dir.
+        """
+        os.makedirs(dest_dir, exist_ok=True)
+        wanted = {key: url for key, url in uploads.items() if url}
+        claims = await asyncio.gather(*(run_in("io", self._claim_cached, key, url, dest_dir) for key, url in wanted.items()))
+        conditions = {key: headers for key, (headers, _) in zip(wanted, claims) if headers}
+        claimed = {key: claim for key, (_, claim) in zip(wanted, claims)}
+
+        results = await download_images(wanted, dest_dir, timeout=timeout, conditions=conditions)
+        await asyncio.gather(*(
+            run_in("io", self._settle, result, claimed.get(key), dest_dir) for key, result in results.items()
+        ))
+        await run_in("io", self.evict)
+        return results
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,215 @@
+"""
+Concurrent, streaming downloads of submission images.
+
+All uploads of a submission are fetched at once over one pooled HTTP client and
+streamed to disk in chunks, so a large upload never sits in memory whole. Each
+file is capped at IMAGE_MAX_BYTES and the whole set at IMAGE_MAX_TOTAL_BYTES
+(checked against Content-Length up front and against the bytes actually read).
+The first bytes are checked against the image formats python-docx can embed, and
+the file extension comes from the detected format rather than the URL. Every
+URL gets a result with its size, time, content hash and validators (ETag,
+Last-Modified) so slow or broken uploads show up in logs and metrics, and
+image_cache can revalidate what it already holds.
+"""
+
+import os
+import time
+import hashlib
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import httpx
+
+import metrics
+from executors import run_in
+
+logger = logging.getLogger(__name__)
+
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_MAX_TOTAL_BYTES = int(os.environ.get("IMAGE_MAX_TOTAL_BYTES", str(40 * 1024 * 1024)))
+IMAGE_DOWNLOAD_CONCURRENCY = int(os.environ.get("IMAGE_DOWNLOAD_CONCURRENCY", "8"))
+IMAGE_CHUNK_BYTES = 64 * 1024
+
+# Leading bytes of the formats python-docx can embed -> file extension
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+_SNIFF_BYTES = 8
+
+
+class ImageDownloadError(Exception):
+    """An upload was rejected (too large, not an image) or could not be fetched."""
+    pass
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """File extension for the image format starting with head, or None if unsupported."""
+    for signature, extension in _SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+
+class ImageDownload:
+    """Outcome of one URL."""
+
+    def __init__(self, key: str, url: str):
+        self.key = key
+        self.url = url
+        self.path: Optional[str] = None
+        self.bytes = 0
+        self.seconds = 0.0
+        self.error: Optional[str] = None
+        self.sha256: Optional[str] = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.not_modified = False  # 304 to a conditional request; nothing was written
+        self.cache: Optional[str] = None  # "hit" or "miss" when served through image_cache
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "path": self.path, "bytes": self.bytes, "seconds": round(self.seconds, 3),
+            "error": self.error, "cache": self.cache,
+        }
+
+
+class _TotalBudget:
+    """Bytes left for the whole set (shared by the concurrent downloads of one call)."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.remaining = limit
+
+    def take(self, count: int) -> None:
+        self.remaining -= count
+        if self.remaining < 0:
+            raise ImageDownloadError(f"Uploads exceed the total limit of {self.limit:,} bytes")
+
+
+async def _write_chunks(path: str, chunks: List[bytes]) -> None:
+    def write():
+        with open(path, "ab") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    await run_in("io", write)
+
+
+async def _download_one(
+    client: httpx.AsyncClient,
+    result: ImageDownload,
+    dest_dir: str,
+    max_bytes: int,
+    total: _TotalBudget,
+    slots: asyncio.Semaphore,
+    headers: Optional[Dict[str, str]] = None,
+) -> None:
+    started = time.monotonic()
+    partial = os.path.join(dest_dir, f".{result.key}.part")
+    try:
+        async with slots:
+            async with client.stream("GET", result.url, headers=headers) as response:
+                result.etag = response.headers.get("etag")
+                result.last_modified = response.headers.get("last-modified")
+                if response.status_code == 304:
+                    result.not_modified = True
+                    return
+                response.raise_for_status()
+                declared = int(response.headers.get("content-length") or 0)
+                if declared > max_bytes:
+                    raise ImageDownloadError(f"{declared:,} bytes is over the {max_bytes:,} byte limit")
+
+                digest = hashlib.sha256()
+                head = b""
+                extension = None
+                pending: List[bytes] = []
+                pending_bytes = 0
+                if os.path.exists(partial):
+                    os.remove(partial)
+                async for chunk in response.aiter_bytes(IMAGE_CHUNK_BYTES):
+                    result.bytes += len(chunk)
+                    if result.bytes > max_bytes:
+                        raise ImageDownloadError(f"Body is over the {max_bytes:,} byte limit")
+                    total.take(len(chunk))
+                    digest.update(chunk)
+                    pending.append(chunk)
+                    pending_bytes += len(chunk)
+                    if extension is None:
+                        head += chunk[:_SNIFF_BYTES - len(head)]
+                        if len(head) < _SNIFF_BYTES:
+                            continue
+                        extension = sniff_image_type(head)
+                        if extension is None:
+                            raise ImageDownloadError(f"Not a supported image (starts with {head!r})")
+                    # Batch small chunks into fewer executor hops
+                    if pending_bytes >= 4 * IMAGE_CHUNK_BYTES:
+                        await _write_chunks(partial, pending)
+                        pending, pending_bytes = [], 0
+
+                if extension is None:
+                    extension = sniff_image_type(head)
+                    if extension is None:
+                        raise ImageDownloadError("Empty or truncated image")
+                if pending:
+                    await _write_chunks(partial, pending)
+
+        path = os.path.join(dest_dir, f"{result.key}.{extension}")
+        os.replace(partial, path)
+        result.path = path
+        result.sha256 = digest.hexdigest()
+    except Exception as e:
+        result.error = str(e) or type(e).__name__
+        if os.path.exists(partial):
+            os.remove(partial)
+    finally:
+        result.seconds = time.monotonic() - started
+        outcome = "not_modified" if result.not_modified else "ok" if result.path else "error"
+        metrics.histogram("image_download_seconds", outcome=outcome).observe(result.seconds)
+        metrics.counter("image_download_bytes_total").inc(result.bytes)
+
+
+async def download_images(
+    uploads: Dict[str, str],
+    dest_dir: str,
+    timeout: float = 30,
+    max_bytes: int = IMAGE_MAX_BYTES,
+    max_total_bytes: int = IMAGE_MAX_TOTAL_BYTES,
+    concurrency: int = IMAGE_DOWNLOAD_CONCURRENCY,
+    conditions: Optional[Dict[str, Dict[str, str]]] = None,
+) -> Dict[str, ImageDownload]:
+    """
+    Download every upload concurrently into dest_dir.
+
+    Args:
+        uploads: Placeholder name -> URL (empty URLs are skipped).
+        dest_dir: Directory for the files (named <placeholder>.<detected extension>).
+        timeout: Per-request connect/read timeout in seconds.
+        max_bytes: Cap per file.
+        max_total_bytes: Cap for all files together; downloads that cross it fail.
+        concurrency: Downloads in flight at once.
+        conditions: Optional placeholder name -> conditional request headers
+            (If-None-Match / If-Modified-Since); a 304 sets not_modified.
+
+    Returns:
+        Placeholder name -> ImageDownload (path set on success, error otherwise).
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    results = {key: ImageDownload(key, url) for key, url in uploads.items() if url}
+    if not results:
+        return {}
+    conditions = conditions or {}
+    total = _TotalBudget(max_total_bytes)
+    slots = asyncio.Semaphore(max(1, concurrency))
+    limits = httpx.Limits(max_connections=max(1, concurrency), max_keepalive_connections=max(1, concurrency))
+    async with httpx.AsyncClient(timeout=timeout, limits=limits, follow_redirects=True) as client:
+        await asyncio.gather(*(
+            _download_one(client, result, dest_dir, max_bytes, total, slots, conditions.get(key))
+            for key, result in results.items()
+        ))
+    return results
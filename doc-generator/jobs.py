@@ -0,0 +1,267 @@
+"""
+In-process job queue for long-running generations.
+
+POST /jobs returns 202 with a job id straight away; a fixed set of asyncio workers
+takes jobs from a bounded queue and runs the generation pipeline, and GET
+/jobs/{id} reports the running stage(s) and progress. Each job has a deadline:
+jobs still queued when it passes are expired without running, and running jobs
+are cancelled. Per-stage worker counts cap how many jobs can be in the same
+stage at once (e.g. only two LibreOffice conversions), shared by all job workers.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+JOBS_WORKERS = int(os.environ.get("JOBS_WORKERS", "4"))
+JOBS_MAX_QUEUED = int(os.environ.get("JOBS_MAX_QUEUED", "100"))
+JOBS_DEADLINE_SECONDS = float(os.environ.get("JOBS_DEADLINE_SECONDS", "900"))
+JOBS_RETENTION_SECONDS = float(os.environ.get("JOBS_RETENTION_SECONDS", "3600"))
+# Max jobs in each stage at once, as "stage=count,..." (upload covers upload_docx and upload_pdf)
+JOBS_STAGE_WORKERS = os.environ.get("JOBS_STAGE_WORKERS", "ai=8,images=4,render=2,pdf=2,upload=4")
+
+# Pipeline stages that share a worker count
+STAGE_GROUPS = {"upload_docx": "upload", "upload_pdf": "upload"}
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+EXPIRED = "expired"
+
+
+class JobQueueFull(Exception):
+    """Raised when JOBS_MAX_QUEUED jobs are already waiting."""
+    pass
+
+
+class JobError(Exception):
+    """A job failure with the HTTP-style status code to report for it."""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_stage_workers(spec: str) -> Dict[str, int]:
+    """Parse "ai=8,render=2" into {"ai": 8, "render": 2}, ignoring malformed entries."""
+    counts = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        try:
+            count = int(value)
+        except ValueError:
+            continue
+        if name.strip() and count > 0:
+            counts[name.strip()] = count
+    return counts
+
+
+class Job:
+    """State of one queued generation."""
+
+    def __init__(self, payload: Dict[str, Any], deadline_seconds: float):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = QUEUED
+        self.stages = []  # stages currently running
+        self.stages_done = 0
+        self.stages_total = 0
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.error_code: Optional[int] = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.enqueued = time.monotonic()
+        self.deadline = self.enqueued + deadline_seconds
+        self.finished: Optional[float] = None
+
+    def on_stage(self, stage: str, event: str, done: int, total: int) -> None:
+        """Pipeline progress callback."""
+        if event == "start":
+            self.stages.append(stage)
+        elif stage in self.stages:
+            self.stages.remove(stage)
+        self.stages_done = done
+        self.stages_total = total
+
+    @property
+    def progress(self) -> float:
+        if self.status == SUCCEEDED:
+            return 1.0
+        if not self.stages_total:
+            return 0.0
+        return round(self.stages_done / self.stages_total, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "submission_id": self.payload.get("submission_id"),
+            "status": self.status,
+            "stage": list(self.stages),
+            "progress": self.progress,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "deadline_in_seconds": round(max(0.0, self.deadline - time.monotonic()), 1)
+            if self.status in (QUEUED, RUNNING) else None,
+            "error": self.error,
+            "error_code": self.error_code,
+            "result": self.result,
+        }
+
+
+class JobManager:
+    """
+    Bounded job queue plus worker tasks.
+
+    Args:
+        runner: Coroutine function runner(job, stage_limits) -> result dict, where
+            stage_limits(stage_names) returns the shared per-stage semaphores.
+        workers: Jobs processed at once.
+        max_queued: Jobs allowed to wait; submit() raises JobQueueFull beyond it.
+        deadline_seconds: Default time from submission to cancellation.
+        stage_workers: Max concurrent jobs per stage (see JOBS_STAGE_WORKERS).
+        retention_seconds: How long finished jobs stay visible on /jobs/{id}.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[..., Awaitable[Dict[str, Any]]],
+        workers: int = JOBS_WORKERS,
+        max_queued: int = JOBS_MAX_QUEUED,
+        deadline_seconds: float = JOBS_DEADLINE_SECONDS,
+        stage_workers: Optional[Dict[str, int]] = None,
+        retention_seconds: float = JOBS_RETENTION_SECONDS,
+    ):
+        self.runner = runner
+        self.workers = workers
+        self.max_queued = max_queued
+        self.deadline_seconds = deadline_seconds
+        self.retention_seconds = retention_seconds
+        self.stage_workers = parse_stage_workers(JOBS_STAGE_WORKERS) if stage_workers is None else stage_workers
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._limits: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stage_limits(self, stage_names: Iterable[str]) -> Dict[str, asyncio.Semaphore]:
+        """Shared semaphores for the given pipeline stages (stages without a count are unlimited)."""
+        limits = {}
+        for name in stage_names:
+            group = STAGE_GROUPS.get(name, name)
+            if group not in self.stage_workers:
+                continue
+            if group not in self._limits:
+                self._limits[group] = asyncio.Semaphore(self.stage_workers[group])
+            limits[name] = self._limits[group]
+        return limits
+
+    def start(self) -> None:
+        """Start the worker tasks on the running event loop (idempotent)."""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.ensure_future(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Job workers started: {self.workers} workers, queue limit {self.max_queued}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def submit(self, payload: Dict[str, Any], deadline_seconds: Optional[float] = None) -> Job:
+        """
+        Queue a job. Must be called from the event loop.
+
+        Raises:
+            JobQueueFull when the queue is at max_queued.
+        """
+        self.start()
+        self._evict_finished()
+        job = Job(payload, deadline_seconds or self.deadline_seconds)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            metrics.counter("jobs_rejected_total").inc()
+            raise JobQueueFull(f"{self.queue_depth} jobs already queued (max {self.max_queued})")
+        self._jobs[job.id] = job
+        metrics.counter("jobs_submitted_total").inc()
+        metrics.gauge("jobs_queue_depth").set(self.queue_depth)
+        logger.info(f"Job {job.id} queued for submission {payload.get('submission_id')} (depth {self.queue_depth})")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._evict_finished()
+        return self._jobs.get(job_id)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self._queue.get()
+            metrics.gauge("jobs_queue_depth").set(self.queue_depth)
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Job worker {index} crashed on job {job.id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        now = time.monotonic()
+        metrics.histogram("job_queue_wait_seconds").observe(now - job.enqueued)
+        if now >= job.deadline:
+            self._finish(job, EXPIRED, error="Deadline passed while queued", error_code=504)
+            return
+
+        job.status = RUNNING
+        job.started_at = datetime.now().isoformat()
+        metrics.gauge("jobs_running").inc()
+        try:
+            job.result = await asyncio.wait_for(self.runner(job, self.stage_limits), timeout=job.deadline - now)
+            self._finish(job, SUCCEEDED)
+        except asyncio.TimeoutError:
+            self._finish(job, FAILED, error="Deadline exceeded while running", error_code=504)
+        except JobError as e:
+            self._finish(job, FAILED, error=str(e), error_code=e.status_code)
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed: {e}")
+            self._finish(job, FAILED, error=str(e), error_code=500)
+        finally:
+            metrics.gauge("jobs_running").dec()
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None, error_code: Optional[int] = None) -> None:
+        job.status = status
+        job.stages = []
+        job.error = error
+        job.error_code = error_code
+        job.finished = time.monotonic()
+        job.finished_at = datetime.now().isoformat()
+        metrics.counter("jobs_finished_total", status=status).inc()
+        metrics.histogram("job_seconds", status=status).observe(job.finished - job.enqueued)
+        logger.info(f"Job {job.id} {status}" + (f": {error}" if error else ""))
+
+    def _evict_finished(self) -> None:
+        now = time.monotonic()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished is not None and now - job.finished > self.retention_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,38 @@
+"""
+Helpers shared by the local on-disk stores: the checkpoint ledger, the image
+cache, the artifact index and the fleet re-render ledger.
+"""
+
+import os
+import shutil
+import sqlite3
+
+
+def link_or_copy(source: str, target: str) -> None:
+    """Hard-link when possible (no extra disk space), copy across filesystems."""
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def open_sqlite(path: str, *schema: str) -> sqlite3.Connection:
+    """
+    Open a SQLite database shared by the service's threads, creating it if needed.
+
+    The connection uses WAL so readers do not block the writer; callers serialise
+    their own use of it with a lock.
+
+    Args:
+        path: Database file (its directory is created).
+        schema: CREATE TABLE IF NOT EXISTS statements to apply.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    for statement in schema:
+        conn.execute(statement)
+    conn.commit()
+    return conn
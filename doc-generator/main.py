@@ -8,19 +8,51 @@ load_dotenv()
 
 import os
 import json
+import time
+import hashlib
+import uuid
+import asyncio
 import logging
-import requests
-import tempfile
 import shutil
 from datetime import datetime
-from typing import Optional, Dict
-from fastapi import FastAPI, HTTPException, Header
+from typing import Awaitable, Callable, Optional, Dict, List, Tuple
+from fastapi import FastAPI, HTTPException, Header, Request, Response
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 
-from generator import generate_docx, TemplateNotFoundError
-from pdf_convert import convert_to_pdf, LibreOfficeError
-from supabase_client import get_submission, update_submission_outputs, upload_file_to_storage
-from ai_generator import generate_cpp_ai_content, generate_rams_ai_content
+from generator import TemplateNotFoundError
+from pdf_convert import convert_docx_bytes_to_pdf, convert_to_pdf, LibreOfficeError, PDF_CONVERT_TIMEOUT_SECONDS
+from supabase_client import (
+    get_submission_async, update_submission_outputs_async, close_clients,
+    SUPABASE_TIMEOUT_SECONDS, STORAGE_UPLOAD_TIMEOUT_SECONDS,
+)
+from ai_generator import generate_cpp_ai_content, generate_rams_ai_content, AI_TIME_BUDGET_SECONDS
+from ai_fallback import build_cpp_fallback_content, build_rams_fallback_content, SOURCE_FALLBACK
+from ai_prefetch import PrefetchStore, PrefetchLimitError
+from pipeline import Stage, StagePipeline
+from executors import run_in, pool_sizes
+from render_pool import RenderPool
+from jobs import Job, JobManager, JobQueueFull, JobError
+import pg_queue
+from singleflight import SingleFlight, RemoteFlightError, LEADER, create_lease
+from checkpoints import Checkpoint, CheckpointLedger, ResumePlan, CHECKPOINT_ENABLED
+from render_manifest import MANIFEST_KEY, ReusePlan, build_manifest, template_hash
+from admission import AdmissionController, Overloaded
+from image_downloads import download_images
+from image_cache import ImageCache, IMAGE_CACHE_ENABLED
+from artifact_store import ArtifactStore
+from disk_lifecycle import OutputJanitor, scoped_temp_dir
+from memory_render import DiskWriteMeter, Document, InMemoryDocument, local_path, DISK_WRITE_BUCKETS, RENDER_IN_MEMORY
+from bulk_export import EXPORT_FORMATS, EXPORT_MAX_IDS, export_filters, iter_submissions, prime, stream_zip
+from rerender import FleetLedger, FleetRerender
+from downloads import (
+    ArtifactCache, MetadataCache, DOWNLOAD_CACHE_DIR, etag_for, etag_matches, redirect_target,
+)
+from deadlines import (
+    Deadline, DeadlineExceeded, DEADLINE_DELIVERY_RESERVE_SECONDS, DEADLINE_MIN_PDF_SECONDS,
+    DEADLINE_MIN_STEP_SECONDS, DEADLINE_OUTPUTS_RESERVE_SECONDS,
+)
+import metrics
 
 # Configure logging
 logging.basicConfig(
@@ -45,6 +77,56 @@ OUTPUT_DIR = os.environ.get('OUTPUT_DIR', os.path.join(os.path.dirname(__file__)
 # Ensure output directory exists
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Template file per product
+TEMPLATE_FILES = {
+    "CPP": "CPP_TEMPLATE_WORKING_v1_copy.docx",
+    "RAMS": "RAMS_TEMPLATE_WORKING_v1_copy.docx"
+}
+
+# Shared executions for duplicate /generate-from-submission calls (lease added at startup)
+generation_flights = SingleFlight()
+
+# Bounded admission and shared per-stage slots for the synchronous generate endpoints
+admission = AdmissionController()
+
+# Stage results kept per submission so a retry resumes where the last run failed
+checkpoint_ledger = CheckpointLedger() if CHECKPOINT_ENABLED else None
+
+# Submission columns each endpoint reads (PostgREST select lists)
+SUBMISSION_RENDER_COLUMNS = "product,placeholders,uploads,ai_input,outputs"
+SUBMISSION_DOWNLOAD_COLUMNS = "product,outputs"
+
+# Downloaded images kept by content hash, revalidated per URL and pre-resized to their placed size
+image_cache = ImageCache() if IMAGE_CACHE_ENABLED else None
+
+# Generated documents are stored by content hash; unchanged documents are not uploaded again
+artifact_store = ArtifactStore()
+
+# Generated files are removed from OUTPUT_DIR by age, size and free space once nothing uses them
+output_janitor = OutputJanitor(OUTPUT_DIR)
+disk_sweeper: Optional[asyncio.Task] = None
+
+# /download: short-lived submission lookups, plus a local copy of documents when DOWNLOAD_CACHE_DIR is set
+download_metadata = MetadataCache()
+download_cache = ArtifactCache(DOWNLOAD_CACHE_DIR) if DOWNLOAD_CACHE_DIR else None
+
+# Stages worth recording; degraded results (fallback AI content, missing PDF, failed uploads) are retried
+SUBMISSION_CHECKPOINTS = {
+    "ai": Checkpoint(keep=lambda content: content.get("AI_CONTENT_SOURCE") != SOURCE_FALLBACK),
+    "images": Checkpoint(files=lambda images: images.values()),
+    # In-memory documents are not checkpointed (checkpoints keep files on disk)
+    "render": Checkpoint(files=lambda docx_path: [docx_path], keep=lambda docx: isinstance(docx, str)),
+    "pdf": Checkpoint(files=lambda pdf: [pdf["path"]], keep=lambda pdf: isinstance(pdf["path"], str)),
+    "upload_docx": Checkpoint(keep=bool),
+    "upload_pdf": Checkpoint(keep=bool),
+}
+
+# Worker processes that keep the parsed templates (RENDER_POOL_SIZE=0 renders in-process)
+render_pool = RenderPool([os.path.join(TEMPLATE_DIR, name) for name in TEMPLATE_FILES.values()])
+
+# Background AI results started from /prefetch-ai, adopted by the generate calls
+ai_prefetch_store = PrefetchStore()
+
 
 # Standard Boilerplate Text for Conditional Sections
 # When a Blue Flag is True, this text replaces the {{include_...}} placeholder.
@@ -84,21 +166,84 @@ class GenerateRequest(BaseModel):
     placeholders: dict
     images: Optional[dict] = {}
     output_basename: Optional[str] = None
+    ai_budget_seconds: Optional[float] = None  # Default: AI_TIME_BUDGET_SECONDS
 
 
 class GenerateFromSubmissionRequest(BaseModel):
     submission_id: str
+    ai_budget_seconds: Optional[float] = None  # Default: AI_TIME_BUDGET_SECONDS
+
+
+class PrefetchAIRequest(BaseModel):
+    product: str  # "CPP" or "RAMS"
+    placeholders: dict = {}  # Draft form values (same keys as the submission)
+    ai_input: Optional[dict] = None  # RAMS: {"aiTaskDescription": ...}
+
+
+class PrefetchAIResponse(BaseModel):
+    prefetch_key: str
+    status: str  # "started", "in_flight" or "ready"
 
 
 class GenerateResponse(BaseModel):
     docx_path: str
     pdf_path: Optional[str] = None
+    ai_content_source: Optional[str] = None  # "ai", "fallback" or None (no AI stage)
 
 
 class GenerateFromSubmissionResponse(BaseModel):
-    docx_path: str
+    docx_path: Optional[str] = None  # None when rendered in memory and uploaded (RENDER_IN_MEMORY)
     pdf_path: Optional[str] = None
     updated_submission_id: Optional[str] = None
+    ai_content_source: Optional[str] = None  # "ai", "fallback" or None (no AI stage)
+    stage_timings: Optional[Dict[str, Dict[str, float]]] = None  # start/end/duration (s) per stage
+    critical_path: Optional[List[str]] = None
+    resumed_stages: Optional[List[str]] = None  # stages restored from checkpoints of an earlier attempt
+    skipped_stages: Optional[List[str]] = None  # stages reused from the previous generation (render manifest)
+    changed_inputs: Optional[List[str]] = None  # placeholder groups/inputs changed since then ("all" if first run)
+    single_flight: Optional[str] = None  # "leader", or "joined"/"cached"/"remote" for a shared result
+    disk_bytes_written: Optional[int] = None  # bytes of files this run wrote to persistent disk
+
+
+class JobSubmitRequest(GenerateFromSubmissionRequest):
+    deadline_seconds: Optional[float] = None  # Default: JOBS_DEADLINE_SECONDS
+    product: Optional[str] = None  # Optional check: must match the submission's product (queue priority)
+
+
+class ExportRequest(BaseModel):
+    submission_ids: Optional[List[str]] = None  # Either a list of submission UUIDs...
+    product: Optional[str] = None  # ...or filters: "CPP" or "RAMS"
+    project: Optional[str] = None  # Exact project name
+    created_from: Optional[str] = None  # ISO date/time, inclusive
+    created_to: Optional[str] = None  # ISO date/time, exclusive
+    formats: List[str] = list(EXPORT_FORMATS)
+
+
+class RerenderRequest(BaseModel):
+    product: str  # "CPP" or "RAMS"
+    dry_run: bool = False  # only count and estimate; nothing is rendered
+    restart: bool = False  # start over instead of resuming an unfinished run
+
+
+class JobAcceptedResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    submission_id: Optional[str] = None
+    status: str  # queued, running, succeeded, failed, expired
+    stage: List[str] = []  # stages currently running
+    progress: float = 0.0  # finished stages / total stages
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    deadline_in_seconds: Optional[float] = None
+    error: Optional[str] = None
+    error_code: Optional[int] = None  # HTTP status the synchronous endpoint would have returned
+    result: Optional[GenerateFromSubmissionResponse] = None
 
 def _process_cpp_blue_flags(placeholders: dict):
     """
@@ -212,28 +357,205 @@ def _process_cpp_blue_flags(placeholders: dict):
     return blue_flags
 
 
+def _read_cpp_toggles(placeholders: dict) -> Dict[str, bool]:
+    """Read Smart Toggles from placeholders (they come as strings "true"/"false")."""
+    return {
+        "external": str(placeholders.get("TOGGLE_EXTERNAL_GROUNDWORKS", "false")).lower() == "true",
+        "height": str(placeholders.get("TOGGLE_HEIGHT_STRUCTURAL", "false")).lower() == "true",
+        "road": str(placeholders.get("TOGGLE_PUBLIC_ROAD_IMPACT", "false")).lower() == "true",
+        "mep": str(placeholders.get("TOGGLE_MEP_COMMISSIONING", "false")).lower() == "true",
+    }
+
+
+def _build_cpp_ai_context(placeholders: dict) -> str:
+    """
+    Build the enriched CPP prompt context from form values.
+    Returns an empty string when CPP_TASK_ACTIVITY is empty (no AI stage).
+    """
+    task_activity = placeholders.get("CPP_TASK_ACTIVITY", "")
+    if not task_activity:
+        return ""
+    project_title = placeholders.get("CPP_PROJECT_TITLE", "")
+    duration = placeholders.get("CPP_DURATION", "")
+    toggles = _read_cpp_toggles(placeholders)
+    
+    enriched_context = f"Project: {project_title}\nDuration: {duration}\n"
+    if toggles["external"]:
+        enriched_context += "User indicated: External Site / Groundworks\n"
+    if toggles["height"]:
+        enriched_context += "User indicated: Structural / Height Work\n"
+    if toggles["road"]:
+        enriched_context += "User indicated: Public Road / Footway Impact\n"
+    if toggles["mep"]:
+        enriched_context += "User indicated: M&E Commissioning\n"
+    enriched_context += f"\nActivity Description:\n{task_activity}"
+    return enriched_context
+
+
+def _apply_cpp_toggle_overrides(ai_content: dict, toggles: Dict[str, bool]) -> None:
+    """Override AI blue flags with the user's explicit toggles (user toggles take precedence)."""
+    ai_content["BLUE_FLAG_SECURE_PERIMETER_HOARDING"] = toggles["external"]
+    ai_content["BLUE_FLAG_HEAVY_LOGISTICS_LAYDOWN"] = toggles["external"]
+    ai_content["BLUE_FLAG_COMPETENCE_PLANT_HEIGHT"] = toggles["height"]
+    ai_content["BLUE_FLAG_SECTION_16_FACADE"] = toggles["height"]
+    ai_content["BLUE_FLAG_PUBLIC_TRAFFIC_MGMT"] = toggles["road"]
+    ai_content["BLUE_FLAG_SECTION_17_COMMISSIONING"] = toggles["mep"]
+
+
+def _parse_ai_input(ai_input_data) -> dict:
+    """Normalise ai_input, which may be stored as a JSON string instead of a dict."""
+    if isinstance(ai_input_data, str):
+        try:
+            ai_input_data = json.loads(ai_input_data)
+            logger.info("RAMS ai_input was a string, parsed to dict")
+        except json.JSONDecodeError as e:
+            logger.warning(f"Failed to parse ai_input as JSON: {e}")
+            ai_input_data = {}
+    return ai_input_data if isinstance(ai_input_data, dict) else {}
+
+
+def _build_rams_ai_context(placeholders: dict, ai_input_data) -> str:
+    """Combine RAMS_TITLE and ai_input.aiTaskDescription into the RAMS prompt context."""
+    rams_title = placeholders.get("RAMS_TITLE", "")
+    ai_task_description = _parse_ai_input(ai_input_data).get("aiTaskDescription", "")
+    
+    logger.info(f"RAMS_TITLE: '{rams_title[:50]}...' " if rams_title else "RAMS_TITLE: (empty)")
+    logger.info(f"aiTaskDescription: '{ai_task_description[:100]}...'" if ai_task_description else "aiTaskDescription: (empty)")
+    
+    # Combine title and description for richer AI context
+    ai_context = f"Project: {rams_title}" if rams_title else ""
+    if ai_task_description:
+        ai_context += f"\n\nActivity Description:\n{ai_task_description}"
+    return ai_context if ai_context.strip() else ""
+
+
+def _get_ai_content(product: str, context: str, budget_seconds: Optional[float]) -> dict:
+    """
+    Get AI content for a context, adopting a matching /prefetch-ai result when one
+    exists (waiting up to the AI budget for an in-flight one), else calling the model
+    with whatever budget the wait left.
+    """
+    generate_fn = generate_cpp_ai_content if product == "CPP" else generate_rams_ai_content
+    fallback_fn = build_cpp_fallback_content if product == "CPP" else build_rams_fallback_content
+    
+    started = time.monotonic()
+    prefetched = ai_prefetch_store.adopt(product, context, timeout=budget_seconds)
+    if prefetched is not None:
+        return prefetched
+    if budget_seconds is not None and ai_prefetch_store.is_pending(product, context):
+        # The matching prefetch used up this request's budget; don't start a second call
+        return fallback_fn(context)
+    if budget_seconds is not None:
+        # A prefetch that failed after a long wait leaves less time (below AI_MIN_BUDGET_SECONDS: fallback)
+        budget_seconds = max(0.0, budget_seconds - (time.monotonic() - started))
+    return generate_fn(context, budget_seconds=budget_seconds)
+
+
+@app.on_event("startup")
+async def warm_render_pool():
+    """Spawn render workers and parse templates before the first request."""
+    try:
+        await run_in("render", render_pool.warm)
+    except Exception as e:
+        logger.error(f"Render pool warm-up failed (renders will start workers on demand): {e}")
+
+
+@app.on_event("startup")
+async def connect_single_flight_lease():
+    """Extend de-duplication across replicas when SINGLEFLIGHT_DATABASE_URL is set."""
+    try:
+        generation_flights.lease = await run_in("io", create_lease)
+    except Exception as e:
+        logger.error(f"Single-flight lease unavailable, de-duplicating within this replica only: {e}")
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    global pg_jobs
+    if pg_queue.JOBS_DATABASE_URL:
+        pg_jobs = await run_in("io", pg_queue.create_backend, _run_job, job_manager)
+        pg_jobs.start()
+    else:
+        job_manager.start()
+
+
+@app.on_event("startup")
+async def start_disk_sweeper():
+    global disk_sweeper
+    disk_sweeper = asyncio.create_task(output_janitor.run())
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    if disk_sweeper is not None:
+        disk_sweeper.cancel()
+    if pg_jobs is not None:
+        await pg_jobs.stop()
+    await job_manager.stop()
+    if generation_flights.lease is not None:
+        generation_flights.lease.close()
+    if checkpoint_ledger is not None:
+        checkpoint_ledger.close()
+    if image_cache is not None:
+        image_cache.close()
+    artifact_store.close()
+    for task in rerender_runs.values():
+        task.cancel()
+    await asyncio.gather(*rerender_runs.values(), return_exceptions=True)
+    rerender_ledger.close()
+    await close_clients()
+    render_pool.shutdown()
+
+
 @app.get("/health")
-def health_check():
+async def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
         "template_dir": TEMPLATE_DIR,
         "output_dir": OUTPUT_DIR,
-        "templates_available": os.listdir(TEMPLATE_DIR) if os.path.exists(TEMPLATE_DIR) else []
+        "templates_available": os.listdir(TEMPLATE_DIR) if os.path.exists(TEMPLATE_DIR) else [],
+        "executors": pool_sizes(),
+        "admission": admission.snapshot(),
+        "disk": output_janitor.snapshot(),
     }
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """In-process counters, gauges and latency histograms (JSON)."""
+    return metrics.snapshot()
+
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=429, detail=f"Server busy: {e}", headers={"Retry-After": str(e.retry_after)})
+
+
 @app.post("/generate", response_model=GenerateResponse)
-def generate(request: GenerateRequest):
+async def generate(request: GenerateRequest, x_request_deadline: Optional[str] = Header(default=None)):
     """
     Generate DOCX and PDF from provided placeholders.
     
+    The X-Request-Deadline header (seconds, default REQUEST_DEADLINE_SECONDS) bounds
+    the whole request; see deadlines.py. Answers 429 with Retry-After when the
+    admission queue is full (see admission.py).
+    
     Args:
         request: GenerateRequest with product, placeholders, optional images, optional output_basename
     
     Returns:
         GenerateResponse with paths to generated DOCX and PDF files
     """
+    deadline = Deadline.from_header(x_request_deadline)
+    try:
+        async with admission.admit(timeout=deadline.remaining()):
+            return await _generate_document(request, deadline)
+    except Overloaded as e:
+        raise _overloaded(e)
+
+
+async def _generate_document(request: GenerateRequest, deadline: Deadline) -> GenerateResponse:
+    """Body of /generate, run once the request is admitted."""
     logger.info(f"Generate request: product={request.product}")
     
     # Validate product
@@ -242,11 +564,7 @@ def generate(request: GenerateRequest):
         raise HTTPException(status_code=400, detail=f"Invalid product: {product}. Must be 'CPP' or 'RAMS'")
     
     # Determine template path
-    template_map = {
-        "CPP": "CPP_TEMPLATE_WORKING_v1_copy.docx",
-        "RAMS": "RAMS_TEMPLATE_WORKING_v1_copy.docx"
-    }
-    template_path = os.path.join(TEMPLATE_DIR, template_map[product])
+    template_path = os.path.join(TEMPLATE_DIR, TEMPLATE_FILES[product])
     
     # Generate output filename
     if request.output_basename:
@@ -256,47 +574,30 @@ def generate(request: GenerateRequest):
         basename = f"{product}_{timestamp}"
     
     docx_path = os.path.join(OUTPUT_DIR, f"{basename}.docx")
+    expected_pdf_path = os.path.join(OUTPUT_DIR, f"{basename}.pdf")
     
     # Get placeholders as a mutable dict
     placeholders = dict(request.placeholders)
+    ai_content_source = None
     
     # Generate AI content for CPP products
     if product == "CPP":
-        task_activity = placeholders.get("CPP_TASK_ACTIVITY", "")
-        project_title = placeholders.get("CPP_PROJECT_TITLE", "")
-        duration = placeholders.get("CPP_DURATION", "")
-        
-        # Read Smart Toggles
-        toggle_external = str(placeholders.get("TOGGLE_EXTERNAL_GROUNDWORKS", "false")).lower() == "true"
-        toggle_height = str(placeholders.get("TOGGLE_HEIGHT_STRUCTURAL", "false")).lower() == "true"
-        toggle_road = str(placeholders.get("TOGGLE_PUBLIC_ROAD_IMPACT", "false")).lower() == "true"
-        toggle_mep = str(placeholders.get("TOGGLE_MEP_COMMISSIONING", "false")).lower() == "true"
-        
-        logger.info(f"Smart Toggles: external={toggle_external}, height={toggle_height}, road={toggle_road}, mep={toggle_mep}")
+        toggles = _read_cpp_toggles(placeholders)
+        logger.info(f"Smart Toggles: {toggles}")
         
-        if task_activity:
-            # Build enriched prompt context
-            enriched_context = f"Project: {project_title}\nDuration: {duration}\n"
-            if toggle_external:
-                enriched_context += "User indicated: External Site / Groundworks\n"
-            if toggle_height:
-                enriched_context += "User indicated: Structural / Height Work\n"
-            if toggle_road:
-                enriched_context += "User indicated: Public Road / Footway Impact\n"
-            if toggle_mep:
-                enriched_context += "User indicated: M&E Commissioning\n"
-            enriched_context += f"\nActivity Description:\n{task_activity}"
-            
+        enriched_context = _build_cpp_ai_context(placeholders)
+        if enriched_context:
             logger.info("Generating AI content for CPP...")
-            ai_content = generate_cpp_ai_content(enriched_context)
+            ai_budget = deadline.budget(
+                request.ai_budget_seconds if request.ai_budget_seconds is not None else AI_TIME_BUDGET_SECONDS,
+                reserve=DEADLINE_DELIVERY_RESERVE_SECONDS,
+            )
+            async with admission.stage_slot("ai"):
+                ai_content = await run_in("ai", _get_ai_content, "CPP", enriched_context, ai_budget)
+            ai_content_source = ai_content.pop("AI_CONTENT_SOURCE", None)
             
             # Override with user toggles
-            ai_content["BLUE_FLAG_SECURE_PERIMETER_HOARDING"] = toggle_external
-            ai_content["BLUE_FLAG_HEAVY_LOGISTICS_LAYDOWN"] = toggle_external
-            ai_content["BLUE_FLAG_COMPETENCE_PLANT_HEIGHT"] = toggle_height
-            ai_content["BLUE_FLAG_SECTION_16_FACADE"] = toggle_height
-            ai_content["BLUE_FLAG_PUBLIC_TRAFFIC_MGMT"] = toggle_road
-            ai_content["BLUE_FLAG_SECTION_17_COMMISSIONING"] = toggle_mep
+            _apply_cpp_toggle_overrides(ai_content, toggles)
             
             placeholders.update(ai_content)
             logger.info(f"AI content merged: {list(ai_content.keys())}")
@@ -308,108 +609,322 @@ def generate(request: GenerateRequest):
     logger.info(f"Blue flags processed: {blue_flags}")
     
     try:
+        output_janitor.pin(docx_path, expected_pdf_path)
         # Generate DOCX
         logger.info(f"Generating DOCX: {docx_path}")
-        generate_docx(
-            template_path=template_path,
-            output_path=docx_path,
-            placeholders=placeholders,
-            images=request.images or {},
-            blue_flags=blue_flags
-        )
+        async with admission.stage_slot("render"):
+            deadline.check("render")
+            await run_in("io", output_janitor.ensure_free)
+            await run_in(
+                "render",
+                render_pool.render,
+                template_path=template_path,
+                output_path=docx_path,
+                placeholders=placeholders,
+                images=request.images or {},
+                blue_flags=blue_flags
+            )
         logger.info(f"DOCX generated successfully: {docx_path}")
         
-        # Convert to PDF
-        logger.info(f"Converting to PDF...")
-        pdf_path = convert_to_pdf(docx_path, OUTPUT_DIR)
+        # Convert to PDF (skipped when the deadline is too close)
+        async with admission.stage_slot("pdf"):
+            pdf_budget = deadline.budget(PDF_CONVERT_TIMEOUT_SECONDS)
+            if pdf_budget < DEADLINE_MIN_PDF_SECONDS:
+                raise LibreOfficeError(f"Skipped: {pdf_budget:.1f}s left before the request deadline")
+            logger.info(f"Converting to PDF...")
+            pdf_path = await run_in("pdf", convert_to_pdf, docx_path, OUTPUT_DIR, pdf_budget)
         logger.info(f"PDF generated successfully: {pdf_path}")
         
-        return GenerateResponse(docx_path=docx_path, pdf_path=pdf_path)
+        return GenerateResponse(docx_path=docx_path, pdf_path=pdf_path, ai_content_source=ai_content_source)
     
     except TemplateNotFoundError as e:
         logger.error(f"Template not found: {e}")
         raise HTTPException(status_code=404, detail=str(e))
+    except DeadlineExceeded as e:
+        logger.warning(f"Generation abandoned: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
     except LibreOfficeError as e:
         logger.warning(f"PDF conversion failed (continuing with DOCX only): {e}")
-        return GenerateResponse(docx_path=docx_path, pdf_path=None)
+        return GenerateResponse(docx_path=docx_path, pdf_path=None, ai_content_source=ai_content_source)
     except Exception as e:
         logger.exception(f"Generation failed: {e}")
         raise HTTPException(status_code=500, detail=f"Document generation failed: {e}")
+    finally:
+        output_janitor.unpin(docx_path, expected_pdf_path)
 
 
-def download_images_from_urls(uploads: Dict[str, str], temp_dir: str) -> Dict[str, str]:
+@app.post("/prefetch-ai", response_model=PrefetchAIResponse)
+async def prefetch_ai(
+    request: PrefetchAIRequest,
+    http_request: Request,
+    x_docgen_key: Optional[str] = Header(default=None),
+    x_client_id: Optional[str] = Header(default=None),
+):
     """
-    Download images from URLs to temporary local files.
+    Start AI generation for a draft form in the background.
+    
+    The result is kept for PREFETCH_TTL_SECONDS and adopted by /generate or
+    /generate-from-submission when they build the same AI context.
+    
+    Args:
+        request: PrefetchAIRequest with product, draft placeholders and ai_input
+    
+    Returns:
+        PrefetchAIResponse with the prefetch key and its status
+    """
+    # Auth check
+    if DOCGEN_KEY and x_docgen_key != DOCGEN_KEY:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    product = request.product.upper()
+    if product == "CPP":
+        context = _build_cpp_ai_context(request.placeholders)
+        generate_fn = generate_cpp_ai_content
+    elif product == "RAMS":
+        context = _build_rams_ai_context(request.placeholders, request.ai_input or {})
+        generate_fn = generate_rams_ai_content
+    else:
+        raise HTTPException(status_code=400, detail=f"Invalid product: {product}. Must be 'CPP' or 'RAMS'")
+    
+    if not context:
+        raise HTTPException(status_code=400, detail="No AI context in draft (task description is empty)")
+    
+    client_id = x_client_id or (http_request.client.host if http_request.client else "unknown")
+    try:
+        result = ai_prefetch_store.start(client_id, product, context, generate_fn)
+    except PrefetchLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    return PrefetchAIResponse(**result)
+
+
+async def download_images_from_urls(uploads: Dict[str, str], temp_dir: str, timeout: float = 30) -> Dict[str, str]:
+    """
+    Download images from URLs to temporary local files, all at once.
+    
+    Files are streamed to disk and checked by image_downloads (size caps, image
+    header), through image_cache when it is enabled; rejected or failed uploads
+    are logged and left out.
     
     Args:
         uploads: Dict mapping placeholder names to URLs
         temp_dir: Directory to save downloaded files
+        timeout: Per-request timeout in seconds
     
     Returns:
         Dict mapping placeholder names to local file paths
     """
-    local_images = {}
-    
-    for placeholder_key, url in uploads.items():
-        if not url:
-            continue
-            
-        try:
-            logger.info(f"Downloading image for {placeholder_key} from {url}")
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            # Determine file extension from URL or content type
-            ext = 'png'
-            if '.' in url:
-                ext = url.split('.')[-1].split('?')[0]  # Remove query params
-            elif 'content-type' in response.headers:
-                content_type = response.headers['content-type']
-                if 'jpeg' in content_type or 'jpg' in content_type:
-                    ext = 'jpg'
-                elif 'png' in content_type:
-                    ext = 'png'
-            
-            # Save to temp file
-            temp_filename = f"{placeholder_key}.{ext}"
-            temp_path = os.path.join(temp_dir, temp_filename)
-            
-            with open(temp_path, 'wb') as f:
-                f.write(response.content)
-            
-            local_images[placeholder_key] = temp_path
-            logger.info(f"Downloaded {placeholder_key} to {temp_path}")
-            
-        except Exception as e:
-            logger.error(f"Failed to download image for {placeholder_key}: {e}")
-            continue
+    if image_cache is not None:
+        results = await image_cache.fetch(uploads, temp_dir, timeout=timeout)
+    else:
+        results = await download_images(uploads, temp_dir, timeout=timeout)
+    for key, result in results.items():
+        if result.error:
+            logger.error(f"Failed to download image for {key} from {result.url}: {result.error}")
+        elif result.cache == "hit":
+            logger.info(f"Image for {key} unchanged, served from cache ({result.seconds:.2f}s)")
+        else:
+            logger.info(f"Downloaded {key}: {result.bytes:,} bytes in {result.seconds:.2f}s")
     
-    return local_images
+    return {key: result.path for key, result in results.items() if result.path}
+
+
+def _apply_rams_deliveries_and_fire_plan(placeholders: dict, local_images: Dict[str, str]) -> None:
+    """
+    Resolve the RAMS deliveries and fire plan sections from the client's uploads and text.
+    Mutates placeholders and local_images in place.
+    """
+    # RAMS Deliveries Logic:
+    # Case A: Client provided BOTH image AND text → use their data
+    # Case B: Client provided TEXT only (no image) → use client's text + default image
+    # Case C: Client provided IMAGE only (no text) → use client's image + default text
+    # Case D: No data or "Use Client CPP" → use default text + default image
+    has_client_deliveries_img = "RAMS_DELIVERIES_IMG" in local_images and local_images["RAMS_DELIVERIES_IMG"]
+    raw_deliveries_text = placeholders.get("RAMS_DELIVERIES_TEXT", "").strip()
+    uses_client_cpp = raw_deliveries_text == "As per Client CPP and Induction"
+
+    # Custom text = text that is NOT empty and NOT the "Use Client CPP" option
+    has_custom_text = raw_deliveries_text and not uses_client_cpp
+
+    logger.info(f"RAMS Deliveries Debug: has_img={has_client_deliveries_img}, raw_text='{raw_deliveries_text[:50] if raw_deliveries_text else ''}', has_custom_text={has_custom_text}, uses_cpp={uses_client_cpp}")
+
+    # Default image path
+    default_img_path = os.path.join(os.path.dirname(__file__), "img", "rams_deliveries_sample.png")
+    default_text = "As per Clients CPP and Induction"
+
+    if has_client_deliveries_img and has_custom_text:
+        # Case A: Client provided BOTH custom image and text
+        logger.info("RAMS: Case A - Using client's custom IMAGE AND TEXT")
+        placeholders["RAMS_DELIVERIES_CLIENT_TEXT"] = raw_deliveries_text
+        placeholders["RAMS_DELIVERIES_DEFAULT"] = ""
+        # local_images already has RAMS_DELIVERIES_IMG from upload
+
+    elif has_custom_text and not has_client_deliveries_img:
+        # Case B: Client provided TEXT only - use client text, NO image
+        logger.info("RAMS: Case B - Using client's TEXT only (no image)")
+        placeholders["RAMS_DELIVERIES_CLIENT_TEXT"] = raw_deliveries_text
+        placeholders["RAMS_DELIVERIES_DEFAULT"] = ""
+        # No image - ensure RAMS_DELIVERIES_IMG is not set
+        if "RAMS_DELIVERIES_IMG" in local_images:
+            del local_images["RAMS_DELIVERIES_IMG"]
+
+    elif has_client_deliveries_img and not has_custom_text:
+        # Case C: Client provided IMAGE only - use client image + DEFAULT text
+        logger.info("RAMS: Case C - Using client's IMAGE + DEFAULT text")
+        placeholders["RAMS_DELIVERIES_DEFAULT"] = default_text
+        placeholders["RAMS_DELIVERIES_CLIENT_TEXT"] = ""
+        # local_images already has RAMS_DELIVERIES_IMG from upload
+
+    else:
+        # Case D: No data or "Use Client CPP"
+        placeholders["RAMS_DELIVERIES_DEFAULT"] = default_text
+        placeholders["RAMS_DELIVERIES_CLIENT_TEXT"] = ""
+        if uses_client_cpp:
+            # User explicitly chose "Use Client CPP & Instructions" → text only, NO image
+            logger.info("RAMS: Case D (Use Client CPP) - DEFAULT text only, NO image")
+            if "RAMS_DELIVERIES_IMG" in local_images:
+                del local_images["RAMS_DELIVERIES_IMG"]
+        else:
+            # Completely blank submission → default text + default image
+            logger.info("RAMS: Case D (blank) - Using DEFAULT image AND text")
+            if os.path.exists(default_img_path):
+                local_images["RAMS_DELIVERIES_IMG"] = default_img_path
+                logger.info(f"RAMS: Default image set: {default_img_path}")
+            else:
+                logger.warning(f"RAMS: Default image not found: {default_img_path}")
+
+    logger.info(f"RAMS Deliveries Final: IMG={local_images.get('RAMS_DELIVERIES_IMG', 'NONE')[:50]}, DEFAULT='{placeholders.get('RAMS_DELIVERIES_DEFAULT', '')}', CLIENT_TEXT='{placeholders.get('RAMS_DELIVERIES_CLIENT_TEXT', '')[:30] if placeholders.get('RAMS_DELIVERIES_CLIENT_TEXT') else ''}'")
+
+    # ========== FIRE PLAN LOGIC ==========
+    # Case A: Client provided BOTH image AND text → use their data
+    # Case B: Client provided TEXT only (no image) → use client's text, NO image
+    # Case C: Client provided IMAGE only (no text) → use client's image + DEFAULT text
+    # Case D: No data or "Use Client Fire Plan" → use default text + default image
+    has_client_fire_plan_img = "RAMS_FIRE_PLAN_IMG" in local_images and local_images["RAMS_FIRE_PLAN_IMG"]
+    raw_fire_plan_text = placeholders.get("RAMS_FIRE_PLAN_TEXT", "").strip()
+    uses_client_fire_plan = raw_fire_plan_text == "As per Client Fire Plan"
+
+    # Custom text = text that is NOT empty and NOT the "Use Client Fire Plan" option
+    has_custom_fire_plan_text = raw_fire_plan_text and not uses_client_fire_plan
+
+    logger.info(f"RAMS Fire Plan Debug: has_img={has_client_fire_plan_img}, raw_text='{raw_fire_plan_text[:50] if raw_fire_plan_text else ''}', has_custom_text={has_custom_fire_plan_text}, uses_client_plan={uses_client_fire_plan}")
+
+    # Default image path for fire plan
+    default_fire_plan_img_path = os.path.join(os.path.dirname(__file__), "img", "rams_fire_plan_sample.png")
+    default_fire_plan_text = "Please refer to the Client's Fire Plan.\nAll emergencies must be reported to the client management team immediately."
+
+    if has_client_fire_plan_img and has_custom_fire_plan_text:
+        # Case A: Client provided BOTH custom image and text
+        logger.info("RAMS Fire Plan: Case A - Using client's custom IMAGE AND TEXT")
+        placeholders["RAMS_FIRE_PLAN_CLIENTS_TEXT"] = raw_fire_plan_text
+        placeholders["RAMS_FIRE_PLAN_DEFAULT_TEXT"] = ""
+        # local_images already has RAMS_FIRE_PLAN_IMG from upload
+
+    elif has_custom_fire_plan_text and not has_client_fire_plan_img:
+        # Case B: Client provided TEXT only - use client text, NO image
+        logger.info("RAMS Fire Plan: Case B - Using client's TEXT only (no image)")
+        placeholders["RAMS_FIRE_PLAN_CLIENTS_TEXT"] = raw_fire_plan_text
+        placeholders["RAMS_FIRE_PLAN_DEFAULT_TEXT"] = ""
+        # No image - ensure RAMS_FIRE_PLAN_IMG is not set
+        if "RAMS_FIRE_PLAN_IMG" in local_images:
+            del local_images["RAMS_FIRE_PLAN_IMG"]
+
+    elif has_client_fire_plan_img and not has_custom_fire_plan_text:
+        # Case C: Client provided IMAGE only - use client image + DEFAULT text
+        logger.info("RAMS Fire Plan: Case C - Using client's IMAGE + DEFAULT text")
+        placeholders["RAMS_FIRE_PLAN_DEFAULT_TEXT"] = default_fire_plan_text
+        placeholders["RAMS_FIRE_PLAN_CLIENTS_TEXT"] = ""
+        # local_images already has RAMS_FIRE_PLAN_IMG from upload
+
+    else:
+        # Case D: No data or "Use Client Fire Plan"
+        placeholders["RAMS_FIRE_PLAN_DEFAULT_TEXT"] = default_fire_plan_text
+        placeholders["RAMS_FIRE_PLAN_CLIENTS_TEXT"] = ""
+        if uses_client_fire_plan:
+            # User explicitly chose "Use Client Fire Plan" → text only, NO image
+            logger.info("RAMS Fire Plan: Case D (Use Client Plan) - DEFAULT text only, NO image")
+            if "RAMS_FIRE_PLAN_IMG" in local_images:
+                del local_images["RAMS_FIRE_PLAN_IMG"]
+        else:
+            # Completely blank submission → default text + default image
+            logger.info("RAMS Fire Plan: Case D (blank) - Using DEFAULT image AND text")
+            if os.path.exists(default_fire_plan_img_path):
+                local_images["RAMS_FIRE_PLAN_IMG"] = default_fire_plan_img_path
+                logger.info(f"RAMS Fire Plan: Default image set: {default_fire_plan_img_path}")
+            else:
+                logger.warning(f"RAMS Fire Plan: Default image not found: {default_fire_plan_img_path}")
+
+    logger.info(f"RAMS Fire Plan Final: IMG={local_images.get('RAMS_FIRE_PLAN_IMG', 'NONE')[:50] if local_images.get('RAMS_FIRE_PLAN_IMG') else 'NONE'}, DEFAULT='{placeholders.get('RAMS_FIRE_PLAN_DEFAULT_TEXT', '')}', CLIENT_TEXT='{placeholders.get('RAMS_FIRE_PLAN_CLIENTS_TEXT', '')[:30] if placeholders.get('RAMS_FIRE_PLAN_CLIENTS_TEXT') else ''}'")
 
 
 @app.post("/generate-from-submission", response_model=GenerateFromSubmissionResponse)
-def generate_from_submission(
+async def generate_from_submission(
     request: GenerateFromSubmissionRequest,
     x_docgen_key: Optional[str] = Header(default=None),
+    x_request_deadline: Optional[str] = Header(default=None),
 ):
     """
     Generate DOCX and PDF from a Supabase submission ID.
     
+    Holds the connection for the whole pipeline; POST /jobs runs the same work
+    in the background. X-Request-Deadline (seconds, default REQUEST_DEADLINE_SECONDS)
+    bounds the whole request; see deadlines.py. Answers 429 with Retry-After when
+    the admission queue is full (see admission.py).
+    
     Args:
         request: GenerateFromSubmissionRequest with submission_id
     
     Returns:
-        GenerateFromSubmissionResponse with paths and updated submission ID
+        GenerateFromSubmissionResponse with paths, updated submission ID and per-stage timings
     """
     # Auth check
     if DOCGEN_KEY and x_docgen_key != DOCGEN_KEY:
         raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    deadline = Deadline.from_header(x_request_deadline)
+    try:
+        async with admission.admit(timeout=deadline.remaining()):
+            return await _generate_submission(request, stage_limits=admission.stage_limits, deadline=deadline)
+    except Overloaded as e:
+        raise _overloaded(e)
 
+
+async def _generate_submission(
+    request: GenerateFromSubmissionRequest,
+    on_stage: Optional[Callable[[str, str, int, int], None]] = None,
+    stage_limits: Optional[Callable[[List[str]], Dict[str, asyncio.Semaphore]]] = None,
+    deadline: Optional[Deadline] = None,
+) -> GenerateFromSubmissionResponse:
+    """
+    Generate DOCX and PDF for a submission and write the results to its outputs.
+    
+    Concurrent calls with the same submission inputs share one execution, and
+    calls shortly after it finished get its result (see singleflight.py).
+    
+    Args:
+        request: GenerateFromSubmissionRequest with submission_id
+        on_stage: Optional pipeline progress callback (see StagePipeline.run_async)
+        stage_limits: Optional provider of shared per-stage semaphores (job mode)
+        deadline: When the request must be done by (default REQUEST_DEADLINE_SECONDS from now)
+    
+    Returns:
+        GenerateFromSubmissionResponse with paths, updated submission ID and per-stage timings
+    
+    Raises:
+        HTTPException with the status the endpoint should return
+    """
     logger.info(f"Generate from submission: id={request.submission_id}")
+    deadline = deadline or Deadline.from_header(None)
     
     # Fetch submission from Supabase
     try:
-        submission = get_submission(request.submission_id)
+        submission = await get_submission_async(
+            request.submission_id,
+            columns=SUBMISSION_RENDER_COLUMNS,
+            timeout=deadline.timeout(SUPABASE_TIMEOUT_SECONDS, "fetch"),
+        )
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to fetch submission: {e}")
         raise HTTPException(status_code=404, detail=f"Submission not found: {e}")
@@ -419,24 +934,13 @@ def generate_from_submission(
     
     product = submission.get("product", "").upper()
     placeholders = submission.get("placeholders", {})
-    uploads = submission.get("uploads", {})
     
     logger.info(f"Submission data: product={product}, placeholders_count={len(placeholders)}")
     logger.info(f"Submission keys: {list(submission.keys())}")
     
-    # Write debug file
-    try:
-        with open("debug_log.txt", "a") as f:
-            f.write(f"\n--- New Request {datetime.now()} ---\n")
-            f.write(f"Product: {product}\n")
-            f.write(f"Submission Keys: {list(submission.keys())}\n")
-            if 'ai_input' in submission:
-                f.write(f"AI Input: {submission['ai_input']}\n")
-            else:
-                f.write("AI Input: MISSING\n")
-            f.write(f"RAMS Title: {placeholders.get('RAMS_TITLE', 'MISSING')}\n")
-    except Exception as e:
-        logger.error(f"Failed to write debug log: {e}")
+    # The full AI input is large; log it at debug level instead of writing a file on the event loop
+    logger.debug(f"AI Input: {submission.get('ai_input', 'MISSING')}")
+    logger.debug(f"RAMS Title: {placeholders.get('RAMS_TITLE', 'MISSING')}")
 
     logger.info(f"AI Input present: {'ai_input' in submission}")
     if 'ai_input' in submission:
@@ -444,85 +948,145 @@ def generate_from_submission(
     
     logger.info(f"Product check: '{product}'")
     
-    # Generate AI content for CPP products
+    # Validate product
+    if product not in ("CPP", "RAMS"):
+        raise HTTPException(status_code=400, detail=f"Invalid product in submission: {product}")
+    
+    # Double clicks and retries for the same inputs share one execution
+    input_hash = _submission_input_hash(submission)
+    flight_key = f"{request.submission_id}:{input_hash}"
+    try:
+        result, how = await generation_flights.do(
+            flight_key, lambda: _render_submission(request, submission, input_hash, deadline, on_stage, stage_limits)
+        )
+    except RemoteFlightError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if how != LEADER:
+        logger.info(f"Submission {request.submission_id}: result shared from {how} execution")
+    return GenerateFromSubmissionResponse(**dict(result, single_flight=how))
+
+
+def _submission_input_hash(submission: dict) -> str:
+    """Hash of everything in a submission that affects the generated documents."""
+    inputs = {key: submission.get(key) for key in ("product", "placeholders", "uploads", "ai_input")}
+    encoded = json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+def _submission_plan(submission: dict) -> Tuple[str, str, Dict[str, bool], dict]:
+    """
+    Template path, AI context, CPP toggles and render manifest of a submission.
+    
+    Built up front so the AI stage never reads placeholders while the prepare
+    stage is editing them.
+    """
+    product = submission.get("product", "").upper()
+    placeholders = submission.get("placeholders", {})
+    template_path = os.path.join(TEMPLATE_DIR, TEMPLATE_FILES[product])
+    
+    toggles = _read_cpp_toggles(placeholders)
     if product == "CPP":
-        task_activity = placeholders.get("CPP_TASK_ACTIVITY", "")
-        project_title = placeholders.get("CPP_PROJECT_TITLE", "")
-        duration = placeholders.get("CPP_DURATION", "")
-        
-        # Read Smart Toggles from placeholders (they come as strings "true"/"false")
-        toggle_external = placeholders.get("TOGGLE_EXTERNAL_GROUNDWORKS", "false").lower() == "true"
-        toggle_height = placeholders.get("TOGGLE_HEIGHT_STRUCTURAL", "false").lower() == "true"
-        toggle_road = placeholders.get("TOGGLE_PUBLIC_ROAD_IMPACT", "false").lower() == "true"
-        toggle_mep = placeholders.get("TOGGLE_MEP_COMMISSIONING", "false").lower() == "true"
-        
-        logger.info(f"Smart Toggles: external={toggle_external}, height={toggle_height}, road={toggle_road}, mep={toggle_mep}")
-        
-        if task_activity:
-            # Build enriched prompt context
-            enriched_context = f"Project: {project_title}\nDuration: {duration}\n"
-            if toggle_external:
-                enriched_context += "User indicated: External Site / Groundworks\n"
-            if toggle_height:
-                enriched_context += "User indicated: Structural / Height Work\n"
-            if toggle_road:
-                enriched_context += "User indicated: Public Road / Footway Impact\n"
-            if toggle_mep:
-                enriched_context += "User indicated: M&E Commissioning\n"
-            enriched_context += f"\nActivity Description:\n{task_activity}"
-            
-            logger.info("Generating AI content for CPP with enriched context...")
-            ai_content = generate_cpp_ai_content(enriched_context)
-            
-            # Override AI blue flags with user's explicit toggles
-            # User toggles take precedence over AI inference
-            ai_content["BLUE_FLAG_SECURE_PERIMETER_HOARDING"] = toggle_external
-            ai_content["BLUE_FLAG_HEAVY_LOGISTICS_LAYDOWN"] = toggle_external
-            ai_content["BLUE_FLAG_COMPETENCE_PLANT_HEIGHT"] = toggle_height
-            ai_content["BLUE_FLAG_SECTION_16_FACADE"] = toggle_height
-            ai_content["BLUE_FLAG_PUBLIC_TRAFFIC_MGMT"] = toggle_road
-            ai_content["BLUE_FLAG_SECTION_17_COMMISSIONING"] = toggle_mep
-            
-            placeholders.update(ai_content)
-            logger.info(f"AI content merged with toggle overrides: {list(ai_content.keys())}")
-        else:
+        logger.info(f"Smart Toggles: {toggles}")
+        ai_context = _build_cpp_ai_context(placeholders)
+        if not ai_context:
             logger.warning("CPP_TASK_ACTIVITY is empty, skipping AI generation")
-    
-    # Generate AI content for RAMS products
-    elif product == "RAMS":
-        rams_title = placeholders.get("RAMS_TITLE", "")
-        
+    else:
         # Get AI task description from ai_input (passed separately from placeholders)
-        ai_task_description = ""
         ai_input_data = submission.get("ai_input", {})
-        
-        # Handle case where ai_input might be stored as a JSON string instead of dict
-        if isinstance(ai_input_data, str):
-            try:
-                ai_input_data = json.loads(ai_input_data)
-                logger.info("RAMS ai_input was a string, parsed to dict")
-            except json.JSONDecodeError as e:
-                logger.warning(f"Failed to parse ai_input as JSON: {e}")
-                ai_input_data = {}
-        
         logger.info(f"RAMS ai_input data type: {type(ai_input_data).__name__}, content: {ai_input_data}")
-        
-        if ai_input_data and isinstance(ai_input_data, dict):
-            ai_task_description = ai_input_data.get("aiTaskDescription", "")
-        
-        logger.info(f"RAMS_TITLE: '{rams_title[:50]}...' " if rams_title else "RAMS_TITLE: (empty)")
-        logger.info(f"aiTaskDescription: '{ai_task_description[:100]}...'" if ai_task_description else "aiTaskDescription: (empty)")
-        
-        # Combine title and description for richer AI context
-        ai_context = f"Project: {rams_title}" if rams_title else ""
-        if ai_task_description:
-            ai_context += f"\n\nActivity Description:\n{ai_task_description}"
-        
-        if ai_context.strip():
-            logger.info(f"Generating AI content for RAMS with context: {ai_context[:150]}...")
-            ai_content = generate_rams_ai_content(ai_context)
-            placeholders.update(ai_content)
-            logger.info(f"RAMS AI content merged: {list(ai_content.keys())}")
+        ai_context = _build_rams_ai_context(placeholders, ai_input_data)
+        if not ai_context:
+            logger.warning("RAMS_TITLE and aiTaskDescription are empty, skipping AI generation")
+    
+    manifest = build_manifest(
+        product, placeholders, submission.get("uploads", {}),
+        {"context": ai_context, "toggles": toggles if product == "CPP" else None},
+        template_path,
+    )
+    return template_path, ai_context, toggles, manifest
+
+
+def _reused_stage(stage: Stage, value) -> Stage:
+    """Stand-in for a stage whose result is taken from the previous generation."""
+    async def reuse(results: dict):
+        return value
+    return Stage(stage.name, reuse, deps=stage.deps)
+
+
+async def _render_submission(
+    request: GenerateFromSubmissionRequest,
+    submission: dict,
+    input_hash: str,
+    deadline: Deadline,
+    on_stage: Optional[Callable[[str, str, int, int], None]] = None,
+    stage_limits: Optional[Callable[[List[str]], Dict[str, asyncio.Semaphore]]] = None,
+    convert_pdf: Optional[Callable[[str, str, float], Awaitable[str]]] = None,
+    write_outputs: Optional[Callable[[str, dict, float], Awaitable[None]]] = None,
+    in_memory: bool = RENDER_IN_MEMORY,
+) -> dict:
+    """
+    Run the generation pipeline for a fetched submission.
+    
+    The work runs as a stage DAG (see pipeline.py) so independent stages overlap:
+    
+        ai ──────────────┐
+        images ─ prepare ┴─ render ┬─ pdf ─ upload_pdf ─┬─ outputs
+                                   └─ upload_docx ──────┘
+    
+    With checkpointing on, stages already completed by an earlier attempt with
+    the same input_hash are restored instead of run (see checkpoints.py). The
+    render manifest of the previous generation lets unchanged AI input skip the
+    LLM, and fully unchanged inputs reuse the previous DOCX/PDF (see render_manifest.py).
+    
+    Every stage gets only what is left of deadline: the AI stage falls back to
+    local content and the PDF is skipped when time is short; required steps fail
+    with 504.
+    
+    Bulk callers (see rerender.py) can replace the PDF conversion and the outputs
+    write with batching versions: convert_pdf(docx_path, output_dir, timeout) and
+    write_outputs(submission_id, outputs, timeout).
+    
+    With in_memory the DOCX and PDF are kept in memory and uploaded from there
+    (see memory_render.py); convert_pdf needs files, so it implies in_memory=False.
+    
+    Returns:
+        GenerateFromSubmissionResponse fields as a JSON-compatible dict
+    """
+    product = submission.get("product", "").upper()
+    placeholders = submission.get("placeholders", {})
+    uploads = submission.get("uploads", {})
+    
+    # Generate output filename
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    basename = f"{product}_{request.submission_id[:8]}_{timestamp}"
+    docx_path = os.path.join(OUTPUT_DIR, f"{basename}.docx")
+    expected_pdf_path = os.path.join(OUTPUT_DIR, f"{basename}.pdf")
+    in_memory = in_memory and convert_pdf is None
+    disk_writes = DiskWriteMeter()
+    # Storage names carry a content hash instead of the timestamp (see artifact_store)
+    artifact_name = f"{product}_{request.submission_id[:8]}"
+    
+    # Diff against the previous generation before any stage edits placeholders
+    template_path, ai_context, toggles, manifest = _submission_plan(submission)
+    reuse = ReusePlan(submission.get("outputs"), manifest)
+    logger.info(f"Changed inputs since last generation: {reuse.changed}")
+    
+    def ai_stage(results: dict) -> dict:
+        """LLM call (or adopted prefetch / fallback). Returns AI placeholders incl. AI_CONTENT_SOURCE."""
+        if not ai_context:
+            return {}
+        logger.info(f"Generating AI content for {product} with context: {ai_context[:150]}...")
+        # Leave time for render, PDF and uploads; a short budget means fallback content
+        ai_budget = deadline.budget(
+            request.ai_budget_seconds if request.ai_budget_seconds is not None else AI_TIME_BUDGET_SECONDS,
+            reserve=DEADLINE_DELIVERY_RESERVE_SECONDS,
+        )
+        ai_content = _get_ai_content(product, ai_context, ai_budget)
+        if product == "CPP":
+            # Override AI blue flags with user's explicit toggles
+            # User toggles take precedence over AI inference
+            _apply_cpp_toggle_overrides(ai_content, toggles)
+        else:
             if ai_content.get("AI_SEQUENCE_OF_WORKS"):
                 logger.info(f"AI_SEQUENCE_OF_WORKS preview: {ai_content['AI_SEQUENCE_OF_WORKS'][:200]}...")
             if ai_content.get("AI_RISK_ASSESSMENT"):
@@ -533,160 +1097,35 @@ def generate_from_submission(
                     logger.warning("AI_RISK_ASSESSMENT does NOT have pipe separators - table will NOT be generated!")
             else:
                 logger.warning("AI_RISK_ASSESSMENT is EMPTY - no content from AI!")
-        else:
-            logger.warning("RAMS_TITLE and aiTaskDescription are empty, skipping AI generation")
-    
-    # Validate product
-    if product not in ("CPP", "RAMS"):
-        raise HTTPException(status_code=400, detail=f"Invalid product in submission: {product}")
-    
-    # Determine template path
-    template_map = {
-        "CPP": "CPP_TEMPLATE_WORKING_v1_copy.docx",
-        "RAMS": "RAMS_TEMPLATE_WORKING_v1_copy.docx"
-    }
-    template_path = os.path.join(TEMPLATE_DIR, template_map[product])
+        return ai_content
     
-    # Generate output filename
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    basename = f"{product}_{request.submission_id[:8]}_{timestamp}"
-    docx_path = os.path.join(OUTPUT_DIR, f"{basename}.docx")
-    
-    
-    try:
-        # Create temp directory for downloaded images
-        temp_dir = tempfile.mkdtemp(prefix="doc_gen_")
+    async def images_stage(results: dict) -> Dict[str, str]:
+        """Download uploaded images to the request's temp directory."""
         logger.info(f"Created temp directory: {temp_dir}")
-        
-        # Download images from URLs to temp files
-        local_images = {}
-        if uploads:
-            logger.info(f"Downloading {len(uploads)} images from URLs...")
-            local_images = download_images_from_urls(uploads, temp_dir)
-            logger.info(f"Downloaded {len(local_images)} images successfully")
-        
-        # RAMS Deliveries Logic:
-        # Case A: Client provided BOTH image AND text → use their data
-        # Case B: Client provided TEXT only (no image) → use client's text + default image
-        # Case C: Client provided IMAGE only (no text) → use client's image + default text
-        # Case D: No data or "Use Client CPP" → use default text + default image
+        if not uploads:
+            return {}
+        logger.info(f"Downloading {len(uploads)} images from URLs...")
+        local_images = await download_images_from_urls(uploads, temp_dir, timeout=deadline.timeout(30, "images"))
+        logger.info(f"Downloaded {len(local_images)} images successfully")
+        return local_images
+    
+    def prepare_stage(results: dict) -> Dict[str, str]:
+        """Non-AI template preparation: template check and RAMS deliveries/fire plan resolution."""
+        if not os.path.exists(template_path):
+            # Fail fast instead of after the AI call
+            raise TemplateNotFoundError(f"Template not found: {template_path}")
+        local_images = dict(results["images"])
         if product == "RAMS":
-            has_client_deliveries_img = "RAMS_DELIVERIES_IMG" in local_images and local_images["RAMS_DELIVERIES_IMG"]
-            raw_deliveries_text = placeholders.get("RAMS_DELIVERIES_TEXT", "").strip()
-            uses_client_cpp = raw_deliveries_text == "As per Client CPP and Induction"
-            
-            # Custom text = text that is NOT empty and NOT the "Use Client CPP" option
-            has_custom_text = raw_deliveries_text and not uses_client_cpp
-            
-            logger.info(f"RAMS Deliveries Debug: has_img={has_client_deliveries_img}, raw_text='{raw_deliveries_text[:50] if raw_deliveries_text else ''}', has_custom_text={has_custom_text}, uses_cpp={uses_client_cpp}")
-            
-            # Default image path
-            default_img_path = os.path.join(os.path.dirname(__file__), "img", "rams_deliveries_sample.png")
-            default_text = "As per Clients CPP and Induction"
-            
-            if has_client_deliveries_img and has_custom_text:
-                # Case A: Client provided BOTH custom image and text
-                logger.info("RAMS: Case A - Using client's custom IMAGE AND TEXT")
-                placeholders["RAMS_DELIVERIES_CLIENT_TEXT"] = raw_deliveries_text
-                placeholders["RAMS_DELIVERIES_DEFAULT"] = ""
-                # local_images already has RAMS_DELIVERIES_IMG from upload
-                
-            elif has_custom_text and not has_client_deliveries_img:
-                # Case B: Client provided TEXT only - use client text, NO image
-                logger.info("RAMS: Case B - Using client's TEXT only (no image)")
-                placeholders["RAMS_DELIVERIES_CLIENT_TEXT"] = raw_deliveries_text
-                placeholders["RAMS_DELIVERIES_DEFAULT"] = ""
-                # No image - ensure RAMS_DELIVERIES_IMG is not set
-                if "RAMS_DELIVERIES_IMG" in local_images:
-                    del local_images["RAMS_DELIVERIES_IMG"]
-                    
-            elif has_client_deliveries_img and not has_custom_text:
-                # Case C: Client provided IMAGE only - use client image + DEFAULT text
-                logger.info("RAMS: Case C - Using client's IMAGE + DEFAULT text")
-                placeholders["RAMS_DELIVERIES_DEFAULT"] = default_text
-                placeholders["RAMS_DELIVERIES_CLIENT_TEXT"] = ""
-                # local_images already has RAMS_DELIVERIES_IMG from upload
-                    
-            else:
-                # Case D: No data or "Use Client CPP"
-                placeholders["RAMS_DELIVERIES_DEFAULT"] = default_text
-                placeholders["RAMS_DELIVERIES_CLIENT_TEXT"] = ""
-                if uses_client_cpp:
-                    # User explicitly chose "Use Client CPP & Instructions" → text only, NO image
-                    logger.info("RAMS: Case D (Use Client CPP) - DEFAULT text only, NO image")
-                    if "RAMS_DELIVERIES_IMG" in local_images:
-                        del local_images["RAMS_DELIVERIES_IMG"]
-                else:
-                    # Completely blank submission → default text + default image
-                    logger.info("RAMS: Case D (blank) - Using DEFAULT image AND text")
-                    if os.path.exists(default_img_path):
-                        local_images["RAMS_DELIVERIES_IMG"] = default_img_path
-                        logger.info(f"RAMS: Default image set: {default_img_path}")
-                    else:
-                        logger.warning(f"RAMS: Default image not found: {default_img_path}")
-            
-            logger.info(f"RAMS Deliveries Final: IMG={local_images.get('RAMS_DELIVERIES_IMG', 'NONE')[:50]}, DEFAULT='{placeholders.get('RAMS_DELIVERIES_DEFAULT', '')}', CLIENT_TEXT='{placeholders.get('RAMS_DELIVERIES_CLIENT_TEXT', '')[:30] if placeholders.get('RAMS_DELIVERIES_CLIENT_TEXT') else ''}'")
-        
-            # ========== FIRE PLAN LOGIC ==========
-            # Case A: Client provided BOTH image AND text → use their data
-            # Case B: Client provided TEXT only (no image) → use client's text, NO image
-            # Case C: Client provided IMAGE only (no text) → use client's image + DEFAULT text
-            # Case D: No data or "Use Client Fire Plan" → use default text + default image
-            has_client_fire_plan_img = "RAMS_FIRE_PLAN_IMG" in local_images and local_images["RAMS_FIRE_PLAN_IMG"]
-            raw_fire_plan_text = placeholders.get("RAMS_FIRE_PLAN_TEXT", "").strip()
-            uses_client_fire_plan = raw_fire_plan_text == "As per Client Fire Plan"
-            
-            # Custom text = text that is NOT empty and NOT the "Use Client Fire Plan" option
-            has_custom_fire_plan_text = raw_fire_plan_text and not uses_client_fire_plan
-            
-            logger.info(f"RAMS Fire Plan Debug: has_img={has_client_fire_plan_img}, raw_text='{raw_fire_plan_text[:50] if raw_fire_plan_text else ''}', has_custom_text={has_custom_fire_plan_text}, uses_client_plan={uses_client_fire_plan}")
-            
-            # Default image path for fire plan
-            default_fire_plan_img_path = os.path.join(os.path.dirname(__file__), "img", "rams_fire_plan_sample.png")
-            default_fire_plan_text = "Please refer to the Client's Fire Plan.\nAll emergencies must be reported to the client management team immediately."
-            
-            if has_client_fire_plan_img and has_custom_fire_plan_text:
-                # Case A: Client provided BOTH custom image and text
-                logger.info("RAMS Fire Plan: Case A - Using client's custom IMAGE AND TEXT")
-                placeholders["RAMS_FIRE_PLAN_CLIENTS_TEXT"] = raw_fire_plan_text
-                placeholders["RAMS_FIRE_PLAN_DEFAULT_TEXT"] = ""
-                # local_images already has RAMS_FIRE_PLAN_IMG from upload
-                
-            elif has_custom_fire_plan_text and not has_client_fire_plan_img:
-                # Case B: Client provided TEXT only - use client text, NO image
-                logger.info("RAMS Fire Plan: Case B - Using client's TEXT only (no image)")
-                placeholders["RAMS_FIRE_PLAN_CLIENTS_TEXT"] = raw_fire_plan_text
-                placeholders["RAMS_FIRE_PLAN_DEFAULT_TEXT"] = ""
-                # No image - ensure RAMS_FIRE_PLAN_IMG is not set
-                if "RAMS_FIRE_PLAN_IMG" in local_images:
-                    del local_images["RAMS_FIRE_PLAN_IMG"]
-                    
-            elif has_client_fire_plan_img and not has_custom_fire_plan_text:
-                # Case C: Client provided IMAGE only - use client image + DEFAULT text
-                logger.info("RAMS Fire Plan: Case C - Using client's IMAGE + DEFAULT text")
-                placeholders["RAMS_FIRE_PLAN_DEFAULT_TEXT"] = default_fire_plan_text
-                placeholders["RAMS_FIRE_PLAN_CLIENTS_TEXT"] = ""
-                # local_images already has RAMS_FIRE_PLAN_IMG from upload
-                    
-            else:
-                # Case D: No data or "Use Client Fire Plan"
-                placeholders["RAMS_FIRE_PLAN_DEFAULT_TEXT"] = default_fire_plan_text
-                placeholders["RAMS_FIRE_PLAN_CLIENTS_TEXT"] = ""
-                if uses_client_fire_plan:
-                    # User explicitly chose "Use Client Fire Plan" → text only, NO image
-                    logger.info("RAMS Fire Plan: Case D (Use Client Plan) - DEFAULT text only, NO image")
-                    if "RAMS_FIRE_PLAN_IMG" in local_images:
-                        del local_images["RAMS_FIRE_PLAN_IMG"]
-                else:
-                    # Completely blank submission → default text + default image
-                    logger.info("RAMS Fire Plan: Case D (blank) - Using DEFAULT image AND text")
-                    if os.path.exists(default_fire_plan_img_path):
-                        local_images["RAMS_FIRE_PLAN_IMG"] = default_fire_plan_img_path
-                        logger.info(f"RAMS Fire Plan: Default image set: {default_fire_plan_img_path}")
-                    else:
-                        logger.warning(f"RAMS Fire Plan: Default image not found: {default_fire_plan_img_path}")
-            
-            logger.info(f"RAMS Fire Plan Final: IMG={local_images.get('RAMS_FIRE_PLAN_IMG', 'NONE')[:50] if local_images.get('RAMS_FIRE_PLAN_IMG') else 'NONE'}, DEFAULT='{placeholders.get('RAMS_FIRE_PLAN_DEFAULT_TEXT', '')}', CLIENT_TEXT='{placeholders.get('RAMS_FIRE_PLAN_CLIENTS_TEXT', '')[:30] if placeholders.get('RAMS_FIRE_PLAN_CLIENTS_TEXT') else ''}'")
+            _apply_rams_deliveries_and_fire_plan(placeholders, local_images)
+        return local_images
+    
+    def render_stage(results: dict) -> Document:
+        """Merge AI content, apply Blue Flags and render the DOCX (to memory when in_memory)."""
+        ai_content = dict(results["ai"])
+        ai_content.pop("AI_CONTENT_SOURCE", None)
+        placeholders.update(ai_content)
+        if ai_content:
+            logger.info(f"AI content merged: {list(ai_content.keys())}")
         
         # Process Blue Flags using shared helper
         # This injects boilerplate text (if True) or clears placeholders (if False)
@@ -696,116 +1135,431 @@ def generate_from_submission(
         
         # Generate DOCX
         logger.info(f"Generating DOCX: {docx_path}")
-        generate_docx(
+        deadline.check("render")
+        output_janitor.ensure_free()
+        rendered = render_pool.render(
             template_path=template_path,
-            output_path=docx_path,
+            output_path=None if in_memory else docx_path,
             placeholders=placeholders,
-            images=local_images,  # Use local file paths
+            images=results["prepare"],  # Use local file paths
             blue_flags=blue_flags  # Pass blue flags for conditional removal
         )
+        if in_memory:
+            logger.info(f"DOCX rendered in memory: {basename}.docx ({len(rendered):,} bytes)")
+            return InMemoryDocument(f"{basename}.docx", rendered)
         logger.info(f"DOCX generated successfully: {docx_path}")
-        
-        # Convert to PDF
+        return docx_path
+    
+    def pdf_budget() -> Optional[float]:
+        budget = deadline.budget(PDF_CONVERT_TIMEOUT_SECONDS, reserve=DEADLINE_OUTPUTS_RESERVE_SECONDS)
+        if budget < DEADLINE_MIN_PDF_SECONDS:
+            logger.warning(f"Skipping PDF: {budget:.1f}s left before the request deadline")
+            metrics.counter("deadline_degraded_total", step="pdf").inc()
+            return None
+        return budget
+    
+    def pdf_stage(results: dict) -> dict:
+        """Convert to PDF. A LibreOffice failure is not fatal: the DOCX is still delivered."""
+        budget = pdf_budget()
+        if budget is None:
+            return {"path": None, "error": "Skipped: request deadline too close"}
         logger.info(f"Converting to PDF...")
-        pdf_path = convert_to_pdf(docx_path, OUTPUT_DIR)
-        logger.info(f"PDF generated successfully: {pdf_path}")
-        
-        # Upload to Supabase Storage (ephemeral container — local files won't survive restarts)
-        storage_prefix = f"{request.submission_id}"
+        rendered = results["render"]
         try:
-            docx_url = upload_file_to_storage(docx_path, f"{storage_prefix}/{os.path.basename(docx_path)}")
+            if isinstance(rendered, InMemoryDocument):
+                pdf = InMemoryDocument(f"{basename}.pdf", convert_docx_bytes_to_pdf(rendered.content, basename, budget))
+            else:
+                pdf = convert_to_pdf(rendered, OUTPUT_DIR, budget)
+        except LibreOfficeError as e:
+            logger.warning(f"PDF conversion failed (continuing with DOCX only): {e}")
+            return {"path": None, "error": str(e)}
+        logger.info(f"PDF generated successfully: {pdf}")
+        return {"path": pdf, "error": None}
+    
+    async def batched_pdf_stage(results: dict) -> dict:
+        """pdf_stage through the caller's convert_pdf."""
+        budget = pdf_budget()
+        if budget is None:
+            return {"path": None, "error": "Skipped: request deadline too close"}
+        try:
+            pdf_path = await convert_pdf(results["render"], OUTPUT_DIR, budget)
+        except LibreOfficeError as e:
+            logger.warning(f"PDF conversion failed (continuing with DOCX only): {e}")
+            return {"path": None, "error": str(e)}
+        return {"path": pdf_path, "error": None}
+    
+    # Upload to Supabase Storage (ephemeral container — local files won't survive restarts)
+    def upload_timeout(kind: str) -> Optional[float]:
+        timeout = deadline.budget(STORAGE_UPLOAD_TIMEOUT_SECONDS, reserve=DEADLINE_OUTPUTS_RESERVE_SECONDS)
+        if timeout < DEADLINE_MIN_STEP_SECONDS:
+            logger.warning(f"Skipping {kind} upload: request deadline too close")
+            metrics.counter("deadline_degraded_total", step=f"upload_{kind}").inc()
+            return None
+        return timeout
+    
+    async def upload_docx_stage(results: dict) -> Optional[dict]:
+        # The DOCX may come from an earlier attempt's checkpoint, so use the stage result
+        rendered = results["render"]
+        timeout = upload_timeout("docx")
+        if timeout is None:
+            return None
+        try:
+            return await artifact_store.upload(rendered, request.submission_id, artifact_name, timeout)
         except Exception as upload_err:
             logger.error(f"Failed to upload DOCX to storage: {upload_err}")
-            docx_url = None
-
+            return None
+    
+    async def upload_pdf_stage(results: dict) -> Optional[dict]:
+        pdf_path = results["pdf"]["path"]
+        timeout = upload_timeout("pdf") if pdf_path else None
+        if timeout is None:
+            return None
         try:
-            pdf_url = upload_file_to_storage(pdf_path, f"{storage_prefix}/{os.path.basename(pdf_path)}")
+            return await artifact_store.upload(pdf_path, request.submission_id, artifact_name, timeout)
         except Exception as upload_err:
             logger.error(f"Failed to upload PDF to storage: {upload_err}")
-            pdf_url = None
-
-        # Update submission with outputs (URLs are the source of truth)
+            return None
+    
+    async def outputs_stage(results: dict) -> dict:
+        """Update submission with outputs (URLs are the source of truth)."""
+        pdf_result = results["pdf"]
+        docx_upload = results["upload_docx"] or {}
+        pdf_upload = results["upload_pdf"] or {}
+        docx_file = local_path(results["render"])
+        pdf_file = local_path(pdf_result["path"])
+        # In-memory documents that did not reach Storage are saved for /download
+        if isinstance(results["render"], InMemoryDocument) and not docx_upload.get("url"):
+            docx_file = await run_in("io", results["render"].save, OUTPUT_DIR)
+            disk_writes.add_file(docx_file)
+        if isinstance(pdf_result["path"], InMemoryDocument) and not pdf_upload.get("url"):
+            pdf_file = await run_in("io", pdf_result["path"].save, OUTPUT_DIR)
+            disk_writes.add_file(pdf_file)
         outputs = {
-            "docx_url": docx_url,
-            "pdf_url": pdf_url,
-            "docx_path": docx_path,
-            "pdf_path": pdf_path,
-            "status": "complete",
-            "generated_at": datetime.now().isoformat()
+            "docx_url": docx_upload.get("url"),
+            "pdf_url": pdf_upload.get("url"),
+            "docx_path": docx_file,
+            "pdf_path": pdf_file,
+            "docx_sha256": docx_upload.get("sha256"),
+            "pdf_sha256": pdf_upload.get("sha256"),
+            "status": "complete" if pdf_result["path"] or pdf_upload.get("url") else "complete_no_pdf",
+            "ai_content_source": results["ai"].get("AI_CONTENT_SOURCE"),  # "fallback" = local library content, not LLM
+            "generated_at": datetime.now().isoformat(),
+            MANIFEST_KEY: dict(manifest, ai_content=results["ai"]),
         }
+        if pdf_result["error"]:
+            outputs["pdf_error"] = pdf_result["error"]
+        # Documents that did not reach Storage are served from disk by /download
+        if not docx_upload.get("url"):
+            output_janitor.keep(docx_file)
+        if not pdf_upload.get("url"):
+            output_janitor.keep(pdf_file)
         
         logger.info(f"Updating submission outputs...")
-        update_submission_outputs(request.submission_id, outputs)
+        try:
+            await (write_outputs or update_submission_outputs_async)(
+                request.submission_id, outputs, deadline.timeout(SUPABASE_TIMEOUT_SECONDS, "outputs")
+            )
+        except Exception as update_err:
+            if pdf_result["path"]:
+                raise
+            logger.error(f"Failed to update submission after PDF error: {update_err}")
+        download_metadata.invalidate(request.submission_id)
         logger.info(f"Submission updated successfully")
-        
-        return GenerateFromSubmissionResponse(
-            docx_path=docx_path,
-            pdf_path=pdf_path,
-            updated_submission_id=request.submission_id
-        )
-        
+        return outputs
+    
+    stages = [
+        Stage("ai", ai_stage, executor="ai"),
+        Stage("images", images_stage),
+        Stage("prepare", prepare_stage, deps=["images"]),
+        Stage("render", render_stage, deps=["ai", "prepare"], executor="render"),
+        Stage("pdf", batched_pdf_stage, deps=["render"]) if convert_pdf else Stage("pdf", pdf_stage, deps=["render"], executor="pdf"),
+        Stage("upload_docx", upload_docx_stage, deps=["render"]),
+        Stage("upload_pdf", upload_pdf_stage, deps=["pdf"]),
+        Stage("outputs", outputs_stage, deps=["upload_docx", "upload_pdf"]),
+    ]
+    reused = {}
+    if reuse.ai_content is not None:
+        reused["ai"] = reuse.ai_content
+    if reuse.artifacts is not None:
+        artifacts = reuse.artifacts
+        reused.update({
+            "images": {},
+            "prepare": {},
+            "render": artifacts["docx_path"],
+            "pdf": {"path": artifacts["pdf_path"], "error": None},
+            "upload_docx": {"url": artifacts["docx_url"], "sha256": artifacts["docx_sha256"], "skipped": True},
+            "upload_pdf": {"url": artifacts["pdf_url"], "sha256": artifacts["pdf_sha256"], "skipped": True},
+        })
+    if reused:
+        logger.info(f"Reusing previous generation for stages: {list(reused)}")
+    stages = [_reused_stage(stage, reused[stage.name]) if stage.name in reused else stage for stage in stages]
+    
+    limits = stage_limits([stage.name for stage in stages]) if stage_limits else None
+    def relocate(stage: str, path: str) -> str:
+        """Restored checkpoint files go into this run's temp directory and under its output names."""
+        if stage == "images":
+            return os.path.join(temp_dir, os.path.basename(path))
+        return os.path.join(OUTPUT_DIR, basename + os.path.splitext(path)[1])
+    
+    resume = None
+    if checkpoint_ledger is not None:
+        resume = ResumePlan(checkpoint_ledger, request.submission_id, input_hash, SUBMISSION_CHECKPOINTS, relocate)
+        stages = resume.wrap(stages)
+    pipeline = StagePipeline(stages, name="generate_from_submission", limits=limits)
+    
+    try:
+        # Images live in a temp directory removed when the run ends; its output files are not evicted meanwhile
+        with scoped_temp_dir() as temp_dir, output_janitor.pinned(docx_path, expected_pdf_path):
+            # Hard stop: blocking stages cannot be interrupted, but the request is answered
+            run = await asyncio.wait_for(pipeline.run_async(on_stage=on_stage), timeout=deadline.remaining())
+            disk_writes.add_tree(temp_dir)
     except TemplateNotFoundError as e:
         logger.error(f"Template not found: {e}")
         raise HTTPException(status_code=404, detail=str(e))
-    except LibreOfficeError as e:
-        logger.warning(f"PDF conversion failed (continuing with DOCX only): {e}")
-        
-        # Upload DOCX to storage even if PDF failed
-        storage_prefix = f"{request.submission_id}"
-        docx_url = None
-        try:
-            docx_url = upload_file_to_storage(docx_path, f"{storage_prefix}/{os.path.basename(docx_path)}")
-        except Exception as upload_err:
-            logger.error(f"Failed to upload DOCX to storage after PDF error: {upload_err}")
+    except (DeadlineExceeded, asyncio.TimeoutError) as e:
+        logger.warning(f"Generation abandoned at the request deadline: {e}")
+        raise HTTPException(status_code=504, detail=f"Request deadline exceeded: {e}")
+    except Exception as e:
+        logger.exception(f"Generation failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Document generation failed: {e}")
+    
+    outputs = run.results["outputs"]
+    logger.info(f"Stage timings: {run.timings_summary()}")
+    # Documents this run wrote itself (not reused or restored from a checkpoint)
+    not_written = set(reused) | set(resume.restored if resume is not None else [])
+    if "render" not in not_written:
+        disk_writes.add_file(local_path(run.results["render"]))
+    if "pdf" not in not_written:
+        disk_writes.add_file(local_path(run.results["pdf"]["path"]))
+    metrics.histogram(
+        "request_disk_write_bytes", buckets=DISK_WRITE_BUCKETS, mode="memory" if in_memory else "disk"
+    ).observe(disk_writes.bytes)
+    if resume is not None and resume.complete:
+        # Nothing left to retry; drop the checkpoints
+        await run_in("io", checkpoint_ledger.clear, request.submission_id)
+    return jsonable_encoder(GenerateFromSubmissionResponse(
+        docx_path=outputs["docx_path"],
+        pdf_path=outputs["pdf_path"],
+        updated_submission_id=request.submission_id,
+        ai_content_source=outputs["ai_content_source"],
+        stage_timings=run.timings_summary(),
+        critical_path=run.critical_path,
+        resumed_stages=resume.restored if resume is not None else None,
+        skipped_stages=list(reused),
+        changed_inputs=reuse.changed,
+        disk_bytes_written=disk_writes.bytes,
+    ))
 
-        outputs = {
-            "docx_url": docx_url,
-            "pdf_url": None,
-            "docx_path": docx_path,
-            "pdf_path": None,
-            "status": "complete_no_pdf",
-            "pdf_error": str(e),
-            "generated_at": datetime.now().isoformat()
-        }
-        
+
+async def _run_job(job: Job, stage_limits) -> dict:
+    """JobManager runner: the /generate-from-submission pipeline with job progress and stage limits."""
+    request = GenerateFromSubmissionRequest(**job.payload)
+    try:
+        response = await _generate_submission(
+            request, on_stage=job.on_stage,
+            # Same stage slots as live requests, within the jobs' own per-stage quota
+            stage_limits=lambda names: admission.stage_limits(names, quota=stage_limits(names)),
+            deadline=Deadline(job.deadline - time.monotonic()),
+        )
+    except HTTPException as e:
+        raise JobError(str(e.detail), e.status_code)
+    return jsonable_encoder(response)
+
+
+# Background generation jobs (POST /jobs): in-process queue, or the shared
+# Postgres queue when JOBS_DATABASE_URL is set (connected at startup)
+job_manager = JobManager(_run_job)
+pg_jobs: Optional[pg_queue.PgJobBackend] = None
+
+
+@app.post("/jobs", status_code=202, response_model=JobAcceptedResponse)
+async def submit_job(
+    request: JobSubmitRequest,
+    response: Response,
+    x_docgen_key: Optional[str] = Header(default=None),
+):
+    """
+    Queue a generation for a submission and return immediately.
+    
+    Poll GET /jobs/{job_id} for stage and progress. Results are written to the
+    submission's outputs exactly as /generate-from-submission does.
+    
+    Returns:
+        202 with the job id, or 429 with Retry-After when the queue is full
+    """
+    # Auth check
+    if DOCGEN_KEY and x_docgen_key != DOCGEN_KEY:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    payload = {"submission_id": request.submission_id, "ai_budget_seconds": request.ai_budget_seconds}
+    if pg_jobs is not None:
+        # Queue priority follows the submission's own product, never a client's claim
+        product = await _job_product(request)
         try:
-            logger.info(f"Updating submission outputs (DOCX only)...")
-            update_submission_outputs(request.submission_id, outputs)
-        except Exception as update_err:
-            logger.error(f"Failed to update submission after PDF error: {update_err}")
+            job = await pg_jobs.submit(payload, request.deadline_seconds, product)
+        except Exception as e:
+            logger.error(f"Failed to enqueue job: {e}")
+            raise HTTPException(status_code=503, detail=f"Job queue unavailable: {e}")
+    else:
+        try:
+            job = job_manager.submit(payload, deadline_seconds=request.deadline_seconds).to_dict()
+        except JobQueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    
+    status_url = f"/jobs/{job['job_id']}"
+    response.headers["Location"] = status_url
+    return JobAcceptedResponse(job_id=job["job_id"], status=job["status"], status_url=status_url)
+
 
-        return GenerateFromSubmissionResponse(
-            docx_path=docx_path,
-            pdf_path=None,
-            updated_submission_id=request.submission_id
+async def _job_product(request: JobSubmitRequest) -> str:
+    """The submission's product, checked against the one the client sent (if any)."""
+    try:
+        submission = await get_submission_async(
+            request.submission_id, columns="product", timeout=SUPABASE_TIMEOUT_SECONDS
         )
     except Exception as e:
-        logger.exception(f"Generation failed: {e}")
-        raise HTTPException(status_code=500, detail=f"Document generation failed: {e}")
+        logger.error(f"Failed to fetch submission: {e}")
+        raise HTTPException(status_code=404, detail=f"Submission not found: {e}")
+    if not submission:
+        raise HTTPException(status_code=404, detail=f"Submission not found: {request.submission_id}")
+    product = (submission.get("product") or "").upper()
+    if product not in TEMPLATE_FILES:
+        raise HTTPException(status_code=400, detail=f"Unknown product: {product or '(none)'}")
+    if request.product and request.product.upper() != product:
+        raise HTTPException(status_code=400, detail=f"Product {request.product} does not match the submission ({product})")
+    return product
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str, x_docgen_key: Optional[str] = Header(default=None)):
+    """Stage, progress and (when finished) result or error of a job."""
+    # Auth check
+    if DOCGEN_KEY and x_docgen_key != DOCGEN_KEY:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    if pg_jobs is not None:
+        job = await pg_jobs.get(job_id)
+    else:
+        job = job_manager.get(job_id)
+        job = job.to_dict() if job is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return JobStatusResponse(**job)
+
+
+async def _fleet_render(submission: dict, manifest: dict, convert_pdf, write_outputs) -> None:
+    """FleetRerender runner: the submission pipeline with batched PDFs and outputs writes."""
+    request = GenerateFromSubmissionRequest(submission_id=submission["id"])
+    # Checkpoints of the old template must not be restored into the new one
+    input_hash = hashlib.sha256(
+        f"{_submission_input_hash(submission)}:{manifest['template']}".encode("utf-8")
+    ).hexdigest()[:32]
+    try:
+        await _render_submission(
+            request, submission, input_hash, Deadline.from_header(None),
+            # Shares render/upload slots with live traffic; PDFs are throttled by batching instead
+            stage_limits=lambda names: admission.stage_limits([name for name in names if name != "pdf"]),
+            convert_pdf=convert_pdf, write_outputs=write_outputs,
+        )
+    except HTTPException as e:
+        raise RuntimeError(e.detail)
+
+
+# Re-render after a template change (POST /rerender); progress kept in a local ledger
+rerender_ledger = FleetLedger()
+fleet = FleetRerender(
+    manifest=lambda submission: _submission_plan(submission)[3],
+    render=_fleet_render,
+    template_hash=lambda product: template_hash(os.path.join(TEMPLATE_DIR, TEMPLATE_FILES[product])),
+    ledger=rerender_ledger,
+)
+rerender_runs: Dict[str, asyncio.Task] = {}
+
+
+@app.post("/rerender")
+async def rerender(request: RerenderRequest, response: Response, x_docgen_key: Optional[str] = Header(default=None)):
+    """
+    Re-render every submission of a product generated with an older template.
+    
+    Stored AI content is reused, so no LLM calls are made. The run is paced and
+    resumable (see rerender.py); poll GET /rerender/{run_id} for progress. With
+    dry_run, returns the counts and a time and token estimate instead.
+    
+    Returns:
+        202 with the run id, 409 if that run is already going, or the estimate
+    """
+    # Auth check
+    if DOCGEN_KEY and x_docgen_key != DOCGEN_KEY:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    product = request.product.upper()
+    if product not in TEMPLATE_FILES:
+        raise HTTPException(status_code=400, detail="Invalid product. Use 'CPP' or 'RAMS'")
+    
+    if request.dry_run:
+        try:
+            return await fleet.estimate(product)
+        except Exception as e:
+            logger.error(f"Re-render estimate failed: {e}")
+            raise HTTPException(status_code=502, detail=f"Failed to list submissions: {e}")
+    
+    run_id = fleet.run_id(product)
+    running = rerender_runs.get(run_id)
+    if running is not None and not running.done():
+        raise HTTPException(status_code=409, detail=f"Re-render already running: {run_id}")
+    task = asyncio.create_task(fleet.run(product, restart=request.restart))
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())  # failures are in the ledger
+    rerender_runs[run_id] = task
+    
+    status_url = f"/rerender/{run_id}"
+    response.status_code = 202
+    response.headers["Location"] = status_url
+    return {"run_id": run_id, "status": "running", "status_url": status_url}
+
+
+@app.get("/rerender/{run_id}")
+async def get_rerender(run_id: str, x_docgen_key: Optional[str] = Header(default=None)):
+    """Status, counts and failed submissions of a re-render run."""
+    # Auth check
+    if DOCGEN_KEY and x_docgen_key != DOCGEN_KEY:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    
+    run = await run_in("io", rerender_ledger.get, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"Re-render run not found: {run_id}")
+    return run
 
 
 @app.get("/download/{submission_id}")
-def download_document(submission_id: str, format: str = "docx"):
+async def download_document(submission_id: str, request: Request, format: str = "docx"):
     """
     Download the generated document for a submission.
+
+    Redirects to the stored document (a signed URL when DOWNLOAD_SIGNED_URL_SECONDS
+    is set). With DOWNLOAD_CACHE_DIR set the document is served from a local copy
+    instead, with an ETag, If-None-Match and Range support. Outputs recorded before
+    documents were uploaded are served from the local docx_path/pdf_path.
     
     Args:
         submission_id: The submission ID to download the document for
         format: File format to download - 'pdf' or 'docx' (default: docx)
     
     Returns:
-        FileResponse with the requested file
+        A redirect, or a FileResponse with the requested file
     """
-    from fastapi.responses import FileResponse
+    from fastapi.responses import FileResponse, RedirectResponse
+    from starlette.background import BackgroundTask
     
     logger.info(f"Download request for submission: {submission_id}, format: {format}")
     
     if format not in ("pdf", "docx"):
         raise HTTPException(status_code=400, detail="Invalid format. Use 'pdf' or 'docx'")
     
-    # Fetch submission from Supabase to get the file path
+    # Fetch submission from Supabase (or the short-lived lookup cache) to get the document
     try:
-        submission = get_submission(submission_id)
+        submission = await download_metadata.get(
+            submission_id, lambda: get_submission_async(submission_id, columns=SUBMISSION_DOWNLOAD_COLUMNS)
+        )
     except Exception as e:
         logger.error(f"Failed to fetch submission: {e}")
         raise HTTPException(status_code=404, detail=f"Submission not found: {e}")
@@ -813,19 +1567,45 @@ def download_document(submission_id: str, format: str = "docx"):
     if not submission:
         raise HTTPException(status_code=404, detail=f"Submission not found: {submission_id}")
     
-    outputs = submission.get("outputs", {})
-    docx_path = outputs.get("docx_path")
-    pdf_path = outputs.get("pdf_path")
-    
-    # Select file based on format
+    outputs = submission.get("outputs") or {}
+    url = outputs.get(f"{format}_url")
+    digest = outputs.get(f"{format}_sha256")
+    file_path = outputs.get(f"{format}_path")
     if format == "pdf":
-        file_path = pdf_path
         media_type = "application/pdf"
-        extension = "pdf"
     else:
-        file_path = docx_path
         media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        extension = "docx"
+    
+    # Get product for filename
+    product = submission.get("product", "Document")
+    filename = f"{product}-{submission_id[:8]}.{format}"
+    
+    if url and download_cache is not None:
+        etag = etag_for(digest) if digest else None
+        if etag and etag_matches(request.headers.get("if-none-match"), etag):
+            metrics.counter("download_requests_total", format=format, mode="not_modified").inc()
+            return Response(status_code=304, headers={"ETag": etag})
+        try:
+            cached_path = await download_cache.fetch(url, digest, format, timeout=STORAGE_UPLOAD_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.warning(f"Download cache fetch failed for {url}, redirecting instead: {e}")
+            cached_path = None
+        if cached_path is not None:
+            logger.info(f"Serving cached {cached_path} as {filename}")
+            metrics.counter("download_requests_total", format=format, mode="cache").inc()
+            headers = {"Cache-Control": "private, no-cache"}
+            if etag:
+                headers["ETag"] = etag
+            return FileResponse(path=cached_path, filename=filename, media_type=media_type, headers=headers)
+    
+    if url:
+        try:
+            target = await redirect_target(url, filename, timeout=SUPABASE_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.error(f"Could not sign download URL for {url}: {e}")
+            raise HTTPException(status_code=502, detail="Document storage unavailable")
+        metrics.counter("download_requests_total", format=format, mode="redirect").inc()
+        return RedirectResponse(target, status_code=307)
     
     if not file_path:
         raise HTTPException(status_code=404, detail=f"{format.upper()} not available")
@@ -834,16 +1614,71 @@ def download_document(submission_id: str, format: str = "docx"):
         logger.error(f"File not found on disk: {file_path}")
         raise HTTPException(status_code=404, detail="Document file not found")
     
-    # Get product for filename
-    product = submission.get("product", "Document")
-    filename = f"{product}-{submission_id[:8]}.{extension}"
-    
     logger.info(f"Serving file: {file_path} as {filename}")
+    metrics.counter("download_requests_total", format=format, mode="local").inc()
     
+    # Not evicted while it is being sent
+    output_janitor.pin(file_path)
     return FileResponse(
         path=file_path,
         filename=filename,
-        media_type=media_type
+        media_type=media_type,
+        background=BackgroundTask(output_janitor.unpin, file_path),
+    )
+
+
+def _is_uuid(value: str) -> bool:
+    try:
+        return str(uuid.UUID(value)) == value.lower()
+    except ValueError:
+        return False
+
+
+@app.post("/export")
+async def export_documents(request: ExportRequest, x_docgen_key: Optional[str] = Header(default=None)):
+    """
+    Stream a ZIP of the documents of many submissions.
+
+    Select submissions with an ID list or with filters (product, project, created
+    date range). The archive is streamed as documents are fetched from Storage;
+    documents that are missing are listed in export_manifest.json inside it.
+
+    Returns:
+        StreamingResponse with application/zip
+    """
+    from fastapi.responses import StreamingResponse
+
+    # Auth check
+    if DOCGEN_KEY and x_docgen_key != DOCGEN_KEY:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    if not request.formats or any(f not in EXPORT_FORMATS for f in request.formats):
+        raise HTTPException(status_code=400, detail="Invalid formats. Use 'pdf' and/or 'docx'")
+    filters = export_filters(request.product, request.project, request.created_from, request.created_to)
+    if request.submission_ids is not None:
+        if not request.submission_ids or len(request.submission_ids) > EXPORT_MAX_IDS:
+            raise HTTPException(status_code=400, detail=f"Send between 1 and {EXPORT_MAX_IDS} submission IDs")
+        # The IDs end up inside a PostgREST in.(...) filter; only UUIDs may get there
+        invalid = [submission_id for submission_id in request.submission_ids if not _is_uuid(submission_id)]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Invalid submission IDs: {', '.join(invalid[:10])}")
+    elif not filters:
+        raise HTTPException(status_code=400, detail="Send submission_ids or at least one filter")
+
+    try:
+        rows = await prime(iter_submissions(request.submission_ids, filters))
+    except Exception as e:
+        logger.error(f"Export query failed: {e}")
+        raise HTTPException(status_code=502, detail=f"Failed to list submissions: {e}")
+    if rows is None:
+        raise HTTPException(status_code=404, detail="No submissions match")
+
+    filename = f"documents-{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    logger.info(f"Streaming export {filename} (ids={len(request.submission_ids or [])}, filters={filters})")
+    return StreamingResponse(
+        stream_zip(rows, request.formats),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
 
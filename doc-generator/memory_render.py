@@ -0,0 +1,137 @@
+"""
+In-memory render-to-upload for /generate-from-submission.
+
+The pipeline wrote the DOCX to OUTPUT_DIR and read it back to hash and upload
+it, had LibreOffice write the PDF there too, and read that back as well. On
+container storage every one of those is overlay-backed I/O. With
+RENDER_IN_MEMORY set:
+
+- the render workers return the DOCX bytes, which are hashed and uploaded from
+  memory (InMemoryDocument);
+- PDF conversion runs in a private directory under PDF_SCRATCH_DIR, /dev/shm
+  (tmpfs) by default, together with the LibreOffice profile, and the PDF bytes
+  are read back from there;
+- nothing is written to OUTPUT_DIR unless an upload fails; the document is then
+  saved there so /download can still serve it.
+
+LibreOffice only converts files it can open by name, so the scratch area is a
+tmpfs directory rather than a memfd. The render and PDF stages are not
+checkpointed in this mode, since checkpoints keep files on disk.
+
+DiskWriteMeter counts the bytes a request wrote to persistent disk in both
+modes (files on tmpfs are not counted); it is reported per request and as the
+request_disk_write_bytes histogram.
+"""
+
+import os
+import hashlib
+import logging
+from typing import Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+RENDER_IN_MEMORY = os.environ.get("RENDER_IN_MEMORY", "false").lower() in ("1", "true", "yes")
+
+# Histogram buckets for request_disk_write_bytes
+DISK_WRITE_BUCKETS = (0, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024)
+
+_MEMORY_FILESYSTEMS = ("tmpfs", "ramfs")
+
+
+class InMemoryDocument:
+    """
+    A rendered document held in memory instead of on disk.
+
+    Args:
+        name: File name including the extension, e.g. "RAMS_1a2b3c4d_20250101_120000.pdf".
+        content: The document bytes.
+    """
+
+    def __init__(self, name: str, content: bytes):
+        self.name = name
+        self.content = content
+        self._sha256: Optional[str] = None
+
+    @property
+    def extension(self) -> str:
+        return os.path.splitext(self.name)[1]
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.content).hexdigest()
+        return self._sha256
+
+    def save(self, directory: str) -> str:
+        """Write the document to directory (e.g. after a failed upload). Returns its path."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.name)
+        with open(path, "wb") as f:
+            f.write(self.content)
+        return path
+
+    def __repr__(self) -> str:
+        return f"InMemoryDocument({self.name!r}, {self.size:,} bytes)"
+
+
+Document = Union[str, InMemoryDocument]
+
+
+def local_path(document: Optional[Document]) -> Optional[str]:
+    """Disk path of a stage's document, or None for in-memory (or missing) documents."""
+    return document if isinstance(document, str) else None
+
+
+def _mounts() -> Dict[str, str]:
+    mounts = {}
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3:
+                    mounts[fields[1]] = fields[2]
+    except OSError:
+        pass
+    return mounts
+
+
+def on_memory_filesystem(path: str) -> bool:
+    """Whether path lives on tmpfs/ramfs (judged by its longest matching mount point)."""
+    path = os.path.realpath(path)
+    best, fs_type = "", None
+    for mount_point, mount_type in _mounts().items():
+        inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+        if inside and len(mount_point) > len(best):
+            best, fs_type = mount_point, mount_type
+    return fs_type in _MEMORY_FILESYSTEMS
+
+
+class DiskWriteMeter:
+    """Bytes one request wrote to persistent disk, counted from the files it created."""
+
+    def __init__(self):
+        self.bytes = 0
+        self._memory_dirs: Dict[str, bool] = {}
+
+    def _persistent(self, path: str) -> bool:
+        directory = os.path.dirname(os.path.abspath(path))
+        if directory not in self._memory_dirs:
+            self._memory_dirs[directory] = on_memory_filesystem(directory)
+        return not self._memory_dirs[directory]
+
+    def add_file(self, path: Optional[str]) -> None:
+        if path and os.path.isfile(path) and self._persistent(path):
+            self.bytes += os.path.getsize(path)
+
+    def add_tree(self, directory: str) -> None:
+        if not os.path.isdir(directory) or not self._persistent(os.path.join(directory, "x")):
+            return
+        for root, _, names in os.walk(directory):
+            for name in names:
+                try:
+                    self.bytes += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
@@ -0,0 +1,136 @@
+"""
+In-process metrics registry for the doc generator.
+Counters, gauges and latency histograms, exposed as JSON via GET /metrics.
+"""
+
+import bisect
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+# Latency buckets in seconds (upper bounds, cumulative like Prometheus)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_counters: Dict[str, "Counter"] = {}
+_gauges: Dict[str, "Gauge"] = {}
+_histograms: Dict[str, "Histogram"] = {}
+
+
+def _key(name: str, labels: Dict[str, str]) -> str:
+    """Build a registry key like name{a="1",b="2"}."""
+    if not labels:
+        return name
+    inner = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{inner}}}"
+
+
+class Counter:
+    """Monotonically increasing count."""
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Gauge:
+    """Value that can go up and down (queue depth, disk usage, ...)."""
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Histogram:
+    """Bucketed distribution of observed values (usually seconds)."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self._buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self._counts = [0] * (len(self._buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        idx = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self._buckets, self._counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = cumulative + self._counts[-1]
+            return {
+                "count": self._count,
+                "sum": round(self._sum, 6),
+                "buckets": buckets,
+            }
+
+
+def counter(name: str, **labels: str) -> Counter:
+    """Get or create a counter."""
+    key = _key(name, labels)
+    with _lock:
+        if key not in _counters:
+            _counters[key] = Counter()
+        return _counters[key]
+
+
+def gauge(name: str, **labels: str) -> Gauge:
+    """Get or create a gauge."""
+    key = _key(name, labels)
+    with _lock:
+        if key not in _gauges:
+            _gauges[key] = Gauge()
+        return _gauges[key]
+
+
+def histogram(name: str, buckets: Optional[Sequence[float]] = None, **labels: str) -> Histogram:
+    """Get or create a histogram. Buckets are only used on first creation."""
+    key = _key(name, labels)
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = Histogram(buckets or DEFAULT_BUCKETS)
+        return _histograms[key]
+
+
+def snapshot() -> dict:
+    """Return all metrics as a JSON-serialisable dict."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = dict(_histograms)
+    return {
+        "counters": {k: c.value for k, c in sorted(counters.items())},
+        "gauges": {k: g.value for k, g in sorted(gauges.items())},
+        "histograms": {k: h.snapshot() for k, h in sorted(histograms.items())},
+    }
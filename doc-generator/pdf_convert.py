@@ -4,16 +4,33 @@ No remote service dependency.
 """
 
 import os
+import re
 import subprocess
 import logging
 import tempfile
 import shutil
 from pathlib import Path
+from typing import Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
 # LibreOffice binary path (can be overridden via environment variable)
 LIBREOFFICE_BIN = os.environ.get("LIBREOFFICE_BIN", "soffice")
+# Longest a conversion may run; callers with a request deadline pass less
+PDF_CONVERT_TIMEOUT_SECONDS = float(os.environ.get("PDF_CONVERT_TIMEOUT_SECONDS", "180"))
+# Where in-memory conversions put their files and LibreOffice profile (tmpfs when available)
+PDF_SCRATCH_DIR = os.environ.get(
+    "PDF_SCRATCH_DIR", "/dev/shm" if os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+)
+
+
+# Fields soffice fills with the conversion time or a random ID. They are blanked
+# in place (same length, so the xref offsets stay valid) to make identical
+# documents convert to identical bytes.
+_VOLATILE_PDF_FIELDS = (
+    re.compile(rb"/(?:CreationDate|ModDate)\s*\((D:[^)]*)\)"),
+    re.compile(rb"/ID\s*\[\s*<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]+)>\s*\]"),
+)
 
 
 class LibreOfficeError(Exception):
@@ -21,13 +38,14 @@ class LibreOfficeError(Exception):
     pass
 
 
-def convert_to_pdf(docx_path: str, output_dir: str) -> str:
+def convert_to_pdf(docx_path: str, output_dir: str, timeout: float = PDF_CONVERT_TIMEOUT_SECONDS) -> str:
     """
     Convert a DOCX file to PDF using local LibreOffice.
 
     Args:
         docx_path: Path to input DOCX file.
         output_dir: Directory for the output PDF.
+        timeout: Seconds before soffice is killed (the request's remaining budget).
 
     Returns:
         Absolute path to the generated PDF.
@@ -38,12 +56,112 @@ def convert_to_pdf(docx_path: str, output_dir: str) -> str:
     if not os.path.exists(docx_path):
         raise LibreOfficeError(f"DOCX file not found: {docx_path}")
 
+    _run_soffice([docx_path], output_dir, timeout)
+
+    # Locate the generated PDF
+    pdf_path = _expected_pdf_path(docx_path, output_dir)
+    if not os.path.exists(pdf_path):
+        # LibreOffice sometimes outputs a slightly different name; find newest PDF
+        candidates = list(Path(output_dir).glob("*.pdf"))
+        if not candidates:
+            raise LibreOfficeError(f"PDF file was not created. Expected: {pdf_path}")
+        pdf_path = str(max(candidates, key=lambda p: p.stat().st_mtime))
+
+    strip_volatile_metadata(pdf_path)
+    file_size = os.path.getsize(pdf_path)
+    logger.info(f"PDF created successfully: {pdf_path} ({file_size:,} bytes)")
+    return pdf_path
+
+
+def convert_many_to_pdf(
+    docx_paths: List[str],
+    output_dir: str,
+    timeout: float = PDF_CONVERT_TIMEOUT_SECONDS,
+) -> Dict[str, Optional[str]]:
+    """
+    Convert several DOCX files with a single LibreOffice start.
+
+    Starting soffice costs seconds; bulk work (fleet re-renders) converts a batch
+    per start instead of paying it for every document. The DOCX basenames must
+    be distinct, as the PDFs are named after them.
+
+    Args:
+        docx_paths: Input DOCX files.
+        output_dir: Directory for the output PDFs.
+        timeout: Seconds before soffice is killed (for the whole batch).
+
+    Returns:
+        Input path -> PDF path, or None for documents that were not converted.
+
+    Raises:
+        LibreOfficeError if soffice itself fails.
+    """
+    existing = [path for path in docx_paths if os.path.exists(path)]
+    if existing:
+        _run_soffice(existing, output_dir, timeout)
+
+    converted: Dict[str, Optional[str]] = {}
+    for docx_path in docx_paths:
+        pdf_path = _expected_pdf_path(docx_path, output_dir)
+        if docx_path in existing and os.path.exists(pdf_path):
+            strip_volatile_metadata(pdf_path)
+            converted[docx_path] = pdf_path
+        else:
+            converted[docx_path] = None
+    logger.info(f"Batch PDF conversion: {sum(1 for p in converted.values() if p)}/{len(docx_paths)} converted")
+    return converted
+
+
+def convert_docx_bytes_to_pdf(
+    docx_content: bytes,
+    name: str,
+    timeout: float = PDF_CONVERT_TIMEOUT_SECONDS,
+    scratch_dir: str = PDF_SCRATCH_DIR,
+) -> bytes:
+    """
+    Convert an in-memory DOCX to PDF bytes.
+
+    The DOCX, the PDF and the LibreOffice profile all live in a private directory
+    under scratch_dir (tmpfs by default) that is removed afterwards, so nothing
+    touches persistent disk.
+
+    Args:
+        docx_content: The DOCX bytes.
+        name: Base name for the scratch files (no extension).
+        timeout: Seconds before soffice is killed.
+        scratch_dir: Directory for the scratch area.
+
+    Returns:
+        The PDF bytes, with volatile metadata blanked.
+
+    Raises:
+        LibreOfficeError on any failure.
+    """
+    work_dir = tempfile.mkdtemp(prefix="pdf_scratch_", dir=scratch_dir)
+    try:
+        docx_path = os.path.join(work_dir, f"{name}.docx")
+        with open(docx_path, "wb") as f:
+            f.write(docx_content)
+        _run_soffice([docx_path], work_dir, timeout, profile_root=work_dir)
+        pdf_path = _expected_pdf_path(docx_path, work_dir)
+        if not os.path.exists(pdf_path):
+            raise LibreOfficeError(f"PDF file was not created. Expected: {pdf_path}")
+        with open(pdf_path, "rb") as f:
+            content = strip_volatile_metadata_bytes(f.read())
+        logger.info(f"PDF created in memory: {name}.pdf ({len(content):,} bytes)")
+        return content
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _run_soffice(docx_paths: List[str], output_dir: str, timeout: float, profile_root: str = "/tmp") -> None:
+    """Run one headless LibreOffice conversion of docx_paths into output_dir."""
     os.makedirs(output_dir, exist_ok=True)
 
     # Create a unique temporary profile directory per invocation
     # to avoid LibreOffice lock contention on concurrent requests.
     # Use /tmp so it works in containers where HOME may not be writable.
-    user_install_dir = tempfile.mkdtemp(prefix="lo_profile_", dir="/tmp")
+    user_install_dir = tempfile.mkdtemp(prefix="lo_profile_", dir=profile_root)
 
     cmd = [
         LIBREOFFICE_BIN,
@@ -55,7 +173,7 @@ def convert_to_pdf(docx_path: str, output_dir: str) -> str:
         f"-env:UserInstallation=file://{user_install_dir}",
         "--convert-to", "pdf",
         "--outdir", output_dir,
-        docx_path,
+        *docx_paths,
     ]
 
     # Build a clean environment that prevents any X11/display probing.
@@ -80,7 +198,7 @@ def convert_to_pdf(docx_path: str, output_dir: str) -> str:
             cmd,
             capture_output=True,
             text=True,
-            timeout=180,  # 3 minutes for large documents
+            timeout=timeout,
             env=env,
         )
 
@@ -99,7 +217,7 @@ def convert_to_pdf(docx_path: str, output_dir: str) -> str:
             "Install LibreOffice or set LIBREOFFICE_BIN env var."
         )
     except subprocess.TimeoutExpired:
-        raise LibreOfficeError("LibreOffice conversion timed out after 180 seconds")
+        raise LibreOfficeError(f"LibreOffice conversion timed out after {timeout:.0f} seconds")
     finally:
         # Always clean up the temporary profile directory
         try:
@@ -107,18 +225,42 @@ def convert_to_pdf(docx_path: str, output_dir: str) -> str:
         except Exception:
             pass
 
-    # Locate the generated PDF
-    pdf_path = _expected_pdf_path(docx_path, output_dir)
-    if not os.path.exists(pdf_path):
-        # LibreOffice sometimes outputs a slightly different name; find newest PDF
-        candidates = list(Path(output_dir).glob("*.pdf"))
-        if not candidates:
-            raise LibreOfficeError(f"PDF file was not created. Expected: {pdf_path}")
-        pdf_path = str(max(candidates, key=lambda p: p.stat().st_mtime))
 
-    file_size = os.path.getsize(pdf_path)
-    logger.info(f"PDF created successfully: {pdf_path} ({file_size:,} bytes)")
-    return pdf_path
+def strip_volatile_metadata(pdf_path: str) -> bool:
+    """
+    Blank the creation/modification dates and document ID of a PDF in place.
+
+    Returns:
+        True if anything was changed.
+    """
+    with open(pdf_path, "rb") as f:
+        content = f.read()
+    stripped = strip_volatile_metadata_bytes(content)
+    if stripped == content:
+        return False
+    with open(pdf_path, "wb") as f:
+        f.write(stripped)
+    return True
+
+
+def strip_volatile_metadata_bytes(content: bytes) -> bytes:
+    """strip_volatile_metadata() for PDF bytes held in memory."""
+    def blank(match: re.Match) -> bytes:
+        field = bytearray(match.group(0))
+        start = match.start()
+        for group in range(1, (match.lastindex or 0) + 1):
+            length = len(match.group(group))
+            if match.group(group).startswith(b"D:"):
+                value = b"D:19800101000000+00'00'".ljust(length)[:length]
+            else:
+                value = b"0" * length
+            field[match.start(group) - start:match.end(group) - start] = value
+        return bytes(field)
+
+    stripped = content
+    for pattern in _VOLATILE_PDF_FIELDS:
+        stripped = pattern.sub(blank, stripped)
+    return stripped
 
 
 def _expected_pdf_path(docx_path: str, output_dir: str) -> str:
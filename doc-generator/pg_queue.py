@@ -0,0 +1,462 @@
+"""
+Optional Postgres-backed job queue shared by all replicas.
+
+Set JOBS_DATABASE_URL to switch POST /jobs from the in-process queue (jobs.py)
+to a `docgen_jobs` table. Any replica's workers claim the next job with
+`FOR UPDATE SKIP LOCKED`, highest priority first (per-product priorities from
+JOBS_PRODUCT_PRIORITY), and hold a lease that a heartbeat extends while the job
+runs. If a worker dies its lease expires and another replica reclaims the job,
+up to JOBS_PG_MAX_ATTEMPTS attempts; a worker that loses its lease stops work.
+
+Requires psycopg 3 (`pip install "psycopg[binary]"`), imported lazily so the
+service still starts without it when the queue is not enabled.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import metrics
+from executors import run_in
+from jobs import Job, JobError, JobManager, QUEUED, RUNNING, SUCCEEDED, FAILED
+
+logger = logging.getLogger(__name__)
+
+JOBS_DATABASE_URL = os.environ.get("JOBS_DATABASE_URL", "")
+JOBS_PG_TABLE = os.environ.get("JOBS_PG_TABLE", "docgen_jobs")
+JOBS_PG_LEASE_SECONDS = float(os.environ.get("JOBS_PG_LEASE_SECONDS", "60"))
+JOBS_PG_HEARTBEAT_SECONDS = float(os.environ.get("JOBS_PG_HEARTBEAT_SECONDS", "15"))
+JOBS_PG_POLL_SECONDS = float(os.environ.get("JOBS_PG_POLL_SECONDS", "1"))
+JOBS_PG_MAX_ATTEMPTS = int(os.environ.get("JOBS_PG_MAX_ATTEMPTS", "3"))
+# Claim order between products, as "PRODUCT=priority,..." (higher first)
+JOBS_PRODUCT_PRIORITY = os.environ.get("JOBS_PRODUCT_PRIORITY", "RAMS=0,CPP=0")
+
+_COLUMNS = (
+    "id, submission_id, product, priority, payload, status, stage, progress, attempts, "
+    "worker_id, error, error_code, result, created_at, started_at, finished_at, deadline_at"
+)
+
+
+def parse_priorities(spec: str) -> Dict[str, int]:
+    """Parse "RAMS=10,CPP=0" into {"RAMS": 10, "CPP": 0}, ignoring malformed entries."""
+    priorities = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        try:
+            priorities[name.strip().upper()] = int(value)
+        except ValueError:
+            continue
+    return priorities
+
+
+class PgQueueError(Exception):
+    """Raised when the Postgres queue is misconfigured or unavailable."""
+    pass
+
+
+class PgTable:
+    """
+    One table on a shared autocommit connection. Queries use {table} (and
+    {claim_index}) placeholders, filled in as quoted identifiers.
+    """
+
+    def __init__(self, database_url: str, table: str):
+        if not database_url:
+            raise PgQueueError("No database URL configured")
+        self.database_url = database_url
+        self.table = table
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            # Import here to avoid startup errors if library not installed
+            import psycopg
+            from psycopg.rows import dict_row
+        except ImportError:
+            raise PgQueueError('psycopg is not installed (pip install "psycopg[binary]")')
+        return psycopg.connect(self.database_url, autocommit=True, row_factory=dict_row)
+
+    def _execute(self, query: str, params: tuple = (), fetch: str = "none", idempotent: bool = False):
+        """
+        Run one statement on the shared connection, reconnecting once if it dropped.
+
+        A statement that reached the server may have committed before the
+        connection dropped, so it is only sent again when the caller marks it
+        idempotent; otherwise only a failure while connecting is retried.
+        """
+        from psycopg import OperationalError, sql
+
+        statement = sql.SQL(query).format(
+            table=sql.Identifier(self.table),
+            claim_index=sql.Identifier(f"{self.table}_claim_idx"),
+        )
+        with self._lock:
+            for attempt in range(2):
+                sent = False
+                try:
+                    if self._conn is None or self._conn.closed:
+                        self._conn = self._connect()
+                    with self._conn.cursor() as cur:
+                        sent = True
+                        cur.execute(statement, params)
+                        if fetch == "one":
+                            return cur.fetchone()
+                        if fetch == "all":
+                            return cur.fetchall()
+                        return cur.rowcount
+                except OperationalError:
+                    self._conn = None
+                    if attempt or (sent and not idempotent):
+                        raise
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+
+class PgJobQueue(PgTable):
+    """
+    Jobs table operations. Every method is a single autocommit statement, so the
+    queue stays consistent if a replica dies between calls.
+
+    Args:
+        database_url: Postgres connection string.
+        table: Jobs table name (created by ensure_schema).
+        lease_seconds: Lease granted on claim and on each heartbeat.
+        max_attempts: Claims allowed before a job whose lease keeps expiring is failed.
+        product_priority: Priority per product (higher is claimed first).
+    """
+
+    def __init__(
+        self,
+        database_url: str = JOBS_DATABASE_URL,
+        table: str = JOBS_PG_TABLE,
+        lease_seconds: float = JOBS_PG_LEASE_SECONDS,
+        max_attempts: int = JOBS_PG_MAX_ATTEMPTS,
+        product_priority: Optional[Dict[str, int]] = None,
+    ):
+        super().__init__(database_url, table)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.product_priority = (
+            parse_priorities(JOBS_PRODUCT_PRIORITY) if product_priority is None else product_priority
+        )
+
+    # --- schema ---
+
+    def ensure_schema(self) -> None:
+        """Create the jobs table and claim index if they don't exist."""
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id text PRIMARY KEY,
+                submission_id text NOT NULL,
+                product text,
+                priority integer NOT NULL DEFAULT 0,
+                payload jsonb NOT NULL,
+                status text NOT NULL DEFAULT 'queued',
+                stage jsonb NOT NULL DEFAULT '[]',
+                progress real NOT NULL DEFAULT 0,
+                attempts integer NOT NULL DEFAULT 0,
+                worker_id text,
+                lease_expires_at timestamptz,
+                heartbeat_at timestamptz,
+                deadline_at timestamptz NOT NULL,
+                result jsonb,
+                error text,
+                error_code integer,
+                created_at timestamptz NOT NULL DEFAULT now(),
+                started_at timestamptz,
+                finished_at timestamptz
+            )
+        """, idempotent=True)
+        self._execute(
+            "CREATE INDEX IF NOT EXISTS {claim_index} "
+            "ON {table} (priority DESC, created_at) WHERE status IN ('queued', 'running')",
+            idempotent=True,
+        )
+
+    # --- producer side ---
+
+    def enqueue(self, payload: Dict[str, Any], deadline_seconds: float, product: Optional[str] = None) -> str:
+        """Insert a queued job and return its id."""
+        job_id = uuid.uuid4().hex
+        product = (product or "").upper() or None
+        priority = self.product_priority.get(product, 0) if product else 0
+        self._execute(
+            "INSERT INTO {table} (id, submission_id, product, priority, payload, deadline_at) "
+            "VALUES (%s, %s, %s, %s, %s, now() + make_interval(secs => %s))",
+            (job_id, payload["submission_id"], product, priority, json.dumps(payload), deadline_seconds),
+        )
+        metrics.counter("jobs_submitted_total", backend="postgres").inc()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job state in the same shape as jobs.Job.to_dict()."""
+        row = self._execute(
+            f"SELECT {_COLUMNS}, GREATEST(0, EXTRACT(EPOCH FROM deadline_at - now())) AS deadline_in "
+            "FROM {table} WHERE id = %s",
+            (job_id,),
+            fetch="one",
+            idempotent=True,
+        )
+        if row is None:
+            return None
+        active = row["status"] in (QUEUED, RUNNING)
+        return {
+            "job_id": row["id"],
+            "submission_id": row["submission_id"],
+            "status": row["status"],
+            "stage": row["stage"] or [],
+            "progress": round(row["progress"], 3),
+            "created_at": row["created_at"].isoformat(),
+            "started_at": row["started_at"].isoformat() if row["started_at"] else None,
+            "finished_at": row["finished_at"].isoformat() if row["finished_at"] else None,
+            "deadline_in_seconds": round(float(row["deadline_in"]), 1) if active else None,
+            "error": row["error"],
+            "error_code": row["error_code"],
+            "result": row["result"],
+        }
+
+    def queue_depth(self) -> int:
+        row = self._execute("SELECT count(*) AS n FROM {table} WHERE status = 'queued'", fetch="one", idempotent=True)
+        return row["n"]
+
+    # --- worker side ---
+
+    def reap(self) -> int:
+        """
+        Expire queued jobs past their deadline and fail jobs whose lease has expired
+        max_attempts times. Returns the number of jobs changed.
+        """
+        expired = self._execute(
+            "UPDATE {table} SET status = 'expired', error = 'Deadline passed while queued', "
+            "error_code = 504, finished_at = now() "
+            "WHERE status = 'queued' AND deadline_at < now()",
+            idempotent=True,
+        )
+        abandoned = self._execute(
+            "UPDATE {table} SET status = 'failed', error_code = 500, finished_at = now(), "
+            "error = 'Worker lease expired ' || attempts || ' times', lease_expires_at = NULL "
+            "WHERE status = 'running' AND lease_expires_at < now() "
+            "AND (attempts >= %s OR deadline_at < now())",
+            (self.max_attempts,),
+            idempotent=True,
+        )
+        if expired or abandoned:
+            metrics.counter("jobs_reaped_total", backend="postgres").inc(expired + abandoned)
+            logger.info(f"Job reaper: {expired} expired while queued, {abandoned} abandoned")
+        return expired + abandoned
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Claim the highest-priority runnable job: queued, or running with an expired
+        lease (its worker died). Concurrent claimers skip each other's rows.
+        """
+        row = self._execute(
+            "UPDATE {table} SET status = 'running', worker_id = %s, attempts = attempts + 1, "
+            "lease_expires_at = now() + make_interval(secs => %s), heartbeat_at = now(), "
+            "started_at = COALESCE(started_at, now()), stage = '[]', progress = 0 "
+            "WHERE id = ("
+            "  SELECT id FROM {table} "
+            "  WHERE (status = 'queued' OR (status = 'running' AND lease_expires_at < now())) "
+            "    AND attempts < %s AND deadline_at > now() "
+            "  ORDER BY priority DESC, created_at "
+            "  LIMIT 1 FOR UPDATE SKIP LOCKED"
+            ") "
+            "RETURNING id, payload, attempts, GREATEST(0, EXTRACT(EPOCH FROM deadline_at - now())) AS deadline_in",
+            (worker_id, self.lease_seconds, self.max_attempts),
+            fetch="one",
+        )
+        if row is not None and row["attempts"] > 1:
+            metrics.counter("jobs_reclaimed_total", backend="postgres").inc()
+            logger.warning(f"Job {row['id']} reclaimed by {worker_id} (attempt {row['attempts']})")
+        return row
+
+    def heartbeat(self, job_id: str, worker_id: str, stage: List[str], progress: float) -> bool:
+        """Extend the lease and publish progress. False means the lease was lost."""
+        return self._execute(
+            "UPDATE {table} SET lease_expires_at = now() + make_interval(secs => %s), heartbeat_at = now(), "
+            "stage = %s, progress = %s "
+            "WHERE id = %s AND worker_id = %s AND status = 'running'",
+            (self.lease_seconds, json.dumps(stage), progress, job_id, worker_id),
+            idempotent=True,
+        ) == 1
+
+    def complete(
+        self,
+        job_id: str,
+        worker_id: str,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+        error_code: Optional[int] = None,
+    ) -> bool:
+        """Record the outcome. False if another worker owns the job now."""
+        done = self._execute(
+            "UPDATE {table} SET status = %s, result = %s, error = %s, error_code = %s, "
+            "progress = CASE WHEN %s = 'succeeded' THEN 1 ELSE progress END, "
+            "stage = '[]', finished_at = now(), lease_expires_at = NULL "
+            "WHERE id = %s AND worker_id = %s AND status = 'running'",
+            (status, json.dumps(result) if result is not None else None, error, error_code, status,
+             job_id, worker_id),
+        ) == 1
+        if done:
+            metrics.counter("jobs_finished_total", status=status, backend="postgres").inc()
+        return done
+
+
+class PgJobWorkers:
+    """
+    Async workers that claim jobs from a PgJobQueue and run them.
+
+    Args:
+        queue: The shared queue.
+        runner: Same runner as JobManager: runner(job, stage_limits) -> result dict.
+        workers: Concurrent jobs on this replica.
+        stage_limits: Per-stage semaphore provider (JobManager.stage_limits).
+        heartbeat_seconds / poll_seconds: Lease refresh and idle poll intervals.
+    """
+
+    def __init__(
+        self,
+        queue: PgJobQueue,
+        runner: Callable[..., Awaitable[Dict[str, Any]]],
+        workers: int,
+        stage_limits: Callable,
+        heartbeat_seconds: float = JOBS_PG_HEARTBEAT_SECONDS,
+        poll_seconds: float = JOBS_PG_POLL_SECONDS,
+    ):
+        self.queue = queue
+        self.runner = runner
+        self.workers = workers
+        self.stage_limits = stage_limits
+        self.heartbeat_seconds = heartbeat_seconds
+        self.poll_seconds = poll_seconds
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.ensure_future(self._worker(f"{self.worker_prefix}:{i}")) for i in range(self.workers)]
+        logger.info(f"Postgres job workers started: {self.workers} on {self.worker_prefix}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, worker_id: str) -> None:
+        while True:
+            try:
+                await run_in("io", self.queue.reap)
+                row = await run_in("io", self.queue.claim, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {worker_id}: queue unavailable: {e}")
+                row = None
+            if row is None:
+                await asyncio.sleep(self.poll_seconds)
+                continue
+            try:
+                await self._run(worker_id, row)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep the worker alive; the job's lease expires and it is reclaimed
+                logger.exception(f"Job worker {worker_id}: job {row.get('id')} crashed the worker: {e}")
+
+    async def _run(self, worker_id: str, row: Dict[str, Any]) -> None:
+        job = Job(row["payload"], float(row["deadline_in"]))
+        job.id = row["id"]
+        job.status = RUNNING
+        work = asyncio.ensure_future(
+            asyncio.wait_for(self.runner(job, self.stage_limits), timeout=job.deadline - time.monotonic())
+        )
+        lease_lost = False
+        while not work.done():
+            try:
+                await asyncio.wait([work], timeout=self.heartbeat_seconds)
+            except asyncio.CancelledError:
+                # Shutting down: stop the work; the lease expires and another replica retries it
+                work.cancel()
+                raise
+            if work.done():
+                break
+            try:
+                held = await run_in("io", self.queue.heartbeat, job.id, worker_id, list(job.stages), job.progress)
+            except Exception as e:
+                logger.warning(f"Job {job.id}: heartbeat failed ({e}); keeping work until the lease runs out")
+                continue
+            if not held:
+                lease_lost = True
+                logger.error(f"Job {job.id}: lease lost to another worker, stopping")
+                work.cancel()
+                break
+
+        status, result, error, code = SUCCEEDED, None, None, None
+        try:
+            result = await work
+        except asyncio.CancelledError:
+            if not lease_lost:
+                raise
+        except asyncio.TimeoutError:
+            status, error, code = FAILED, "Deadline exceeded while running", 504
+        except JobError as e:
+            status, error, code = FAILED, str(e), e.status_code
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed: {e}")
+            status, error, code = FAILED, str(e), 500
+        if lease_lost:
+            return
+        try:
+            await run_in("io", self.queue.complete, job.id, worker_id, status, result, error, code)
+        except Exception as e:
+            logger.error(f"Job {job.id}: could not record the result ({e}); the lease will expire and it is retried")
+
+
+class PgJobBackend:
+    """POST /jobs and GET /jobs/{id} on top of the Postgres queue (same interface as main uses for JobManager)."""
+
+    def __init__(self, queue: PgJobQueue, workers: PgJobWorkers, deadline_seconds: float):
+        self.queue = queue
+        self.workers = workers
+        self.deadline_seconds = deadline_seconds
+
+    def start(self) -> None:
+        self.workers.start()
+
+    async def stop(self) -> None:
+        await self.workers.stop()
+        self.queue.close()
+
+    async def submit(self, payload: Dict[str, Any], deadline_seconds: Optional[float] = None,
+                     product: Optional[str] = None) -> Dict[str, Any]:
+        job_id = await run_in("io", self.queue.enqueue, payload, deadline_seconds or self.deadline_seconds, product)
+        return {"job_id": job_id, "status": QUEUED}
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await run_in("io", self.queue.get, job_id)
+
+
+def create_backend(runner: Callable[..., Awaitable[Dict[str, Any]]], manager: JobManager) -> Optional[PgJobBackend]:
+    """Postgres job backend when JOBS_DATABASE_URL is set, else None (use the in-process JobManager)."""
+    if not JOBS_DATABASE_URL:
+        return None
+    queue = PgJobQueue()
+    queue.ensure_schema()
+    workers = PgJobWorkers(queue, runner, manager.workers, manager.stage_limits)
+    logger.info(f"Jobs use the Postgres queue (table {queue.table})")
+    return PgJobBackend(queue, workers, manager.deadline_seconds)
@@ -0,0 +1,195 @@
+"""
+Small stage DAG runner for the generation pipeline.
+
+Each stage names the stages it depends on; a stage starts as soon as all of its
+dependencies have finished, so independent work (AI call, image downloads,
+uploads) overlaps. Stages are coroutines, or blocking callables that run in one
+of the sized pools from executors.py. Per-stage start/end offsets are recorded and the critical path
+is derived from them so slow requests can be explained stage by stage.
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import metrics
+from executors import run_in
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """
+    One unit of pipeline work.
+
+    Args:
+        name: Unique stage name (also the key of its result).
+        fn: Callable (or coroutine function) taking the dict of finished stage results
+            and returning this stage's result.
+        deps: Names of stages that must finish first.
+        executor: Pool for a blocking fn (see executors.py). Ignored for coroutines.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[Dict[str, Any]], Any],
+        deps: Iterable[str] = (),
+        executor: str = "io",
+    ):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.executor = executor
+
+
+class PipelineResult:
+    """Results and timings of a pipeline run."""
+
+    def __init__(self, results: Dict[str, Any], timings: Dict[str, Dict[str, float]], deps: Dict[str, tuple]):
+        self.results = results
+        self.timings = timings
+        self._deps = deps
+
+    @property
+    def critical_path(self) -> List[str]:
+        """Chain of stages that determined end-to-end latency, first to last."""
+        if not self.timings:
+            return []
+        current = max(self.timings, key=lambda name: self.timings[name]["end"])
+        path = [current]
+        while True:
+            finished_deps = [d for d in self._deps.get(current, ()) if d in self.timings]
+            if not finished_deps:
+                break
+            current = max(finished_deps, key=lambda name: self.timings[name]["end"])
+            path.append(current)
+        return list(reversed(path))
+
+    def timings_summary(self) -> Dict[str, Dict[str, float]]:
+        """Timings rounded for API responses and logs (seconds from pipeline start)."""
+        return {
+            name: {k: round(v, 3) for k, v in timing.items()}
+            for name, timing in sorted(self.timings.items(), key=lambda item: item[1]["start"])
+        }
+
+
+class StagePipeline:
+    """
+    Runs a set of stages respecting their dependencies, concurrently where possible.
+
+    Args:
+        stages: The stages.
+        name: Pipeline name for logs and metrics.
+        limits: Optional semaphores by stage name; a stage holds its semaphore while it
+            runs, so sharing one semaphore across runs caps that stage's concurrency.
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        name: str = "pipeline",
+        limits: Optional[Dict[str, asyncio.Semaphore]] = None,
+    ):
+        self.stages = {stage.name: stage for stage in stages}
+        self.name = name
+        self.limits = limits or {}
+        for stage in stages:
+            missing = [d for d in stage.deps if d not in self.stages]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {missing}")
+
+    def run(self, results: Optional[Dict[str, Any]] = None) -> PipelineResult:
+        """Blocking wrapper around run_async() for callers outside an event loop."""
+        return asyncio.run(self.run_async(results))
+
+    async def run_async(
+        self,
+        results: Optional[Dict[str, Any]] = None,
+        on_stage: Optional[Callable[[str, str, int, int], None]] = None,
+    ) -> PipelineResult:
+        """
+        Run all stages.
+
+        Args:
+            results: Optional pre-populated results (stages already done are skipped).
+            on_stage: Optional progress callback, called as
+                on_stage(stage_name, "start" | "end", stages_done, stages_total).
+
+        Returns:
+            PipelineResult with each stage's return value and timing.
+
+        Raises:
+            The first exception raised by a stage (remaining stages are cancelled).
+        """
+        results = dict(results or {})
+        timings: Dict[str, Dict[str, float]] = {}
+        deps = {name: stage.deps for name, stage in self.stages.items()}
+        remaining = {name for name in self.stages if name not in results}
+        running: Dict[asyncio.Task, str] = {}
+        started = time.monotonic()
+
+        def notify(name: str, event: str) -> None:
+            if on_stage is None:
+                return
+            try:
+                on_stage(name, event, len(timings), len(self.stages))
+            except Exception as e:
+                logger.warning(f"Pipeline {self.name}: progress callback failed: {e}")
+
+        async def execute(stage: Stage) -> Any:
+            limit = self.limits.get(stage.name)
+            if limit is not None:
+                waited = time.monotonic()
+                await limit.acquire()
+                metrics.histogram("stage_slot_wait_seconds", pipeline=self.name, stage=stage.name).observe(
+                    time.monotonic() - waited
+                )
+            stage_started = time.monotonic()
+            notify(stage.name, "start")
+            try:
+                if asyncio.iscoroutinefunction(stage.fn):
+                    return await stage.fn(results)
+                return await run_in(stage.executor, stage.fn, results)
+            finally:
+                stage_ended = time.monotonic()
+                timings[stage.name] = {
+                    "start": stage_started - started,
+                    "end": stage_ended - started,
+                    "duration": stage_ended - stage_started,
+                }
+                metrics.histogram("stage_seconds", pipeline=self.name, stage=stage.name).observe(
+                    stage_ended - stage_started
+                )
+                if limit is not None:
+                    limit.release()
+                notify(stage.name, "end")
+
+        try:
+            while remaining or running:
+                ready = [n for n in remaining if all(d in results for d in self.stages[n].deps)]
+                for name in ready:
+                    remaining.discard(name)
+                    running[asyncio.ensure_future(execute(self.stages[name]))] = name
+
+                if not running:
+                    raise RuntimeError(f"Pipeline '{self.name}' cannot make progress: {sorted(remaining)}")
+
+                done, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    # Raises the stage's own exception so callers can handle specific types
+                    results[name] = task.result()
+        except BaseException:
+            for task in running:
+                task.cancel()
+            raise
+
+        result = PipelineResult(results, timings, deps)
+        total = time.monotonic() - started
+        metrics.histogram("pipeline_seconds", pipeline=self.name).observe(total)
+        logger.info(
+            f"Pipeline {self.name} finished in {total:.2f}s; critical path: {' -> '.join(result.critical_path)}"
+        )
+        return result
@@ -0,0 +1,143 @@
+"""
+Prompt size accounting and user-context compaction.
+
+Token counts are estimated locally (no tokenizer download): words are split into
+~4-character pieces and punctuation counts as one token each, which tracks
+BPE tokenizers closely enough for budgeting and reporting.
+"""
+
+import re
+import logging
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+
+# Header lines built by main.py that must survive compaction
+_HEADER_PREFIXES = ("Project:", "Duration:", "User indicated:")
+
+# Sentences mentioning these are kept first when the description has to be cut
+_PRIORITY_KEYWORDS = (
+    "hazard", "risk", "height", "excavat", "crane", "lift", "asbestos", "demolition",
+    "live", "public", "road", "scaffold", "confined", "hot work", "electrical", "plant",
+    "service", "occupied", "fragile", "roof", "temporary works",
+)
+
+TRIM_MARKER = "[... description trimmed to fit prompt budget]"
+
+# Size classes used to label latency metrics
+PROMPT_SIZE_CLASSES = ((1000, "<1k"), (2000, "1k-2k"), (4000, "2k-4k"), (8000, "4k-8k"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of text."""
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        tokens += max(1, (len(piece) + 3) // 4)
+    return tokens
+
+
+def prompt_size_class(tokens: int) -> str:
+    """Bucket a token count into a label such as "1k-2k"."""
+    for bound, label in PROMPT_SIZE_CLASSES:
+        if tokens < bound:
+            return label
+    return ">8k"
+
+
+def _normalise(text: str) -> str:
+    """Collapse runs of whitespace and drop repeated lines (common in pasted text)."""
+    lines = []
+    seen = set()
+    for line in text.splitlines():
+        line = re.sub(r"[ \t]+", " ", line).strip()
+        key = line.lower()
+        if line and key in seen:
+            continue
+        if line:
+            seen.add(key)
+        lines.append(line)
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def _summarise(body: str, max_tokens: int) -> str:
+    """
+    Extractive summary: keep opening sentences and sentences with hazard keywords,
+    in their original order, until the token budget is used.
+    """
+    sentences = [s.strip() for s in _SENTENCE_SPLIT.split(body) if s and s.strip()]
+    budget = max_tokens - estimate_tokens(TRIM_MARKER)
+
+    def priority(index_sentence):
+        index, sentence = index_sentence
+        lowered = sentence.lower()
+        hits = sum(1 for kw in _PRIORITY_KEYWORDS if kw in lowered)
+        # First two sentences usually state the activity - always rank them first
+        return (0 if index < 2 else 1, -hits, index)
+
+    chosen: List[int] = []
+    used = 0
+    for index, sentence in sorted(enumerate(sentences), key=priority):
+        cost = estimate_tokens(sentence)
+        if used + cost > budget:
+            continue
+        chosen.append(index)
+        used += cost
+
+    if not chosen and sentences:
+        # A single giant sentence: hard-truncate by words
+        words = sentences[0].split()
+        kept = []
+        for word in words:
+            used += estimate_tokens(word)
+            if used > budget:
+                break
+            kept.append(word)
+        return " ".join(kept) + f"\n{TRIM_MARKER}"
+
+    return " ".join(sentences[i] for i in sorted(chosen)) + f"\n{TRIM_MARKER}"
+
+
+def compact_context(context: str, max_tokens: int) -> str:
+    """
+    Fit user context into max_tokens.
+
+    Whitespace and duplicate lines are removed first. If it is still too long, the
+    header lines (Project/Duration/User indicated) are kept verbatim and the free
+    text is reduced to an extractive summary.
+
+    Args:
+        context: User context built by main.py.
+        max_tokens: Token budget for the context (<= 0 disables compaction).
+
+    Returns:
+        The (possibly) compacted context.
+    """
+    if max_tokens <= 0 or estimate_tokens(context) <= max_tokens:
+        return context
+
+    original_tokens = estimate_tokens(context)
+    context = _normalise(context)
+    if estimate_tokens(context) <= max_tokens:
+        logger.info(f"Prompt context normalised: {original_tokens} -> {estimate_tokens(context)} tokens")
+        return context
+
+    header_lines = []
+    body_lines = []
+    for line in context.splitlines():
+        if not body_lines and (line.startswith(_HEADER_PREFIXES) or not line.strip()):
+            header_lines.append(line)
+        else:
+            body_lines.append(line)
+
+    header = "\n".join(header_lines).strip()
+    body = "\n".join(body_lines).strip()
+    body_budget = max(32, max_tokens - estimate_tokens(header))
+    compacted = f"{header}\n\n{_summarise(body, body_budget)}" if header else _summarise(body, body_budget)
+
+    logger.info(f"Prompt context compacted: {original_tokens} -> {estimate_tokens(compacted)} tokens (budget {max_tokens})")
+    return compacted
@@ -0,0 +1,227 @@
+"""
+Adaptive rate limiter for the shared OpenRouter key.
+
+A token bucket whose refill rate is tuned AIMD-style: every successful call nudges
+the rate up, every 429 cuts it and pauses the bucket for the provider's Retry-After.
+Rate-limit headers (X-RateLimit-Remaining / X-RateLimit-Reset) pause the bucket
+before the provider has to reject us. Callers that cannot get a token straight
+away wait in a FIFO queue with a deadline instead of failing.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+AI_RATE_LIMIT_INITIAL_RPS = float(os.environ.get("AI_RATE_LIMIT_INITIAL_RPS", "0.33"))  # ~20/min free tier
+AI_RATE_LIMIT_MIN_RPS = float(os.environ.get("AI_RATE_LIMIT_MIN_RPS", "0.05"))
+AI_RATE_LIMIT_MAX_RPS = float(os.environ.get("AI_RATE_LIMIT_MAX_RPS", "2"))
+AI_RATE_LIMIT_BURST = float(os.environ.get("AI_RATE_LIMIT_BURST", "3"))
+
+
+class RateLimitTimeout(TimeoutError):
+    """Raised when a caller's deadline passes while it is queued for a token."""
+    pass
+
+
+def _header(headers: Mapping[str, str], name: str) -> Optional[str]:
+    if headers is None:
+        return None
+    value = headers.get(name)
+    if value is None:
+        value = headers.get(name.lower())
+    return value
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to wait from Retry-After / retry-after-ms, or None if absent."""
+    value = _header(headers, "retry-after-ms")
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000.0)
+        except ValueError:
+            pass
+    value = _header(headers, "retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def parse_reset_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds until an X-RateLimit-Reset value. Providers send epoch milliseconds
+    (OpenRouter), epoch seconds, or a relative number of seconds.
+    """
+    if value is None:
+        return None
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    if reset > 1e12:
+        return max(0.0, reset / 1000.0 - time.time())
+    if reset > 1e9:
+        return max(0.0, reset - time.time())
+    return max(0.0, reset)
+
+
+class AdaptiveRateLimiter:
+    """Token bucket with AIMD rate learning and a FIFO wait queue."""
+
+    def __init__(
+        self,
+        initial_rate: float = AI_RATE_LIMIT_INITIAL_RPS,
+        min_rate: float = AI_RATE_LIMIT_MIN_RPS,
+        max_rate: float = AI_RATE_LIMIT_MAX_RPS,
+        burst: float = AI_RATE_LIMIT_BURST,
+        increase_step: float = 0.02,
+        decrease_factor: float = 0.5,
+        name: str = "openrouter",
+    ):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.name = name
+        self._rate = min(max(initial_rate, min_rate), max_rate)
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._queue = deque()
+        self._next_ticket = 0
+        self._cond = threading.Condition()
+        metrics.gauge("ai_rate_limit_rps", limiter=name).set(self._rate)
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def acquire(self, deadline: Optional[float] = None) -> float:
+        """
+        Block until a token is available, in arrival order.
+
+        Args:
+            deadline: Optional time.monotonic() value; waiting past it raises.
+
+        Returns:
+            Seconds spent waiting.
+
+        Raises:
+            RateLimitTimeout if the deadline passes first.
+        """
+        started = time.monotonic()
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._queue.append(ticket)
+            self._publish_depth()
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    at_head = self._queue[0] == ticket
+                    if at_head and now >= self._blocked_until and self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+
+                    wait_for = None
+                    if at_head:
+                        wait_for = max(self._blocked_until - now, (1 - self._tokens) / self._rate, 0.001)
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            metrics.counter("ai_rate_limit_timeouts_total", limiter=self.name).inc()
+                            raise RateLimitTimeout(
+                                f"Waited {now - started:.1f}s for a rate limit token ({len(self._queue) - 1} ahead)"
+                            )
+                        wait_for = remaining if wait_for is None else min(wait_for, remaining)
+                    self._cond.wait(timeout=wait_for)
+            finally:
+                self._queue.remove(ticket)
+                self._publish_depth()
+                self._cond.notify_all()
+
+        waited = time.monotonic() - started
+        metrics.histogram("ai_rate_limit_wait_seconds", limiter=self.name).observe(waited)
+        if waited > 1:
+            logger.info(f"Rate limiter {self.name}: waited {waited:.1f}s for a token (rate={self._rate:.3f}/s)")
+        return waited
+
+    def refund(self) -> None:
+        """Give back a token that was acquired but not spent on a request."""
+        with self._cond:
+            self._tokens = min(self.burst, self._tokens + 1)
+            self._cond.notify_all()
+
+    def on_success(self, headers: Optional[Mapping[str, str]] = None) -> None:
+        """Additive increase, plus a pause if the provider says the window is used up."""
+        with self._cond:
+            self._rate = min(self.max_rate, self._rate + self.increase_step)
+            remaining = _header(headers, "x-ratelimit-remaining")
+            reset_in = parse_reset_seconds(_header(headers, "x-ratelimit-reset"))
+            if remaining is not None and reset_in is not None:
+                try:
+                    if float(remaining) < 1:
+                        self._block_for(reset_in)
+                except ValueError:
+                    pass
+            self._publish_rate()
+            self._cond.notify_all()
+
+    def on_rate_limited(self, headers: Optional[Mapping[str, str]] = None) -> float:
+        """
+        Multiplicative decrease after a 429, and pause until Retry-After (or the
+        rate-limit reset, or one token interval at the new rate).
+
+        Returns:
+            Seconds the bucket is paused for.
+        """
+        with self._cond:
+            self._rate = max(self.min_rate, self._rate * self.decrease_factor)
+            self._tokens = 0.0
+            pause = parse_retry_after(headers)
+            if pause is None:
+                pause = parse_reset_seconds(_header(headers, "x-ratelimit-reset"))
+            if pause is None:
+                pause = 1.0 / self._rate
+            self._block_for(pause)
+            self._publish_rate()
+            self._cond.notify_all()
+        metrics.counter("ai_rate_limited_total", limiter=self.name).inc()
+        logger.warning(f"Rate limiter {self.name}: 429 received, rate cut to {self._rate:.3f}/s, pausing {pause:.1f}s")
+        return pause
+
+    def _block_for(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def _refill(self, now: float) -> None:
+        if now < self._blocked_until:
+            # No credit accrues while the provider has us paused
+            self._last_refill = now
+            return
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def _publish_depth(self) -> None:
+        metrics.gauge("ai_rate_limit_queue_depth", limiter=self.name).set(len(self._queue))
+
+    def _publish_rate(self) -> None:
+        metrics.gauge("ai_rate_limit_rps", limiter=self.name).set(self._rate)
@@ -0,0 +1,122 @@
+"""
+Render manifests for incremental re-generation.
+
+Users often fix one field (a phone number, the site address) and regenerate.
+Each completed generation stores a manifest in the submission's outputs: a hash
+per placeholder group, of the uploads, of the AI input and of the template, plus
+the AI content that was used. On the next generation the inputs are diffed
+against it:
+
+- AI input unchanged: the stored AI content is reused and the LLM is skipped.
+- Nothing changed at all: the previous DOCX/PDF (and their URLs) are reused
+  outright; only the submission outputs are rewritten.
+
+Fallback AI content and runs without a PDF are never reused, so a regeneration
+still retries them.
+"""
+
+import os
+import json
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+from ai_fallback import SOURCE_FALLBACK
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_KEY = "render_manifest"
+MANIFEST_VERSION = 1
+
+# template path -> (mtime, sha256)
+_template_hashes: Dict[str, tuple] = {}
+
+
+def _hash(value: Any) -> str:
+    encoded = json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def placeholder_group(key: str) -> str:
+    """Group of a placeholder: its first two name segments (RAMS_SITE_ADDRESS_LINE1 -> RAMS_SITE)."""
+    return "_".join(key.split("_")[:2])
+
+
+def template_hash(template_path: str) -> Optional[str]:
+    if not os.path.exists(template_path):
+        return None
+    mtime = os.path.getmtime(template_path)
+    cached = _template_hashes.get(template_path)
+    if cached is None or cached[0] != mtime:
+        with open(template_path, "rb") as f:
+            cached = (mtime, hashlib.sha256(f.read()).hexdigest()[:16])
+        _template_hashes[template_path] = cached
+    return cached[1]
+
+
+def build_manifest(product: str, placeholders: dict, uploads: dict, ai_input: Any, template_path: str) -> Dict[str, Any]:
+    """
+    Hash the inputs of a generation. Call it before the pipeline edits placeholders.
+
+    Args:
+        product: "CPP" or "RAMS".
+        placeholders / uploads: As stored on the submission.
+        ai_input: Everything the AI content depends on (context and toggles).
+        template_path: Template that will be rendered.
+    """
+    grouped: Dict[str, Dict[str, Any]] = {}
+    for key, value in placeholders.items():
+        grouped.setdefault(placeholder_group(key), {})[key] = value
+    return {
+        "version": MANIFEST_VERSION,
+        "product": product,
+        "template": template_hash(template_path),
+        "ai_input": _hash(ai_input),
+        "uploads": _hash(uploads),
+        "groups": {group: _hash(values) for group, values in sorted(grouped.items())},
+    }
+
+
+def changed_inputs(prior: Optional[Dict[str, Any]], current: Dict[str, Any]) -> List[str]:
+    """
+    Inputs that differ from the prior manifest, e.g. ["RAMS_SITE", "uploads"].
+
+    Returns ["all"] when there is no usable prior manifest.
+    """
+    if not prior or prior.get("version") != MANIFEST_VERSION or prior.get("product") != current["product"]:
+        return ["all"]
+    changed = [key for key in ("template", "ai_input", "uploads") if prior.get(key) != current[key]]
+    prior_groups = prior.get("groups", {})
+    for group in sorted(set(prior_groups) | set(current["groups"])):
+        if prior_groups.get(group) != current["groups"].get(group):
+            changed.append(group)
+    return changed
+
+
+class ReusePlan:
+    """
+    What a regeneration can take from the previous run.
+
+    Args:
+        prior_outputs: The submission's current outputs (may be empty).
+        manifest: Manifest of the inputs being generated now.
+    """
+
+    def __init__(self, prior_outputs: Optional[Dict[str, Any]], manifest: Dict[str, Any]):
+        prior_outputs = prior_outputs or {}
+        prior = prior_outputs.get(MANIFEST_KEY)
+        self.changed = changed_inputs(prior, manifest)
+
+        self.ai_content: Optional[Dict[str, Any]] = None
+        if "all" not in self.changed and "ai_input" not in self.changed:
+            content = prior.get("ai_content")
+            if isinstance(content, dict) and content.get("AI_CONTENT_SOURCE") != SOURCE_FALLBACK:
+                self.ai_content = content
+
+        self.artifacts: Optional[Dict[str, Any]] = None
+        if not self.changed and self.ai_content is not None and prior_outputs.get("status") == "complete" \
+                and prior_outputs.get("docx_url") and prior_outputs.get("pdf_url"):
+            self.artifacts = {
+                key: prior_outputs.get(key)
+                for key in ("docx_path", "pdf_path", "docx_url", "pdf_url", "docx_sha256", "pdf_sha256")
+            }
@@ -0,0 +1,229 @@
+"""
+Process pool for DOCX rendering.
+
+generate_docx is CPU-bound python-docx/lxml work that holds the GIL, so renders
+in one process serialise no matter how many threads call it. This pool runs
+renders in worker processes instead. Each worker parses the CPP/RAMS templates
+once at start-up and deep-copies the parsed document per job (several times
+cheaper than re-reading and re-parsing the .docx).
+
+Crash policy: if a worker dies (BrokenProcessPool) the pool is rebuilt and the
+job retried once. More than RENDER_POOL_MAX_RESTARTS rebuilds within a minute
+marks the pool unhealthy; renders then run in-process until the cooldown ends.
+"""
+
+import io
+import os
+import copy
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Optional, Union
+
+import metrics
+from generator import generate_docx, load_template, render_document, save_document, TemplateNotFoundError
+
+logger = logging.getLogger(__name__)
+
+RENDER_POOL_SIZE = int(os.environ.get("RENDER_POOL_SIZE", str(os.cpu_count() or 2)))  # 0 = render in-process
+RENDER_POOL_MAX_TASKS_PER_WORKER = int(os.environ.get("RENDER_POOL_MAX_TASKS_PER_WORKER", "200"))
+RENDER_POOL_MAX_RESTARTS = int(os.environ.get("RENDER_POOL_MAX_RESTARTS", "3"))
+RENDER_POOL_COOLDOWN_SECONDS = float(os.environ.get("RENDER_POOL_COOLDOWN_SECONDS", "60"))
+
+
+# --- Worker process side -------------------------------------------------------
+
+# template path -> (mtime, parsed Document); one copy per worker process
+_worker_templates: Dict[str, tuple] = {}
+
+
+def _init_worker(template_paths: Iterable[str]) -> None:
+    """Pool initializer: configure logging and parse the templates once."""
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    for path in template_paths:
+        try:
+            _cached_template(path)
+        except TemplateNotFoundError as e:
+            logger.warning(f"Render worker could not preload template: {e}")
+
+
+def _cached_template(template_path: str):
+    mtime = os.path.getmtime(template_path) if os.path.exists(template_path) else None
+    cached = _worker_templates.get(template_path)
+    if cached is None or cached[0] != mtime:
+        # First use, or the template was replaced on disk
+        cached = (mtime, load_template(template_path))
+        _worker_templates[template_path] = cached
+    return cached[1]
+
+
+def _render_job(
+    template_path: str,
+    output_path: Optional[str],
+    placeholders: Dict[str, str],
+    images: Optional[Dict[str, str]],
+    blue_flags: Optional[Dict[str, bool]],
+) -> Union[str, bytes]:
+    """Render one document in a worker. Returns output_path, or the DOCX bytes if output_path is None."""
+    doc = copy.deepcopy(_cached_template(template_path))
+    render_document(doc, placeholders, images, blue_flags)
+    if output_path is None:
+        buffer = io.BytesIO()
+        save_document(doc, buffer)
+        return buffer.getvalue()
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    save_document(doc, output_path)
+    return output_path
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+# --- Parent process side -------------------------------------------------------
+
+class RenderPool:
+    """
+    Pool of pre-warmed render worker processes.
+
+    Args:
+        template_paths: Templates each worker parses at start-up.
+        size: Worker processes (0 renders in the calling process).
+        max_tasks_per_worker: Recycle a worker after this many jobs (bounds leaks).
+        max_restarts: Rebuilds allowed per minute before falling back to in-process renders.
+        cooldown_seconds: How long to stay on the in-process fallback.
+    """
+
+    def __init__(
+        self,
+        template_paths: Iterable[str],
+        size: int = RENDER_POOL_SIZE,
+        max_tasks_per_worker: int = RENDER_POOL_MAX_TASKS_PER_WORKER,
+        max_restarts: int = RENDER_POOL_MAX_RESTARTS,
+        cooldown_seconds: float = RENDER_POOL_COOLDOWN_SECONDS,
+    ):
+        self.template_paths = list(template_paths)
+        self.size = size
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_restarts = max_restarts
+        self.cooldown_seconds = cooldown_seconds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._generation = 0
+        self._restarts = []
+        self._unhealthy_until = 0.0
+        self._lock = threading.Lock()
+        metrics.gauge("render_pool_size").set(size)
+
+    def _create(self) -> ProcessPoolExecutor:
+        # spawn: forking a process that already runs event-loop and pool threads is unsafe
+        return ProcessPoolExecutor(
+            max_workers=self.size,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.template_paths,),
+            max_tasks_per_child=self.max_tasks_per_worker or None,
+        )
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create()
+            return self._executor, self._generation
+
+    def warm(self) -> None:
+        """Start every worker now so the first requests don't pay spawn + template parse."""
+        if self.size <= 0:
+            return
+        started = time.monotonic()
+        executor, _ = self._get_executor()
+        pids = {f.result() for f in [executor.submit(_ping) for _ in range(self.size * 2)]}
+        logger.info(f"Render pool warm: {len(pids)} workers in {time.monotonic() - started:.2f}s")
+
+    def _restart(self, generation: int) -> bool:
+        """Rebuild a broken pool. Returns False if the pool should not be used right now."""
+        with self._lock:
+            if generation != self._generation:
+                # Another caller already rebuilt it
+                return True
+            now = time.monotonic()
+            self._restarts = [t for t in self._restarts if now - t < 60] + [now]
+            old, self._executor = self._executor, None
+            self._generation += 1
+            metrics.counter("render_pool_restarts_total").inc()
+            if len(self._restarts) > self.max_restarts:
+                self._unhealthy_until = now + self.cooldown_seconds
+                logger.error(
+                    f"Render pool restarted {len(self._restarts)} times in 60s; "
+                    f"rendering in-process for {self.cooldown_seconds:.0f}s"
+                )
+                self._restarts = []
+                ok = False
+            else:
+                logger.warning("Render worker died; rebuilding render pool")
+                ok = True
+        if old is not None:
+            old.shutdown(wait=False, cancel_futures=True)
+        return ok
+
+    def render(
+        self,
+        template_path: str,
+        output_path: Optional[str],
+        placeholders: Dict[str, str],
+        images: Optional[Dict[str, str]] = None,
+        blue_flags: Optional[Dict[str, bool]] = None,
+    ) -> Union[str, bytes]:
+        """
+        Render a document (blocking; call it from the render executor).
+
+        Args:
+            template_path: Template to fill.
+            output_path: Where to save the DOCX, or None to get the DOCX bytes back.
+            placeholders / images / blue_flags: As for generate_docx.
+
+        Returns:
+            output_path, or the DOCX bytes when output_path is None.
+
+        Raises:
+            TemplateNotFoundError and any render error from the worker.
+        """
+        if not os.path.exists(template_path):
+            raise TemplateNotFoundError(f"Template not found: {template_path}")
+
+        started = time.monotonic()
+        for attempt in range(2):
+            if self.size <= 0 or time.monotonic() < self._unhealthy_until:
+                break
+            executor, generation = self._get_executor()
+            try:
+                result = executor.submit(
+                    _render_job, template_path, output_path, placeholders, images, blue_flags
+                ).result()
+                metrics.histogram("render_seconds", mode="pool").observe(time.monotonic() - started)
+                return result
+            except BrokenProcessPool:
+                if not self._restart(generation):
+                    break
+
+        # Pool disabled or unhealthy: render here
+        result = _render_in_process(template_path, output_path, placeholders, images, blue_flags)
+        metrics.histogram("render_seconds", mode="in_process").observe(time.monotonic() - started)
+        return result
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _render_in_process(template_path, output_path, placeholders, images, blue_flags) -> Union[str, bytes]:
+    if output_path is not None:
+        return generate_docx(template_path, output_path, placeholders, images, blue_flags)
+    doc = render_document(load_template(template_path), placeholders, images, blue_flags)
+    buffer = io.BytesIO()
+    save_document(doc, buffer)
+    return buffer.getvalue()
@@ -0,0 +1,430 @@
+"""
+Fleet re-render after a template change.
+
+When the CPP or RAMS template is updated, documents generated earlier keep the
+old layout, and refreshing them meant one /generate-from-submission call per
+row. POST /rerender runs the submission pipeline over every submission of a
+product instead:
+
+- submissions are read page by page (keyset paging on id);
+- the AI content stored in each render manifest is reused, so no LLM calls are
+  made; rows without reusable content are counted as needs_ai and left alone;
+- rows whose manifest already names the current template are skipped;
+- renders go through the render process pool as usual, while PDF conversions
+  are collected into batches converted by one LibreOffice start each, and
+  outputs are written in batches of concurrent PATCHes;
+- starts are paced to FLEET_MAX_PER_MINUTE, with FLEET_CONCURRENCY rows in
+  flight, and share the per-stage slots of live traffic.
+
+Progress is kept in a local SQLite ledger per (product, template hash): the id
+of the last finished page and the counts so far. A run that is stopped or
+crashes resumes after that page when started again. A dry run only reads the
+rows and returns counts plus a rough time and token estimate.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import metrics
+from executors import run_in
+from local_store import open_sqlite
+from pdf_convert import convert_many_to_pdf, LibreOfficeError, PDF_CONVERT_TIMEOUT_SECONDS
+from prompt_budget import estimate_tokens
+from render_manifest import MANIFEST_KEY, ReusePlan
+from supabase_client import list_submissions_async, update_submission_outputs_async
+
+logger = logging.getLogger(__name__)
+
+FLEET_PAGE_SIZE = int(os.environ.get("FLEET_PAGE_SIZE", "50"))
+# Submissions in flight at once, and how many may start per minute (0 = unpaced)
+FLEET_CONCURRENCY = int(os.environ.get("FLEET_CONCURRENCY", "8"))
+FLEET_MAX_PER_MINUTE = float(os.environ.get("FLEET_MAX_PER_MINUTE", "30"))
+# A batch is converted/written when it is full or its first item has waited this long
+FLEET_PDF_BATCH_SIZE = int(os.environ.get("FLEET_PDF_BATCH_SIZE", "8"))
+FLEET_PATCH_BATCH_SIZE = int(os.environ.get("FLEET_PATCH_BATCH_SIZE", "25"))
+FLEET_BATCH_WAIT_SECONDS = float(os.environ.get("FLEET_BATCH_WAIT_SECONDS", "5"))
+FLEET_LEDGER_PATH = os.environ.get(
+    "FLEET_LEDGER_PATH", os.path.join(os.path.dirname(__file__), "rerender_ledger.sqlite3")
+)
+# Per-document seconds used by the dry-run estimate
+FLEET_ESTIMATE_RENDER_SECONDS = float(os.environ.get("FLEET_ESTIMATE_RENDER_SECONDS", "2"))
+FLEET_ESTIMATE_PDF_SECONDS = float(os.environ.get("FLEET_ESTIMATE_PDF_SECONDS", "3"))
+
+FLEET_COLUMNS = "id,product,placeholders,uploads,ai_input,outputs"
+
+STALE = "stale"  # rendered with an older template; will be re-rendered
+CURRENT = "current"  # already rendered with the current template
+NEEDS_AI = "needs_ai"  # no reusable AI content; only a full regeneration can refresh it
+
+
+def classify(outputs: Optional[Dict[str, Any]], manifest: Dict[str, Any]) -> Tuple[str, ReusePlan]:
+    """
+    Decide what a fleet run does with a submission.
+
+    Args:
+        outputs: The submission's current outputs.
+        manifest: Manifest of its inputs against the current template.
+    """
+    reuse = ReusePlan(outputs, manifest)
+    prior = (outputs or {}).get(MANIFEST_KEY) or {}
+    if prior.get("template") == manifest["template"]:
+        return CURRENT, reuse
+    if reuse.ai_content is None:
+        return NEEDS_AI, reuse
+    return STALE, reuse
+
+
+class Batcher:
+    """
+    Collects single calls into batched calls of fn(items).
+
+    fn returns one result per item, in order; an Exception instance as a result
+    fails that item only.
+
+    Args:
+        fn: Coroutine function handling a batch.
+        size: Items that trigger a batch straight away.
+        wait_seconds: Longest the first item of a batch waits for others.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], Awaitable[List[Any]]], size: int, wait_seconds: float):
+        self.fn = fn
+        self.size = max(1, size)
+        self.wait_seconds = wait_seconds
+        self._items: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running: set = set()
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._items.append((item, future))
+        if len(self._items) >= self.size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.wait_seconds, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._items = self._items, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        try:
+            results = await self.fn([item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def close(self) -> None:
+        """Fail whatever is still queued (the run is stopping)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for _, future in self._items:
+            future.cancel()
+        self._items = []
+
+
+async def _convert_pdfs(items: List[Tuple[str, str, float]]) -> List[Any]:
+    """Batch fn: (docx_path, output_dir, timeout) items converted by one soffice start per directory."""
+    by_dir: Dict[str, List[str]] = {}
+    for docx_path, output_dir, _ in items:
+        by_dir.setdefault(output_dir, []).append(docx_path)
+    timeout = max(timeout for _, _, timeout in items)
+    converted: Dict[str, Any] = {}
+    for output_dir, paths in by_dir.items():
+        try:
+            converted.update(await run_in("pdf", convert_many_to_pdf, paths, output_dir, timeout))
+        except LibreOfficeError as e:
+            converted.update({path: e for path in paths})
+    metrics.counter("fleet_pdf_batches_total").inc()
+    return [
+        converted[path] if converted[path] is not None else LibreOfficeError(f"PDF was not created for {path}")
+        for path, _, _ in items
+    ]
+
+
+async def _write_outputs(items: List[Tuple[str, Dict[str, Any]]]) -> List[Any]:
+    """Batch fn: (submission_id, outputs) items written as concurrent per-row PATCHes."""
+    # Not an upsert: Postgres checks NOT NULL columns of the proposed insert row
+    # before resolving the conflict, and a row deleted mid-run would come back
+    metrics.counter("fleet_patch_batches_total").inc()
+    return await asyncio.gather(
+        *[update_submission_outputs_async(submission_id, outputs) for submission_id, outputs in items],
+        return_exceptions=True,
+    )
+
+
+class FleetLedger:
+    """
+    Progress of fleet runs in a local SQLite file.
+
+    Args:
+        path: SQLite database file.
+    """
+
+    def __init__(self, path: str = FLEET_LEDGER_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = open_sqlite(
+                self.path,
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "run_id TEXT PRIMARY KEY, product TEXT NOT NULL, template TEXT, status TEXT NOT NULL, "
+                "cursor TEXT, counts TEXT NOT NULL, error TEXT, started_at REAL NOT NULL, updated_at REAL NOT NULL)",
+                "CREATE TABLE IF NOT EXISTS failures ("
+                "run_id TEXT NOT NULL, submission_id TEXT NOT NULL, error TEXT NOT NULL, "
+                "PRIMARY KEY (run_id, submission_id))",
+            )
+        return self._conn
+
+    def start(self, run_id: str, product: str, template: Optional[str], restart: bool = False) -> Dict[str, Any]:
+        """Begin a run, or pick up an unfinished one where it stopped."""
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT cursor, counts, status FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            now = time.time()
+            if row is None or restart or row[2] == "succeeded":
+                cursor, counts = None, {}
+                db.execute("DELETE FROM failures WHERE run_id = ?", (run_id,))
+                db.execute(
+                    "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, 'running', NULL, '{}', NULL, ?, ?)",
+                    (run_id, product, template, now, now),
+                )
+            else:
+                cursor, counts = row[0], json.loads(row[1])
+                db.execute("UPDATE runs SET status = 'running', error = NULL, updated_at = ? WHERE run_id = ?", (now, run_id))
+            db.commit()
+        return {"cursor": cursor, "counts": counts}
+
+    def advance(self, run_id: str, cursor: str, counts: Dict[str, int], failures: Dict[str, str]) -> None:
+        """Record a finished page: its last id, the running counts and its failed rows."""
+        with self._lock:
+            db = self._db()
+            db.executemany(
+                "INSERT OR REPLACE INTO failures VALUES (?, ?, ?)",
+                [(run_id, submission_id, error) for submission_id, error in failures.items()],
+            )
+            db.execute(
+                "UPDATE runs SET cursor = ?, counts = ?, updated_at = ? WHERE run_id = ?",
+                (cursor, json.dumps(counts), time.time(), run_id),
+            )
+            db.commit()
+
+    def finish(self, run_id: str, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "UPDATE runs SET status = ?, error = ?, updated_at = ? WHERE run_id = ?",
+                (status, error, time.time(), run_id),
+            )
+            db.commit()
+
+    def get(self, run_id: str, max_failures: int = 100) -> Optional[Dict[str, Any]]:
+        """A run's status, counts and (up to max_failures) failed submissions."""
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT product, template, status, cursor, counts, error, started_at, updated_at "
+                "FROM runs WHERE run_id = ?", (run_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            failures = db.execute(
+                "SELECT submission_id, error FROM failures WHERE run_id = ? ORDER BY submission_id LIMIT ?",
+                (run_id, max_failures),
+            ).fetchall()
+        product, template, status, cursor, counts, error, started_at, updated_at = row
+        return {
+            "run_id": run_id, "product": product, "template": template, "status": status, "cursor": cursor,
+            "counts": json.loads(counts), "error": error, "started_at": started_at, "updated_at": updated_at,
+            "failures": [{"submission_id": sid, "error": message} for sid, message in failures],
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class FleetRerender:
+    """
+    Re-renders the submissions of a product that predate its current template.
+
+    Args:
+        manifest: submission -> manifest of its inputs against the current template.
+        render: Coroutine (submission, manifest, convert_pdf, write_outputs) that runs
+            the pipeline for one submission with the stored AI content.
+        template_hash: product -> hash of its current template.
+        ledger: Progress store.
+    """
+
+    def __init__(
+        self,
+        manifest: Callable[[dict], Dict[str, Any]],
+        render: Callable[..., Awaitable[Any]],
+        template_hash: Callable[[str], Optional[str]],
+        ledger: FleetLedger,
+        page_size: int = FLEET_PAGE_SIZE,
+        concurrency: int = FLEET_CONCURRENCY,
+        max_per_minute: float = FLEET_MAX_PER_MINUTE,
+    ):
+        self.manifest = manifest
+        self.render = render
+        self.template_hash = template_hash
+        self.ledger = ledger
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.max_per_minute = max_per_minute
+        self._next_start = 0.0
+
+    def run_id(self, product: str) -> str:
+        return f"{product}-{self.template_hash(product)}"
+
+    async def _pages(self, product: str, after_id: Optional[str] = None):
+        while True:
+            page = await list_submissions_async(
+                [("product", f"eq.{product}")], columns=FLEET_COLUMNS, limit=self.page_size, after_id=after_id
+            )
+            if page:
+                yield page
+            if len(page) < self.page_size:
+                return
+            after_id = page[-1]["id"]
+
+    async def estimate(self, product: str) -> Dict[str, Any]:
+        """
+        Dry run: classify every submission without rendering anything.
+
+        Returns:
+            Counts per outcome, LLM calls and tokens the reuse avoids, the prompt
+            tokens needs_ai rows would cost to regenerate, and estimated seconds.
+        """
+        counts = {STALE: 0, CURRENT: 0, NEEDS_AI: 0}
+        tokens_avoided = tokens_needed = 0
+        async for page in self._pages(product):
+            for submission in page:
+                manifest = self.manifest(submission)
+                outcome, reuse = classify(submission.get("outputs"), manifest)
+                counts[outcome] += 1
+                if outcome == STALE:
+                    tokens_avoided += estimate_tokens(json.dumps(reuse.ai_content))
+                elif outcome == NEEDS_AI:
+                    tokens_needed += estimate_tokens(json.dumps(submission.get("placeholders") or {}))
+                    tokens_needed += estimate_tokens(json.dumps(submission.get("ai_input") or {}))
+
+        work_seconds = counts[STALE] * (FLEET_ESTIMATE_RENDER_SECONDS + FLEET_ESTIMATE_PDF_SECONDS) / max(1, self.concurrency)
+        paced_seconds = counts[STALE] * 60.0 / self.max_per_minute if self.max_per_minute > 0 else 0.0
+        return {
+            "product": product,
+            "run_id": self.run_id(product),
+            "dry_run": True,
+            "counts": counts,
+            "ai_calls_avoided": counts[STALE],
+            "ai_completion_tokens_avoided": tokens_avoided,
+            "needs_ai_prompt_tokens": tokens_needed,
+            "pdf_batches": -(-counts[STALE] // max(1, FLEET_PDF_BATCH_SIZE)),
+            "estimated_seconds": round(max(work_seconds, paced_seconds), 1),
+        }
+
+    async def _pace(self) -> None:
+        """Space out starts to max_per_minute."""
+        if self.max_per_minute <= 0:
+            return
+        now = time.monotonic()
+        start = max(now, self._next_start)
+        self._next_start = start + 60.0 / self.max_per_minute
+        await asyncio.sleep(start - now)
+
+    async def run(self, product: str, restart: bool = False) -> Dict[str, Any]:
+        """
+        Re-render every stale submission of product, resuming an unfinished run.
+
+        Returns:
+            The run's final ledger entry.
+        """
+        run_id = self.run_id(product)
+        state = await run_in("io", self.ledger.start, run_id, product, self.template_hash(product), restart)
+        counts: Dict[str, int] = state["counts"]
+        if state["cursor"]:
+            logger.info(f"Fleet re-render {run_id}: resuming after {state['cursor']} ({counts})")
+
+        pdfs = Batcher(_convert_pdfs, FLEET_PDF_BATCH_SIZE, FLEET_BATCH_WAIT_SECONDS)
+        writes = Batcher(_write_outputs, FLEET_PATCH_BATCH_SIZE, FLEET_BATCH_WAIT_SECONDS)
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def convert_pdf(docx_path: str, output_dir: str, timeout: float = PDF_CONVERT_TIMEOUT_SECONDS) -> str:
+            return await pdfs.submit((docx_path, output_dir, timeout))
+
+        async def write_outputs(submission_id: str, outputs: Dict[str, Any], timeout: float = 0) -> None:
+            await writes.submit((submission_id, outputs))
+
+        async def rerender(submission: dict, manifest: Dict[str, Any]) -> Optional[str]:
+            async with slots:
+                await self._pace()
+                try:
+                    await self.render(submission, manifest, convert_pdf, write_outputs)
+                    return None
+                except Exception as e:
+                    logger.error(f"Fleet re-render of {submission['id']} failed: {e}")
+                    return str(e) or type(e).__name__
+
+        work: List[Tuple[str, asyncio.Future]] = []
+        try:
+            async for page in self._pages(product, state["cursor"]):
+                work = []
+                for submission in page:
+                    manifest = self.manifest(submission)
+                    outcome, _ = classify(submission.get("outputs"), manifest)
+                    if outcome == STALE:
+                        work.append((submission["id"], asyncio.ensure_future(rerender(submission, manifest))))
+                    else:
+                        counts[outcome] = counts.get(outcome, 0) + 1
+                failures = {}
+                for submission_id, task in work:
+                    error = await task
+                    outcome = "failed" if error else "rendered"
+                    counts[outcome] = counts.get(outcome, 0) + 1
+                    metrics.counter("fleet_rerender_total", product=product, outcome=outcome).inc()
+                    if error:
+                        failures[submission_id] = error
+                await run_in("io", self.ledger.advance, run_id, page[-1]["id"], counts, failures)
+                logger.info(f"Fleet re-render {run_id}: through {page[-1]['id']} {counts}")
+        except asyncio.CancelledError:
+            for _, task in work:
+                task.cancel()
+            await run_in("io", self.ledger.finish, run_id, "paused")
+            raise
+        except Exception as e:
+            logger.exception(f"Fleet re-render {run_id} stopped: {e}")
+            await run_in("io", self.ledger.finish, run_id, "failed", str(e))
+            raise
+        finally:
+            pdfs.close()
+            writes.close()
+
+        await run_in("io", self.ledger.finish, run_id, "succeeded")
+        return await run_in("io", self.ledger.get, run_id)
@@ -0,0 +1,274 @@
+"""
+Single-flight execution for duplicate generation requests.
+
+Double clicks and front-end retries send several generate calls for the same
+submission at once. Calls with the same key (submission id + hash of the
+submission's inputs) share one execution: the first caller runs it, concurrent
+callers attach to it, and callers arriving shortly after it finished get the
+cached result. Different inputs for the same submission get a new key, so an
+edited submission is always regenerated.
+
+Within one process this is an asyncio task per key. With SINGLEFLIGHT_DATABASE_URL
+set, a lease row in Postgres extends it across replicas: the replica holding the
+lease runs the work and stores the result; the others poll the row for it.
+"""
+
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import metrics
+from executors import run_in
+from pg_queue import PgTable
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_RESULT_TTL_SECONDS = float(os.environ.get("SINGLEFLIGHT_RESULT_TTL_SECONDS", "30"))
+SINGLEFLIGHT_DATABASE_URL = os.environ.get("SINGLEFLIGHT_DATABASE_URL", "")
+SINGLEFLIGHT_PG_TABLE = os.environ.get("SINGLEFLIGHT_PG_TABLE", "docgen_flights")
+SINGLEFLIGHT_LEASE_SECONDS = float(os.environ.get("SINGLEFLIGHT_LEASE_SECONDS", "60"))
+SINGLEFLIGHT_POLL_SECONDS = float(os.environ.get("SINGLEFLIGHT_POLL_SECONDS", "0.5"))
+# How long a failure is handed to concurrent duplicates before a retry may run again
+SINGLEFLIGHT_FAILURE_TTL_SECONDS = float(os.environ.get("SINGLEFLIGHT_FAILURE_TTL_SECONDS", "5"))
+
+# How a caller got its result
+LEADER = "leader"   # ran the work
+JOINED = "joined"   # attached to an in-flight execution in this process
+CACHED = "cached"   # recent result from this process
+REMOTE = "remote"   # result produced by another replica
+
+
+class RemoteFlightError(Exception):
+    """The execution another replica ran for this key failed."""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class PgFlightLease:
+    """
+    Cross-replica lease and result store (one row per key).
+
+    Args:
+        database_url: Postgres connection string.
+        table: Table name (created by ensure_schema).
+        lease_seconds: Lease length; the holder refreshes it while running.
+        result_ttl_seconds: How long a stored result is served to late duplicates.
+        failure_ttl_seconds: How long a stored failure is served before a retry may run.
+        poll_seconds: How often waiting replicas check the row.
+    """
+
+    def __init__(
+        self,
+        database_url: str = SINGLEFLIGHT_DATABASE_URL,
+        table: str = SINGLEFLIGHT_PG_TABLE,
+        lease_seconds: float = SINGLEFLIGHT_LEASE_SECONDS,
+        result_ttl_seconds: float = SINGLEFLIGHT_RESULT_TTL_SECONDS,
+        failure_ttl_seconds: float = SINGLEFLIGHT_FAILURE_TTL_SECONDS,
+        poll_seconds: float = SINGLEFLIGHT_POLL_SECONDS,
+    ):
+        self.db = PgTable(database_url, table)
+        self.lease_seconds = lease_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.failure_ttl_seconds = failure_ttl_seconds
+        self.poll_seconds = poll_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def ensure_schema(self) -> None:
+        self.db._execute("""
+            CREATE TABLE IF NOT EXISTS {table} (
+                key text PRIMARY KEY,
+                owner text NOT NULL,
+                status text NOT NULL,
+                lease_expires_at timestamptz,
+                result jsonb,
+                error text,
+                error_code integer,
+                updated_at timestamptz NOT NULL DEFAULT now()
+            )
+        """, idempotent=True)
+
+    def _acquire(self, key: str) -> Tuple[str, Any]:
+        """
+        Take the lease if the key is free, stale or its holder died.
+
+        Returns:
+            ("acquired", None), ("done", result), ("failed", (error, code)) or ("busy", None)
+        """
+        row = self.db._execute(
+            "INSERT INTO {table} (key, owner, status, lease_expires_at, updated_at) "
+            "VALUES (%s, %s, 'running', now() + make_interval(secs => %s), now()) "
+            "ON CONFLICT (key) DO UPDATE SET owner = EXCLUDED.owner, status = 'running', "
+            "lease_expires_at = EXCLUDED.lease_expires_at, result = NULL, error = NULL, "
+            "error_code = NULL, updated_at = now() "
+            "WHERE ({table}.status = 'running' AND {table}.lease_expires_at < now()) "
+            "OR ({table}.status = 'done' AND {table}.updated_at < now() - make_interval(secs => %s)) "
+            "OR ({table}.status = 'failed' AND {table}.updated_at < now() - make_interval(secs => %s)) "
+            "RETURNING owner",
+            (key, self.owner, self.lease_seconds, self.result_ttl_seconds, self.failure_ttl_seconds),
+            fetch="one",
+        )
+        if row is not None:
+            return "acquired", None
+        row = self.db._execute(
+            "SELECT owner, status, result, error, error_code FROM {table} WHERE key = %s",
+            (key,),
+            fetch="one",
+            idempotent=True,
+        )
+        if row is None:
+            return "busy", None  # Deleted between the statements; try again
+        if row["status"] == "running" and row["owner"] == self.owner:
+            # Our INSERT committed but the connection dropped before RETURNING reached us
+            return "acquired", None
+        if row["status"] == "done":
+            return "done", row["result"]
+        if row["status"] == "failed":
+            return "failed", (row["error"], row["error_code"] or 500)
+        return "busy", None
+
+    def _extend(self, key: str) -> None:
+        self.db._execute(
+            "UPDATE {table} SET lease_expires_at = now() + make_interval(secs => %s) "
+            "WHERE key = %s AND owner = %s AND status = 'running'",
+            (self.lease_seconds, key, self.owner),
+            idempotent=True,
+        )
+
+    def _finish(self, key: str, result: Any = None, error: Optional[str] = None, error_code: Optional[int] = None):
+        self.db._execute(
+            "UPDATE {table} SET status = %s, result = %s, error = %s, error_code = %s, "
+            "lease_expires_at = NULL, updated_at = now() WHERE key = %s AND owner = %s",
+            ("failed" if error is not None else "done",
+             json.dumps(result) if error is None else None, error, error_code, key, self.owner),
+            idempotent=True,
+        )
+        # Old rows are only useful for the TTL windows; keep the table small
+        self.db._execute("DELETE FROM {table} WHERE updated_at < now() - interval '1 day'", idempotent=True)
+
+    def _release(self, key: str) -> None:
+        """Give up a lease without a result (the leader was cancelled) so another replica can run."""
+        self.db._execute(
+            "DELETE FROM {table} WHERE key = %s AND owner = %s AND status = 'running'", (key, self.owner),
+            idempotent=True,
+        )
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """Run fn under the lease, or wait for the replica that holds it."""
+        while True:
+            state, value = await run_in("io", self._acquire, key)
+            if state == "done":
+                return value, REMOTE
+            if state == "failed":
+                raise RemoteFlightError(value[0], value[1])
+            if state == "busy":
+                await asyncio.sleep(self.poll_seconds)
+                continue
+
+            keepalive = asyncio.ensure_future(self._keep_lease(key))
+            try:
+                result = await fn()
+            except asyncio.CancelledError:
+                # Cancelled leader (shutdown, request deadline): free the key now rather than
+                # leaving waiters to poll until the lease expires
+                try:
+                    await asyncio.shield(run_in("io", self._release, key))
+                except Exception as e:
+                    logger.warning(f"Single-flight lease release failed for {key}: {e}")
+                raise
+            except Exception as e:
+                await run_in("io", self._finish, key, None, str(getattr(e, "detail", e)),
+                             getattr(e, "status_code", 500))
+                raise
+            finally:
+                keepalive.cancel()
+            await run_in("io", self._finish, key, result)
+            return result, LEADER
+
+    async def _keep_lease(self, key: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await run_in("io", self._extend, key)
+            except Exception as e:
+                logger.warning(f"Single-flight lease refresh failed for {key}: {e}")
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class SingleFlight:
+    """
+    Per-key de-duplication of concurrent async work, with a short result cache.
+
+    Args:
+        result_ttl_seconds: How long a finished result is served to late duplicates.
+        lease: Optional PgFlightLease to de-duplicate across replicas.
+    """
+
+    def __init__(self, result_ttl_seconds: float = SINGLEFLIGHT_RESULT_TTL_SECONDS,
+                 lease: Optional[PgFlightLease] = None):
+        self.result_ttl_seconds = result_ttl_seconds
+        self.lease = lease
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._results: Dict[str, Tuple[float, Any]] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """
+        Run fn once per key.
+
+        Returns:
+            (result, how) where how is LEADER, JOINED, CACHED or REMOTE.
+
+        Raises:
+            Whatever fn raised (every attached caller gets the same exception), or
+            RemoteFlightError when another replica's execution failed.
+        """
+        self._evict()
+        cached = self._results.get(key)
+        if cached is not None:
+            metrics.counter("singleflight_total", outcome=CACHED).inc()
+            return cached[1], CACHED
+
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.counter("singleflight_total", outcome=JOINED).inc()
+            logger.info(f"Single-flight: attaching to in-flight execution {key}")
+            result, _ = await asyncio.shield(task)
+            return result, JOINED
+
+        task = asyncio.ensure_future(self._lead(key, fn))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded: a caller that goes away must not cancel the work the others wait on
+        result, how = await asyncio.shield(task)
+        metrics.counter("singleflight_total", outcome=how).inc()
+        return result, how
+
+    async def _lead(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        if self.lease is not None:
+            result, how = await self.lease.run(key, fn)
+        else:
+            result, how = await fn(), LEADER
+        self._results[key] = (time.monotonic() + self.result_ttl_seconds, result)
+        return result, how
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._results.items() if expires < now]:
+            del self._results[key]
+
+
+def create_lease() -> Optional[PgFlightLease]:
+    """Cross-replica lease when SINGLEFLIGHT_DATABASE_URL is set, else None."""
+    if not SINGLEFLIGHT_DATABASE_URL:
+        return None
+    lease = PgFlightLease()
+    lease.ensure_schema()
+    logger.info(f"Single-flight uses Postgres leases (table {lease.db.table})")
+    return lease
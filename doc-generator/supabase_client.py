@@ -1,11 +1,27 @@
 """
 Supabase client wrapper for fetching and updating submissions.
 Uses httpx for REST API calls (simpler than supabase-py for our use case).
+Each call has a blocking form and an *_async form for the async handlers.
+
+All calls share one lazily created, keep-alive connection pool (one blocking
+client per process, one async client per event loop), using HTTP/2 when the h2
+package is installed, so a generation no longer pays a TCP+TLS handshake for
+every fetch, upload and PATCH. Reads are idempotent and are retried on
+connection errors and 429/5xx within their timeout; writes are not retried.
+Callers fetch only the columns they use.
 """
 
 import os
+import time
+import base64
+import random
+import asyncio
 import logging
-from typing import Dict, Any, Optional
+import threading
+import weakref
+import contextlib
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
+from urllib.parse import urlencode
 from pathlib import Path
 import httpx
 
@@ -14,14 +30,141 @@ from dotenv import load_dotenv
 env_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# After load_dotenv: the pool sizes come from the environment
+from executors import run_in
+
 logger = logging.getLogger(__name__)
 
 # Environment configuration  
 SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
 SUPABASE_SERVICE_ROLE_KEY = os.environ.get('SUPABASE_SERVICE_ROLE_KEY', '')
+# Default timeouts; requests with a deadline pass their remaining budget instead
+SUPABASE_TIMEOUT_SECONDS = float(os.environ.get('SUPABASE_TIMEOUT_SECONDS', '30'))
+STORAGE_UPLOAD_TIMEOUT_SECONDS = float(os.environ.get('STORAGE_UPLOAD_TIMEOUT_SECONDS', '120'))
+# Shared connection pool
+SUPABASE_MAX_CONNECTIONS = int(os.environ.get('SUPABASE_MAX_CONNECTIONS', '20'))
+SUPABASE_MAX_KEEPALIVE = int(os.environ.get('SUPABASE_MAX_KEEPALIVE', '10'))
+SUPABASE_KEEPALIVE_SECONDS = float(os.environ.get('SUPABASE_KEEPALIVE_SECONDS', '60'))
+# Extra attempts for reads that fail with a connection error or 429/5xx
+SUPABASE_READ_RETRIES = int(os.environ.get('SUPABASE_READ_RETRIES', '2'))
+SUPABASE_RETRY_BACKOFF_SECONDS = float(os.environ.get('SUPABASE_RETRY_BACKOFF_SECONDS', '0.25'))
+
+# Uploads stream from disk in STORAGE_STREAM_CHUNK_BYTES pieces; files of
+# STORAGE_RESUMABLE_THRESHOLD_BYTES or more use resumable (TUS) uploads in
+# STORAGE_RESUMABLE_CHUNK_BYTES requests (Supabase expects 6 MB chunks)
+STORAGE_STREAM_CHUNK_BYTES = 256 * 1024
+STORAGE_RESUMABLE_THRESHOLD_BYTES = int(os.environ.get('STORAGE_RESUMABLE_THRESHOLD_BYTES', str(6 * 1024 * 1024)))
+STORAGE_RESUMABLE_CHUNK_BYTES = int(os.environ.get('STORAGE_RESUMABLE_CHUNK_BYTES', str(6 * 1024 * 1024)))
+# Times a resumable upload picks up again after a network error
+STORAGE_RESUME_ATTEMPTS = int(os.environ.get('STORAGE_RESUME_ATTEMPTS', '5'))
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_client: Optional[httpx.Client] = None
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+# (bucket, object, size, mtime) -> TUS upload URL of an unfinished resumable upload
+_resumable_locations: Dict[tuple, str] = {}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _client_options() -> Dict[str, Any]:
+    return {
+        "http2": _http2_available(),
+        "timeout": SUPABASE_TIMEOUT_SECONDS,
+        "limits": httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+            keepalive_expiry=SUPABASE_KEEPALIVE_SECONDS,
+        ),
+    }
+
+
+def get_client() -> httpx.Client:
+    """The shared blocking client (created on first use)."""
+    global _client
+    with _client_lock:
+        if _client is None or _client.is_closed:
+            _client = httpx.Client(**_client_options())
+        return _client
+
 
+def get_async_client() -> httpx.AsyncClient:
+    """The shared async client of the running event loop (created on first use)."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(**_client_options())
+        _async_clients[loop] = client
+    return client
 
-def _get_headers() -> Dict[str, str]:
+
+async def close_clients() -> None:
+    """Close the pooled clients (on shutdown)."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _retry_delay(attempt: int) -> float:
+    return SUPABASE_RETRY_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def _get(url: str, timeout: float, **kwargs) -> httpx.Response:
+    """GET with retries; timeout bounds all attempts together."""
+    started = time.monotonic()
+    for attempt in range(SUPABASE_READ_RETRIES + 1):
+        left = timeout - (time.monotonic() - started)
+        try:
+            response = get_client().get(url, timeout=left, **kwargs)
+            if response.status_code not in _RETRY_STATUSES:
+                return response
+            error, failure = None, f"HTTP {response.status_code}"
+        except httpx.TransportError as e:
+            error, failure = e, repr(e)
+        delay = _retry_delay(attempt)
+        if attempt == SUPABASE_READ_RETRIES or time.monotonic() - started + delay >= timeout:
+            if error is not None:
+                raise error
+            return response
+        logger.warning(f"GET {url} failed ({failure}); retrying in {delay:.2f}s")
+        time.sleep(delay)
+
+
+async def _get_async(url: str, timeout: float, **kwargs) -> httpx.Response:
+    """Async form of _get()."""
+    started = time.monotonic()
+    for attempt in range(SUPABASE_READ_RETRIES + 1):
+        left = timeout - (time.monotonic() - started)
+        try:
+            response = await get_async_client().get(url, timeout=left, **kwargs)
+            if response.status_code not in _RETRY_STATUSES:
+                return response
+            error, failure = None, f"HTTP {response.status_code}"
+        except httpx.TransportError as e:
+            error, failure = e, repr(e)
+        delay = _retry_delay(attempt)
+        if attempt == SUPABASE_READ_RETRIES or time.monotonic() - started + delay >= timeout:
+            if error is not None:
+                raise error
+            return response
+        logger.warning(f"GET {url} failed ({failure}); retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+
+def _get_headers(prefer: str = "return=representation") -> Dict[str, str]:
     """Get headers for Supabase REST API requests."""
     if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
         raise ValueError(
@@ -33,7 +176,7 @@ def _get_headers() -> Dict[str, str]:
         "apikey": SUPABASE_SERVICE_ROLE_KEY,
         "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
         "Content-Type": "application/json",
-        "Prefer": "return=representation"
+        "Prefer": prefer
     }
 
 
@@ -44,12 +187,35 @@ def _get_rest_url() -> str:
     return f"{base_url}/rest/v1"
 
 
-def get_submission(submission_id: str) -> Optional[Dict[str, Any]]:
+def _submission_query(submission_id: str, select: str = "*") -> Dict[str, str]:
+    """PostgREST filter for a single submission."""
+    return {
+        "id": f"eq.{submission_id}",
+        "select": select
+    }
+
+
+def _first_row(data, submission_id: str) -> Optional[Dict[str, Any]]:
+    if not data or len(data) == 0:
+        logger.warning(f"Submission not found: {submission_id}")
+        return None
+    
+    logger.info(f"Submission fetched successfully: {submission_id}")
+    return data[0]
+
+
+def get_submission(
+    submission_id: str,
+    columns: str = "*",
+    timeout: float = SUPABASE_TIMEOUT_SECONDS,
+) -> Optional[Dict[str, Any]]:
     """
     Fetch a submission from Supabase by ID.
     
     Args:
         submission_id: UUID of the submission
+        columns: PostgREST select list, e.g. "product,outputs"
+        timeout: Timeout in seconds for the fetch, retries included
     
     Returns:
         Submission data dict or None if not found
@@ -58,25 +224,38 @@ def get_submission(submission_id: str) -> Optional[Dict[str, Any]]:
         Exception on API errors
     """
     url = f"{_get_rest_url()}/submissions"
-    params = {
-        "id": f"eq.{submission_id}",
-        "select": "*"
-    }
+    params = _submission_query(submission_id, columns)
     
     logger.info(f"Fetching submission: {submission_id}")
     
     try:
-        response = httpx.get(url, headers=_get_headers(), params=params, timeout=30)
+        response = _get(url, timeout, headers=_get_headers(), params=params)
         response.raise_for_status()
+        return _first_row(response.json(), submission_id)
         
-        data = response.json()
-        
-        if not data or len(data) == 0:
-            logger.warning(f"Submission not found: {submission_id}")
-            return None
-        
-        logger.info(f"Submission fetched successfully: {submission_id}")
-        return data[0]
+    except httpx.HTTPStatusError as e:
+        logger.error(f"HTTP error fetching submission: {e.response.status_code} - {e.response.text}")
+        raise Exception(f"Failed to fetch submission: {e.response.status_code}")
+    except Exception as e:
+        logger.error(f"Error fetching submission: {e}")
+        raise
+
+
+async def get_submission_async(
+    submission_id: str,
+    columns: str = "*",
+    timeout: float = SUPABASE_TIMEOUT_SECONDS,
+) -> Optional[Dict[str, Any]]:
+    """Async form of get_submission()."""
+    url = f"{_get_rest_url()}/submissions"
+    params = _submission_query(submission_id, columns)
+    
+    logger.info(f"Fetching submission: {submission_id}")
+    
+    try:
+        response = await _get_async(url, timeout, headers=_get_headers(), params=params)
+        response.raise_for_status()
+        return _first_row(response.json(), submission_id)
         
     except httpx.HTTPStatusError as e:
         logger.error(f"HTTP error fetching submission: {e.response.status_code} - {e.response.text}")
@@ -86,13 +265,18 @@ def get_submission(submission_id: str) -> Optional[Dict[str, Any]]:
         raise
 
 
-def update_submission_outputs(submission_id: str, outputs: Dict[str, Any]) -> bool:
+def update_submission_outputs(
+    submission_id: str,
+    outputs: Dict[str, Any],
+    timeout: float = SUPABASE_TIMEOUT_SECONDS,
+) -> bool:
     """
     Update the outputs field of a submission.
     
     Args:
         submission_id: UUID of the submission
         outputs: Dict containing output paths and metadata
+        timeout: Request timeout in seconds
     
     Returns:
         True if update was successful
@@ -113,7 +297,10 @@ def update_submission_outputs(submission_id: str, outputs: Dict[str, Any]) -> bo
     logger.debug(f"Outputs: {outputs}")
     
     try:
-        response = httpx.patch(url, headers=_get_headers(), params=params, json=payload, timeout=30)
+        # The updated row is not used; return=minimal keeps it off the wire
+        response = get_client().patch(
+            url, headers=_get_headers("return=minimal"), params=params, json=payload, timeout=timeout
+        )
         response.raise_for_status()
         
         logger.info(f"Submission outputs updated successfully: {submission_id}")
@@ -127,24 +314,76 @@ def update_submission_outputs(submission_id: str, outputs: Dict[str, Any]) -> bo
         raise
 
 
-def upload_file_to_storage(
-    local_path: str,
-    storage_path: str,
-    bucket: str = "generated-documents",
-) -> str:
+async def update_submission_outputs_async(
+    submission_id: str,
+    outputs: Dict[str, Any],
+    timeout: float = SUPABASE_TIMEOUT_SECONDS,
+) -> bool:
+    """Async form of update_submission_outputs()."""
+    url = f"{_get_rest_url()}/submissions"
+    params = {
+        "id": f"eq.{submission_id}"
+    }
+    
+    logger.info(f"Updating submission outputs: {submission_id}")
+    logger.debug(f"Outputs: {outputs}")
+    
+    try:
+        response = await get_async_client().patch(
+            url, headers=_get_headers("return=minimal"), params=params, json={"outputs": outputs}, timeout=timeout
+        )
+        response.raise_for_status()
+        
+        logger.info(f"Submission outputs updated successfully: {submission_id}")
+        return True
+        
+    except httpx.HTTPStatusError as e:
+        logger.error(f"HTTP error updating submission: {e.response.status_code} - {e.response.text}")
+        raise Exception(f"Failed to update submission: {e.response.status_code}")
+    except Exception as e:
+        logger.error(f"Error updating submission: {e}")
+        raise
+
+
+async def list_submissions_async(
+    filters: List[Tuple[str, str]],
+    columns: str = "*",
+    limit: int = 100,
+    after_id: Optional[str] = None,
+    timeout: float = SUPABASE_TIMEOUT_SECONDS,
+) -> List[Dict[str, Any]]:
     """
-    Upload a local file to Supabase Storage and return its public URL.
+    Fetch one page of submissions matching PostgREST filters, ordered by id.
 
     Args:
-        local_path: Absolute path to the local file.
-        storage_path: Target path inside the bucket (e.g. "submission-id/file.pdf").
-        bucket: Supabase Storage bucket name (default: "generated-documents").
+        filters: (column, "operator.value") pairs, e.g. [("product", "eq.RAMS")]
+        columns: PostgREST select list (include "id" to page on it)
+        limit: Page size
+        after_id: Last id of the previous page (keyset paging, stable while rows are added)
+        timeout: Timeout in seconds for the fetch, retries included
 
     Returns:
-        Public URL string for the uploaded object.
+        Up to limit rows; fewer means this was the last page.
 
     Raises:
-        Exception if upload fails.
+        Exception on API errors
+    """
+    params = list(filters) + [("select", columns), ("order", "id.asc"), ("limit", str(limit))]
+    if after_id is not None:
+        params.append(("id", f"gt.{after_id}"))
+    response = await _get_async(f"{_get_rest_url()}/submissions", timeout, headers=_get_headers(), params=params)
+    if response.status_code != 200:
+        logger.error(f"HTTP error listing submissions: {response.status_code} - {response.text[:500]}")
+        raise Exception(f"Failed to list submissions: {response.status_code}")
+    return response.json()
+
+
+def _storage_target(local_path: str, storage_path: str, bucket: str) -> Tuple[str, Dict[str, str], str]:
+    """
+    Validate an upload and build its request.
+
+    Returns:
+        (upload_url, headers, public_url)
     """
     if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
         raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY")
@@ -155,13 +394,7 @@ def upload_file_to_storage(
     base_url = SUPABASE_URL.rstrip("/")
     upload_url = f"{base_url}/storage/v1/object/{bucket}/{storage_path}"
 
-    # Determine content type
-    ext = os.path.splitext(local_path)[1].lower()
-    content_types = {
-        ".pdf": "application/pdf",
-        ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-    }
-    content_type = content_types.get(ext, "application/octet-stream")
+    content_type = _content_type(local_path)
 
     file_size = os.path.getsize(local_path)
     logger.info(f"Uploading {local_path} ({file_size:,} bytes) to {bucket}/{storage_path}")
@@ -172,19 +405,227 @@ def upload_file_to_storage(
         "Content-Type": content_type,
         "x-upsert": "true",  # Overwrite if exists (re-runs)
     }
+    public_url = f"{base_url}/storage/v1/object/public/{bucket}/{storage_path}"
+    return upload_url, headers, public_url
+
+
+def _content_type(name: str) -> str:
+    content_types = {
+        ".pdf": "application/pdf",
+        ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    }
+    return content_types.get(os.path.splitext(name)[1].lower(), "application/octet-stream")
 
+
+def _check_upload_response(response: httpx.Response, public_url: str) -> str:
+    if response.status_code not in (200, 201):
+        logger.error(f"Storage upload failed ({response.status_code}): {response.text[:500]}")
+        raise Exception(f"Storage upload failed: {response.status_code} - {response.text[:200]}")
+
+    logger.info(f"Upload complete: {public_url}")
+    return public_url
+
+
+def _file_chunks(path: str, chunk_size: int, offset: int = 0, length: Optional[int] = None):
+    """Yield a file (or length bytes of it from offset) in chunks, without holding it in memory."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        left = os.path.getsize(path) - offset if length is None else length
+        while left > 0:
+            chunk = f.read(min(chunk_size, left))
+            if not chunk:
+                break
+            left -= len(chunk)
+            yield chunk
+
+
+async def _file_chunks_async(path: str, chunk_size: int, offset: int = 0, length: Optional[int] = None):
+    """Async form of _file_chunks(); reads run in the io pool."""
+    chunks = _file_chunks(path, chunk_size, offset, length)
     try:
-        with open(local_path, "rb") as f:
-            response = httpx.post(upload_url, headers=headers, content=f.read(), timeout=120)
+        while True:
+            chunk = await run_in("io", next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        chunks.close()
+
+
+class _UploadInterrupted(Exception):
+    """A resumable upload chunk was not accepted; look up the offset and continue."""
+    pass
+
+
+class _ResumableUpload:
+    """
+    State of one TUS upload (Supabase's /storage/v1/upload/resumable).
+
+    Uploads of the same file to the same object are remembered in-process, so a
+    retried upload continues from the last offset the server acknowledged.
+    """
+
+    def __init__(self, local_path: str, storage_path: str, bucket: str, headers: Dict[str, str]):
+        self.local_path = local_path
+        self.size = os.path.getsize(local_path)
+        self.key = (bucket, storage_path, self.size, os.path.getmtime(local_path))
+        self.create_url = f"{SUPABASE_URL.rstrip('/')}/storage/v1/upload/resumable"
+        self.location = _resumable_locations.get(self.key)
+        self.offset = 0
+        self.auth = {name: headers[name] for name in ("apikey", "Authorization")}
+        metadata = {
+            "bucketName": bucket,
+            "objectName": storage_path,
+            "contentType": headers["Content-Type"],
+        }
+        self.create_headers = dict(
+            self.auth,
+            **{
+                "Tus-Resumable": "1.0.0",
+                "Upload-Length": str(self.size),
+                "Upload-Metadata": ",".join(
+                    f"{name} {base64.b64encode(value.encode()).decode()}" for name, value in metadata.items()
+                ),
+                "x-upsert": "true",
+            },
+        )
+
+    def head_headers(self) -> Dict[str, str]:
+        return dict(self.auth, **{"Tus-Resumable": "1.0.0"})
+
+    def created(self, response: httpx.Response) -> None:
+        if response.status_code != 201 or "location" not in response.headers:
+            raise Exception(f"Resumable upload not created: {response.status_code} - {response.text[:200]}")
+        self.location = str(httpx.URL(self.create_url).join(response.headers["location"]))
+        self.offset = 0
+        _resumable_locations[self.key] = self.location
+
+    def resumed(self, response: httpx.Response) -> bool:
+        """Apply a HEAD response; False if the server no longer knows the upload."""
+        if response.status_code != 200 or "upload-offset" not in response.headers:
+            _resumable_locations.pop(self.key, None)
+            self.location = None
+            return False
+        self.offset = int(response.headers["upload-offset"])
+        return True
+
+    def next_chunk(self) -> Tuple[Dict[str, str], int]:
+        length = min(STORAGE_RESUMABLE_CHUNK_BYTES, self.size - self.offset)
+        headers = dict(
+            self.auth,
+            **{
+                "Tus-Resumable": "1.0.0",
+                "Upload-Offset": str(self.offset),
+                "Content-Type": "application/offset+octet-stream",
+                "Content-Length": str(length),
+            },
+        )
+        return headers, length
+
+    def acknowledged(self, response: httpx.Response) -> None:
+        # 409 is an offset mismatch (an earlier chunk landed after all)
+        if response.status_code == 409 or response.status_code in _RETRY_STATUSES:
+            raise _UploadInterrupted(f"HTTP {response.status_code}")
+        if response.status_code not in (200, 204):
+            raise Exception(f"Resumable upload chunk failed: {response.status_code} - {response.text[:200]}")
+        self.offset = int(response.headers["upload-offset"])
+        if self.done:
+            _resumable_locations.pop(self.key, None)
+
+    @property
+    def done(self) -> bool:
+        return self.location is not None and self.offset >= self.size
 
-        if response.status_code not in (200, 201):
-            logger.error(f"Storage upload failed ({response.status_code}): {response.text[:500]}")
-            raise Exception(f"Storage upload failed: {response.status_code} - {response.text[:200]}")
 
-        # Build public URL
-        public_url = f"{base_url}/storage/v1/object/public/{bucket}/{storage_path}"
-        logger.info(f"Upload complete: {public_url}")
-        return public_url
+def _upload_resumable(upload: _ResumableUpload, deadline: float) -> None:
+    client = get_client()
+    failures = 0
+    while not upload.done:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise httpx.TimeoutException(f"Resumable upload timed out at {upload.offset:,}/{upload.size:,} bytes")
+        try:
+            if upload.location is not None and failures:
+                if not upload.resumed(client.head(upload.location, headers=upload.head_headers(), timeout=left)):
+                    continue
+            if upload.location is None:
+                upload.created(client.post(upload.create_url, headers=upload.create_headers, timeout=left))
+                continue
+            headers, length = upload.next_chunk()
+            content = _file_chunks(upload.local_path, STORAGE_STREAM_CHUNK_BYTES, upload.offset, length)
+            upload.acknowledged(client.patch(upload.location, headers=headers, content=content, timeout=left))
+            failures = 0
+        except (httpx.TransportError, _UploadInterrupted) as e:
+            failures += 1
+            if failures > STORAGE_RESUME_ATTEMPTS:
+                raise
+            logger.warning(f"Resumable upload interrupted at {upload.offset:,} bytes ({e!r}); resuming")
+            time.sleep(_retry_delay(failures - 1))
+
+
+async def _upload_resumable_async(upload: _ResumableUpload, deadline: float) -> None:
+    client = get_async_client()
+    failures = 0
+    while not upload.done:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise httpx.TimeoutException(f"Resumable upload timed out at {upload.offset:,}/{upload.size:,} bytes")
+        try:
+            if upload.location is not None and failures:
+                response = await client.head(upload.location, headers=upload.head_headers(), timeout=left)
+                if not upload.resumed(response):
+                    continue
+            if upload.location is None:
+                upload.created(await client.post(upload.create_url, headers=upload.create_headers, timeout=left))
+                continue
+            headers, length = upload.next_chunk()
+            content = _file_chunks_async(upload.local_path, STORAGE_STREAM_CHUNK_BYTES, upload.offset, length)
+            upload.acknowledged(await client.patch(upload.location, headers=headers, content=content, timeout=left))
+            failures = 0
+        except (httpx.TransportError, _UploadInterrupted) as e:
+            failures += 1
+            if failures > STORAGE_RESUME_ATTEMPTS:
+                raise
+            logger.warning(f"Resumable upload interrupted at {upload.offset:,} bytes ({e!r}); resuming")
+            await asyncio.sleep(_retry_delay(failures - 1))
+
+
+def upload_file_to_storage(
+    local_path: str,
+    storage_path: str,
+    bucket: str = "generated-documents",
+    timeout: float = STORAGE_UPLOAD_TIMEOUT_SECONDS,
+) -> str:
+    """
+    Upload a local file to Supabase Storage and return its public URL.
+
+    The file is streamed from disk; files of STORAGE_RESUMABLE_THRESHOLD_BYTES or
+    more go through a resumable upload that continues after network errors.
+
+    Args:
+        local_path: Absolute path to the local file.
+        storage_path: Target path inside the bucket (e.g. "submission-id/file.pdf").
+        bucket: Supabase Storage bucket name (default: "generated-documents").
+        timeout: Timeout in seconds for the whole upload.
+
+    Returns:
+        Public URL string for the uploaded object.
+
+    Raises:
+        Exception if upload fails.
+    """
+    upload_url, headers, public_url = _storage_target(local_path, storage_path, bucket)
+
+    try:
+        size = os.path.getsize(local_path)
+        if size >= STORAGE_RESUMABLE_THRESHOLD_BYTES:
+            _upload_resumable(_ResumableUpload(local_path, storage_path, bucket, headers), time.monotonic() + timeout)
+            logger.info(f"Upload complete: {public_url}")
+            return public_url
+        headers = dict(headers, **{"Content-Length": str(size)})
+        content = _file_chunks(local_path, STORAGE_STREAM_CHUNK_BYTES)
+        response = get_client().post(upload_url, headers=headers, content=content, timeout=timeout)
+        return _check_upload_response(response, public_url)
 
     except httpx.HTTPStatusError as e:
         logger.error(f"HTTP error uploading to storage: {e.response.status_code}")
@@ -194,6 +635,252 @@ def upload_file_to_storage(
         raise
 
 
+async def upload_file_to_storage_async(
+    local_path: str,
+    storage_path: str,
+    bucket: str = "generated-documents",
+    timeout: float = STORAGE_UPLOAD_TIMEOUT_SECONDS,
+) -> str:
+    """Async form of upload_file_to_storage()."""
+    upload_url, headers, public_url = _storage_target(local_path, storage_path, bucket)
+
+    try:
+        size = os.path.getsize(local_path)
+        if size >= STORAGE_RESUMABLE_THRESHOLD_BYTES:
+            upload = _ResumableUpload(local_path, storage_path, bucket, headers)
+            await _upload_resumable_async(upload, time.monotonic() + timeout)
+            logger.info(f"Upload complete: {public_url}")
+            return public_url
+        headers = dict(headers, **{"Content-Length": str(size)})
+        content = _file_chunks_async(local_path, STORAGE_STREAM_CHUNK_BYTES)
+        response = await get_async_client().post(upload_url, headers=headers, content=content, timeout=timeout)
+        return _check_upload_response(response, public_url)
+
+    except httpx.HTTPStatusError as e:
+        logger.error(f"HTTP error uploading to storage: {e.response.status_code}")
+        raise Exception(f"Storage upload HTTP error: {e.response.status_code}")
+    except Exception as e:
+        logger.error(f"Error uploading to storage: {e}")
+        raise
+
+
+def _storage_headers() -> Dict[str, str]:
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        raise ValueError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY")
+    return {
+        "apikey": SUPABASE_SERVICE_ROLE_KEY,
+        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+    }
+
+
+def upload_bytes_to_storage(
+    content: bytes,
+    storage_path: str,
+    bucket: str,
+    content_type: str = "application/octet-stream",
+) -> None:
+    """
+    Upload (upsert) in-memory content to Supabase Storage.
+
+    Raises:
+        Exception if upload fails.
+    """
+    url = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/{bucket}/{storage_path}"
+    headers = dict(_storage_headers(), **{"Content-Type": content_type, "x-upsert": "true"})
+    response = get_client().post(url, headers=headers, content=content, timeout=STORAGE_UPLOAD_TIMEOUT_SECONDS)
+    if response.status_code not in (200, 201):
+        raise Exception(f"Storage upload failed: {response.status_code} - {response.text[:200]}")
+
+
+async def upload_bytes_to_storage_async(
+    content: bytes,
+    storage_path: str,
+    bucket: str = "generated-documents",
+    timeout: float = STORAGE_UPLOAD_TIMEOUT_SECONDS,
+) -> str:
+    """
+    Upload (upsert) an in-memory document and return its public URL.
+
+    The content type follows the extension of storage_path. The body is sent in
+    one request: it is already in memory, so a retry costs no disk reads.
+
+    Raises:
+        Exception if upload fails.
+    """
+    headers = dict(_storage_headers(), **{"Content-Type": _content_type(storage_path), "x-upsert": "true"})
+    base_url = SUPABASE_URL.rstrip("/")
+    public_url = f"{base_url}/storage/v1/object/public/{bucket}/{storage_path}"
+    logger.info(f"Uploading {len(content):,} bytes from memory to {bucket}/{storage_path}")
+    response = await get_async_client().post(
+        f"{base_url}/storage/v1/object/{bucket}/{storage_path}", headers=headers, content=content, timeout=timeout
+    )
+    return _check_upload_response(response, public_url)
+
+
+def _object_info_url(storage_path: str, bucket: str) -> str:
+    return f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/authenticated/{bucket}/{storage_path}"
+
+
+def _object_exists(response: httpx.Response) -> bool:
+    # Storage answers 400 with "not_found" for missing objects in some versions
+    if response.status_code in (400, 404):
+        return False
+    response.raise_for_status()
+    return True
+
+
+def object_exists(storage_path: str, bucket: str = "generated-documents", timeout: float = SUPABASE_TIMEOUT_SECONDS) -> bool:
+    """
+    Check with a HEAD request whether an object is stored (works for private buckets).
+
+    Raises:
+        Exception for failures other than "not found".
+    """
+    response = get_client().head(_object_info_url(storage_path, bucket), headers=_storage_headers(), timeout=timeout)
+    return _object_exists(response)
+
+
+async def object_exists_async(
+    storage_path: str,
+    bucket: str = "generated-documents",
+    timeout: float = SUPABASE_TIMEOUT_SECONDS,
+) -> bool:
+    """Async form of object_exists()."""
+    response = await get_async_client().head(
+        _object_info_url(storage_path, bucket), headers=_storage_headers(), timeout=timeout
+    )
+    return _object_exists(response)
+
+
+def download_from_storage(storage_path: str, bucket: str) -> Optional[bytes]:
+    """
+    Download an object with the service role key (works for private buckets).
+
+    Returns:
+        The object bytes, or None if it does not exist.
+
+    Raises:
+        Exception for other failures.
+    """
+    url = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/{bucket}/{storage_path}"
+    response = _get(url, STORAGE_UPLOAD_TIMEOUT_SECONDS, headers=_storage_headers())
+    # Storage answers 400 with "not_found" for missing objects in some versions
+    if response.status_code in (400, 404):
+        return None
+    response.raise_for_status()
+    return response.content
+
+
+def storage_object_from_url(url: str) -> Optional[Tuple[str, str]]:
+    """
+    Split a Storage object URL (public or authenticated) into (bucket, path).
+
+    Returns:
+        None for URLs that are not objects of this project's Storage.
+    """
+    base = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/"
+    if not SUPABASE_URL or not url.startswith(base):
+        return None
+    rest = url[len(base):].split("?", 1)[0]
+    for visibility in ("public/", "authenticated/"):
+        if rest.startswith(visibility):
+            rest = rest[len(visibility):]
+            break
+    bucket, _, path = rest.partition("/")
+    return (bucket, path) if bucket and path else None
+
+
+async def create_signed_url_async(
+    storage_path: str,
+    bucket: str,
+    expires_in: int,
+    download: Optional[str] = None,
+    timeout: float = SUPABASE_TIMEOUT_SECONDS,
+) -> str:
+    """
+    Create a URL that grants read access to an object for expires_in seconds.
+
+    Args:
+        download: Filename to send in Content-Disposition when the URL is fetched.
+
+    Raises:
+        Exception if Storage refuses to sign.
+    """
+    base_url = SUPABASE_URL.rstrip("/")
+    response = await get_async_client().post(
+        f"{base_url}/storage/v1/object/sign/{bucket}/{storage_path}",
+        headers=_storage_headers(),
+        json={"expiresIn": expires_in},
+        timeout=timeout,
+    )
+    if response.status_code not in (200, 201):
+        raise Exception(f"Storage sign failed: {response.status_code} - {response.text[:200]}")
+    signed = f"{base_url}/storage/v1{response.json()['signedURL']}"
+    if download:
+        signed += ("&" if "?" in signed else "?") + urlencode({"download": download})
+    return signed
+
+
+@contextlib.asynccontextmanager
+async def open_storage_stream_async(
+    storage_path: str,
+    bucket: str,
+    timeout: float = STORAGE_UPLOAD_TIMEOUT_SECONDS,
+) -> AsyncIterator[Optional[httpx.Response]]:
+    """
+    Open an object for streaming with the service role key (works for private buckets).
+
+    Yields:
+        The response (read it with aiter_bytes), or None if the object does not exist.
+
+    Raises:
+        Exception for other failures.
+    """
+    url = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/{bucket}/{storage_path}"
+    async with get_async_client().stream("GET", url, headers=_storage_headers(), timeout=timeout) as response:
+        # Storage answers 400 with "not_found" for missing objects in some versions
+        if response.status_code in (400, 404):
+            yield None
+            return
+        response.raise_for_status()
+        yield response
+
+
+async def download_to_file_async(
+    storage_path: str,
+    bucket: str,
+    target_path: str,
+    timeout: float = STORAGE_UPLOAD_TIMEOUT_SECONDS,
+) -> bool:
+    """
+    Stream an object to target_path, without holding it in memory.
+
+    Returns:
+        False if the object does not exist.
+
+    Raises:
+        Exception for other failures (target_path is then left untouched).
+    """
+    partial = f"{target_path}.part"
+    async with open_storage_stream_async(storage_path, bucket, timeout=timeout) as response:
+        if response is None:
+            return False
+        try:
+            # Writes run in the io pool, like the reads in _file_chunks_async()
+            f = await run_in("io", open, partial, "wb")
+            try:
+                async for chunk in response.aiter_bytes(STORAGE_STREAM_CHUNK_BYTES):
+                    await run_in("io", f.write, chunk)
+            finally:
+                await run_in("io", f.close)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+    os.replace(partial, target_path)
+    return True
+
+
 if __name__ == "__main__":
     # Simple test
     logging.basicConfig(level=logging.INFO)
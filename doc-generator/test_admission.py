@@ -0,0 +1,114 @@
+"""
+Tests for admission control: bounded waiting queue, 429 hints and stage slots.
+"""
+
+import os
+import sys
+import asyncio
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from admission import AdmissionController, Overloaded
+from jobs import JobManager
+from pipeline import Stage, StagePipeline
+
+
+def test_requests_beyond_the_waiting_queue_are_rejected():
+    async def scenario():
+        admission = AdmissionController(max_active=2, max_waiting=2, queue_timeout_seconds=5, stage_limits={})
+        release = asyncio.Event()
+        outcomes = []
+
+        async def request(i):
+            try:
+                async with admission.admit():
+                    await release.wait()
+                outcomes.append("ok")
+            except Overloaded as e:
+                outcomes.append(e.retry_after)
+
+        tasks = [asyncio.ensure_future(request(i)) for i in range(6)]
+        await asyncio.sleep(0.05)
+        depth = admission.snapshot()
+        release.set()
+        await asyncio.gather(*tasks)
+        return depth, outcomes
+
+    depth, outcomes = asyncio.run(scenario())
+    assert depth["active"] == 2 and depth["waiting"] == 2
+    assert outcomes.count("ok") == 4
+    rejected = [o for o in outcomes if o != "ok"]
+    assert len(rejected) == 2 and all(1 <= r <= 60 for r in rejected)
+
+
+def test_waiting_too_long_is_rejected():
+    async def scenario():
+        admission = AdmissionController(max_active=1, max_waiting=5, queue_timeout_seconds=0.05, stage_limits={})
+        async with admission.admit():
+            with pytest.raises(Overloaded):
+                async with admission.admit():
+                    pass
+        # The slot is free again afterwards
+        async with admission.admit(timeout=0):
+            return admission.snapshot()
+
+    assert asyncio.run(scenario())["active"] == 1
+
+
+def test_stage_slots_cap_concurrency_across_pipelines():
+    peak = {"render": 0, "now": 0}
+
+    async def render(results):
+        peak["now"] += 1
+        peak["render"] = max(peak["render"], peak["now"])
+        await asyncio.sleep(0.02)
+        peak["now"] -= 1
+
+    async def noop(results):
+        return None
+
+    async def scenario():
+        admission = AdmissionController(stage_limits={"render": 2, "upload": 1})
+        limits = admission.stage_limits(["prepare", "render", "upload_docx"])
+        assert set(limits) == {"render", "upload_docx"}
+        stages = [Stage("prepare", noop), Stage("render", render, deps=["prepare"])]
+        await asyncio.gather(*(
+            StagePipeline(stages, limits=admission.stage_limits(["render"])).run_async() for _ in range(6)
+        ))
+        return admission.snapshot()["stages"]
+
+    stages = asyncio.run(scenario())
+    assert peak["render"] == 2
+    assert stages["render"] == {"limit": 2, "in_use": 0, "waiting": 0}
+
+
+def test_jobs_share_stage_slots_within_their_quota():
+    running = {"job": 0, "live": 0}
+    peak = {"job": 0, "total": 0}
+
+    def render(kind):
+        async def run(results):
+            running[kind] += 1
+            peak["job"] = max(peak["job"], running["job"])
+            peak["total"] = max(peak["total"], running["job"] + running["live"])
+            await asyncio.sleep(0.02)
+            running[kind] -= 1
+        return run
+
+    async def scenario():
+        admission = AdmissionController(stage_limits={"render": 2})
+        jobs = JobManager(runner=None, stage_workers={"render": 1})
+        job_limits = admission.stage_limits(["render"], quota=jobs.stage_limits(["render"]))
+        await asyncio.gather(
+            *(StagePipeline([Stage("render", render("job"))], limits=job_limits).run_async() for _ in range(3)),
+            *(StagePipeline([Stage("render", render("live"))], limits=admission.stage_limits(["render"])).run_async()
+              for _ in range(3)),
+        )
+        return admission.snapshot()["stages"]["render"]
+
+    stages = asyncio.run(scenario())
+    assert peak == {"job": 1, "total": 2}
+    assert stages == {"limit": 2, "in_use": 0, "waiting": 0}
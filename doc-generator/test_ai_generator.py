@@ -0,0 +1,266 @@
+"""
+Tests for the AI call layer: hedging and model fallback.
+The network call (_call_llm) is replaced with a scripted stub.
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import ai_generator
+import metrics
+from ai_prefetch import PrefetchStore, PrefetchLimitError
+
+
+def _scripted_llm(script):
+    """Return a _call_llm stand-in. script maps model -> (delay_seconds, result_or_exception)."""
+    def fake_call(prompt, attempt):
+        delay, outcome = script[attempt.model]
+        deadline = time.monotonic() + delay
+        while time.monotonic() < deadline:
+            if attempt.cancelled:
+                raise RuntimeError("cancelled")
+            time.sleep(0.005)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return fake_call
+
+
+def _configure(monkeypatch, script, fallbacks, hedge_delay=0.05, per_minute=10):
+    monkeypatch.setattr(ai_generator, "_call_llm", _scripted_llm(script))
+    monkeypatch.setattr(ai_generator, "AI_MODEL", "primary")
+    monkeypatch.setattr(ai_generator, "AI_FALLBACK_MODELS", fallbacks)
+    monkeypatch.setattr(ai_generator, "AI_HEDGE_ENABLED", True)
+    monkeypatch.setattr(ai_generator, "_hedge_delay", lambda: hedge_delay)
+    monkeypatch.setattr(ai_generator, "_hedge_budget", ai_generator._HedgeBudget(per_minute))
+
+
+def test_fast_primary_wins_without_hedge(monkeypatch):
+    _configure(monkeypatch, {"primary": (0.0, {"ok": "primary"})}, ["backup"])
+    fired = metrics.counter("ai_hedges_fired_total").value
+
+    assert ai_generator._complete_json("prompt", "test") == {"ok": "primary"}
+    assert metrics.counter("ai_hedges_fired_total").value == fired
+
+
+def test_slow_primary_is_hedged_to_fallback_model(monkeypatch):
+    _configure(monkeypatch, {
+        "primary": (2.0, {"ok": "primary"}),
+        "backup": (0.0, {"ok": "backup"}),
+    }, ["backup"])
+    won = metrics.counter("ai_hedges_won_total").value
+
+    started = time.monotonic()
+    assert ai_generator._complete_json("prompt", "test") == {"ok": "backup"}
+    assert time.monotonic() - started < 1.0
+    assert metrics.counter("ai_hedges_won_total").value == won + 1
+
+
+def test_hedge_budget_caps_hedges(monkeypatch):
+    _configure(monkeypatch, {
+        "primary": (0.2, {"ok": "primary"}),
+        "backup": (0.0, {"ok": "backup"}),
+    }, ["backup"], per_minute=0)
+
+    assert ai_generator._complete_json("prompt", "test") == {"ok": "primary"}
+
+
+def test_failed_primary_falls_through_chain(monkeypatch):
+    _configure(monkeypatch, {
+        "primary": (0.0, ValueError("bad json")),
+        "backup": (0.0, {"ok": "backup"}),
+    }, ["backup"], hedge_delay=10)
+
+    assert ai_generator._complete_json("prompt", "test") == {"ok": "backup"}
+
+
+def test_latency_window_percentile():
+    window = ai_generator._LatencyWindow(size=10)
+    assert window.percentile(90) is None
+    for v in range(1, 11):
+        window.add(float(v))
+    assert window.percentile(90) == 9.0
+    assert window.percentile(100) == 10.0
+
+
+def test_budget_exceeded_uses_fallback_content(monkeypatch):
+    _configure(monkeypatch, {"primary": (5.0, {"ok": "primary"})}, [], hedge_delay=10)
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    monkeypatch.setattr(ai_generator, "AI_MIN_BUDGET_SECONDS", 0)  # exercise the in-flight timeout
+
+    started = time.monotonic()
+    content = ai_generator.generate_rams_ai_content("Excavation for strip foundations", budget_seconds=0.2)
+    assert time.monotonic() - started < 1.0
+    assert content["AI_CONTENT_SOURCE"] == "fallback"
+    assert content["AI_SEQUENCE_OF_WORKS"]
+    # Fallback table must survive the same sanitiser as LLM output (8+ valid rows)
+    rows = ai_generator._sanitize_pipe_table(content["AI_RISK_ASSESSMENT"], min_rows=8)
+    assert len(rows.splitlines()) >= 8
+
+
+def test_cpp_fallback_classifies_activity(monkeypatch):
+    monkeypatch.delenv("OPENROUTER_API_KEY", raising=False)
+
+    content = ai_generator.generate_cpp_ai_content("Scaffold erection and roof repairs on a street-facing facade")
+    assert content["AI_CONTENT_SOURCE"] == "fallback"
+    assert "WORKING AT HEIGHT" in content["AI_RISK_MANAGEMENT"]
+    assert content["AI_CONSTRUCTION_SEQUENCE"].startswith("1. ")
+    assert content["BLUE_FLAG_SECTION_16_FACADE"] is True
+    assert content["BLUE_FLAG_PUBLIC_TRAFFIC_MGMT"] is True
+    assert content["BLUE_FLAG_SECTION_17_COMMISSIONING"] is False
+
+
+def test_empty_input_skips_fallback():
+    assert "AI_CONTENT_SOURCE" not in ai_generator.generate_rams_ai_content("  ")
+
+
+def test_prefetch_is_adopted_by_matching_context():
+    store = PrefetchStore(ttl_seconds=60, max_per_client=2, max_workers=2)
+    calls = []
+
+    def fake_generate(context):
+        calls.append(context)
+        time.sleep(0.1)
+        return {"AI_SEQUENCE_OF_WORKS": "step", "AI_CONTENT_SOURCE": "ai"}
+
+    assert store.start("client-a", "RAMS", "Project: X", fake_generate)["status"] == "started"
+    assert store.start("client-a", "RAMS", "Project: X", fake_generate)["status"] == "in_flight"
+    assert store.adopt("RAMS", "Project: Y") is None
+    assert store.adopt("RAMS", "Project: X", timeout=5)["AI_SEQUENCE_OF_WORKS"] == "step"
+    assert calls == ["Project: X"]
+
+
+def test_prefetch_per_client_cap_and_ttl():
+    store = PrefetchStore(ttl_seconds=0.2, max_per_client=1, max_workers=2)
+
+    def slow_generate(context):
+        time.sleep(0.5)
+        return {"AI_CONTENT_SOURCE": "ai"}
+
+    store.start("client-a", "CPP", "one", slow_generate)
+    with pytest.raises(PrefetchLimitError):
+        store.start("client-a", "CPP", "two", slow_generate)
+    # Other clients are not affected by client-a's cap
+    store.start("client-b", "CPP", "two", slow_generate)
+
+    time.sleep(0.3)
+    assert store.adopt("CPP", "one", timeout=0) is None  # expired
+
+
+def test_failed_prefetch_wait_counts_against_the_ai_budget(monkeypatch):
+    import main
+
+    store = PrefetchStore(ttl_seconds=60, max_per_client=2, max_workers=2)
+
+    def failing_generate(context):
+        time.sleep(0.3)
+        raise RuntimeError("model down")
+
+    budgets = []
+
+    def generate(context, budget_seconds=None):
+        budgets.append(budget_seconds)
+        return {"AI_CONTENT_SOURCE": "ai"}
+
+    monkeypatch.setattr(main, "ai_prefetch_store", store)
+    monkeypatch.setattr(main, "generate_rams_ai_content", generate)
+    store.start("client-a", "RAMS", "Project: X", failing_generate)
+
+    assert main._get_ai_content("RAMS", "Project: X", budget_seconds=1.0)["AI_CONTENT_SOURCE"] == "ai"
+    assert 0.5 < budgets[0] < 0.8  # the wait for the failed prefetch was deducted
+
+
+def test_rate_limiter_serves_waiters_in_order_and_honours_deadline():
+    from rate_limiter import AdaptiveRateLimiter, RateLimitTimeout
+    import threading
+
+    limiter = AdaptiveRateLimiter(initial_rate=20, min_rate=1, max_rate=50, burst=1, name="test-fifo")
+    limiter.acquire()  # drain the burst
+    order = []
+
+    def worker(i):
+        limiter.acquire(deadline=time.monotonic() + 5)
+        order.append(i)
+
+    threads = []
+    for i in range(4):
+        t = threading.Thread(target=worker, args=(i,))
+        t.start()
+        threads.append(t)
+        time.sleep(0.01)  # fix arrival order
+    for t in threads:
+        t.join()
+    assert order == [0, 1, 2, 3]
+
+    limiter.on_rate_limited({"retry-after": "2"})
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(deadline=time.monotonic() + 0.1)
+
+
+def test_rate_limiter_aimd():
+    from rate_limiter import AdaptiveRateLimiter
+
+    limiter = AdaptiveRateLimiter(initial_rate=1.0, min_rate=0.1, max_rate=1.1, increase_step=0.05, name="test-aimd")
+    limiter.on_rate_limited({"retry-after-ms": "10"})
+    assert limiter.rate == 0.5
+    limiter.on_success({})
+    assert abs(limiter.rate - 0.55) < 1e-9
+
+
+def test_compact_context_keeps_header_and_fits_budget():
+    from prompt_budget import compact_context, estimate_tokens, TRIM_MARKER
+
+    filler = "The client has asked for the works to be completed in a tidy manner. " * 80
+    context = (
+        "Project: Riverside Offices\nDuration: 6 weeks\nUser indicated: Structural / Height Work\n\n"
+        "Activity Description:\nReplace the roof coverings on the east wing. "
+        + filler
+        + "Scaffold access is required next to the public road."
+    )
+    compacted = compact_context(context, 200)
+
+    assert estimate_tokens(compacted) <= 200
+    assert compacted.startswith("Project: Riverside Offices\nDuration: 6 weeks")
+    assert "Replace the roof coverings" in compacted
+    assert "Scaffold access is required" in compacted  # hazard sentence kept
+    assert compacted.endswith(TRIM_MARKER)
+    assert compact_context("short context", 200) == "short context"
+
+
+def test_compact_system_prompt_chosen_per_model(monkeypatch):
+    monkeypatch.setattr(ai_generator, "AI_COMPACT_PROMPT_MODELS", ["google/gemma-*"])
+    build = ai_generator._prompt_builder("FULL", "COMPACT", "TASK", "Excavation")
+
+    assert build("google/gemma-3-4b-it:free").startswith("COMPACT")
+    assert build("meta-llama/llama-3.2-3b-instruct:free").startswith("FULL")
+
+
+def test_attempt_cancelled_while_queued_gives_its_token_back(monkeypatch):
+    from rate_limiter import AdaptiveRateLimiter
+
+    limiter = AdaptiveRateLimiter(initial_rate=0.1, min_rate=0.1, max_rate=1, burst=1, name="test-refund")
+    attempt = ai_generator._Attempt("primary", "hedge")
+    acquire = limiter.acquire
+
+    def acquire_then_lose_the_race(deadline=None):
+        waited = acquire(deadline)
+        attempt.cancel()  # another attempt won while this one held the queue slot
+        return waited
+
+    monkeypatch.setattr(limiter, "acquire", acquire_then_lose_the_race)
+    monkeypatch.setattr(ai_generator, "_rate_limiter", limiter)
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+
+    with pytest.raises(RuntimeError, match="cancelled before start"):
+        ai_generator._call_llm("prompt", attempt)
+    assert acquire(time.monotonic() + 0.1) < 0.1  # the unspent token is available again
+
+    with pytest.raises(RuntimeError, match="cancelled before start"):
+        ai_generator._call_llm("prompt", attempt)  # already cancelled: does not queue at all
+    assert limiter.queue_depth == 0 and limiter._tokens < 1
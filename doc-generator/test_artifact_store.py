@@ -0,0 +1,104 @@
+"""
+Tests for content-addressed document uploads and byte-stable outputs.
+"""
+
+import io
+import os
+import sys
+import asyncio
+import zipfile
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from artifact_store import ArtifactStore, file_sha256
+from generator import load_template, save_document
+from pdf_convert import strip_volatile_metadata
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "templates", "CPP_TEMPLATE_WORKING_v1_copy.docx")
+
+
+class _Storage:
+    objects = {}  # "bucket/path" -> bytes
+    posts = []
+
+
+def _post(request):
+    name = request.url.path[len("/storage/v1/object/"):]
+    _Storage.objects[name] = request.body()
+    _Storage.posts.append(name)
+    return 200, b""
+
+
+def _head(request):
+    name = request.url.path[len("/storage/v1/object/authenticated/"):]
+    return 200 if name in _Storage.objects else 400, b""
+
+
+@pytest.fixture
+def store(tmp_path, supabase_stub):
+    supabase_stub({("POST", "/storage/v1/object/"): _post, ("HEAD", "/storage/v1/object/authenticated/"): _head})
+    _Storage.objects, _Storage.posts = {}, []
+    store = ArtifactStore(str(tmp_path / "index.sqlite3"))
+    yield store
+    store.close()
+
+
+def _upload(store, path):
+    return asyncio.run(store.upload(str(path), "sub-1", "RAMS_sub-1", timeout=10))
+
+
+def test_identical_documents_are_uploaded_once(store, tmp_path):
+    path = tmp_path / "RAMS_sub-1_20260101_120000.pdf"
+    path.write_bytes(b"%PDF-1.6 same bytes")
+
+    first = _upload(store, path)
+    second = _upload(store, path)
+
+    digest = file_sha256(str(path))
+    assert first == {"url": first["url"], "sha256": digest, "skipped": False}
+    assert first["url"].endswith(f"/generated-documents/sub-1/RAMS_sub-1_{digest[:16]}.pdf")
+    assert second == dict(first, skipped=True)
+    assert len(_Storage.posts) == 1
+
+
+def test_missing_or_changed_objects_are_uploaded(store, tmp_path):
+    path = tmp_path / "doc.docx"
+    path.write_bytes(b"version one")
+    first = _upload(store, path)
+
+    _Storage.objects.clear()  # deleted from the bucket behind the index's back
+    assert _upload(store, path)["skipped"] is False
+
+    path.write_bytes(b"version two")
+    changed = _upload(store, path)
+    assert changed["skipped"] is False and changed["url"] != first["url"]
+    assert len(_Storage.posts) == 3
+
+
+def test_saved_documents_are_byte_stable(tmp_path):
+    outputs = []
+    for _ in range(2):
+        buffer = io.BytesIO()
+        save_document(load_template(TEMPLATE), buffer)
+        outputs.append(buffer.getvalue())
+    assert outputs[0] == outputs[1]
+    with zipfile.ZipFile(io.BytesIO(outputs[0])) as saved:
+        assert {item.date_time for item in saved.infolist()} == {(1980, 1, 1, 0, 0, 0)}
+        assert saved.testzip() is None
+
+
+def test_pdf_dates_and_id_are_blanked_in_place(tmp_path):
+    path = tmp_path / "a.pdf"
+    original = (
+        b"%PDF-1.6\n1 0 obj<</Producer(LibreOffice)/CreationDate(D:20261019130720+01'00')>>endobj\n"
+        b"trailer<</Size 3/ID [ <AB12CD> <0F0F0F> ] >>\n"
+    )
+    path.write_bytes(original)
+    assert strip_volatile_metadata(str(path)) is True
+    stripped = path.read_bytes()
+    assert len(stripped) == len(original)  # xref offsets stay valid
+    assert b"(D:19800101000000+00'00')" in stripped and b"<000000> <000000>" in stripped
+    assert strip_volatile_metadata(str(path)) is False
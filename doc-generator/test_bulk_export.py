@@ -0,0 +1,142 @@
+"""
+Tests for the streamed bulk ZIP export, against stub PostgREST and Storage servers.
+"""
+
+import io
+import os
+import sys
+import json
+import asyncio
+import zipfile
+import tracemalloc
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import main
+from bulk_export import export_filters, iter_submissions, stream_zip, MANIFEST_NAME
+
+
+def _document(n, size=200_000):
+    return bytes([n]) * size
+
+
+class _Backend:
+    rows = []
+    queries = []
+
+
+def _submissions(request):
+    params = request.query
+    _Backend.queries.append(params)
+    rows = sorted(_Backend.rows, key=lambda row: row["id"])
+    for column, condition in params:
+        op, _, value = condition.partition(".")
+        if column == "product":
+            rows = [row for row in rows if row["product"] == value]
+        elif column == "id" and op == "in":
+            rows = [row for row in rows if row["id"] in value.strip("()").split(",")]
+        elif column == "id" and op == "gt":
+            rows = [row for row in rows if row["id"] > value]
+    limit = int(dict(params)["limit"])
+    return 200, json.dumps(rows[:limit]).encode()
+
+
+def _stored_document(request):
+    name = request.url.path.rsplit("/", 1)[1]
+    if name.startswith("missing"):
+        return 400, b'{"error": "not_found"}'
+    return 200, _document(int(name.split(".")[0]))
+
+
+@pytest.fixture
+def backend(supabase_stub):
+    base = supabase_stub({
+        ("GET", "/rest/v1/submissions"): _submissions,
+        ("GET", "/storage/v1/object/generated-documents/"): _stored_document,
+    })
+    public = f"{base}/storage/v1/object/public/generated-documents"
+    _Backend.rows = [
+        {"id": f"sub-{n}", "product": "RAMS" if n % 2 else "CPP",
+         "outputs": {"docx_url": f"{public}/{n}.docx", "pdf_url": f"{public}/{n}.pdf" if n != 3 else None}}
+        for n in range(1, 6)
+    ]
+    _Backend.rows[3]["outputs"]["docx_url"] = f"{public}/missing.docx"  # sub-4: gone from Storage
+    _Backend.queries = []
+    return base
+
+
+def _export(rows, **kwargs):
+    async def scenario():
+        return b"".join([chunk async for chunk in stream_zip(rows, **kwargs)])
+    return zipfile.ZipFile(io.BytesIO(asyncio.run(scenario())))
+
+
+def test_filters_are_paged_by_id(backend):
+    async def scenario():
+        return [row["id"] async for row in iter_submissions(filters=export_filters(product="rams"), page_size=2)]
+
+    assert asyncio.run(scenario()) == ["sub-1", "sub-3", "sub-5"]
+    assert [dict(query).get("id") for query in _Backend.queries] == [None, "gt.sub-3"]
+
+
+def test_project_and_date_filters():
+    assert export_filters(project='Tower "B", Phase 2', created_from="2026-01-01", created_to="2026-02-01") == [
+        ("or", '(placeholders->>CPP_PROJECT_TITLE.eq."Tower \\"B\\", Phase 2",'
+               'placeholders->>RAMS_TITLE.eq."Tower \\"B\\", Phase 2")'),
+        ("created_at", "gte.2026-01-01"),
+        ("created_at", "lt.2026-02-01"),
+    ]
+
+
+def test_archive_contains_documents_and_lists_missing_ones(backend):
+    archive = _export(iter_submissions(["sub-5", "sub-4", "sub-3"], page_size=2), concurrency=3)
+
+    assert archive.testzip() is None
+    assert archive.namelist() == [
+        "RAMS/RAMS-sub-3.docx", "CPP/CPP-sub-4.pdf", "RAMS/RAMS-sub-5.docx", "RAMS/RAMS-sub-5.pdf", MANIFEST_NAME,
+    ]
+    assert archive.read("RAMS/RAMS-sub-5.pdf") == _document(5)
+    missing = json.loads(archive.read(MANIFEST_NAME))["missing"]
+    assert sorted(item["name"] for item in missing) == ["CPP/CPP-sub-4.docx", "RAMS/RAMS-sub-3.pdf"]
+
+
+def test_memory_stays_flat_while_streaming(backend):
+    async def rows():
+        for n in range(40):
+            yield {"id": f"sub-{n}", "product": "CPP", "outputs": {
+                "pdf_url": f"{backend}/storage/v1/object/public/generated-documents/{n % 5 + 1}.pdf",
+            }}
+
+    async def scenario():
+        total = largest = 0
+        tracemalloc.start()
+        async for chunk in stream_zip(rows(), formats=["pdf"], concurrency=4):
+            total += len(chunk)
+            largest = max(largest, len(chunk))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return total, largest, peak
+
+    total, largest, peak = asyncio.run(scenario())
+    assert total > 40 * 200_000
+    assert largest < 128 * 1024
+    assert peak < 3 * 1024 * 1024  # a fraction of the 8 MB archive
+
+
+def test_export_endpoint_streams_a_zip(backend):
+    client = TestClient(main.app)
+    response = client.post("/export", json={"product": "CPP", "formats": ["pdf"]})
+    assert response.status_code == 200 and response.headers["content-type"] == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.namelist() == ["CPP/CPP-sub-2.pdf", "CPP/CPP-sub-4.pdf"]
+
+    assert client.post("/export", json={}).status_code == 400
+    assert client.post("/export", json={"product": "CPP", "formats": ["xlsx"]}).status_code == 400
+    assert client.post("/export", json={"submission_ids": ["1b9d6bcd-bbfd-4b2d-9b5d-ab8dfbbd4bed"]}).status_code == 404
+    # IDs go into a PostgREST in.(...) filter, so anything but a UUID is refused
+    response = client.post("/export", json={"submission_ids": ["sub-1),id.neq.(x"]})
+    assert response.status_code == 400 and "Invalid submission IDs" in response.json()["detail"]
@@ -0,0 +1,156 @@
+"""
+Tests for the stage checkpoint ledger and resuming a failed pipeline run.
+"""
+
+import os
+import sys
+import asyncio
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from checkpoints import Checkpoint, CheckpointLedger, ResumePlan, _MISSING
+from pipeline import Stage, StagePipeline
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = CheckpointLedger(str(tmp_path / "ledger"), mirror_bucket="")
+    yield ledger
+    ledger.close()
+
+
+def test_files_are_kept_and_restored(ledger, tmp_path):
+    docx = tmp_path / "out" / "doc.docx"
+    docx.parent.mkdir()
+    docx.write_bytes(b"docx bytes")
+    ledger.save("sub-1", "hash-a", "render", str(docx), [str(docx)])
+
+    docx.unlink()
+    assert ledger.load("sub-1", "hash-a", "render") == str(docx)
+    assert docx.read_bytes() == b"docx bytes"
+
+
+def test_files_are_restored_into_the_resuming_run(ledger, tmp_path):
+    old_temp, new_temp, output = tmp_path / "doc_gen_old", tmp_path / "doc_gen_new", tmp_path / "output"
+    old_temp.mkdir()
+    (old_temp / "logo.png").write_bytes(b"png")
+    ledger.save("sub-1", "hash-a", "images", {"LOGO": str(old_temp / "logo.png")}, [str(old_temp / "logo.png")])
+    output.mkdir()
+    (output / "RAMS_old.docx").write_bytes(b"docx")
+    os.utime(output / "RAMS_old.docx", (1, 1))
+    ledger.save("sub-1", "hash-a", "render", str(output / "RAMS_old.docx"), [str(output / "RAMS_old.docx")])
+    for path in (old_temp / "logo.png", output / "RAMS_old.docx"):
+        path.unlink()
+    old_temp.rmdir()
+
+    def relocate(stage, path):
+        if stage == "images":
+            return str(new_temp / os.path.basename(path))
+        return str(output / ("RAMS_new" + os.path.splitext(path)[1]))
+
+    checkpoints = {"images": Checkpoint(), "render": Checkpoint()}
+    plan = ResumePlan(ledger, "sub-1", "hash-a", checkpoints, relocate)
+    run = StagePipeline(plan.wrap([
+        Stage("images", lambda r: pytest.fail("images ran again")),
+        Stage("render", lambda r: pytest.fail("render ran again"), deps=["images"]),
+    ])).run()
+
+    assert run.results["images"] == {"LOGO": str(new_temp / "logo.png")}
+    assert run.results["render"] == str(output / "RAMS_new.docx")
+    assert (new_temp / "logo.png").read_bytes() == b"png" and not old_temp.exists()
+    assert os.path.getmtime(output / "RAMS_new.docx") > 1  # not evicted as old
+
+
+def test_other_inputs_do_not_match_and_replace_old_checkpoints(ledger):
+    ledger.save("sub-1", "hash-a", "ai", {"AI_X": "old"})
+    assert ledger.load("sub-1", "hash-b", "ai") is _MISSING
+
+    ledger.save("sub-1", "hash-b", "images", {})
+    assert ledger.load("sub-1", "hash-a", "ai") is _MISSING
+    assert ledger.load("sub-1", "hash-b", "images") == {}
+
+
+def _pipeline(calls, fail_at=None):
+    def stage(name):
+        def fn(results):
+            calls.append(name)
+            if name == fail_at:
+                raise RuntimeError(f"{name} failed")
+            return f"{name}-result"
+        return fn
+
+    return [
+        Stage("ai", stage("ai")),
+        Stage("images", stage("images")),
+        Stage("render", stage("render"), deps=["ai", "images"]),
+        Stage("pdf", stage("pdf"), deps=["render"]),
+        Stage("outputs", stage("outputs"), deps=["pdf"]),
+    ]
+
+
+CHECKPOINTS = {name: Checkpoint() for name in ("ai", "images", "render", "pdf")}
+
+
+def _run(ledger, calls, fail_at=None, checkpoints=CHECKPOINTS, input_hash="hash-a"):
+    plan = ResumePlan(ledger, "sub-1", input_hash, checkpoints)
+    pipeline = StagePipeline(plan.wrap(_pipeline(calls, fail_at)))
+    try:
+        pipeline.run()
+    except RuntimeError:
+        pass
+    return plan
+
+
+def test_retry_resumes_at_first_incomplete_stage(ledger):
+    first = []
+    _run(ledger, first, fail_at="pdf")
+    assert sorted(first) == ["ai", "images", "pdf", "render"]
+
+    retry = []
+    plan = _run(ledger, retry)
+    assert retry == ["pdf", "outputs"]
+    assert sorted(plan.restored) == ["ai", "images", "render"]
+    assert plan.complete
+
+
+def test_stages_after_a_rerun_stage_run_again(ledger):
+    _run(ledger, [], fail_at="outputs")
+    ledger.clear("sub-1")
+    ledger.save("sub-1", "hash-a", "ai", "ai-result")
+    ledger.save("sub-1", "hash-a", "pdf", "pdf-result")  # recorded, but its input will be re-rendered
+
+    calls = []
+    _run(ledger, calls)
+    assert sorted(calls) == ["images", "outputs", "pdf", "render"]
+
+
+def test_results_rejected_by_keep_are_not_reused(ledger):
+    checkpoints = dict(CHECKPOINTS, ai=Checkpoint(keep=lambda value: False))
+    _run(ledger, [], fail_at="pdf", checkpoints=checkpoints)
+
+    calls = []
+    plan = _run(ledger, calls, checkpoints=checkpoints)
+    assert sorted(calls) == ["ai", "outputs", "pdf", "render"]
+    assert plan.restored == ["images"]
+
+
+def test_async_stages_are_checkpointed(ledger):
+    calls = []
+
+    async def fetch(results):
+        calls.append("fetch")
+        return {"url": "https://example/doc.docx"}
+
+    async def scenario():
+        for _ in range(2):
+            plan = ResumePlan(ledger, "sub-2", "h", {"fetch": Checkpoint()})
+            run = await StagePipeline(plan.wrap([Stage("fetch", fetch)])).run_async()
+        return run.results["fetch"], plan.restored
+
+    result, restored = asyncio.run(scenario())
+    assert calls == ["fetch"]
+    assert result == {"url": "https://example/doc.docx"}
+    assert restored == ["fetch"]
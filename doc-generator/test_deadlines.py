@@ -0,0 +1,70 @@
+"""
+Tests for per-request deadlines and how the steps degrade when time is short.
+"""
+
+import os
+import sys
+import time
+import stat
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import ai_generator
+import deadlines
+from deadlines import Deadline, DeadlineExceeded
+from pdf_convert import convert_to_pdf, LibreOfficeError
+
+
+def test_header_is_relative_seconds_or_absolute_timestamp():
+    assert 44 < Deadline.from_header("45").remaining() <= 45
+    assert 9 < Deadline.from_header(str(time.time() + 10)).remaining() <= 10
+    assert Deadline.from_header(str(time.time() - 5)).remaining() == 0
+
+
+def test_header_defaults_and_cap(monkeypatch):
+    monkeypatch.setattr(deadlines, "REQUEST_DEADLINE_MAX_SECONDS", 60)
+    assert Deadline.from_header("not-a-number", default=20).seconds == 20
+    assert Deadline.from_header(None, default=20).seconds == 20
+    assert Deadline.from_header("3600").seconds == 60
+
+
+def test_required_steps_get_the_remaining_time_or_fail_fast():
+    deadline = Deadline(10)
+    assert 9 < deadline.timeout(30, "fetch") <= 10
+    assert deadline.timeout(2, "fetch") == 2
+    with pytest.raises(DeadlineExceeded, match="before upload"):
+        Deadline(0.1).check("upload")
+
+
+def test_optional_budgets_keep_the_reserve():
+    deadline = Deadline(30)
+    assert 9 < deadline.budget(60, reserve=20) <= 10
+    assert deadline.budget(5) == 5
+    assert Deadline(5).budget(60, reserve=20) == 0
+
+
+def test_short_ai_budget_uses_fallback_without_calling_the_model(monkeypatch):
+    def no_call(prompt, attempt):
+        raise AssertionError("LLM must not be called")
+
+    monkeypatch.setattr(ai_generator, "_call_llm", no_call)
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    content = ai_generator.generate_rams_ai_content("Roof repairs", budget_seconds=1)
+    assert content["AI_CONTENT_SOURCE"] == "fallback"
+
+
+def test_soffice_is_killed_at_the_budget(tmp_path, monkeypatch):
+    slow = tmp_path / "soffice"
+    slow.write_text("#!/bin/sh\nsleep 5\n")
+    slow.chmod(slow.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr("pdf_convert.LIBREOFFICE_BIN", str(slow))
+    docx = tmp_path / "doc.docx"
+    docx.write_bytes(b"docx")
+
+    started = time.monotonic()
+    with pytest.raises(LibreOfficeError, match="timed out"):
+        convert_to_pdf(str(docx), str(tmp_path), timeout=0.3)
+    assert time.monotonic() - started < 2
@@ -0,0 +1,115 @@
+"""
+Tests for scoped temp directories and OUTPUT_DIR eviction.
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import main
+from disk_lifecycle import OutputJanitor, scoped_temp_dir, sweep_temp_dirs
+from downloads import MetadataCache
+
+
+def _file(directory, name, size, age_seconds=0):
+    path = directory / name
+    path.write_bytes(b"x" * size)
+    mtime = time.time() - age_seconds
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_scoped_temp_dirs_are_removed_even_on_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    with pytest.raises(RuntimeError):
+        with scoped_temp_dir() as temp_dir:
+            open(os.path.join(temp_dir, "image.png"), "wb").close()
+            raise RuntimeError("render failed")
+    assert os.listdir(tmp_path) == []
+
+
+def test_orphaned_temp_dirs_are_swept(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    orphan = tmp_path / "doc_gen_orphan"
+    orphan.mkdir()
+    os.utime(orphan, (1, 1))
+    (tmp_path / "doc_gen_recent").mkdir()
+    (tmp_path / "other").mkdir()
+    os.utime(tmp_path / "other", (1, 1))
+
+    with scoped_temp_dir() as active:
+        os.utime(active, (1, 1))
+        assert sweep_temp_dirs() == 1
+        assert os.path.isdir(active)
+    assert sorted(os.listdir(tmp_path)) == ["doc_gen_recent", "other"]
+
+
+def test_sweep_removes_expired_files_except_pinned(tmp_path):
+    janitor = OutputJanitor(str(tmp_path), max_age_seconds=3600, max_bytes=0, min_free_bytes=0)
+    old = _file(tmp_path, "old.docx", 10, age_seconds=7200)
+    served = _file(tmp_path, "served.pdf", 10, age_seconds=7200)
+    _file(tmp_path, "new.docx", 10)
+    _file(tmp_path, ".gitkeep", 0, age_seconds=7200)
+
+    with janitor.pinned(served):
+        assert janitor.sweep() == 1
+    assert not os.path.exists(old)
+    assert sorted(os.listdir(tmp_path)) == [".gitkeep", "new.docx", "served.pdf"]
+    assert janitor.snapshot()["output_bytes"] == 20
+
+
+def test_size_cap_evicts_oldest_and_only_copies_last(tmp_path):
+    janitor = OutputJanitor(str(tmp_path), max_age_seconds=0, max_bytes=1000, min_free_bytes=0)
+    only_copy = _file(tmp_path, "a.docx", 400, age_seconds=400)
+    _file(tmp_path, "b.docx", 400, age_seconds=300)
+    _file(tmp_path, "c.docx", 400, age_seconds=200)
+    janitor.keep(only_copy)
+
+    assert janitor.sweep() == 1  # 1200 bytes -> 800, under 90% of the cap
+    assert sorted(os.listdir(tmp_path)) == ["a.docx", "c.docx"]
+
+
+def test_low_free_space_evicts_before_rendering(tmp_path, monkeypatch):
+    janitor = OutputJanitor(str(tmp_path), max_age_seconds=0, max_bytes=0, min_free_bytes=1000)
+    _file(tmp_path, "a.docx", 600, age_seconds=300)
+    _file(tmp_path, "b.docx", 600, age_seconds=200)
+    _file(tmp_path, "c.docx", 600, age_seconds=100)
+    monkeypatch.setattr(janitor, "free_bytes", lambda: 100)
+
+    assert janitor.ensure_free() == 2  # 100 + 600 + 600 >= 1000
+    assert os.listdir(tmp_path) == ["c.docx"]
+    monkeypatch.setattr(janitor, "free_bytes", lambda: 5000)
+    assert janitor.ensure_free() == 0
+
+
+def test_local_downloads_are_pinned_while_sent(tmp_path, monkeypatch):
+    document = _file(tmp_path, "RAMS_sub.pdf", 1000, age_seconds=7200)
+    janitor = OutputJanitor(str(tmp_path), max_age_seconds=3600, max_bytes=0, min_free_bytes=0)
+    pins = []
+    real_pin = janitor.pin
+
+    def pin(*paths):
+        real_pin(*paths)
+        pins.append(janitor.snapshot()["pinned_files"])
+
+    monkeypatch.setattr(janitor, "pin", pin)
+    monkeypatch.setattr(main, "output_janitor", janitor)
+
+    async def get_submission_async(submission_id, columns="*", timeout=None):
+        return {"product": "RAMS", "outputs": {"pdf_path": document}}
+
+    monkeypatch.setattr(main, "get_submission_async", get_submission_async)
+    monkeypatch.setattr(main, "download_metadata", MetadataCache(ttl_seconds=0))
+
+    response = TestClient(main.app).get("/download/sub-1", params={"format": "pdf"})
+    assert response.status_code == 200 and len(response.content) == 1000
+    assert pins == [1] and janitor.snapshot()["pinned_files"] == 0  # released once sent
+    assert janitor.sweep() == 1
+
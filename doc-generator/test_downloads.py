@@ -0,0 +1,153 @@
+"""
+Tests for /download: redirects, signed URLs, the local document cache and the lookup cache.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import main
+import downloads
+from downloads import ArtifactCache, MetadataCache
+
+DOCUMENT = os.urandom(50_000)
+DIGEST = hashlib.sha256(DOCUMENT).hexdigest()
+
+
+class _Storage:
+    gets = []
+
+
+def _get(request):
+    _Storage.gets.append(request.path)
+    if request.path == "/storage/v1/object/generated-documents/sub-1/RAMS.pdf":
+        return 200, DOCUMENT
+    return 400, b'{"error": "not_found"}'
+
+
+def _sign(request):
+    request.body()
+    path = request.url.path[len("/storage/v1/object/sign/"):]
+    return 200, json.dumps({"signedURL": f"/object/sign/{path}?token=abc"}).encode()
+
+
+@pytest.fixture
+def storage(supabase_stub):
+    _Storage.gets = []
+    return supabase_stub({("GET", "/storage/"): _get, ("POST", "/storage/v1/object/sign/"): _sign})
+
+
+@pytest.fixture
+def client(storage, monkeypatch):
+    lookups = []
+
+    async def get_submission_async(submission_id, columns="*", timeout=None):
+        lookups.append(submission_id)
+        return {"product": "RAMS", "outputs": {
+            "pdf_url": f"{storage}/storage/v1/object/public/generated-documents/sub-1/RAMS.pdf",
+            "pdf_sha256": DIGEST,
+        }}
+
+    monkeypatch.setattr(main, "get_submission_async", get_submission_async)
+    monkeypatch.setattr(main, "download_metadata", MetadataCache(ttl_seconds=60))
+    test_client = TestClient(main.app)  # not entered, so the startup hooks (workers, render pool) do not run
+    test_client.lookups = lookups
+    return test_client
+
+
+def test_downloads_redirect_to_the_stored_document(client, storage):
+    response = client.get("/download/sub-1", params={"format": "pdf"}, follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == (
+        f"{storage}/storage/v1/object/public/generated-documents/sub-1/RAMS.pdf?download=RAMS-sub-1.pdf"
+    )
+    assert client.get("/download/sub-1", params={"format": "docx"}).status_code == 404
+    assert client.lookups == ["sub-1"]  # second request answered from the lookup cache
+
+
+def test_downloads_can_redirect_to_signed_urls(client, storage, monkeypatch):
+    monkeypatch.setattr(downloads, "DOWNLOAD_SIGNED_URL_SECONDS", 60)
+    response = client.get("/download/sub-1", params={"format": "pdf"}, follow_redirects=False)
+    assert response.headers["location"] == (
+        f"{storage}/storage/v1/object/sign/generated-documents/sub-1/RAMS.pdf?token=abc&download=RAMS-sub-1.pdf"
+    )
+
+
+def test_cached_downloads_support_etags_and_ranges(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "download_cache", ArtifactCache(str(tmp_path)))
+
+    full = client.get("/download/sub-1", params={"format": "pdf"})
+    assert full.status_code == 200 and full.content == DOCUMENT
+    assert full.headers["etag"] == f'"{DIGEST}"'
+    assert 'filename="RAMS-sub-1.pdf"' in full.headers["content-disposition"]
+
+    revalidated = client.get("/download/sub-1", params={"format": "pdf"}, headers={"If-None-Match": f'"{DIGEST}"'})
+    assert revalidated.status_code == 304
+
+    part = client.get("/download/sub-1", params={"format": "pdf"}, headers={"Range": "bytes=100-199"})
+    assert part.status_code == 206 and part.content == DOCUMENT[100:200]
+    assert len(_Storage.gets) == 1  # fetched from storage once
+
+
+def test_artifact_cache_checks_hashes_and_evicts_least_recent(storage, tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=60_000)
+    url = f"{storage}/storage/v1/object/public/generated-documents/sub-1/RAMS.pdf"
+
+    with pytest.raises(Exception, match="does not match"):
+        asyncio.run(cache.fetch(url, "0" * 64, "pdf", timeout=10))
+    assert os.listdir(tmp_path) == []
+    assert asyncio.run(cache.fetch(f"{storage}/storage/v1/object/public/generated-documents/gone.pdf", None, "pdf", 10)) is None
+
+    path = asyncio.run(cache.fetch(url, DIGEST, "pdf", timeout=10))
+    older = tmp_path / "older.docx"
+    older.write_bytes(b"x" * 20_000)
+    os.utime(older, (1, 1))
+    assert cache.evict() == 1
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+
+def test_metadata_cache_expires_and_invalidates():
+    async def scenario():
+        loads = []
+
+        async def load():
+            loads.append(1)
+            return {"outputs": {}}
+
+        cache = MetadataCache(ttl_seconds=60)
+        await cache.get("sub-1", load)
+        await cache.get("sub-1", load)
+        cache.invalidate("sub-1")
+        await cache.get("sub-1", load)
+        expired = MetadataCache(ttl_seconds=0)
+        await expired.get("sub-1", load)
+        await expired.get("sub-1", load)
+        return len(loads)
+
+    assert asyncio.run(scenario()) == 4
+
+
+def test_storage_downloads_write_through_the_io_pool(storage, tmp_path, monkeypatch):
+    import supabase_client
+
+    pools = []
+
+    async def run_in(pool, fn, *args):
+        pools.append(pool)
+        return fn(*args)
+
+    monkeypatch.setattr(supabase_client, "run_in", run_in)
+    target = str(tmp_path / "RAMS.pdf")
+    assert asyncio.run(supabase_client.download_to_file_async("sub-1/RAMS.pdf", "generated-documents", target))
+    with open(target, "rb") as f:
+        assert f.read() == DOCUMENT
+    assert pools and set(pools) == {"io"}
+    assert not os.path.exists(target + ".part")
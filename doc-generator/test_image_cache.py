@@ -0,0 +1,143 @@
+"""
+Tests for the local image cache: revalidation, normalised copies and eviction.
+"""
+
+import io
+import os
+import sys
+import asyncio
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from image_cache import ImageCache, normalise_image, target_pixels
+
+
+def _png(size, color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+BIG_LOGO = _png((2000, 2000))
+SMALL_LOGO = _png((100, 100), "blue")
+FILES = {}
+SENT = []  # paths answered with a body
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = FILES[self.path]
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if self.path.startswith("/etag") and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        if self.path.startswith("/dated") and self.headers.get("If-Modified-Since"):
+            self.send_response(304)
+            self.end_headers()
+            return
+        SENT.append(self.path)
+        self.send_response(200)
+        if self.path.startswith("/etag"):
+            self.send_header("ETag", etag)
+        else:
+            self.send_header("Last-Modified", "Mon, 05 Jan 2026 10:00:00 GMT")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ImageCache(str(tmp_path / "cache"), dpi=200)
+    yield cache
+    cache.close()
+
+
+def _fetch(cache, uploads, dest):
+    return asyncio.run(cache.fetch(uploads, str(dest)))
+
+
+def test_revalidates_with_etag_and_serves_cached_copy(server, cache, tmp_path):
+    FILES["/etag/logo.png"] = BIG_LOGO
+    SENT.clear()
+    uploads = {"CPP_LOGO_COVER_MIDDLE_IMG": f"{server}/etag/logo.png"}
+
+    first = _fetch(cache, uploads, tmp_path / "one")["CPP_LOGO_COVER_MIDDLE_IMG"]
+    second = _fetch(cache, uploads, tmp_path / "two")["CPP_LOGO_COVER_MIDDLE_IMG"]
+
+    assert (first.cache, second.cache) == ("miss", "hit")
+    assert SENT == ["/etag/logo.png"]  # the second request got a 304
+    assert second.path == str(tmp_path / "two" / "CPP_LOGO_COVER_MIDDLE_IMG.png")
+    # Pre-resized to the 1.43" cover logo at 200 dpi
+    with Image.open(second.path) as image:
+        assert image.size == target_pixels("CPP_LOGO_COVER_MIDDLE_IMG", 200) == (286, 286)
+    assert open(first.path, "rb").read() == open(second.path, "rb").read()
+    assert os.listdir(tmp_path / "two") == ["CPP_LOGO_COVER_MIDDLE_IMG.png"]
+
+
+def test_changed_content_is_downloaded_again(server, cache, tmp_path):
+    FILES["/etag/changing.png"] = SMALL_LOGO
+    uploads = {"RAMS_COVER_PAGE_LOGO_IMG": f"{server}/etag/changing.png"}
+    _fetch(cache, uploads, tmp_path / "one")
+
+    FILES["/etag/changing.png"] = _png((100, 100), "green")
+    result = _fetch(cache, uploads, tmp_path / "two")["RAMS_COVER_PAGE_LOGO_IMG"]
+    assert result.cache == "miss"
+    # Already small enough, so the original bytes are embedded as they are
+    assert open(result.path, "rb").read() == FILES["/etag/changing.png"]
+
+
+def test_last_modified_revalidation(server, cache, tmp_path):
+    FILES["/dated/map.png"] = SMALL_LOGO
+    uploads = {"RAMS_NEAREST_HOSPITAL_IMG": f"{server}/dated/map.png"}
+    _fetch(cache, uploads, tmp_path / "one")
+    result = _fetch(cache, uploads, tmp_path / "two")["RAMS_NEAREST_HOSPITAL_IMG"]
+    assert result.cache == "hit"
+    # Already small enough, so the cached original is handed out, still with its extension
+    assert result.path == str(tmp_path / "two" / "RAMS_NEAREST_HOSPITAL_IMG.png")
+
+
+def test_eviction_keeps_files_already_handed_out(server, tmp_path):
+    FILES["/etag/a.png"] = BIG_LOGO
+    FILES["/etag/b.png"] = _png((2000, 2000), "blue")
+    cache = ImageCache(str(tmp_path / "cache"), max_bytes=len(BIG_LOGO), dpi=200)
+    try:
+        first = _fetch(cache, {"LOGO": f"{server}/etag/a.png"}, tmp_path / "one")["LOGO"]
+        _fetch(cache, {"LOGO": f"{server}/etag/b.png"}, tmp_path / "two")
+        with cache._lock:
+            names = [row[0] for row in cache._db().execute("SELECT name FROM files")]
+        assert not any(name.startswith(hashlib.sha256(BIG_LOGO).hexdigest()) for name in names)
+        assert os.path.exists(first.path)  # the earlier caller's copy survives eviction
+    finally:
+        cache.close()
+
+
+def test_normalise_applies_exif_rotation(tmp_path):
+    source = tmp_path / "photo.jpg"
+    image = Image.new("RGB", (300, 100), "white")
+    exif = image.getexif()
+    exif[0x0112] = 6  # rotate 90 degrees clockwise
+    image.save(source, "JPEG", exif=exif)
+
+    written = normalise_image(str(source), str(tmp_path / "out"), (400, 0))
+    with Image.open(written) as result:
+        assert written.endswith(".jpg") and result.size == (100, 300)
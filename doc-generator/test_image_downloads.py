@@ -0,0 +1,94 @@
+"""
+Tests for streaming image downloads, against a local HTTP server.
+"""
+
+import os
+import sys
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from image_downloads import download_images, sniff_image_type
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 200_000
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 1000
+FILES = {
+    "/logo.png": PNG,
+    "/photo": JPEG,
+    "/notes.png": b"<html>not an image</html>",
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = FILES.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        if self.path != "/photo":  # one response without Content-Length
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def test_sniff_image_type():
+    assert sniff_image_type(PNG[:8]) == "png"
+    assert sniff_image_type(JPEG[:8]) == "jpg"
+    assert sniff_image_type(b"GIF89a\x01\x00") == "gif"
+    assert sniff_image_type(b"%PDF-1.7") is None
+
+
+def test_downloads_stream_to_disk_with_timings(server, tmp_path):
+    results = asyncio.run(download_images(
+        {"LOGO": f"{server}/logo.png", "PHOTO": f"{server}/photo", "EMPTY": ""}, str(tmp_path),
+    ))
+    assert set(results) == {"LOGO", "PHOTO"}
+    logo, photo = results["LOGO"], results["PHOTO"]
+    assert logo.path == str(tmp_path / "LOGO.png") and logo.error is None
+    assert open(logo.path, "rb").read() == PNG
+    # Extension comes from the bytes, not the URL
+    assert photo.path.endswith("PHOTO.jpg") and photo.bytes == len(JPEG)
+    assert logo.seconds > 0 and photo.to_dict()["bytes"] == len(JPEG)
+    assert sorted(os.listdir(tmp_path)) == ["LOGO.png", "PHOTO.jpg"]
+
+
+def test_rejects_non_images_missing_files_and_oversized_files(server, tmp_path):
+    results = asyncio.run(download_images(
+        {"NOTES": f"{server}/notes.png", "GONE": f"{server}/missing.png", "LOGO": f"{server}/logo.png"},
+        str(tmp_path),
+        max_bytes=100_000,
+    ))
+    assert "Not a supported image" in results["NOTES"].error
+    assert "404" in results["GONE"].error
+    assert "byte limit" in results["LOGO"].error
+    assert all(result.path is None for result in results.values())
+    assert os.listdir(tmp_path) == []  # partial files are removed
+
+
+def test_total_limit_caps_the_whole_set(server, tmp_path):
+    results = asyncio.run(download_images(
+        {"A": f"{server}/logo.png", "B": f"{server}/logo.png", "C": f"{server}/photo"},
+        str(tmp_path),
+        max_total_bytes=300_000,
+    ))
+    failed = [key for key, result in results.items() if result.error]
+    assert failed and all("total limit" in results[key].error for key in failed)
+    assert sum(result.bytes for result in results.values() if result.path) <= 300_000
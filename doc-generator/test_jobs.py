@@ -0,0 +1,151 @@
+"""
+Tests for the background job queue: progress, deadlines, queue bound and stage limits.
+"""
+
+import os
+import sys
+import asyncio
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from jobs import JobManager, JobQueueFull, JobError, parse_stage_workers
+from pipeline import Stage, StagePipeline
+
+
+async def _wait_for(manager, job_id, statuses=("succeeded", "failed", "expired"), timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        job = manager.get(job_id)
+        if job.status in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} stuck in {manager.get(job_id).status}")
+
+
+def _pipeline_runner(delay=0.05):
+    async def step(results):
+        await asyncio.sleep(delay)
+        return True
+
+    async def runner(job, stage_limits):
+        stages = [Stage("a", step), Stage("b", step, deps=["a"]), Stage("c", step, deps=["b"])]
+        await StagePipeline(stages, limits=stage_limits([s.name for s in stages])).run_async(on_stage=job.on_stage)
+        return {"submission_id": job.payload["submission_id"]}
+    return runner
+
+
+def test_job_reports_progress_and_result():
+    async def scenario():
+        manager = JobManager(_pipeline_runner(), workers=1, max_queued=5, stage_workers={})
+        job = manager.submit({"submission_id": "sub-1"})
+        assert job.status == "queued"
+
+        seen_running = None
+        for _ in range(200):
+            if job.status == "running" and job.stages:
+                seen_running = (list(job.stages), job.progress)
+                break
+            await asyncio.sleep(0.005)
+        done = await _wait_for(manager, job.id)
+        await manager.stop()
+        return seen_running, done.to_dict()
+
+    running, final = asyncio.run(scenario())
+    assert running[0] in (["a"], ["b"], ["c"])
+    assert 0 <= running[1] < 1
+    assert final["status"] == "succeeded"
+    assert final["progress"] == 1.0
+    assert final["result"] == {"submission_id": "sub-1"}
+
+
+def test_deadlines_expire_queued_and_cancel_running_jobs():
+    async def scenario():
+        async def slow(job, stage_limits):
+            await asyncio.sleep(1)
+            return {}
+
+        manager = JobManager(slow, workers=1, max_queued=5, stage_workers={})
+        running = manager.submit({"submission_id": "slow"}, deadline_seconds=0.1)
+        queued = manager.submit({"submission_id": "late"}, deadline_seconds=0.05)
+        first = await _wait_for(manager, running.id)
+        second = await _wait_for(manager, queued.id)
+        await manager.stop()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.status == "failed" and first.error_code == 504
+    assert second.status == "expired"
+
+
+def test_queue_is_bounded_and_job_errors_keep_status_code():
+    async def scenario():
+        async def not_found(job, stage_limits):
+            raise JobError("Submission not found", 404)
+
+        # No workers, so submitted jobs stay queued
+        idle = JobManager(not_found, workers=0, max_queued=1, stage_workers={})
+        idle.submit({"submission_id": "one"})
+        try:
+            idle.submit({"submission_id": "two"})
+            rejected = False
+        except JobQueueFull:
+            rejected = True
+
+        manager2 = JobManager(not_found, workers=1, max_queued=1, stage_workers={})
+        failed = await _wait_for(manager2, manager2.submit({"submission_id": "x"}).id)
+        await manager2.stop()
+        return rejected, failed
+
+    rejected, failed = asyncio.run(scenario())
+    assert rejected
+    assert failed.status == "failed" and failed.error_code == 404
+
+
+def test_stage_workers_cap_concurrency_across_jobs():
+    async def scenario():
+        active = {"render": 0, "peak": 0}
+
+        async def render(results):
+            active["render"] += 1
+            active["peak"] = max(active["peak"], active["render"])
+            await asyncio.sleep(0.05)
+            active["render"] -= 1
+
+        async def runner(job, stage_limits):
+            stages = [Stage("render", render)]
+            await StagePipeline(stages, limits=stage_limits(["render"])).run_async()
+            return {}
+
+        manager = JobManager(runner, workers=4, max_queued=10, stage_workers=parse_stage_workers("render=2,bad"))
+        ids = [manager.submit({"submission_id": str(i)}).id for i in range(6)]
+        for job_id in ids:
+            await _wait_for(manager, job_id)
+        await manager.stop()
+        return active["peak"]
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_postgres_queue_priority_follows_the_submission_product(monkeypatch):
+    import main
+    from fastapi.testclient import TestClient
+
+    submitted = []
+
+    class _Backend:
+        async def submit(self, payload, deadline_seconds=None, product=None):
+            submitted.append(product)
+            return {"job_id": "job-1", "status": "queued"}
+
+    async def get_submission_async(submission_id, columns="*", timeout=None):
+        return {"product": {"sub-rams": "rams", "sub-odd": "XYZ"}[submission_id]}
+
+    monkeypatch.setattr(main, "pg_jobs", _Backend())
+    monkeypatch.setattr(main, "get_submission_async", get_submission_async)
+    client = TestClient(main.app)
+
+    assert client.post("/jobs", json={"submission_id": "sub-rams"}).status_code == 202
+    assert client.post("/jobs", json={"submission_id": "sub-rams", "product": "RAMS"}).status_code == 202
+    assert client.post("/jobs", json={"submission_id": "sub-rams", "product": "CPP"}).status_code == 400
+    assert client.post("/jobs", json={"submission_id": "sub-odd"}).status_code == 400
+    assert submitted == ["RAMS", "RAMS"]
@@ -0,0 +1,146 @@
+"""
+Tests for the in-memory render-to-upload path: in-memory uploads, the tmpfs PDF
+scratch area and per-request disk write accounting.
+"""
+
+import os
+import sys
+import asyncio
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import main
+import pdf_convert
+from artifact_store import ArtifactStore
+from deadlines import Deadline
+from disk_lifecycle import OutputJanitor
+from memory_render import DiskWriteMeter, InMemoryDocument, on_memory_filesystem
+from render_pool import RenderPool
+
+# Stands in for soffice: writes <name>.pdf with a creation date into --outdir
+FAKE_SOFFICE = """#!{python}
+import os, sys
+args = sys.argv[1:]
+outdir = args[args.index("--outdir") + 1]
+profile = [a for a in args if a.startswith("-env:UserInstallation=file://")][0].split("file://", 1)[1]
+open(os.path.join(profile, "registrymodifications.xcu"), "w").write("x" * 1000)
+for path in args[args.index("--outdir") + 2:]:
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(os.path.join(outdir, name + ".pdf"), "wb") as f:
+        f.write(b"%PDF-1.4 /CreationDate (D:20250101120000+00'00') " + open(path, "rb").read()[:10])
+"""
+
+
+class _Storage:
+    uploads = []  # (path, content type, body)
+
+
+def _upload(request):
+    _Storage.uploads.append((request.path, request.headers["Content-Type"], request.body()))
+    return 200, b'{"Key": "ok"}'
+
+
+@pytest.fixture
+def storage(supabase_stub):
+    supabase_stub({("POST", "/storage/v1/object/"): _upload, ("HEAD", "/storage/v1/object/"): lambda request: (200, b"")})
+    _Storage.uploads = []
+
+
+@pytest.fixture
+def soffice(tmp_path, monkeypatch):
+    script = tmp_path / "soffice"
+    script.write_text(FAKE_SOFFICE.format(python=sys.executable))
+    script.chmod(0o755)
+    monkeypatch.setattr(pdf_convert, "LIBREOFFICE_BIN", str(script))
+
+
+def test_in_memory_documents_upload_from_their_bytes(storage, tmp_path):
+    store = ArtifactStore(str(tmp_path / "index.sqlite3"))
+    document = InMemoryDocument("RAMS_sub-1_20250101_120000.pdf", b"%PDF-1.4 content")
+
+    first = asyncio.run(store.upload(document, "sub-1", "RAMS_sub-1", timeout=10))
+    second = asyncio.run(store.upload(document, "sub-1", "RAMS_sub-1", timeout=10))
+    store.close()
+
+    assert first["sha256"] == document.sha256() and not first["skipped"] and second["skipped"]
+    path, content_type, body = _Storage.uploads[0]
+    assert path == f"/storage/v1/object/generated-documents/sub-1/RAMS_sub-1_{document.sha256()[:16]}.pdf"
+    assert content_type == "application/pdf" and body == b"%PDF-1.4 content"
+    assert len(_Storage.uploads) == 1
+
+
+def test_pdf_scratch_area_is_private_and_removed(soffice, tmp_path):
+    scratch = tmp_path / "shm"
+    scratch.mkdir()
+
+    pdf = pdf_convert.convert_docx_bytes_to_pdf(b"PK docx bytes", "RAMS_sub", timeout=30, scratch_dir=str(scratch))
+
+    assert pdf.startswith(b"%PDF-1.4 /CreationDate (D:19800101000000+00'00') PK docx by")
+    assert os.listdir(scratch) == []  # DOCX, PDF and LibreOffice profile all gone
+
+
+def test_disk_write_meter_skips_memory_filesystems(tmp_path):
+    meter = DiskWriteMeter()
+    (tmp_path / "a.docx").write_bytes(b"x" * 100)
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "logo.png").write_bytes(b"x" * 50)
+    meter.add_file(str(tmp_path / "a.docx"))
+    meter.add_file(None)
+    meter.add_tree(str(tmp_path / "images"))
+    assert meter.bytes == 150
+
+    if not on_memory_filesystem("/dev/shm"):
+        pytest.skip("/dev/shm is not tmpfs here")
+    with open("/dev/shm/doc_gen_meter_test", "wb") as f:
+        f.write(b"x" * 100)
+    try:
+        meter.add_file("/dev/shm/doc_gen_meter_test")
+    finally:
+        os.remove("/dev/shm/doc_gen_meter_test")
+    assert meter.bytes == 150
+
+
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_render_to_upload_writes_nothing_to_disk_in_memory(in_memory, storage, soffice, tmp_path, monkeypatch):
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    template = os.path.join(main.TEMPLATE_DIR, main.TEMPLATE_FILES["RAMS"])
+    monkeypatch.setattr(main, "OUTPUT_DIR", str(output_dir))
+    monkeypatch.setattr(main, "render_pool", RenderPool([template], size=0))
+    monkeypatch.setattr(main, "checkpoint_ledger", None)
+    monkeypatch.setattr(main, "artifact_store", ArtifactStore(str(tmp_path / "index.sqlite3")))
+    monkeypatch.setattr(main, "output_janitor", OutputJanitor(str(output_dir)))
+    monkeypatch.setattr(pdf_convert, "PDF_SCRATCH_DIR", str(tmp_path))
+    written = []
+
+    async def write_outputs(submission_id, outputs, timeout):
+        written.append(outputs)
+
+    monkeypatch.setattr(main, "update_submission_outputs_async", write_outputs)
+    submission = {"product": "RAMS", "placeholders": {"RAMS_TITLE": "Memory render"}, "uploads": {}, "ai_input": {}}
+    request = main.GenerateFromSubmissionRequest(submission_id="sub-12345678")
+
+    result = asyncio.run(main._render_submission(
+        request, submission, "0" * 32, Deadline(120), in_memory=in_memory,
+    ))
+    main.artifact_store.close()
+
+    outputs = written[0]
+    assert outputs["status"] == "complete" and outputs["docx_url"] and outputs["pdf_url"]
+    assert sorted(content_type for _, content_type, _ in _Storage.uploads) == [
+        "application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ]
+    if in_memory:
+        assert os.listdir(output_dir) == []
+        assert outputs["docx_path"] is None and result["docx_path"] is None
+        assert result["disk_bytes_written"] == 0
+    else:
+        assert sorted(os.listdir(output_dir)) == [
+            os.path.basename(outputs["docx_path"]), os.path.basename(outputs["pdf_path"]),
+        ]
+        assert result["disk_bytes_written"] == sum(
+            os.path.getsize(outputs[key]) for key in ("docx_path", "pdf_path")
+        )
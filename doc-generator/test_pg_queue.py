@@ -0,0 +1,211 @@
+"""
+Tests for the Postgres job queue. Those using the queue fixture need a local
+Postgres and are skipped unless TEST_DATABASE_URL is set, e.g.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost/postgres python -m pytest test_pg_queue.py
+"""
+
+import os
+import sys
+import time
+import uuid
+import asyncio
+import threading
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL", "")
+
+from jobs import JobManager
+from pg_queue import PgJobQueue, PgJobWorkers
+
+
+@pytest.fixture
+def queue():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL not set")
+    q = PgJobQueue(
+        TEST_DATABASE_URL,
+        table=f"test_jobs_{uuid.uuid4().hex[:8]}",
+        lease_seconds=0.5,
+        max_attempts=2,
+        product_priority={"RAMS": 10, "CPP": 0},
+    )
+    q.ensure_schema()
+    yield q
+    q._execute("DROP TABLE IF EXISTS {table}")
+    q.close()
+
+
+def test_claims_follow_priority_then_age(queue):
+    cpp = queue.enqueue({"submission_id": "cpp-1"}, 60, product="CPP")
+    rams = queue.enqueue({"submission_id": "rams-1"}, 60, product="RAMS")
+
+    assert queue.claim("w1")["id"] == rams
+    assert queue.claim("w1")["id"] == cpp
+    assert queue.claim("w1") is None
+
+
+def test_concurrent_claimers_never_share_a_job(queue):
+    ids = {queue.enqueue({"submission_id": f"s{i}"}, 60) for i in range(20)}
+    claimed = []
+    lock = threading.Lock()
+
+    def claimer(name):
+        # Each thread gets its own connection, like separate replicas
+        own = PgJobQueue(TEST_DATABASE_URL, table=queue.table, lease_seconds=30)
+        while True:
+            row = own.claim(name)
+            if row is None:
+                break
+            with lock:
+                claimed.append(row["id"])
+        own.close()
+
+    threads = [threading.Thread(target=claimer, args=(f"w{i}",)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(claimed) == sorted(ids)
+
+
+def test_expired_lease_is_reclaimed_then_failed(queue):
+    job_id = queue.enqueue({"submission_id": "crashy"}, 60)
+    assert queue.claim("dead-worker")["attempts"] == 1
+    assert queue.claim("other") is None  # lease still held
+
+    time.sleep(0.6)
+    row = queue.claim("other")
+    assert row["id"] == job_id and row["attempts"] == 2
+    # The first worker has lost the job
+    assert not queue.heartbeat(job_id, "dead-worker", ["render"], 0.5)
+    assert not queue.complete(job_id, "dead-worker", "succeeded", {})
+
+    time.sleep(0.6)
+    queue.reap()
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and "lease expired" in job["error"]
+
+
+def test_queued_job_past_deadline_expires(queue):
+    job_id = queue.enqueue({"submission_id": "late"}, 0.1)
+    time.sleep(0.2)
+    assert queue.claim("w1") is None
+    queue.reap()
+    assert queue.get(job_id)["status"] == "expired"
+
+
+def test_workers_run_jobs_with_heartbeats(queue):
+    async def runner(job, stage_limits):
+        job.on_stage("render", "start", 0, 2)
+        await asyncio.sleep(0.4)  # longer than a heartbeat interval
+        return {"docx_path": f"/tmp/{job.payload['submission_id']}.docx"}
+
+    async def scenario():
+        manager = JobManager(runner, workers=2, stage_workers={})
+        workers = PgJobWorkers(queue, runner, 2, manager.stage_limits, heartbeat_seconds=0.1, poll_seconds=0.05)
+        job_id = queue.enqueue({"submission_id": "sub-9"}, 60)
+        workers.start()
+        seen_stage = None
+        for _ in range(200):
+            job = queue.get(job_id)
+            if job["stage"]:
+                seen_stage = job["stage"]
+            if job["status"] == "succeeded":
+                break
+            await asyncio.sleep(0.02)
+        await workers.stop()
+        return seen_stage, queue.get(job_id)
+
+    seen_stage, job = asyncio.run(scenario())
+    assert seen_stage == ["render"]
+    assert job["status"] == "succeeded"
+    assert job["result"] == {"docx_path": "/tmp/sub-9.docx"}
+    assert job["progress"] == 1.0
+
+
+class _FlakyQueue:
+    """Stands in for PgJobQueue: hands out two jobs, and the first result cannot be recorded."""
+
+    def __init__(self):
+        self.rows = [{"id": f"job-{n}", "payload": {"submission_id": f"sub-{n}"}, "deadline_in": 60} for n in (1, 2)]
+        self.completed = []
+
+    def reap(self):
+        return 0
+
+    def claim(self, worker_id):
+        return self.rows.pop(0) if self.rows else None
+
+    def complete(self, job_id, worker_id, status, result, error=None, error_code=None):
+        if job_id == "job-1":
+            raise RuntimeError("db down")
+        self.completed.append((job_id, status))
+        return True
+
+
+def test_worker_survives_a_failure_to_record_a_result():
+    fake = _FlakyQueue()
+
+    async def runner(job, stage_limits):
+        return {"docx_path": f"/tmp/{job.payload['submission_id']}.docx"}
+
+    async def scenario():
+        workers = PgJobWorkers(fake, runner, 1, lambda stages: {}, heartbeat_seconds=1, poll_seconds=0.01)
+        workers.start()
+        for _ in range(200):
+            if fake.completed:
+                break
+            await asyncio.sleep(0.01)
+        alive = not workers._tasks[0].done()
+        await workers.stop()
+        return alive
+
+    assert asyncio.run(scenario())
+    assert fake.completed == [("job-2", "succeeded")]
+
+
+class _DroppingConnection:
+    """A connection that drops while running every statement sent to it."""
+
+    closed = False
+
+    def __init__(self, sent):
+        self.sent = sent
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params):
+        from psycopg import OperationalError
+
+        self.sent.append(params)
+        raise OperationalError("server closed the connection unexpectedly")
+
+
+def test_only_idempotent_statements_are_resent_after_a_dropped_connection():
+    from psycopg import OperationalError
+
+    sent = []
+    q = PgJobQueue("postgresql://unused", table="jobs")
+    q._connect = lambda: _DroppingConnection(sent)
+
+    with pytest.raises(OperationalError):
+        q.enqueue({"submission_id": "sub-1"}, 60)
+    assert len(sent) == 1  # the INSERT may have committed; never sent twice
+
+    sent.clear()
+    with pytest.raises(OperationalError):
+        q.heartbeat("job-1", "worker-1", [], 0.5)
+    assert len(sent) == 2
@@ -0,0 +1,61 @@
+"""
+Tests for the stage DAG runner used by /generate-from-submission.
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from pipeline import Stage, StagePipeline
+
+
+def _sleep_stage(seconds, value=None):
+    def fn(results):
+        time.sleep(seconds)
+        return value
+    return fn
+
+
+def test_independent_stages_overlap_and_critical_path():
+    pipeline = StagePipeline([
+        Stage("ai", _sleep_stage(0.3, "ai")),
+        Stage("images", _sleep_stage(0.1, "images")),
+        Stage("prepare", _sleep_stage(0.05, "prepared"), deps=["images"]),
+        Stage("render", lambda r: f"{r['ai']}+{r['prepare']}", deps=["ai", "prepare"]),
+    ], name="test")
+
+    started = time.monotonic()
+    run = pipeline.run()
+    elapsed = time.monotonic() - started
+
+    assert run.results["render"] == "ai+prepared"
+    assert elapsed < 0.45  # ai (0.3) overlaps images+prepare (0.15)
+    assert run.timings["render"]["start"] >= run.timings["ai"]["end"]
+    assert run.critical_path == ["ai", "render"]
+
+
+def test_stage_exception_propagates_with_original_type():
+    class Boom(Exception):
+        pass
+
+    def fail(results):
+        raise Boom("no template")
+
+    ran = []
+    pipeline = StagePipeline([
+        Stage("prepare", fail),
+        Stage("render", lambda r: ran.append("render"), deps=["prepare"]),
+    ])
+    with pytest.raises(Boom):
+        pipeline.run()
+    assert ran == []
+
+
+def test_unknown_dependency_rejected():
+    with pytest.raises(ValueError):
+        StagePipeline([Stage("render", lambda r: None, deps=["missing"])])
@@ -0,0 +1,79 @@
+"""
+Tests for render manifests: input diffing and what a regeneration may reuse.
+"""
+
+import os
+import sys
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from render_manifest import MANIFEST_KEY, ReusePlan, build_manifest, changed_inputs, placeholder_group
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "templates", "RAMS_TEMPLATE_WORKING_v1_copy.docx")
+PLACEHOLDERS = {"RAMS_TITLE": "Roof works", "RAMS_SITE_ADDRESS_LINE1": "1 High St", "RAMS_SITE_PHONE": "0123"}
+AI_CONTENT = {"AI_SEQUENCE_OF_WORKS": "1. Set up", "AI_CONTENT_SOURCE": "ai"}
+
+
+def _manifest(placeholders=PLACEHOLDERS, uploads=None, ai_input="Roof works"):
+    return build_manifest("RAMS", dict(placeholders), uploads or {}, ai_input, TEMPLATE)
+
+
+def _outputs(manifest, ai_content=AI_CONTENT, status="complete"):
+    return {
+        "status": status,
+        "docx_path": "/out/a.docx",
+        "pdf_path": "/out/a.pdf" if status == "complete" else None,
+        "docx_url": "https://storage/a.docx",
+        "pdf_url": "https://storage/a.pdf" if status == "complete" else None,
+        "docx_sha256": "d0c5",
+        "pdf_sha256": "bdf5" if status == "complete" else None,
+        MANIFEST_KEY: dict(manifest, ai_content=ai_content),
+    }
+
+
+def test_placeholder_groups():
+    assert placeholder_group("RAMS_SITE_ADDRESS_LINE1") == "RAMS_SITE"
+    assert placeholder_group("CPP_PROJECT_NAME") == "CPP_PROJECT"
+    assert placeholder_group("TITLE") == "TITLE"
+
+
+def test_changed_inputs_lists_only_the_edited_group():
+    before = _manifest()
+    after = _manifest(dict(PLACEHOLDERS, RAMS_SITE_PHONE="0999"))
+    assert changed_inputs(before, after) == ["RAMS_SITE"]
+    assert changed_inputs(before, _manifest(uploads={"RAMS_LOGO": "https://x/logo.png"})) == ["uploads"]
+    assert changed_inputs(None, after) == ["all"]
+
+
+def test_field_edit_reuses_ai_content_but_renders_again():
+    plan = ReusePlan(_outputs(_manifest()), _manifest(dict(PLACEHOLDERS, RAMS_SITE_PHONE="0999")))
+    assert plan.ai_content == AI_CONTENT
+    assert plan.artifacts is None
+
+
+def test_unchanged_inputs_reuse_the_documents():
+    plan = ReusePlan(_outputs(_manifest()), _manifest())
+    assert plan.changed == []
+    assert plan.artifacts == {
+        "docx_path": "/out/a.docx",
+        "pdf_path": "/out/a.pdf",
+        "docx_url": "https://storage/a.docx",
+        "pdf_url": "https://storage/a.pdf",
+        "docx_sha256": "d0c5",
+        "pdf_sha256": "bdf5",
+    }
+
+
+def test_changed_ai_input_calls_the_llm_again():
+    plan = ReusePlan(_outputs(_manifest()), _manifest(ai_input="Roof and gutter works"))
+    assert "ai_input" in plan.changed
+    assert plan.ai_content is None and plan.artifacts is None
+
+
+def test_degraded_results_are_not_reused():
+    fallback = dict(AI_CONTENT, AI_CONTENT_SOURCE="fallback")
+    assert ReusePlan(_outputs(_manifest(), ai_content=fallback), _manifest()).ai_content is None
+    no_pdf = ReusePlan(_outputs(_manifest(), status="complete_no_pdf"), _manifest())
+    assert no_pdf.ai_content == AI_CONTENT
+    assert no_pdf.artifacts is None
@@ -0,0 +1,62 @@
+"""
+Tests for the DOCX render process pool: output parity and crash recovery.
+"""
+
+import io
+import os
+import sys
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from docx import Document
+
+import metrics
+from render_pool import RenderPool
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "templates", "RAMS_TEMPLATE_WORKING_v1_copy.docx")
+PLACEHOLDERS = {"RAMS_TITLE": "Pool Render Check", "RAMS_SITE_ADDRESS_LINE1": "1 Test Street"}
+
+
+def _text(docx_bytes):
+    doc = Document(io.BytesIO(docx_bytes))
+    parts = [p.text for p in doc.paragraphs]
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                parts.append(cell.text)
+    return "\n".join(parts)
+
+
+def test_pool_output_matches_in_process_render():
+    pool = RenderPool([TEMPLATE], size=1)
+    try:
+        pooled = pool.render(TEMPLATE, None, dict(PLACEHOLDERS))
+        # Second job reuses the worker's preloaded template; it must not see the first job's edits
+        pooled_again = pool.render(TEMPLATE, None, {"RAMS_TITLE": "Second Job"})
+    finally:
+        pool.shutdown()
+    in_process = RenderPool([TEMPLATE], size=0).render(TEMPLATE, None, dict(PLACEHOLDERS))
+
+    assert "Pool Render Check" in _text(pooled)
+    assert _text(pooled) == _text(in_process)
+    assert "Pool Render Check" not in _text(pooled_again)
+    assert "Second Job" in _text(pooled_again)
+
+
+def test_pool_rebuilds_after_worker_crash(tmp_path):
+    pool = RenderPool([TEMPLATE], size=1, max_restarts=3)
+    restarts = metrics.counter("render_pool_restarts_total").value
+    try:
+        executor, _ = pool._get_executor()
+        try:
+            executor.submit(os._exit, 1).result()
+        except Exception:
+            pass  # BrokenProcessPool
+
+        output = str(tmp_path / "after_crash.docx")
+        assert pool.render(TEMPLATE, output, dict(PLACEHOLDERS)) == output
+        assert os.path.getsize(output) > 0
+    finally:
+        pool.shutdown()
+    assert metrics.counter("render_pool_restarts_total").value == restarts + 1
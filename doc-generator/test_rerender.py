@@ -0,0 +1,188 @@
+"""
+Tests for the fleet re-render: batching, classification, the progress ledger and
+a full run against a stub PostgREST server.
+"""
+
+import os
+import sys
+import json
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import main
+import rerender
+from render_manifest import MANIFEST_KEY
+from rerender import Batcher, FleetLedger, FleetRerender, classify, CURRENT, NEEDS_AI, STALE
+
+
+def _manifest(template):
+    return {"version": 1, "product": "CPP", "template": template, "ai_input": "a", "uploads": "u", "groups": {}}
+
+
+def _outputs(template, ai_content=True):
+    manifest = dict(_manifest(template), ai_content={"CPP_AI_SCOPE": "Scope"} if ai_content else None)
+    return {"status": "complete", MANIFEST_KEY: manifest}
+
+
+class _Backend:
+    rows = []
+    queries = []
+    patches = []
+    rejected = []
+
+
+def _select(request):
+    params = request.query
+    _Backend.queries.append(params)
+    rows = sorted(_Backend.rows, key=lambda row: row["id"])
+    for column, condition in params:
+        if column == "id":
+            rows = [row for row in rows if row["id"] > condition[len("gt."):]]
+    return 200, json.dumps(rows[:int(dict(params)["limit"])]).encode()
+
+
+def _insert(request):
+    # Like Postgres, an upsert row must satisfy NOT NULL (product) before any conflict is resolved
+    rows = json.loads(request.body())
+    if any(row.get("product") is None for row in rows):
+        _Backend.rejected.append(rows)
+        return 400, b'{"code": "23502", "message": "null value in column \\"product\\""}'
+    return 201, b""
+
+
+def _update(request):
+    body = json.loads(request.body())
+    submission_id = dict(request.query)["id"][len("eq."):]
+    for row in _Backend.rows:
+        if row["id"] == submission_id:
+            row.update(body)
+    _Backend.patches.append((submission_id, request.headers["Prefer"], body))
+    return 204, b""
+
+
+@pytest.fixture
+def backend(supabase_stub):
+    supabase_stub({
+        ("GET", "/rest/v1/submissions"): _select,
+        ("POST", "/rest/v1/submissions"): _insert,
+        ("PATCH", "/rest/v1/submissions"): _update,
+    })
+    # sub-1..sub-6 are stale, sub-7 is current, sub-8 has no reusable AI content
+    _Backend.rows = [{"id": f"sub-{n}", "product": "CPP", "outputs": _outputs("old")} for n in range(1, 7)]
+    _Backend.rows += [
+        {"id": "sub-7", "product": "CPP", "outputs": _outputs("new")},
+        {"id": "sub-8", "product": "CPP", "outputs": _outputs("old", ai_content=False)},
+    ]
+    _Backend.queries = []
+    _Backend.patches = []
+    _Backend.rejected = []
+
+
+@pytest.fixture
+def fleet(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(rerender, "FLEET_PDF_BATCH_SIZE", 3)
+    monkeypatch.setattr(rerender, "FLEET_PATCH_BATCH_SIZE", 3)
+    monkeypatch.setattr(rerender, "FLEET_BATCH_WAIT_SECONDS", 0.05)
+    conversions = []
+
+    def convert_many_to_pdf(docx_paths, output_dir, timeout):
+        conversions.append(len(docx_paths))
+        return {path: path[:-len(".docx")] + ".pdf" for path in docx_paths}
+
+    monkeypatch.setattr(rerender, "convert_many_to_pdf", convert_many_to_pdf)
+
+    async def render(submission, manifest, convert_pdf, write_outputs):
+        if submission["id"] == "sub-5":
+            raise RuntimeError("Template rendering failed")
+        pdf_path = await convert_pdf(str(tmp_path / f"{submission['id']}.docx"), str(tmp_path))
+        await write_outputs(submission["id"], {"pdf_path": pdf_path, MANIFEST_KEY: manifest})
+
+    fleet = FleetRerender(
+        manifest=lambda submission: _manifest("new"),
+        render=render,
+        template_hash=lambda product: "new",
+        ledger=FleetLedger(str(tmp_path / "ledger.sqlite3")),
+        page_size=4,
+        concurrency=4,
+        max_per_minute=0,
+    )
+    fleet.conversions = conversions
+    yield fleet
+    fleet.ledger.close()
+
+
+def test_batcher_groups_calls_and_fails_items_separately():
+    async def scenario():
+        batches = []
+
+        async def double(items):
+            batches.append(list(items))
+            return [ValueError("odd") if item == 3 else item * 2 for item in items]
+
+        batcher = Batcher(double, size=2, wait_seconds=0.05)
+        results = await asyncio.gather(*[batcher.submit(n) for n in range(1, 6)], return_exceptions=True)
+        return batches, results
+
+    batches, results = asyncio.run(scenario())
+    assert batches == [[1, 2], [3, 4], [5]]
+    assert results[:2] == [2, 4] and isinstance(results[2], ValueError) and results[3:] == [8, 10]
+
+
+def test_classify_compares_templates_and_stored_ai_content():
+    assert classify(_outputs("new"), _manifest("new"))[0] == CURRENT
+    assert classify(_outputs("old", ai_content=False), _manifest("new"))[0] == NEEDS_AI
+    assert classify({}, _manifest("new"))[0] == NEEDS_AI
+    status, reuse = classify(_outputs("old"), _manifest("new"))
+    assert status == STALE and reuse.ai_content == {"CPP_AI_SCOPE": "Scope"}
+
+
+def test_run_rerenders_stale_rows_in_batches(fleet):
+    run = asyncio.run(fleet.run("CPP"))
+
+    assert run["status"] == "succeeded" and run["cursor"] == "sub-8"
+    assert run["counts"] == {"rendered": 5, "failed": 1, CURRENT: 1, NEEDS_AI: 1}
+    assert run["failures"] == [{"submission_id": "sub-5", "error": "Template rendering failed"}]
+    assert sorted(fleet.conversions) == [1, 1, 3]  # page 1: a batch of 3 (sub-4 waits alone); page 2: sub-6
+    written = sorted(submission_id for submission_id, _, _ in _Backend.patches)
+    assert written == ["sub-1", "sub-2", "sub-3", "sub-4", "sub-6"]
+    submission_id, prefer, body = _Backend.patches[0]
+    assert prefer == "return=minimal" and list(body) == ["outputs"]
+    assert body["outputs"]["pdf_path"].endswith(f"{submission_id}.pdf")
+    # Only outputs change, so NOT NULL columns never fail a write
+    assert _Backend.rejected == [] and all(row["product"] == "CPP" for row in _Backend.rows)
+
+
+def test_run_resumes_after_the_last_finished_page(fleet):
+    fleet.ledger.start("CPP-new", "CPP", "new")
+    fleet.ledger.advance("CPP-new", "sub-4", {"rendered": 4}, {})
+    fleet.ledger.finish("CPP-new", "paused")
+
+    run = asyncio.run(fleet.run("CPP"))
+    assert dict(_Backend.queries[0])["id"] == "gt.sub-4"
+    assert run["counts"] == {"rendered": 5, "failed": 1, CURRENT: 1, NEEDS_AI: 1}
+
+    asyncio.run(fleet.run("CPP"))  # a finished run starts over
+    assert "id" not in dict(_Backend.queries[-3])
+
+
+def test_dry_run_estimates_without_rendering(fleet):
+    estimate = asyncio.run(fleet.estimate("CPP"))
+
+    assert estimate["counts"] == {STALE: 6, CURRENT: 1, NEEDS_AI: 1}
+    assert estimate["ai_calls_avoided"] == 6 and estimate["ai_completion_tokens_avoided"] > 0
+    assert estimate["pdf_batches"] == -(-6 // rerender.FLEET_PDF_BATCH_SIZE)
+    assert fleet.conversions == [] and _Backend.patches == []
+    assert fleet.ledger.get("CPP-new") is None
+
+
+def test_rerender_endpoints_validate_input(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "rerender_ledger", FleetLedger(str(tmp_path / "ledger.sqlite3")))
+    client = TestClient(main.app)
+    assert client.post("/rerender", json={"product": "XYZ"}).status_code == 400
+    assert client.get("/rerender/CPP-unknown").status_code == 404
+    main.rerender_ledger.close()
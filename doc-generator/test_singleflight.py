@@ -0,0 +1,165 @@
+"""
+Tests for single-flight de-duplication. The cross-replica test needs a local
+Postgres and is skipped unless TEST_DATABASE_URL is set; lease cancellation runs
+against a fake table.
+"""
+
+import os
+import sys
+import uuid
+import asyncio
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from singleflight import SingleFlight, PgFlightLease, RemoteFlightError, LEADER, JOINED, CACHED, REMOTE
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL", "")
+
+
+def _counting_work(delay=0.05, fail=False):
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if fail:
+            raise ValueError("render failed")
+        return {"docx_path": "/tmp/out.docx"}
+    return work, calls
+
+
+def test_concurrent_duplicates_share_one_execution():
+    work, calls = _counting_work()
+
+    async def scenario():
+        flights = SingleFlight(result_ttl_seconds=30)
+        return await asyncio.gather(*(flights.do("sub-1:abc", work) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert sorted(how for _, how in results) == [JOINED] * 4 + [LEADER]
+    assert all(result == {"docx_path": "/tmp/out.docx"} for result, _ in results)
+
+
+def test_late_duplicate_is_served_from_cache_until_ttl():
+    work, calls = _counting_work(delay=0)
+
+    async def scenario():
+        flights = SingleFlight(result_ttl_seconds=0.1)
+        first = await flights.do("sub-1:abc", work)
+        second = await flights.do("sub-1:abc", work)
+        await asyncio.sleep(0.15)
+        third = await flights.do("sub-1:abc", work)
+        return first[1], second[1], third[1]
+
+    assert asyncio.run(scenario()) == (LEADER, CACHED, LEADER)
+    assert len(calls) == 2
+
+
+def test_different_inputs_run_separately():
+    work, calls = _counting_work()
+
+    async def scenario():
+        flights = SingleFlight()
+        return await asyncio.gather(flights.do("sub-1:abc", work), flights.do("sub-1:def", work))
+
+    assert [how for _, how in asyncio.run(scenario())] == [LEADER, LEADER]
+    assert len(calls) == 2
+
+
+def test_failure_reaches_every_caller_and_is_not_cached():
+    work, calls = _counting_work(fail=True)
+
+    async def scenario():
+        flights = SingleFlight()
+        outcomes = await asyncio.gather(*(flights.do("k", work) for _ in range(3)), return_exceptions=True)
+        retry = await asyncio.gather(flights.do("k", work), return_exceptions=True)
+        return outcomes, retry
+
+    outcomes, retry = asyncio.run(scenario())
+    assert all(isinstance(o, ValueError) for o in outcomes)
+    assert isinstance(retry[0], ValueError)
+    assert len(calls) == 2
+
+
+class _FakeTable:
+    """Stands in for PgTable: every key is free, and statements are recorded."""
+
+    def __init__(self):
+        self.statements = []
+
+    def _execute(self, query, params=(), fetch=None, idempotent=False):
+        self.statements.append((query.split()[0], params))
+        return {"owner": "me"} if fetch == "one" else None
+
+
+class _LostReplyTable(_FakeTable):
+    """The INSERT commits but its RETURNING row never arrives; the row is ours."""
+
+    def __init__(self, owner):
+        super().__init__()
+        self.owner = owner
+
+    def _execute(self, query, params=(), fetch=None, idempotent=False):
+        self.statements.append((query.split()[0], params))
+        if query.startswith("SELECT"):
+            return {"owner": self.owner, "status": "running", "result": None, "error": None, "error_code": None}
+        return None
+
+
+def test_leader_recognises_its_own_running_lease():
+    lease = PgFlightLease("postgresql://unused", "flights")
+    lease.db = _LostReplyTable(lease.owner)
+    assert lease._acquire("sub-1:abc") == ("acquired", None)
+
+    lease.db = _LostReplyTable("other-replica")
+    assert lease._acquire("sub-1:abc") == ("busy", None)
+
+
+def test_cancelled_leader_releases_the_lease():
+    lease = PgFlightLease("postgresql://unused", "flights")
+    lease.db = _FakeTable()
+
+    async def scenario():
+        task = asyncio.ensure_future(lease.run("sub-1:abc", lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert [verb for verb, _ in lease.db.statements] == ["INSERT", "DELETE"]
+    assert lease.db.statements[-1][1] == ("sub-1:abc", lease.owner)
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+def test_replicas_share_one_execution_through_lease():
+    table = f"test_flights_{uuid.uuid4().hex[:8]}"
+    leases = [PgFlightLease(TEST_DATABASE_URL, table, poll_seconds=0.02) for _ in range(2)]
+    leases[0].ensure_schema()
+    leases[1].owner = "other-replica"
+    work, calls = _counting_work(delay=0.2)
+    failing, _ = _counting_work(delay=0.1, fail=True)
+
+    async def scenario():
+        replicas = [SingleFlight(lease=lease) for lease in leases]
+        shared = await asyncio.gather(replicas[0].do("sub-1:abc", work), replicas[1].do("sub-1:abc", work))
+        failed = await asyncio.gather(
+            replicas[0].do("sub-2:abc", failing), replicas[1].do("sub-2:abc", failing), return_exceptions=True
+        )
+        return shared, failed
+
+    try:
+        shared, failed = asyncio.run(scenario())
+    finally:
+        leases[0].db._execute("DROP TABLE IF EXISTS {table}")
+        for lease in leases:
+            lease.close()
+
+    assert len(calls) == 1
+    assert sorted(how for _, how in shared) == [LEADER, REMOTE]
+    assert any(isinstance(o, ValueError) for o in failed)
+    assert any(isinstance(o, RemoteFlightError) and "render failed" in str(o) for o in failed)
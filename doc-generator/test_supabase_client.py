@@ -0,0 +1,176 @@
+"""
+Tests for the pooled Supabase client, against a stub PostgREST server.
+"""
+
+import os
+import sys
+import json
+import base64
+import socket
+import asyncio
+from urllib.parse import parse_qs
+
+import pytest
+
+# Setup path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import supabase_client
+
+ROW = {"id": "sub-1", "product": "RAMS", "outputs": {"status": "complete"}}
+
+
+class _Server:
+    """State of the stub PostgREST and Storage routes."""
+    requests = []  # PostgREST (method, query, client port, Prefer header)
+    failures = 0  # next PostgREST requests answered with 503
+    objects = {}  # "bucket/path" -> bytes
+    uploads = {}  # TUS id -> {"name", "length", "data"}
+    received = 0  # body bytes accepted by TUS PATCH
+    drop_patches = 0  # next TUS PATCHes get the connection cut mid-body
+
+
+def _postgrest(answer):
+    def route(request):
+        request.body()
+        _Server.requests.append(
+            (request.command, parse_qs(request.url.query), request.client_address[1], request.headers.get("Prefer"))
+        )
+        if _Server.failures:
+            _Server.failures -= 1
+            return 503, b'{"message": "unavailable"}'
+        return answer(request)
+    return route
+
+
+def _select(request):
+    select = parse_qs(request.url.query)["select"][0]
+    row = ROW if select == "*" else {key: ROW[key] for key in select.split(",")}
+    return 200, json.dumps([row]).encode(), {"Content-Type": "application/json"}
+
+
+def _upload(request):
+    assert "Content-Length" in request.headers and "Transfer-Encoding" not in request.headers
+    _Server.objects[request.url.path[len("/storage/v1/object/"):]] = request.body()
+    return 200, b'{"Key": "ok"}'
+
+
+def _tus_create(request):
+    metadata = dict(item.split(" ") for item in request.headers["Upload-Metadata"].split(","))
+    name = "/".join(base64.b64decode(metadata[key]).decode() for key in ("bucketName", "objectName"))
+    upload_id = str(len(_Server.uploads))
+    _Server.uploads[upload_id] = {"name": name, "length": int(request.headers["Upload-Length"]), "data": b""}
+    return 201, b"", {"Location": f"/storage/v1/upload/resumable/{upload_id}"}
+
+
+def _tus_offset(request):
+    upload = _Server.uploads[request.url.path.rsplit("/", 1)[1]]
+    return 200, b"", {"Upload-Offset": str(len(upload["data"]))}
+
+
+def _tus_patch(request):
+    upload = _Server.uploads[request.url.path.rsplit("/", 1)[1]]
+    length = int(request.headers["Content-Length"])
+    if _Server.drop_patches:
+        _Server.drop_patches -= 1
+        request.rfile.read(length // 2)
+        request.close_connection = True
+        request.connection.shutdown(socket.SHUT_RDWR)
+        return None
+    assert int(request.headers["Upload-Offset"]) == len(upload["data"])
+    upload["data"] += request.body()
+    _Server.received += length
+    if len(upload["data"]) == upload["length"]:
+        _Server.objects[upload["name"]] = upload["data"]
+    return 204, b"", {"Upload-Offset": str(len(upload["data"]))}
+
+
+ROUTES = {
+    ("GET", "/rest/v1/"): _postgrest(_select),
+    ("PATCH", "/rest/v1/"): _postgrest(lambda request: (204, b"")),
+    ("POST", "/storage/v1/object/"): _upload,
+    ("POST", "/storage/v1/upload/resumable"): _tus_create,
+    ("HEAD", "/storage/v1/upload/resumable/"): _tus_offset,
+    ("PATCH", "/storage/v1/upload/resumable/"): _tus_patch,
+}
+
+
+@pytest.fixture(autouse=True)
+def configured(supabase_stub, monkeypatch):
+    supabase_stub(ROUTES)
+    monkeypatch.setattr(supabase_client, "SUPABASE_RETRY_BACKOFF_SECONDS", 0.01)
+    _Server.requests = []
+    _Server.failures = 0
+    _Server.objects, _Server.uploads = {}, {}
+
+
+def test_calls_reuse_one_connection_and_project_columns():
+    for _ in range(3):
+        assert supabase_client.get_submission("sub-1", columns="product,outputs") == {
+            "product": "RAMS", "outputs": {"status": "complete"},
+        }
+    supabase_client.update_submission_outputs("sub-1", {"status": "complete"})
+
+    assert [query["select"] for method, query, _, _ in _Server.requests if method == "GET"] == [["product,outputs"]] * 3
+    assert len({port for _, _, port, _ in _Server.requests}) == 1
+    assert _Server.requests[-1][3] == "return=minimal"
+
+
+def test_async_calls_share_the_loop_client():
+    async def scenario():
+        await asyncio.gather(*(supabase_client.get_submission_async("sub-1", columns="id") for _ in range(3)))
+        await supabase_client.get_submission_async("sub-1")
+        await supabase_client.update_submission_outputs_async("sub-1", {"status": "complete"})
+
+    asyncio.run(scenario())
+    # Three concurrent reads may open up to three connections; later calls reuse them
+    assert len({port for _, _, port, _ in _Server.requests}) <= 3
+    assert len(_Server.requests) == 5
+
+
+def test_reads_are_retried_and_writes_are_not():
+    _Server.failures = 2
+    assert supabase_client.get_submission("sub-1")["id"] == "sub-1"
+    assert len(_Server.requests) == 3
+
+    _Server.requests = []
+    _Server.failures = 1
+    with pytest.raises(Exception, match="503"):
+        supabase_client.update_submission_outputs("sub-1", {"status": "complete"})
+    assert len(_Server.requests) == 1
+
+
+def test_retries_give_up_after_the_limit(monkeypatch):
+    monkeypatch.setattr(supabase_client, "SUPABASE_READ_RETRIES", 1)
+    _Server.failures = 5
+    with pytest.raises(Exception, match="503"):
+        supabase_client.get_submission("sub-1")
+    assert len(_Server.requests) == 2
+
+
+def test_small_files_are_streamed_in_one_request(tmp_path):
+    path = tmp_path / "doc.docx"
+    path.write_bytes(os.urandom(300_000))
+    url = supabase_client.upload_file_to_storage(str(path), "sub-1/doc.docx")
+    assert url.endswith("/storage/v1/object/public/generated-documents/sub-1/doc.docx")
+    assert _Server.objects["generated-documents/sub-1/doc.docx"] == path.read_bytes()
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_large_files_resume_after_a_dropped_connection(tmp_path, monkeypatch, use_async):
+    monkeypatch.setattr(supabase_client, "STORAGE_RESUMABLE_THRESHOLD_BYTES", 100_000)
+    monkeypatch.setattr(supabase_client, "STORAGE_RESUMABLE_CHUNK_BYTES", 64 * 1024)
+    path = tmp_path / "rams.pdf"
+    path.write_bytes(os.urandom(400_000))
+    _Server.received = 0
+    _Server.drop_patches = 1
+
+    if use_async:
+        asyncio.run(supabase_client.upload_file_to_storage_async(str(path), "sub-1/rams.pdf"))
+    else:
+        supabase_client.upload_file_to_storage(str(path), "sub-1/rams.pdf")
+
+    assert _Server.objects["generated-documents/sub-1/rams.pdf"] == path.read_bytes()
+    # Only the interrupted chunk was sent again, not the whole file
+    assert _Server.drop_patches == 0 and _Server.received == 400_000
+    assert supabase_client._resumable_locations == {}